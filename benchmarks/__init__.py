@@ -0,0 +1,16 @@
+"""Benchmarks for the hot paths of clusterjob
+
+The benchmarks follow the conventions of `airspeed velocity`_ (asv): each
+benchmark is a method of a class in one of the ``bench_*`` modules, named
+``time_*`` (run time), ``peakmem_*`` (peak resident memory), or ``track_*``
+(an arbitrary value, e.g. the peak memory allocated by Python as reported by
+:mod:`tracemalloc`). Run them with::
+
+    asv run
+
+or, without asv, with the minimal runner included here::
+
+    python -m benchmarks [pattern]
+
+.. _airspeed velocity: https://asv.readthedocs.io
+"""
@@ -0,0 +1,110 @@
+"""Minimal runner for the benchmarks, for use without asv
+
+Usage::
+
+    python -m benchmarks [--repeat N] [pattern]
+
+runs all benchmarks whose full name (e.g.
+``bench_results.TimePolling.time_poll_many_10000``) matches the regular
+expression `pattern`, and prints the best time for ``time_*`` benchmarks, and
+the returned value for ``track_*`` benchmarks. For ``peakmem_*`` benchmarks,
+the peak memory allocated by Python (not the resident memory measured by asv)
+is reported.
+"""
+from __future__ import print_function
+import argparse
+import importlib
+import inspect
+import itertools
+import os
+import timeit
+
+from .common import matches, traced_peak
+
+
+def benchmark_modules():
+    """Return a list of all ``bench_*`` modules"""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    names = sorted([os.path.splitext(filename)[0]
+                    for filename in os.listdir(folder)
+                    if filename.startswith('bench_')
+                    and filename.endswith('.py')])
+    return [importlib.import_module('benchmarks.' + name) for name in names]
+
+
+def parameter_sets(cls):
+    """Return a list of parameter tuples for the given benchmark class"""
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+    if len(params) > 0 and not isinstance(params[0], (list, tuple)):
+        params = [params, ]
+    return list(itertools.product(*params))
+
+
+def time_benchmark(func, repeat):
+    """Return the best time per call of `func`, in seconds"""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        if timer.timeit(number) >= 0.2 or number >= 10**6:
+            break
+        number *= 10
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds):
+    for (unit, factor) in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * factor >= 1:
+            return "%.3g %s" % (seconds * factor, unit)
+    return "%.3g ns" % (seconds * 1e9)
+
+
+def run(pattern=None, repeat=5):
+    for module in benchmark_modules():
+        for (cls_name, cls) in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            for params in parameter_sets(cls):
+                for meth_name in sorted(dir(cls)):
+                    if not meth_name.startswith(('time_', 'track_',
+                                                 'peakmem_')):
+                        continue
+                    name = "%s.%s.%s" % (module.__name__.split('.')[-1],
+                                         cls_name, meth_name)
+                    if not matches(name, pattern):
+                        continue
+                    label = name
+                    if len(params) > 0:
+                        label += "(%s)" % ", ".join([str(p) for p in params])
+                    bench = cls()
+                    if hasattr(bench, 'setup'):
+                        bench.setup(*params)
+                    try:
+                        method = getattr(bench, meth_name)
+                        if meth_name.startswith('time_'):
+                            result = format_time(time_benchmark(
+                                lambda: method(*params), repeat))
+                        elif meth_name.startswith('track_'):
+                            result = "%s %s" % (method(*params),
+                                                getattr(method, 'unit', ''))
+                        else:
+                            result = "%s bytes" % traced_peak(method, *params)
+                    finally:
+                        if hasattr(bench, 'teardown'):
+                            bench.teardown(*params)
+                    print("%-72s %s" % (label, result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="number of repetitions (default: 5)")
+    parser.add_argument('pattern', nargs='?', default=None,
+                        help="regular expression for benchmarks to run")
+    args = parser.parse_args()
+    run(args.pattern, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmarks for the methods of the scheduler backends"""
+from clusterjob import JobScript
+from clusterjob.status import RUNNING
+
+from .common import BODY, RESOURCES, STATUS_RESPONSES, make_results
+
+
+BACKENDS = ['slurm', 'pbs', 'pbspro', 'lpbs', 'lsf', 'sge']
+
+
+class TimeResourceHeaders(object):
+    """Compiling the resource header of a job script"""
+
+    params = BACKENDS
+    param_names = ['backend']
+
+    def setup(self, backend):
+        self.backend = JobScript._backends[backend]
+        resources = dict(RESOURCES, array='1-100%10')
+        if backend == 'sge':
+            del resources['nodes']
+            del resources['threads']
+        self.job = JobScript(BODY, jobname='bench', backend=backend,
+                             **resources)
+
+    def time_resource_headers(self, backend):
+        self.backend.resource_headers(self.job)
+
+    def time_resource_headers_uncached(self, backend):
+        self.backend._compile_headers(self.job.resources)
+
+
+class TimeReplaceBodyVars(object):
+    """Replacing the core environment variables in a job script body"""
+
+    params = (BACKENDS, ['sparse', 'dense'])
+    param_names = ['backend', 'body']
+
+    def setup(self, backend, body):
+        self.backend = JobScript._backends[backend]
+        if body == 'sparse':
+            # a script with a large embedded input file
+            data = "1.0 2.0 3.0 4.0 5.0 6.0 7.0 8.0 9.0 10.0\n" * 1000
+            self.body = BODY + "cat > input.dat <<EOF\n" + data + "EOF\n"
+        else:
+            self.body = BODY * 100
+
+    def time_replace_body_vars(self, backend, body):
+        self.backend.replace_body_vars(self.body)
+
+
+class TimeGetStatus(object):
+    """Parsing the response of the scheduler to status queries"""
+
+    params = BACKENDS
+    param_names = ['backend']
+
+    def setup(self, backend):
+        self.backend = JobScript._backends[backend]
+        self.response = STATUS_RESPONSES[backend]
+
+    def time_get_status(self, backend):
+        self.backend.get_status(self.response, finished=False)
+
+
+class TimeGetStatusMany(object):
+    """Building and parsing a bulk status query for 10000 jobs"""
+
+    params = ['slurm', 'pbs', 'lsf']
+    param_names = ['backend']
+
+    def setup(self, backend):
+        self.backend = JobScript._backends[backend]
+        self.runs = make_results(10000, backend=backend)
+        job_ids = [run.job_id for run in self.runs]
+        if backend == 'slurm':
+            lines = ["%s RUNNING" % job_id for job_id in job_ids]
+        elif backend == 'pbs':
+            lines = (STATUS_RESPONSES['pbs'].splitlines()[:2]
+                     + ["%s.cluster  test  user  00:00:01 R batch"
+                        % job_id for job_id in job_ids])
+        else:
+            lines = (STATUS_RESPONSES['lsf'].splitlines()[:1]
+                     + ["%s    user    RUN   normal  login1     node001"
+                        "    test" % job_id for job_id in job_ids])
+        self.response = "\n".join(lines) + "\n"
+
+    def time_cmd_status_many(self, backend):
+        self.backend.cmd_status_many(self.runs, finished=False)
+
+    def time_get_status_many(self, backend):
+        statuses = self.backend.get_status_many(self.response)
+        assert statuses[self.runs[-1].job_id] == RUNNING
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Benchmark the replacement of environment variables in job script bodies
+
+Compares the single-pass :meth:`ClusterjobBackend.replace_body_vars
+<clusterjob.backends.ClusterjobBackend.replace_body_vars>` to the previous
+implementation, which called ``body.replace`` once for every entry in the
+backend's `job_vars`. Usage::
+
+    python benchmarks/bench_body_vars.py [--size MB] [--repeat N]
+"""
+from __future__ import print_function
+import argparse
+import timeit
+
+from clusterjob import JobScript
+
+
+def replace_body_vars_loop(backend, body):
+    """The previous implementation of `replace_body_vars`"""
+    for key, val in backend.job_vars.items():
+        body = body.replace(key, val)
+    return body
+
+
+def make_body(size_mb, dense=False):
+    """Return a job script body of roughly `size_mb` megabytes that uses the
+    core environment variables. If `dense` is False, most of the body consists
+    of lines without any variables (e.g. an embedded input file or
+    here-document). Otherwise, almost every line uses a variable."""
+    block = [
+        'echo "Job $CLUSTERJOB_ID (${CLUSTERJOB_NAME})"',
+        'echo "Running on $CLUSTERJOB_NODELIST"',
+        'cd ${CLUSTERJOB_WORKDIR}/data',
+        './simulate --index=$CLUSTERJOB_ARRAY_INDEX --out=out.dat',
+        'ssh $CLUSTERJOB_SUBMIT_HOST "touch ~/finished.$CLUSTERJOB_ID"',
+    ]
+    if not dense:
+        block += ['1.0 2.0 3.0 4.0 5.0 6.0 7.0 8.0 9.0 10.0 11.0 12.0 13.0'
+                  for i in range(100)]
+    block = "\n".join(block) + "\n"
+    return block * int(size_mb * 2**20 / len(block))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=float, default=4.0,
+                        help="size of the body in MB (default: 4)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="number of repetitions (default: 5)")
+    args = parser.parse_args()
+    for dense in (False, True):
+        body = make_body(args.size, dense=dense)
+        print("\n%s body, %.1f MB" % ('Dense' if dense else 'Sparse',
+                                      len(body) / 2.0**20))
+        print("%-8s %12s %12s %8s" % ('backend', 'loop (ms)', 'regex (ms)',
+                                      'speedup'))
+        for name in sorted(JobScript._backends):
+            backend = JobScript._backends[name]
+            assert (backend.replace_body_vars(body)
+                    == replace_body_vars_loop(backend, body))
+            t_loop = min(timeit.repeat(
+                lambda: replace_body_vars_loop(backend, body),
+                number=1, repeat=args.repeat))
+            t_regex = min(timeit.repeat(
+                lambda: backend.replace_body_vars(body),
+                number=1, repeat=args.repeat))
+            print("%-8s %12.1f %12.1f %7.1fx" % (name, 1000*t_loop,
+                                                1000*t_regex,
+                                                t_loop / t_regex))
+
+
+if __name__ == "__main__":
+    main()
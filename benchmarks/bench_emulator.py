@@ -0,0 +1,46 @@
+"""Benchmarks for submitting and polling jobs at scale, through the emulated
+SLURM scheduler of :mod:`clusterjob.emulator`"""
+import os
+
+from clusterjob import JobScript, AsyncResult, poll_many
+from clusterjob.emulator import Emulator
+from clusterjob.status import RUNNING
+
+from .common import BODY, RESOURCES, MockedScheduler, make_results
+
+
+class TimeEmulatedScheduler(MockedScheduler):
+    """Submission and polling of simulated jobs, with all scheduler commands
+    handled in-process by the emulator"""
+
+    timeout = 300
+
+    def setup(self):
+        super(TimeEmulatedScheduler, self).setup()
+        self.emulator = Emulator(os.path.join(self._tempdir, 'state'),
+                                 flavor='slurm', queue_delay=0,
+                                 run_time=3600)
+        JobScript._run_cmd = staticmethod(self.emulator.run_cmd)
+        AsyncResult._run_cmd = staticmethod(self.emulator.run_cmd)
+        self.jobs = [JobScript(BODY, jobname='bench%d' % i, input='in.dat',
+                               seed=i, **RESOURCES) for i in range(100)]
+        self.results = make_results(10000)
+        for ar in self.results:
+            ar.job_id = str(self.emulator.submit(BODY, self._tempdir))
+        self.counter = 0
+
+    def teardown(self):
+        self.emulator.close()
+        super(TimeEmulatedScheduler, self).teardown()
+
+    def time_submit_100(self):
+        self.counter += 1
+        for (i, job) in enumerate(self.jobs):
+            job.submit(cache_id="%d.%d" % (self.counter, i))
+
+    def time_poll_many_10000(self):
+        assert poll_many(self.results)[-1] == RUNNING
+
+    def time_status_1000(self):
+        for ar in self.results[:1000]:
+            ar.status
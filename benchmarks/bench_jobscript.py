@@ -0,0 +1,85 @@
+"""Benchmarks for creating, rendering, and submitting job scripts"""
+from clusterjob import JobScript
+
+from .common import BODY, RESOURCES, MockedScheduler, traced_peak
+
+
+class TimeInit(object):
+    """Instantiation of :class:`clusterjob.JobScript`"""
+
+    def time_init(self):
+        JobScript(BODY, jobname='bench', **RESOURCES)
+
+    def time_init_1000(self):
+        for i in range(1000):
+            JobScript(BODY, jobname='bench%d' % i, seed=i, **RESOURCES)
+
+    def track_peak_memory_init_10000(self):
+        return traced_peak(
+            lambda: [JobScript(BODY, jobname='bench%d' % i, seed=i,
+                               **RESOURCES) for i in range(10000)])
+    track_peak_memory_init_10000.unit = "bytes"
+
+
+class TimeRender(object):
+    """Rendering of job scripts through :meth:`clusterjob.JobScript.__str__`
+    (:meth:`~clusterjob.JobScript.render_script`), for every backend"""
+
+    params = ['slurm', 'pbs', 'pbspro', 'lpbs', 'lsf', 'sge']
+    param_names = ['backend']
+
+    def setup(self, backend):
+        resources = dict(RESOURCES)
+        if backend == 'sge':
+            # SGE requires a parallel environment for nodes/threads
+            del resources['nodes']
+            del resources['threads']
+        self.job = JobScript(BODY, jobname='bench', backend=backend,
+                             input='in.dat', seed=1, **resources)
+        self.jobs = [JobScript(BODY, jobname='bench%d' % i, backend=backend,
+                               input='in%d.dat' % i, seed=i,
+                               **resources) for i in range(100)]
+        if backend == 'sge':
+            for job in [self.job, ] + self.jobs:
+                job.threads = 4 # attribute instead of resource
+
+    def time_render_cached(self, backend):
+        str(self.job)
+
+    def time_render_modified(self, backend):
+        # changing a resource invalidates the cached rendering
+        self.job.resources['seed'] += 1
+        str(self.job)
+
+    def time_render_100_jobs(self, backend):
+        for job in self.jobs:
+            job.resources['seed'] += 1
+            str(job)
+
+
+class TimeSubmit(MockedScheduler):
+    """Submission of job scripts with a mocked scheduler (the script is
+    written to a temporary folder, but no process is spawned)"""
+
+    params = ['files', 'sqlite']
+    param_names = ['cache_backend']
+
+    def setup(self, cache_backend):
+        super(TimeSubmit, self).setup(cache_backend)
+        JobScript.cache_backend = cache_backend
+        self.jobs = [JobScript(BODY, jobname='bench%d' % i, input='in.dat',
+                               seed=i, **RESOURCES) for i in range(100)]
+        self.counter = 0
+
+    def time_submit(self, cache_backend):
+        self.counter += 1
+        self.jobs[0].submit(cache_id=str(self.counter))
+
+    def time_submit_100(self, cache_backend):
+        self.counter += 1
+        for (i, job) in enumerate(self.jobs):
+            job.submit(cache_id="%d.%d" % (self.counter, i))
+
+    def time_submit_cached(self, cache_backend):
+        # resubmission only reads the cache
+        self.jobs[0].submit(cache_id='cached')
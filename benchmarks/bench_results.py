@@ -0,0 +1,80 @@
+"""Benchmarks for caching and polling :class:`clusterjob.AsyncResult`
+instances"""
+import os
+
+from clusterjob import AsyncResult, JobScript, poll_many
+from clusterjob.store import SqliteJobStore
+
+from .common import MockedScheduler, make_results, traced_peak
+
+
+class TimeDumpLoad(MockedScheduler):
+    """Writing and reading cached :class:`clusterjob.AsyncResult`
+    instances"""
+
+    params = ['files', 'sqlite']
+    param_names = ['cache_backend']
+
+    def setup(self, cache_backend):
+        super(TimeDumpLoad, self).setup(cache_backend)
+        self.results = make_results(100)
+        os.mkdir(JobScript.cache_folder)
+        self.store = None
+        if cache_backend == 'sqlite':
+            self.store = SqliteJobStore(
+                os.path.join(JobScript.cache_folder, 'bench.sqlite'))
+        for (i, ar) in enumerate(self.results):
+            if self.store is None:
+                ar.cache_file = os.path.join(JobScript.cache_folder,
+                                             "%d.cache" % i)
+            else:
+                ar.cache_store = self.store
+                ar.cache_key = str(i)
+            ar.dump()
+
+    def teardown(self, cache_backend):
+        if self.store is not None:
+            self.store.close()
+        super(TimeDumpLoad, self).teardown(cache_backend)
+
+    def time_dump_100(self, cache_backend):
+        for ar in self.results:
+            ar.dump()
+
+    def time_load_100(self, cache_backend):
+        for (i, ar) in enumerate(self.results):
+            if self.store is None:
+                AsyncResult.load(ar.cache_file)
+            else:
+                AsyncResult._from_cache_data(self.store.load(ar.cache_key),
+                                             cache_store=self.store,
+                                             cache_key=ar.cache_key)
+
+
+class TimePolling(MockedScheduler):
+    """Polling the status of 10000 running jobs through a mocked SLURM
+    scheduler"""
+
+    timeout = 120
+
+    def setup(self):
+        super(TimePolling, self).setup()
+        self.results = make_results(10000)
+
+    def time_status_10000(self):
+        for ar in self.results:
+            ar.status
+
+    def time_poll_many_10000(self):
+        poll_many(self.results)
+
+    def track_peak_memory_status_10000(self):
+        return traced_peak(lambda: [ar.status for ar in self.results])
+    track_peak_memory_status_10000.unit = "bytes"
+
+    def track_peak_memory_poll_many_10000(self):
+        return traced_peak(poll_many, self.results)
+    track_peak_memory_poll_many_10000.unit = "bytes"
+
+    def peakmem_poll_many_10000(self):
+        poll_many(self.results)
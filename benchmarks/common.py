@@ -0,0 +1,120 @@
+"""Shared fixtures for the benchmarks"""
+from __future__ import print_function
+import re
+import shutil
+import tempfile
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.status import RUNNING
+
+try:
+    import tracemalloc
+except ImportError: # Python < 3.4
+    tracemalloc = None
+
+
+BODY = r'''
+echo "####################################################"
+echo "Job id         : $CLUSTERJOB_ID"
+echo "Job name       : $CLUSTERJOB_NAME"
+echo "Workdir        : $CLUSTERJOB_WORKDIR"
+echo "Submission Host: $CLUSTERJOB_SUBMIT_HOST"
+echo "Compute Node   : $CLUSTERJOB_NODELIST"
+echo "Job started on" `hostname` `date`
+echo "Current directory:" `pwd`
+echo "####################################################"
+
+cd {rootdir}/{workdir}
+./simulate --input={input} --threads={threads} --seed={seed}
+
+echo "Job Finished: " `date`
+exit 0
+'''
+
+RESOURCES = dict(queue='batch', time='01:00:00', nodes=1, threads=4,
+                 mem=1000, stdout='run.out', stderr='run.err')
+
+# Typical responses of the scheduler to the status query of a running job
+STATUS_RESPONSES = {
+    'slurm': "RUNNING\n",
+    'pbs': "Job id            Name     User   Time Use S Queue\n"
+           "----------------  -------- ------ -------- - -----\n"
+           "1234.cluster      test     user   00:00:01 R batch\n",
+    'pbspro': "Job id            Name     User   Time Use S Queue\n"
+              "----------------  -------- ------ -------- - -----\n"
+              "1234.cluster      test     user   00:00:01 R batch\n",
+    'lpbs': "Job id            Name     User   Time Use S Queue\n"
+            "----------------  -------- ------ -------- - -----\n"
+            "1234.cluster      test     user   00:00:01 R batch\n",
+    'lsf': "JOBID   USER    STAT  QUEUE   FROM_HOST  EXEC_HOST  JOB_NAME\n"
+           "1234    user    RUN   normal  login1     node001    test\n",
+    'sge': "Following jobs do not exist:\n1234\n",
+}
+
+
+def fake_run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
+                 ssh='ssh'):
+    """Stand-in for :func:`clusterjob.utils.run_cmd` that simulates a SLURM
+    scheduler with all jobs running, without spawning any processes"""
+    if cmd[0] == 'sbatch':
+        return "Submitted batch job 1234\n"
+    elif cmd[0] == 'squeue':
+        if cmd[-1].find(',') > 0: # multiple jobs
+            return "".join(["%s RUNNING\n" % job_id
+                            for job_id in cmd[-1].split(",")])
+        return "RUNNING\n"
+    return ""
+
+
+class MockedScheduler(object):
+    """Mixin for benchmark classes that replaces all communication with the
+    scheduler by :func:`fake_run_cmd`, and directs all files to a temporary
+    folder"""
+
+    def setup(self, *params):
+        self._tempdir = tempfile.mkdtemp()
+        self._saved = (JobScript.__dict__['_run_cmd'],
+                       AsyncResult.__dict__['_run_cmd'],
+                       JobScript.rootdir, JobScript.cache_folder,
+                       JobScript.cache_backend)
+        JobScript._run_cmd = staticmethod(fake_run_cmd)
+        AsyncResult._run_cmd = staticmethod(fake_run_cmd)
+        JobScript.rootdir = self._tempdir
+        JobScript.cache_folder = self._tempdir + '/cache'
+
+    def teardown(self, *params):
+        (JobScript._run_cmd, AsyncResult._run_cmd, JobScript.rootdir,
+         JobScript.cache_folder, JobScript.cache_backend) = self._saved
+        shutil.rmtree(self._tempdir, ignore_errors=True)
+
+
+def traced_peak(func, *args, **kwargs):
+    """Return the peak memory (in bytes) allocated by Python while calling
+    `func` with the given arguments, or NaN if :mod:`tracemalloc` is not
+    available"""
+    if tracemalloc is None:
+        return float('nan')
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def make_results(n, backend='slurm', cls=AsyncResult):
+    """Return a list of `n` running :class:`clusterjob.AsyncResult` instances
+    with consecutive job IDs, that are not cached"""
+    backend = JobScript._backends[backend]
+    results = []
+    for i in range(n):
+        ar = cls(backend=backend)
+        ar.job_id = str(10000 + i)
+        ar._status = RUNNING
+        results.append(ar)
+    return results
+
+
+def matches(name, pattern):
+    """Check whether the benchmark `name` matches the regex `pattern`"""
+    return pattern is None or re.search(pattern, name) is not None
@@ -29,14 +29,20 @@ except ImportError:
 import subprocess as sp
 from glob import glob
 from textwrap import dedent
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
 import logging
 import importlib
 import pprint
 import pkgutil
 import time
+import itertools
+import string
+import threading
+
+import six
 
 from .backends import ClusterjobBackend, ResourcesNotSupportedError
+from .backends.local import LocalBackend
 from .backends.lpbs import LPbsBackend
 from .backends.lsf import LsfBackend
 from .backends.pbs import PbsBackend
@@ -44,12 +50,154 @@ from .backends.pbspro import PbsProBackend
 from .backends.sge import SgeBackend
 from .backends.slurm import SlurmBackend
 from .status import (STATUS_CODES, COMPLETED, FAILED, CANCELLED, PENDING,
-        str_status)
-from .utils import (set_executable, run_cmd, upload_file, mkdir,
-        time_to_seconds)
+        RUNNING, str_status)
+from .store import get_job_store, CACHE_BACKENDS
+from .polling import BackoffPolling, runtime_history
+from .ratelimit import rate_limiter
+from .epilogue import epilogue_executor
+from .agent import agent_pool
+from .staging import stage_in, stage_out, stage_paths
+from .markers import (MARKER_FOLDER, marker_script, marker_status,
+        read_markers, cmd_list_markers, parse_marker_listing,
+        remove_markers, cmd_remove_markers)
+from .utils import (set_executable, run_cmd, upload_file, upload_files,
+                    upload_and_run,
+        mkdir, time_to_seconds, ssh_pool, quote, quote_path, InProcessCommand,
+        DEPENDENCY_CONDITIONS, format_dependency_spec)
+
+_BACKENDS = [LocalBackend(), LPbsBackend(), LsfBackend(), PbsBackend(),
+             PbsProBackend(), SgeBackend(), SlurmBackend()]
+
+_RENDER_PLANS = OrderedDict() # (backend, scriptbody) => _RenderPlan
+_RENDER_PLANS_MAXSIZE = 512
+
+_versions = itertools.count()
+
+
+class _Resources(OrderedDict):
+    """OrderedDict that keeps track of modifications, in order to invalidate
+    the cached renderings of a :class:`JobScript`. The `_version` attribute
+    is set to a new unique value on every modification."""
+
+    def __init__(self, *args, **kwargs):
+        self._version = next(_versions)
+        super(_Resources, self).__init__(*args, **kwargs)
+
+    def _modified(self):
+        self._version = next(_versions)
+
+    def __setitem__(self, key, value):
+        self._modified()
+        super(_Resources, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._modified()
+        super(_Resources, self).__delitem__(key)
+
+    def clear(self):
+        self._modified()
+        super(_Resources, self).clear()
+
+    def pop(self, *args):
+        self._modified()
+        return super(_Resources, self).pop(*args)
+
+    def popitem(self, *args, **kwargs):
+        self._modified()
+        return super(_Resources, self).popitem(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._modified()
+        return super(_Resources, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._modified()
+        super(_Resources, self).update(*args, **kwargs)
+
+    def move_to_end(self, *args, **kwargs):
+        self._modified()
+        super(_Resources, self).move_to_end(*args, **kwargs)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __repr__(self):
+        return repr(OrderedDict(self))
+
+
+class _RenderPlan(object):
+    """A script body, compiled for rendering by :meth:`JobScript.render_script`
+
+    Attributes:
+        shbang (bool): Whether the first line of the script is a shbang
+        lines (list): For every line of the script (after applying the
+            backend's environment variable mappings), a tuple of the line and
+            a boolean that indicates whether the line must be formatted
+        fields (set or None): The names of all the mappings required to
+            format the script, or None if they cannot be determined (in which
+            case all known attributes and resources must be passed)
+        job_vars (tuple): The compiled `job_vars` of the backend at the time
+            the plan was created
+    """
+
+    def __init__(self, backend, scriptbody):
+        formatter = string.Formatter()
+        self.job_vars = backend._compiled_job_vars()
+        lines = backend.replace_body_vars(scriptbody).split("\n")
+        self.shbang = lines[0].startswith("#!")
+        self.lines = []
+        self.fields = set()
+        for line in lines:
+            needs_format = ('{' in line or '}' in line)
+            self.lines.append((line, needs_format))
+            if needs_format and self.fields is not None:
+                try:
+                    self._collect_fields(formatter, line)
+                except ValueError:
+                    # invalid format string: we leave it to `str.format` to
+                    # raise the appropriate exception
+                    self.fields = None
+
+    def _collect_fields(self, formatter, format_string):
+        for (__, field_name, format_spec, __) \
+        in formatter.parse(format_string):
+            if field_name is None:
+                continue
+            self.fields.add(re.match(r'[^.\[]*', field_name).group(0))
+            if format_spec is not None and '{' in format_spec:
+                self._collect_fields(formatter, format_spec)
+
+
+def _render_plan(backend, scriptbody):
+    """Return the (cached) :class:`_RenderPlan` for the given `backend` and
+    `scriptbody`"""
+    key = (backend, scriptbody)
+    plan = _RENDER_PLANS.pop(key, None)
+    if plan is None or plan.job_vars is not backend._compiled_job_vars():
+        plan = _RenderPlan(backend, scriptbody)
+        if len(_RENDER_PLANS) >= _RENDER_PLANS_MAXSIZE:
+            _RENDER_PLANS.popitem(last=False)
+    _RENDER_PLANS[key] = plan
+    return plan
+
+
+class _JobScriptMeta(type):
+    """Metaclass for :class:`JobScript` that keeps track of modifications of
+    (public) class attributes, in order to invalidate cached renderings"""
+
+    generation = 0
+
+    def __setattr__(cls, name, value):
+        super(_JobScriptMeta, cls).__setattr__(name, value)
+        if not name.startswith('_'):
+            _JobScriptMeta.generation += 1
+
+    def __delattr__(cls, name):
+        super(_JobScriptMeta, cls).__delattr__(name)
+        if not name.startswith('_'):
+            _JobScriptMeta.generation += 1
 
-_BACKENDS = [LPbsBackend(), LsfBackend(), PbsBackend(), PbsProBackend(),
-             SgeBackend(), SlurmBackend()]
 
 def _init_with_read_defaults(cls):
     """Class decorator that calls the read_defaults class method in order to
@@ -66,6 +214,7 @@ def _init_default_backends(cls):
 
 @_init_default_backends
 @_init_with_read_defaults
+@six.add_metaclass(_JobScriptMeta)
 class JobScript(object):
     """Encapsulation of a job script
 
@@ -106,6 +255,20 @@ class JobScript(object):
         mem (int):     Required memory, per node in MB
         stdout (str):  Name of file to which to write the jobs stdout
         stderr (str):  Name of file to which to write the jobs stderr
+        array (str, int, or list): Indices for a job array, see
+                       :func:`~clusterjob.utils.parse_array_spec`. For
+                       example, ``array='1-100%10'`` submits a single job
+                       array of 100 tasks, with at most 10 tasks running at
+                       the same time. In the body of the job script, the
+                       index of each task is available as
+                       ``$CLUSTERJOB_ARRAY_INDEX``. Submitting a job array
+                       results in an :class:`ArrayAsyncResult`.
+        dependency (str): Jobs that must finish before the job may start, as
+                       ``condition:job_id[:job_id...]``, see
+                       :func:`~clusterjob.utils.parse_dependency_spec`. This
+                       is usually set through the `after` argument of
+                       :meth:`submit`, or by a
+                       :class:`~clusterjob.workflow.Workflow`.
 
     The above list constitutes the simplified resource model supported by the
     `clusterjob` package, as a lowest common denominator of various schedulig
@@ -139,6 +302,14 @@ class JobScript(object):
             jobs will be stored inside `cachefolder` in a file
             `cache_prefix`.`cache_id`.cache, where `cache_id` is defined in the
             `submit` method.
+        cache_backend (str): How to store the cached :class:`AsyncResult`
+            instances inside the `cache_folder`. If 'files' (default), every
+            job is stored in its own pickle file, as described above. If
+            'sqlite', all jobs are stored in a single SQLite database
+            ``clusterjob.sqlite``, under the key `cache_prefix`.`cache_id`
+            (see :class:`~clusterjob.store.SqliteJobStore`). This is
+            recommended for a large number of jobs, especially on a network
+            file system. See also :meth:`load_all`.
 
         resources (OrderedDict): Dictionary of *default* resource requirements.
             Modifying the `resources` class attribute affects the default
@@ -188,12 +359,70 @@ class JobScript(object):
             :class:`AsyncResult` object resulting from the job submission. The
             main purpose of the epilogue script is to move data from a remote
             cluster upon completion of the job.
+        epilogue_workers (int): If larger than zero, the epilogue does not
+            run synchronously while the status of the job is checked, but in
+            a background thread, with at most `epilogue_workers` epilogues
+            running at the same time for any remote (see
+            :mod:`clusterjob.epilogue`). Defaults to 0.
+        epilogue_retries (int): Number of times a failing epilogue that runs
+            in the background is retried. Defaults to 2.
+        epilogue_backoff (float): Number of seconds to wait before the first
+            retry of a failing epilogue. The waiting time doubles for every
+            further retry. Defaults to 5.
+        stage_in (list): Files (relative to `workdir`) that are uploaded to
+            the `remote` before the job is submitted (see
+            :mod:`clusterjob.staging`). In an INI file, the files are
+            separated by whitespace. Defaults to an empty list.
+        stage_out (list): Files (relative to `workdir`) that are downloaded
+            from the `remote` once the job has finished, before the
+            `epilogue` runs. Defaults to an empty list.
+        stage_compress (bool): If True, compress the data when transferring
+            the `stage_in` and `stage_out` files. Defaults to False.
+        rsync (str): The executable to use for rsync. If not a full path,
+            must be in the ``$PATH``.
         max_sleep_interval (int): Upper limit for the number of seconds to
             sleep between polling the status of a submitted job.
         ssh (str): The executable to use for ssh. If not a full path, must be
             in the ``$PATH``.
         scp (str): The executable to use for scp. If not a full path, must be
             in the ``$PATH``.
+        ssh_multiplex (bool): If True, route all communication with the
+            `remote` through a single persistent ssh connection (see
+            :class:`~clusterjob.utils.SshConnectionPool`), instead of opening a
+            new connection for every command. Defaults to False.
+        ssh_persist (int): Number of seconds that a multiplexed ssh connection
+            stays open while idle. Defaults to 600.
+        agent (bool): If True, run all commands for the `remote` (or for the
+            local scheduler, if `remote` is None) through a persistent helper
+            process, instead of starting a new ssh session for every command
+            (see :mod:`clusterjob.agent`). Defaults to False.
+        agent_python (str): The Python interpreter that runs the agent on the
+            `remote`. Defaults to 'python3'.
+        stream_submit (bool): If True, a job on a `remote` is submitted
+            through a single ssh connection: the job script and all auxiliary
+            scripts are streamed to a remote shell that writes them, creates
+            any missing folders, makes the scripts executable, and runs the
+            submission command. The `prologue` then runs before the scripts
+            are written, instead of after. Also, folders that were created
+            once are not created again when writing scripts. Defaults to
+            False.
+        submit_rate (float): Maximum number of submission commands per second
+            sent to the `remote` (see :mod:`clusterjob.ratelimit`). Defaults
+            to 0, i.e. no limit.
+        status_rate (float): Maximum number of status queries per second.
+            Defaults to 0, i.e. no limit.
+        cancel_rate (float): Maximum number of cancellation commands per
+            second. Defaults to 0, i.e. no limit.
+        upload_rate (float): Maximum number of uploads of job scripts per
+            second. Defaults to 0, i.e. no limit.
+        rate_burst (int): Number of commands of each class that may be sent
+            in quick succession before the above rates apply. Defaults to 1.
+        status_markers (bool): If True, the job script writes marker files
+            from which the job status can be obtained without querying the
+            scheduler (see :mod:`clusterjob.markers`). Defaults to False.
+        marker_grace (int): Number of seconds after submission during which a
+            job without a marker file is assumed to be pending, before the
+            scheduler is queried. Defaults to 300.
 
     This allows to define defaults for all jobs by setting the class attribute,
     and overriding them for specific jobs by setting the instance attribute.
@@ -232,6 +461,10 @@ class JobScript(object):
                 ssh {remote} 'mkdir -p {rootdir}/{workdir}'
                 rsync -av {workdir}/ {remote}:{rootdir}/{workdir}
 
+          When submitting many jobs, the `stage_in` and `stage_out`
+          attributes are more efficient, as the transfers for all jobs are
+          combined (see :mod:`clusterjob.staging`).
+
     .. rubric:: _`Instance Attributes`
 
     The following attributes are local to any `JobScript` instance, and are set
@@ -336,9 +569,28 @@ class JobScript(object):
         'filename': None,
         'prologue': '',
         'epilogue': '',
+        'epilogue_workers': 0,
+        'epilogue_retries': 2,
+        'epilogue_backoff': 5,
+        'stage_in': (),
+        'stage_out': (),
+        'stage_compress': False,
+        'rsync': 'rsync',
         'max_sleep_interval': 900,
         'ssh': 'ssh',
         'scp': 'scp',
+        'ssh_multiplex': False,
+        'ssh_persist': 600,
+        'agent': False,
+        'agent_python': 'python3',
+        'stream_submit': False,
+        'submit_rate': 0,
+        'status_rate': 0,
+        'cancel_rate': 0,
+        'upload_rate': 0,
+        'rate_burst': 1,
+        'status_markers': False,
+        'marker_grace': 300,
     }
 
     # the following are genuine class attributes:
@@ -346,9 +598,14 @@ class JobScript(object):
         '_backends': {},
         'cache_folder': None,
         'cache_prefix': 'clusterjob',
+        'cache_backend': 'files',
         '_cache_counter': 0,
         '_run_cmd': staticmethod(run_cmd),          # for easy mocking
         '_upload_file': staticmethod(upload_file),  # for easy mocking
+        '_upload_files': staticmethod(upload_files),  # for easy mocking
+        '_upload_and_run': staticmethod(upload_and_run),  # for easy mocking
+        # (remote, ssh, folder) for folders known to exist (`stream_submit`)
+        '_created_folders': set(),
     }
     # Trying to create an instance  attribute of the same name will raise an
     # AttributeError.
@@ -393,16 +650,77 @@ class JobScript(object):
             raise TypeError("backend "+name+" must have extension attribute "
                             "of type str")
         cls._backends[name] = backend
+        _JobScriptMeta.generation += 1
 
     @classmethod
     def clear_cache_folder(cls):
-        """Remove all files in the :attr:`cache_folder`"""
+        """Remove all files in the :attr:`cache_folder`. For the 'sqlite'
+        :attr:`cache_backend`, remove all entries from the database instead."""
         if cls.cache_folder is not None:
+            store = cls._job_store()
+            if store is not None:
+                store.clear()
             for file in glob(os.path.join(cls.cache_folder, '*')):
-                os.unlink(file)
+                if store is None or file != store.filename:
+                    os.unlink(file)
+
+    @classmethod
+    def _job_store(cls):
+        """Return the :class:`~clusterjob.store.SqliteJobStore` inside the
+        :attr:`cache_folder`, or None if the :attr:`cache_backend` is 'files'
+        (or caching is disabled)"""
+        if cls.cache_backend not in CACHE_BACKENDS:
+            raise ValueError("Unknown cache_backend %s" % cls.cache_backend)
+        if cls.cache_folder is None or cls.cache_backend == 'files':
+            return None
+        mkdir(cls.cache_folder)
+        return get_job_store(os.path.join(cls.cache_folder,
+                                          'clusterjob.sqlite'))
+
+    @classmethod
+    def load_all(cls, status=None, remote=None):
+        """Return a list of all the :class:`AsyncResult` instances in the
+        :attr:`cache_folder`, e.g. to re-attach to jobs that are still running
+        after a restart of the Python process.
+
+        Parameters
+        ----------
+
+        status: int, list of int, or None
+            If given, only return results with the given cached status code
+            (or one of the given status codes), cf. :mod:`clusterjob.status`
+
+        remote: str or None
+            If given, only return results for jobs on the given remote
+
+        For the 'sqlite' :attr:`cache_backend`, the selection is done through
+        an indexed database query. For the 'files' backend, all cache files
+        must be loaded.
+        """
+        if cls.cache_folder is None:
+            return []
+        if isinstance(status, int):
+            status = [status, ]
+        store = cls._job_store()
+        if store is None:
+            results = []
+            pattern = os.path.join(cls.cache_folder, '*.cache')
+            for cache_file in sorted(glob(pattern)):
+                ar = AsyncResult.load(cache_file)
+                if status is not None and ar._status not in status:
+                    continue
+                if remote is not None and ar.remote != remote:
+                    continue
+                results.append(ar)
+            return results
+        else:
+            return [AsyncResult._from_cache_data(data, cache_store=store,
+                                                 cache_key=cache_key)
+                    for (cache_key, data)
+                    in store.load_all(status=status, remote=remote)]
 
     def __init__(self, body, jobname, aux_scripts=None, **kwargs):
-        self.resources = self.__class__.resources.copy()
+        self.resources = _Resources(self.__class__.resources)
         self.resources['jobname'] = str(jobname)
 
         self.body = str(body)
@@ -435,6 +753,11 @@ class JobScript(object):
                                  % name)
         else:
             self.__dict__[name] = self._sanitize_attr(name, value)
+            self.__dict__.pop('_rendered', None)
+
+    def __delattr__(self, name):
+        super(JobScript, self).__delattr__(name)
+        self.__dict__.pop('_rendered', None)
 
     @classmethod
     def _sanitize_attr(cls, name, value):
@@ -445,11 +768,18 @@ class JobScript(object):
             value = value.strip()
             if value.endswith('/'):
                 value = value[:-1] # strip trailing slash
+        elif name == 'cache_backend':
+            if not value in CACHE_BACKENDS:
+                raise ValueError("Unknown cache_backend %s" % value)
         elif name in ['prologue', 'epilogue']:
             if value is None:
                 raise ValueError('prologue and epilogue must be strings, '
                                  'not None')
             value = dedent(value).strip()
+        elif name in ['stage_in', 'stage_out']:
+            if isinstance(value, six.string_types):
+                value = value.split()
+            value = tuple([str(filename) for filename in value])
         return value
 
     @classmethod
@@ -574,7 +904,23 @@ class JobScript(object):
         readers = {
             # for values that are not strings, be must specify a reader
             'Attributes': defaultdict(lambda:config.get,
-                {'max_sleep_interval': config.getint, }
+                {'max_sleep_interval': config.getint,
+                 'epilogue_workers': config.getint,
+                 'epilogue_retries': config.getint,
+                 'epilogue_backoff': config.getfloat,
+                 'stage_compress': config.getboolean,
+                 'ssh_multiplex': config.getboolean,
+                 'ssh_persist': config.getint,
+                 'agent': config.getboolean,
+                 'stream_submit': config.getboolean,
+                 'submit_rate': config.getfloat,
+                 'status_rate': config.getfloat,
+                 'cancel_rate': config.getfloat,
+                 'upload_rate': config.getfloat,
+                 'rate_burst': config.getint,
+                 'status_markers': config.getboolean,
+                 'marker_grace': config.getint,
+                }
             ),
             'Resources': defaultdict(lambda:config.get,
                 {'nodes': config.getint,
@@ -623,6 +969,11 @@ class JobScript(object):
           backend-specific resource headers (based on the `resources`
           attribute)
 
+        * If rendering the body of a JobScript and the `status_markers`
+          attribute is True, insert the code that writes the status markers
+          (see :mod:`clusterjob.markers`) after the leading comment lines of
+          the body
+
         * Map environment variables to their corresponding scheduler-specific
           version, using the backend's :meth:`~clusterjob.backends.ClusterjobBackend.replace_body_vars`
           method. Note that the prologue and epilogue will not be run by a
@@ -637,23 +988,52 @@ class JobScript(object):
           - keys in the `resources` attribute
           - instance attributes
           - class attributes
+
+        Every `scriptbody` is compiled only once (for every backend), and the
+        rendered result is cached until any attribute or resource of the job
+        (or any public class attribute), or the header configuration or
+        `job_vars` of the backend is changed. Changes to the *contents* of
+        mutable attributes of the job other than `resources` are not tracked.
         """
+        backend = self._backends[self.backend]
+        token = None
+        if isinstance(self.resources, _Resources):
+            token = (_JobScriptMeta.generation, self.resources._version,
+                     backend._compiled_job_vars(), backend._header_config())
+            rendered = self.__dict__.get('_rendered')
+            if rendered is not None and rendered[0] == token:
+                try:
+                    return rendered[1][(scriptbody, jobscript)]
+                except KeyError:
+                    pass
+            else:
+                self.__dict__['_rendered'] = (token, {})
         rendered_lines = []
         # add the resource headers
-        backend = self._backends[self.backend]
         if jobscript:
             rendered_lines.extend(backend.resource_headers(self))
         # apply environment variable mappings
-        scriptbody = backend.replace_body_vars(scriptbody)
+        plan = _render_plan(backend, scriptbody)
+        if not plan.shbang:
+            # add shbang for file that does not have one
+            rendered_lines.insert(0, "#!%s" % self.shell)
         # apply attribute mappings
-        mappings = dict(self.__class__.__dict__)
-        mappings.update(self.__dict__)
-        mappings.update(self.resources)
-        for line_index, line in enumerate(scriptbody.split("\n")):
-            if line_index == 0:
-                if not line.startswith("#!"):
-                    # add shbang for file that does not have one
-                    rendered_lines.insert(0, "#!%s" % self.shell)
+        if plan.fields is None:
+            mappings = dict(self.__class__.__dict__)
+            mappings.update(self.__dict__)
+            mappings.update(self.resources)
+        else:
+            mappings = {}
+            for field in plan.fields:
+                for source in (self.resources, self.__dict__,
+                               self.__class__.__dict__):
+                    if field in source:
+                        mappings[field] = source[field]
+                        break
+        for (line, needs_format) in plan.lines:
+            if not needs_format:
+                rendered_lines.append(line)
+                continue
             try:
                 rendered_lines.append(line.format(**mappings))
             except KeyError as exc:
@@ -661,7 +1041,19 @@ class JobScript(object):
                 raise KeyError("The scriptbody contains a formatting "
                     "placeholder '{"+key+"}', but there is no matching "
                     "attribute or resource entry")
-        return "\n".join(rendered_lines)
+        if jobscript and self.status_markers \
+                and 'array' not in self.resources:
+            # the markers must not precede any scheduler directives
+            i = 0
+            while i < len(rendered_lines) and \
+                    (rendered_lines[i].startswith('#')
+                     or rendered_lines[i].strip() == ''):
+                i += 1
+            rendered_lines[i:i] = marker_script(backend)
+        result = "\n".join(rendered_lines)
+        if token is not None:
+            self.__dict__['_rendered'][1][(scriptbody, jobscript)] = result
+        return result
 
     def __str__(self):
         """String representation of the job, i.e., the fully rendered
@@ -687,13 +1079,19 @@ class JobScript(object):
             raise ValueError("filename not given")
         if remote is None:
             filename = os.path.expanduser(filename)
+        else:
+            self._enable_connections()
         self._write_script(str(self), filename, remote)
 
     def _write_script(self, scriptbody, filename, remote):
         filepath = os.path.split(filename)[0]
-        if len(filepath) > 0:
+        folder_key = (remote, self.ssh, filepath)
+        if len(filepath) > 0 and folder_key not in self._created_folders:
+            self._throttle('upload', remote)
             self._run_cmd(['mkdir', '-p', filepath], remote,
-                        ignore_exit_code=False, ssh=self.ssh)
+                        ignore_exit_code=False, ssh=self.ssh, agent=self.agent)
+            if self.stream_submit:
+                self._created_folders.add(folder_key)
         if remote is None:
             with open(filename, 'w') as run_fh:
                 run_fh.write(scriptbody)
@@ -704,10 +1102,51 @@ class JobScript(object):
                 tempfilename = run_fh.name
             set_executable(tempfilename)
             try:
-                self._upload_file(tempfilename, remote, filename, scp=self.scp)
+                self._throttle('upload', remote)
+                self._upload_file(tempfilename, remote, filename, scp=self.scp,
+                                  ssh=self.ssh, agent=self.agent)
             finally:
                 os.unlink(tempfilename)
 
+    def _stream_submit(self):
+        """Write the job script and all auxiliary scripts to the `remote`
+        and run the submission command, through a single ssh connection (see
+        the `stream_submit` attribute). Return the response of the submission
+        command."""
+        self._default_filename()
+        folder = os.path.join(self.rootdir, self.workdir)
+        files = OrderedDict()
+        for filename in self.aux_scripts:
+            files[os.path.join(folder, filename)] \
+                = self.render_script(self.aux_scripts[filename])
+        files[os.path.join(folder, self.filename)] = str(self)
+        cmd = self._backends[self.backend].cmd_submit(self)
+        self._throttle('upload', self.remote)
+        self._throttle('submit', self.remote)
+        response = self._upload_and_run(files, cmd, self.remote, folder,
+                                        ssh=self.ssh, agent=self.agent)
+        for filename in files:
+            self._created_folders.add(
+                (self.remote, self.ssh, os.path.split(filename)[0]))
+        return response
+
+    def _enable_connections(self):
+        """If requested by the `ssh_multiplex` attribute, register the
+        `remote` with the pool of persistent ssh connections. If requested by
+        the `agent` attribute, register the `remote` with the pool of
+        agents."""
+        if self.ssh_multiplex and self.remote is not None:
+            ssh_pool.enable(self.ssh, self.remote, persist=self.ssh_persist)
+        if self.agent:
+            agent_pool.enable(self.ssh, self.remote, python=self.agent_python)
+
+    def _throttle(self, cmd_class, remote):
+        """Wait until the rate limit allows to send a command of the given
+        class (see :mod:`clusterjob.ratelimit`) to `remote`"""
+        rate_limiter.acquire(remote, cmd_class,
+                             getattr(self, cmd_class + '_rate'),
+                             self.rate_burst)
+
     def _run_prologue(self):
         """Render and run the prologue script"""
         if self.prologue is not None:
@@ -735,7 +1174,54 @@ class JobScript(object):
             finally:
                 os.unlink(tempfilename)
 
-    def submit(self, block=False, cache_id=None, force=False, retry=True):
+    def _set_dependency(self, after, condition='afterok'):
+        """Set the `dependency` resource such that the job starts only once
+        all the :class:`AsyncResult` instances in `after` satisfy the given
+        `condition` (one of :data:`~clusterjob.utils.DEPENDENCY_CONDITIONS`).
+        Results that are already known to have finished are not passed to the
+        scheduler; if all of them have finished, the `dependency` resource is
+        left unchanged. Return False if the dependency can never be satisfied
+        because of the final status of one of these results, True otherwise.
+
+        The dependency is meant for a single submission only: the caller must
+        restore the previous value of the `dependency` resource afterwards
+        (see :meth:`_restore_dependency`).
+
+        Raises:
+            ValueError: if `condition` is invalid, or if any of the results
+                belongs to a different `remote` than the job.
+        """
+        if condition not in DEPENDENCY_CONDITIONS:
+            raise ValueError("Invalid dependency condition %r" % condition)
+        job_ids = []
+        for ar in after:
+            if ar.remote != self.remote:
+                raise ValueError("Cannot depend on job %s on remote %s"
+                                 % (ar.job_id, ar.remote))
+            if ar._status >= COMPLETED or ar.job_id is None:
+                if condition == 'afterok' and ar._status != COMPLETED:
+                    return False
+                if condition == 'afternotok' and ar._status == COMPLETED:
+                    return False
+            else:
+                job_ids.append(ar.job_id)
+        if len(job_ids) > 0:
+            self.resources['dependency'] = format_dependency_spec(
+                [(condition, job_ids), ])
+        return True
+
+    def _restore_dependency(self, dependency):
+        """Reset the `dependency` resource to the given value (as it was
+        before a call to :meth:`_set_dependency`), or remove it if
+        `dependency` is None"""
+        if dependency is None:
+            if 'dependency' in self.resources:
+                del self.resources['dependency']
+        elif self.resources.get('dependency') != dependency:
+            self.resources['dependency'] = dependency
+
+    def submit(self, block=False, cache_id=None, force=False, retry=True,
+               after=None, condition='afterok'):
         """Run the :attr:`prologue` script (if defined), then submit the job to
         a local or remote scheduler.
 
@@ -765,7 +1251,54 @@ class JobScript(object):
             that the job finished with an error (``CANCELLED``/``FAILED``),
             resubmit the job, discard the cache and return a fresh
             :class:`AsyncResult` object
+
+        after: list of AsyncResult or None, optional
+            If given, the job waits in the scheduler's queue until the jobs
+            of all the given :class:`AsyncResult` objects have finished
+            according to `condition`. This sets the `dependency` resource of
+            the job for this submission only (it is translated by the
+            backend into the scheduler's native dependency mechanism), so
+            that the job starts without any further interaction with the
+            client. If the condition can never be
+            satisfied due to the (known) final status of one of the results,
+            the job is not submitted, and the returned :class:`AsyncResult`
+            has the status ``CANCELLED``. See also
+            :class:`~clusterjob.workflow.Workflow`.
+
+        condition: str, optional
+            One of 'afterok' (start if all jobs in `after` completed
+            successfully), 'afterany' (start once all jobs in `after` have
+            finished), or 'afternotok' (start if all jobs in `after` failed).
+            Not all schedulers support all conditions: SGE treats 'afterok'
+            as 'afterany' (with a warning), so that the job also starts if a
+            job in `after` failed, and does not support 'afternotok'.
         """
+        dependency = self.resources.get('dependency')
+        try:
+            (cache_key, ar) = self._submit_prepare(cache_id, force, retry,
+                                                   after, condition)
+            if ar is None:
+                ar = self._submit_uncached(cache_key)
+        finally:
+            self._restore_dependency(dependency)
+
+        if block:
+            result = ar.get()
+        else:
+            result = ar
+
+        ar.dump()
+
+        return result
+
+    def _submit_prepare(self, cache_id=None, force=False, retry=True,
+                        after=None, condition='afterok'):
+        """Set up the connections to the `remote` for a submission with the
+        given parameters (see :meth:`submit`), and return a tuple
+        ``(cache_key, ar)``. The `ar` is the cached :class:`AsyncResult` (see
+        :meth:`_load_cached`), an :class:`AsyncResult` with the status
+        ``CANCELLED`` if the dependencies in `after` cannot be satisfied, or
+        None if the job must be submitted."""
         logger = logging.getLogger(__name__)
         if self.remote is None:
             logger.info("Submitting job %s locally",
@@ -773,94 +1306,380 @@ class JobScript(object):
         else:
             logger.info("Submitting job %s on %s",
                         self.resources['jobname'], self.remote)
+        self._enable_connections()
+        cache_key = self._cache_key(cache_id)
+        ar = self._load_cached(cache_key, force, retry)
+        if ar is None and after is not None:
+            if not self._set_dependency(after, condition):
+                logger.info("Dependencies of job %s cannot be satisfied",
+                            self.resources['jobname'])
+                ar = self._async_result(None, CANCELLED, cache_key)
+        return cache_key, ar
+
+    def _submit_uncached(self, cache_key):
+        """Write the job script and auxiliary scripts, stage in files, run the
+        prologue, and submit the job to the scheduler. Return a new
+        :class:`AsyncResult` to be cached under `cache_key`"""
+        stream = self._streams_submission()
+        if not stream:
+            self._write_aux_scripts()
+        response = None
+        staged = None
+        error = None
+        try:
+            staged = self._write_and_stage_in(stream)
+            self._run_prologue()
+            if stream:
+                response = self._stream_submit()
+            else:
+                cmd = self._backends[self.backend].cmd_submit(self)
+                self._throttle('submit', self.remote)
+                response = self._run_cmd(
+                    cmd, self.remote, self.rootdir, self.workdir,
+                    ignore_exit_code=True, ssh=self.ssh, agent=self.agent)
+        except (sp.CalledProcessError, ResourcesNotSupportedError) as e:
+            error = e
+        return self._submission_result(cache_key, response, staged, error)
+
+    def _batch_key(self):
+        """Return a tuple of `remote`, `ssh`, and all attributes that
+        determine how commands are sent to the remote. Jobs with the same
+        batch key can be submitted together by :meth:`submit_many`."""
+        return (self.remote, self.ssh, self.stream_submit, self.submit_rate,
+                self.upload_rate, self.rate_burst, self.ssh_multiplex,
+                self.ssh_persist, self.agent, self.agent_python)
+
+    def _streams_submission(self):
+        """Return True if the scripts are written as part of the submission
+        command, see the `stream_submit` attribute"""
+        return self.stream_submit and self.remote is not None
+
+    def _write_aux_scripts(self):
+        """Render and write all auxiliary scripts"""
+        for filename in self.aux_scripts:
+            self._write_script(
+                scriptbody=self.render_script(self.aux_scripts[filename]),
+                filename=os.path.join(self.rootdir, self.workdir, filename),
+                remote=self.remote)
+
+    def _write_and_stage_in(self, stream=False):
+        """Write the job script (unless it is written as part of a `stream`
+        submission) and stage in the files of the `stage_in` attribute.
+        Return a tuple ``(bytes, seconds)`` for the staged files."""
+        if not stream:
+            self.write()
+        return stage_in([self, ])[0]
+
+    def _submission_result(self, cache_key, response, staged=None,
+                           error=None):
+        """Return a new :class:`AsyncResult` for the `response` of the
+        submission command, to be cached under `cache_key`. The `staged`
+        tuple is the result of :meth:`_write_and_stage_in`, if any. If the
+        submission failed with an exception, `error`, the result has the
+        status ``FAILED``."""
+        logger = logging.getLogger(__name__)
+        job_id = None
+        if error is not None:
+            logger.error("Failed to submit job: %s", error)
+            status = FAILED
+        else:
+            job_id = self._backends[self.backend].get_job_id(response)
+            if job_id is None:
+                logger.error("Failed to submit job")
+                status = FAILED
+            else:
+                logger.info("Job ID: %s", job_id)
+                status = PENDING
+        ar = self._async_result(job_id, status, cache_key)
+        if staged is not None:
+            (ar.stage_in_bytes, ar.stage_in_time) = staged
+        return ar
 
-        submitted = False
+    def submit_async(self, block=False, cache_id=None, force=False,
+                     retry=True, after=None, condition='afterok'):
+        """Coroutine version of :meth:`submit`, for use with :mod:`asyncio`
+        (Python >= 3.5). See :func:`clusterjob.aio.submit`."""
+        from .aio import submit
+        return submit(self, block=block, cache_id=cache_id, force=force,
+                      retry=retry, after=after, condition=condition)
+
+    def _cache_key(self, cache_id=None):
+        """Return the key (`cache_prefix`.`cache_id`) under which to cache the
+        :class:`AsyncResult` for the given `cache_id`, or None if caching is
+        disabled. If `cache_id` is None, obtain a new unique `cache_id`."""
         if cache_id is None:
             JobScript._cache_counter += 1
             cache_id = str(JobScript._cache_counter)
         else:
             cache_id = str(cache_id)
-        cache_file = None
+        if self.cache_folder is None:
+            return None
+        return "%s.%s" % (self.cache_prefix, cache_id)
+
+    def _cache_file(self, cache_key):
+        """Return the name of the file in which to cache the
+        :class:`AsyncResult` for the given `cache_key`, for the 'files'
+        :attr:`cache_backend`"""
+        mkdir(self.cache_folder)
+        return os.path.join(self.cache_folder, "%s.cache" % cache_key)
+
+    def _load_cached(self, cache_key, force=False, retry=True):
+        """Return the :class:`AsyncResult` cached under `cache_key`, or None if
+        the job must be (re-)submitted. See :meth:`submit` for the meaning of
+        `force` and `retry`."""
+        logger = logging.getLogger(__name__)
+        if cache_key is None:
+            return None
+        backend = self._backends[self.backend]
+        store = self._job_store()
+        if store is None:
+            cache_file = self._cache_file(cache_key)
+            if not os.path.isfile(cache_file):
+                return None
+            if force:
+                try:
+                    os.unlink(cache_file)
+                except OSError:
+                    pass
+                return None
+            logger.debug("Reloading AsyncResult from %s", cache_file)
+            ar = AsyncResult.load(cache_file, backend=backend)
+            discard = lambda: os.unlink(cache_file)
+        else:
+            data = store.load(cache_key)
+            if data is None:
+                return None
+            if force:
+                store.delete(cache_key)
+                return None
+            logger.debug("Reloading AsyncResult %s from %s", cache_key,
+                         store.filename)
+            ar = AsyncResult._from_cache_data(data, backend=backend,
+                                              cache_store=store,
+                                              cache_key=cache_key)
+            discard = lambda: store.delete(cache_key)
+        if ar._status >= CANCELLED and retry:
+            logger.debug("Cached run %s, resubmitting",
+                         str_status[ar._status])
+            discard()
+            return None
+        return ar
 
+    def _async_result(self, job_id, status, cache_key):
+        """Return a new :class:`AsyncResult` for a job that was submitted with
+        the given `job_id`, resulting in the given initial `status`. The
+        result is cached under the given `cache_key` (if not None)"""
         backend = self._backends[self.backend]
+        if 'array' in self.resources:
+            ar = ArrayAsyncResult(backend=backend)
+            ar.array = self.resources['array']
+        else:
+            ar = AsyncResult(backend=backend)
+        ar.ssh = self.ssh
+        ar.scp = self.scp
+        ar.ssh_multiplex = self.ssh_multiplex
+        ar.ssh_persist = self.ssh_persist
+        ar.agent = self.agent
+        ar.agent_python = self.agent_python
+        ar.status_rate = self.status_rate
+        ar.cancel_rate = self.cancel_rate
+        ar.rate_burst = self.rate_burst
+        ar.remote = self.remote
+        ar.submitted = time.time()
+        if self.status_markers and 'array' not in self.resources:
+            ar.marker_root = self.rootdir
+            ar.marker_dir = os.path.join(self.workdir, MARKER_FOLDER)
+            ar.marker_grace = self.marker_grace
+        if cache_key is not None:
+            store = self._job_store()
+            if store is None:
+                ar.cache_file = self._cache_file(cache_key)
+            else:
+                ar.cache_store = store
+                ar.cache_key = cache_key
+        ar.backend = backend
+        ar.jobname = self.resources['jobname']
+        try:
+            ar.walltime = time_to_seconds(self.resources['time'])
+            ar.max_sleep_interval = int(ar.walltime / 10)
+            if ar.max_sleep_interval < 10:
+                ar.max_sleep_interval = 10
+        except KeyError:
+            ar.max_sleep_interval = self.max_sleep_interval
+        if self.max_sleep_interval < ar.max_sleep_interval:
+            ar.max_sleep_interval = self.max_sleep_interval
+        ar._status = status
+        ar.job_id = job_id
+        if self.epilogue is not None:
+            epilogue = self.render_script(self.epilogue)
+            ar.epilogue = epilogue
+        ar.epilogue_workers = self.epilogue_workers
+        ar.epilogue_retries = self.epilogue_retries
+        ar.epilogue_backoff = self.epilogue_backoff
+        ar.stage_root = self.rootdir
+        ar.stage_out = tuple(stage_paths(self.workdir, self.stage_out))
+        ar.stage_compress = self.stage_compress
+        ar.rsync = self.rsync
+        return ar
 
-        if self.cache_folder is not None:
-            mkdir(self.cache_folder)
-            cache_file = os.path.join(
-                self.cache_folder,
-                "%s.%s.cache" % (self.cache_prefix, cache_id))
-            if os.path.isfile(cache_file):
-                if force:
-                    try:
-                        os.unlink(cache_file)
-                    except OSError:
-                        pass
-                else:
-                    logger.debug("Reloading AsyncResult from %s", cache_file)
-                    ar = AsyncResult.load(cache_file, backend=backend)
-                    submitted = True
-                    if ar._status >= CANCELLED:
-                        if retry:
-                            logger.debug("Cached run %s, resubmitting",
-                                         str_status[ar._status])
-                            os.unlink(cache_file)
-                            submitted = False
-
-        if not submitted:
-            for filename in self.aux_scripts:
-                self._write_script(
-                    scriptbody=self.render_script(self.aux_scripts[filename]),
-                    filename=os.path.join(self.rootdir, self.workdir,
-                                          filename),
-                    remote=self.remote)
-            job_id = None
+    @classmethod
+    def submit_many(cls, jobs, block=False, cache_ids=None, force=False,
+                    retry=True):
+        """Submit multiple jobs, minimizing the number of connections to the
+        remote server(s).
+
+        All jobs are rendered locally. The jobs are grouped by their `remote`
+        (and `ssh` executable), and by the attributes that determine how
+        commands are sent to it (`stream_submit`, the rate limits, and the
+        settings for multiplexing and agents). For every group, all job
+        scripts and
+        auxiliary scripts are uploaded as a single archive streamed through
+        one ssh connection, and the submission commands for all jobs are run
+        in one remote shell invocation. The job IDs are then obtained from
+        the combined response. The :attr:`prologue` scripts are run locally
+        for every job, before the submission. If the `stream_submit`
+        attribute is set for all jobs on a remote, the archive of scripts and
+        the submission commands are sent through the same ssh connection.
+
+        Parameters
+        ----------
+
+        jobs: list of JobScript
+            The jobs to submit
+
+        block: boolean, optional
+            If True, wait until all jobs are finished, and return a list of
+            exit status codes. Otherwise, return a list of
+            :class:`AsyncResult` objects.
+
+        cache_ids: list of str or None, optional
+            List of cache IDs, one for every job (cf. the `cache_id` argument
+            of :meth:`submit`). If not given, the `cache_id` for every job is
+            determined internally.
+
+        force: boolean, optional
+            If True, discard any existing cached :class:`AsyncResult` objects,
+            cf. :meth:`submit`
+
+        retry: boolean, optional
+            If True, resubmit any job whose cached :class:`AsyncResult`
+            indicates that it finished with an error, cf. :meth:`submit`.
+        """
+        logger = logging.getLogger(__name__)
+        jobs = list(jobs)
+        if cache_ids is None:
+            cache_ids = [None for job in jobs]
+        if len(cache_ids) != len(jobs):
+            raise ValueError("cache_ids must have the same length as jobs")
+        results = [None for job in jobs]
+        cache_keys = [None for job in jobs]
+        groups = OrderedDict() # batch key => list of job indices
+        for (i, job) in enumerate(jobs):
+            cache_keys[i] = job._cache_key(cache_ids[i])
+            results[i] = job._load_cached(cache_keys[i], force, retry)
+            if results[i] is None:
+                groups.setdefault(job._batch_key(), []).append(i)
+
+        marker = '--- clusterjob submission %d ---'
+        for (batch_key, indices) in groups.items():
+            (remote, ssh) = batch_key[:2]
+            if remote is None:
+                logger.info("Submitting %d jobs locally", len(indices))
+            else:
+                logger.info("Submitting %d jobs on %s", len(indices), remote)
+            jobs[indices[0]]._enable_connections()
+            files = OrderedDict() # filename => rendered script
+            submit_cmds = [] # list of (index, shell command)
+            for i in indices:
+                job = jobs[i]
+                backend = job._backends[job.backend]
+                try:
+                    job._default_filename()
+                    folder = os.path.join(job.rootdir, job.workdir)
+                    cmd = backend.cmd_submit(job)
+                    if isinstance(cmd, InProcessCommand):
+                        # cannot be combined into a single shell command
+                        results[i] = job._submit_uncached(cache_keys[i])
+                        continue
+                    for filename in job.aux_scripts:
+                        files[os.path.join(folder, filename)] \
+                            = job.render_script(job.aux_scripts[filename])
+                    files[os.path.join(folder, job.filename)] = str(job)
+                except ResourcesNotSupportedError as e:
+                    logger.error("Failed to submit job %s: %s",
+                                 job.resources['jobname'], e)
+                    results[i] = job._async_result(None, FAILED,
+                                                   cache_keys[i])
+                    continue
+                if type(cmd) in [list, tuple]:
+                    cmd = " ".join([quote(part) for part in cmd])
+                submit_cmds.append(
+                    (i, "(cd %s && %s); echo '%s'"
+                        % (quote_path(folder), cmd, marker % i)))
+            if len(submit_cmds) == 0:
+                continue
+            # all jobs in the group have the same batch key
+            job = jobs[submit_cmds[0][0]]
+            stream = job._streams_submission()
+            responses = {}
+            staged = {}
             try:
-                self.write()
-                self._run_prologue()
-                cmd = backend.cmd_submit(self)
-                response = self._run_cmd(cmd, self.remote, self.rootdir,
-                                         self.workdir, ignore_exit_code=True,
-                                         ssh=self.ssh)
-                job_id = backend.get_job_id(response)
+                if remote is None:
+                    for filename in files:
+                        job._write_script(files[filename],
+                                          os.path.expanduser(filename), None)
+                elif not stream:
+                    job._throttle('upload', remote)
+                    cls._upload_files(files, remote, ssh=ssh,
+                                      agent=job.agent)
+                staged = dict(zip(
+                    [i for (i, __) in submit_cmds],
+                    stage_in([jobs[i] for (i, __) in submit_cmds])))
+                for (i, __) in submit_cmds:
+                    jobs[i]._run_prologue()
+                cmd = "\n".join([cmd for (__, cmd) in submit_cmds])
+                if stream:
+                    job._throttle('upload', remote)
+                    job._throttle('submit', remote)
+                    response = cls._upload_and_run(files, cmd, remote,
+                                                   ssh=ssh, agent=job.agent)
+                else:
+                    job._throttle('submit', remote)
+                    response = cls._run_cmd(cmd, remote,
+                                            ignore_exit_code=True, ssh=ssh,
+                                            agent=job.agent)
+                for (i, __) in submit_cmds:
+                    (responses[i], __, response) \
+                        = response.partition(marker % i + "\n")
+            except sp.CalledProcessError as e:
+                logger.error("Failed to submit jobs: %s", e)
+            for (i, __) in submit_cmds:
+                job = jobs[i]
+                backend = job._backends[job.backend]
+                job_id = None
+                try:
+                    job_id = backend.get_job_id(responses.get(i, ''))
+                except IndexError:
+                    pass # empty response
                 if job_id is None:
-                    logger.error("Failed to submit job")
+                    logger.error("Failed to submit job %s",
+                                 job.resources['jobname'])
                     status = FAILED
                 else:
-                    logger.info("Job ID: %s", job_id)
+                    logger.info("Job ID for %s: %s", job.resources['jobname'],
+                                job_id)
                     status = PENDING
-            except (sp.CalledProcessError, ResourcesNotSupportedError) as e:
-                logger.error("Failed to submit job: %s", e)
-                status = FAILED
-
-            ar = AsyncResult(backend=backend)
-            ar.ssh = self.ssh
-            ar.scp = self.scp
-            ar.remote = self.remote
-            ar.cache_file = cache_file
-            ar.backend = backend
-            try:
-                ar.max_sleep_interval \
-                = int(time_to_seconds(self.resources['time']) / 10)
-                if ar.max_sleep_interval < 10:
-                    ar.max_sleep_interval = 10
-            except KeyError:
-                ar.max_sleep_interval = self.max_sleep_interval
-            if self.max_sleep_interval < ar.max_sleep_interval:
-                ar.max_sleep_interval = self.max_sleep_interval
-            ar._status = status
-            ar.job_id = job_id
-            if self.epilogue is not None:
-                epilogue = self.render_script(self.epilogue)
-                ar.epilogue = epilogue
+                results[i] = job._async_result(job_id, status, cache_keys[i])
+                if i in staged:
+                    (results[i].stage_in_bytes, results[i].stage_in_time) \
+                        = staged[i]
 
+        for ar in results:
+            ar.dump()
         if block:
-            result = ar.get()
+            return [ar.get() for ar in results]
         else:
-            result = ar
-
-        ar.dump()
-
-        return result
+            return results
 
 
 class AsyncResult(object):
@@ -881,6 +1700,14 @@ class AsyncResult(object):
             to cache the `AsyncResult` object. The cache file will be written
             automatically anytime a change in status is detected
 
+        cache_store (clusterjob.store.SqliteJobStore or None): If
+            `cache_file` is None, the database in which to cache the
+            `AsyncResult` object (under `cache_key`) whenever a change in
+            status is detected
+
+        cache_key (str or None): The key for the `AsyncResult` in
+            `cache_store`
+
         backend (clusterjob.backends.ClusterjobBackend): A reference to the
             backend instance under which the job is running
 
@@ -888,22 +1715,161 @@ class AsyncResult(object):
             sleep between polls to the cluster scheduling systems when waiting
             for the Job to finish
 
+        polling (clusterjob.polling.PollingStrategy): The strategy that
+            determines how long :meth:`wait` sleeps between polls. Defaults to
+            the `polling` class attribute, a
+            :class:`~clusterjob.polling.BackoffPolling` instance.
+
+        status_ttl (float): Number of seconds for which a status obtained from
+            the scheduler is considered current. Reading :attr:`status`
+            (directly, or through :meth:`get`, :meth:`wait`, :meth:`ready`,
+            ...) within that time after the last query returns the known
+            status without querying the scheduler again. Use :meth:`refresh`
+            to force a query. Defaults to the `status_ttl` class attribute,
+            which is 0 (no memoization).
+
+        queries_saved (int): Number of times that :attr:`status` was answered
+            without querying the scheduler, due to `status_ttl`
+
         job_id (str): The Job ID assigned by the cluster scheduler
 
+        jobname (str or None): The name of the job, used to look up the
+            runtimes of earlier jobs of the same name
+
+        walltime (int or None): The number of seconds requested for the job
+            through the `time` resource
+
+        started (float or None): The time (in seconds since the epoch) at
+            which the job was first seen running
+
         epilogue (str): Multiline script to be run once when the status changes
             from "running" (pending/running) to "not running" (completed,
             canceled, failed).  The contents of this variable will be written
             to a temporary file as is, and executed as a script in the current
             working directory.
 
+        epilogue_workers (int): If larger than zero, the `epilogue` runs in a
+            background thread (see :mod:`clusterjob.epilogue`), with at most
+            this number of epilogues running at the same time for the
+            `remote`. Otherwise, it runs synchronously when the job is first
+            seen to have finished.
+
+        epilogue_retries (int): Number of times a failing epilogue that runs
+            in the background is retried
+
+        epilogue_backoff (float): Number of seconds before the first retry of
+            a failing epilogue
+
+        epilogue_state (str or None): 'pending' while the epilogue is waiting
+            or running in the background, 'done' or 'failed' afterwards, and
+            None if no epilogue was dispatched to the background (yet)
+
+        stage_root (str or None): The `rootdir` of the job, relative to which
+            the `stage_out` files are located on the remote
+
+        stage_out (tuple): Paths of files (relative to the current working
+            directory, and to `stage_root` on the remote) that are downloaded
+            when the job has finished, before the `epilogue` runs (see
+            :mod:`clusterjob.staging`)
+
+        stage_compress (bool): Whether to compress the data when downloading
+            the `stage_out` files
+
+        rsync (str): The executable to use for rsync
+
+        stage_in_bytes (int or None): Number of bytes transferred when
+            uploading the `stage_in` files of the job
+
+        stage_in_time (float or None): Duration (in seconds) of the (possibly
+            coalesced) transfer of the `stage_in` files
+
+        stage_out_bytes (int or None): Number of bytes transferred when
+            downloading the `stage_out` files, or None if they have not been
+            downloaded yet
+
+        stage_out_time (float or None): Duration (in seconds) of the
+            (possibly coalesced) transfer of the `stage_out` files
+
+        exit_code (int or None): The exit code of the job, if reported by
+            the scheduler along with the status (e.g. by the
+            :class:`~clusterjob.backends.slurm.SlurmBackend` in the 'sacct'
+            status mode)
+
+        elapsed (int or None): The number of seconds that the job has been
+            running, as reported by the scheduler
+
+        start_time (str or None): The time at which the job started, in the
+            format reported by the scheduler
+
+        end_time (str or None): The time at which the job ended, in the
+            format reported by the scheduler
+
+        job_stats (clusterjob.accounting.JobStats or None): The resources
+            used by the finished job, once obtained by :meth:`accounting`
+
         ssh (str): The executable to use for ssh. If not a full path, must be
             in the ``$PATH``.
 
         scp (str): The executable to use for scp. If not a full path, must be
             in the ``$PATH``.
+
+        ssh_multiplex (bool): Whether to communicate with the `remote` through
+            a persistent multiplexed ssh connection
+
+        ssh_persist (int): Number of seconds that a multiplexed ssh connection
+            stays open while idle
+
+        agent (bool): Whether to communicate with the `remote` through a
+            persistent agent process (see :mod:`clusterjob.agent`)
+
+        agent_python (str): The Python interpreter that runs the agent
+
+        status_rate (float): Maximum number of status queries per second
+            sent to the `remote`, see :mod:`clusterjob.ratelimit`. Zero for no
+            limit.
+
+        cancel_rate (float): Maximum number of cancellation commands per
+            second sent to the `remote`. Zero for no limit.
+
+        rate_burst (int): Number of commands that may be sent in quick
+            succession before the rate limits apply
+
+        submitted (float or None): The time (in seconds since the epoch) at
+            which the job was submitted
+
+        marker_root (str or None): The `rootdir` of the job, if the job
+            writes status markers (see :mod:`clusterjob.markers`)
+
+        marker_dir (str or None): The folder containing the status markers,
+            relative to `marker_root`. If None, the job does not write
+            status markers, and its status is obtained from the scheduler.
+
+        marker_grace (int): Number of seconds after submission during which a
+            job without a status marker is assumed to be pending
     """
 
     _run_cmd = staticmethod(run_cmd)
+    # attributes that are written to the cache file by `dump` (in addition to
+    # the name of the backend)
+    _cache_attributes = ['remote', 'max_sleep_interval', 'job_id', '_status',
+                         'epilogue', 'ssh', 'scp', 'ssh_multiplex',
+                         'ssh_persist', 'agent', 'agent_python', 'jobname',
+                         'walltime', 'started',
+                         'status_rate', 'cancel_rate', 'rate_burst',
+                         'submitted', 'marker_root', 'marker_dir',
+                         'marker_grace', 'epilogue_workers',
+                         'epilogue_retries', 'epilogue_backoff',
+                         'epilogue_state', 'stage_root', 'stage_out',
+                         'stage_compress', 'rsync', 'stage_in_bytes',
+                         'stage_in_time', 'stage_out_bytes',
+                         'stage_out_time', 'exit_code', 'elapsed',
+                         'start_time', 'end_time', 'job_stats']
+    # attributes that may be set from the details that the backend reports
+    # along with the status
+    _status_detail_attributes = ['exit_code', 'elapsed', 'start_time',
+                                 'end_time']
+    polling = BackoffPolling()
+    status_ttl = 0
     # setting the sleep_interval < 1 can have some very problematic
     # consequences, so we build in a safety net.
     _min_sleep_interval = 1
@@ -913,15 +1879,52 @@ class AsyncResult(object):
     def __init__(self, backend):
         self.remote = None
         self.cache_file = None
+        self.cache_store = None
+        self.cache_key = None
         if not isinstance(backend, ClusterjobBackend):
             raise TypeError("backend must be an instance of ClusterjobBackend")
         self.backend = backend
         self.max_sleep_interval = 160
         self.job_id = ''
+        self.jobname = None
+        self.walltime = None
+        self.started = None
         self._status = CANCELLED
+        self._status_time = None # time of the last status query
+        self.queries_saved = 0
         self.epilogue = None
+        self.epilogue_workers = 0
+        self.epilogue_retries = 2
+        self.epilogue_backoff = 5
+        self.epilogue_state = None
+        self._epilogue_done = threading.Event()
+        self.stage_root = None
+        self.stage_out = ()
+        self.stage_compress = False
+        self.rsync = 'rsync'
+        self.stage_in_bytes = None
+        self.stage_in_time = None
+        self.stage_out_bytes = None
+        self.stage_out_time = None
+        self.exit_code = None
+        self.elapsed = None
+        self.start_time = None
+        self.end_time = None
+        self.job_stats = None
         self.ssh = 'ssh'
         self.scp = 'scp'
+        self.ssh_multiplex = False
+        self.ssh_persist = 600
+        self.agent = False
+        self.agent_python = 'python3'
+        self.status_rate = 0
+        self.cancel_rate = 0
+        self.rate_burst = 1
+        self.submitted = None
+        self.marker_root = None
+        self.marker_dir = None
+        self.marker_grace = 300
+        self._wakeup = threading.Event()
 
     @property
     def status(self):
@@ -929,50 +1932,170 @@ class AsyncResult(object):
         `clusterjob.status` module.
         finished, communicate with the cluster to determine the job's status.
         """
-        if self._status >= COMPLETED:
+        if self._status >= COMPLETED or self._status_is_current():
             return self._status
         else:
-            cmd = self.backend.cmd_status(self, finished=False)
+            return self._update_status(self._query_status())
+
+    def _status_is_current(self):
+        """Return True if the last status query happened less than
+        :attr:`status_ttl` seconds ago (counting the saved query), False
+        otherwise"""
+        if self._status_time is None or self.status_ttl <= 0:
+            return False
+        if time.time() - self._status_time < self.status_ttl:
+            self.queries_saved += 1
+            return True
+        return False
+
+    def refresh(self):
+        """Query the scheduler for the status of the job, irrespective of
+        :attr:`status_ttl`, and return the updated status"""
+        self._status_time = None
+        return self.status
+
+    def _query_status(self):
+        """Query the scheduler for the job status, and return it (or None if
+        the status cannot be determined). If the job writes status markers,
+        obtain the status from the markers instead, if possible."""
+        self._enable_connections()
+        if self.marker_dir is not None:
+            status = marker_status(_read_markers([self, ])[0], self)
+            if status is not None:
+                if status >= COMPLETED:
+                    _remove_markers([self, ])
+                return status
+        status = None
+        for finished in (False, True):
+            cmd = self.backend.cmd_status(self, finished=finished)
+            self._throttle('status')
             response = self._run_cmd(cmd, self.remote, ignore_exit_code=True,
-                                     ssh=self.ssh)
-            status = self.backend.get_status(response, finished=False)
-            if status is None:
-                cmd = self.backend.cmd_status(self, finished=True)
-                response = self._run_cmd(cmd, self.remote,
-                                         ignore_exit_code=True, ssh=self.ssh)
-                status = self.backend.get_status(response, finished=True)
-            prev_status = self._status
-            self._status = status
-            if self._status not in STATUS_CODES:
-                raise ValueError("Invalid status code %s", self._status)
-            if prev_status != self._status:
-                if self._status >= COMPLETED:
+                                     ssh=self.ssh, agent=self.agent)
+            status = self._status_from_response(response, finished)
+            if status is not None:
+                break
+        return status
+
+    def _status_from_response(self, response, finished):
+        """Return the status code for the `response` of the backend's
+        :meth:`~clusterjob.backends.ClusterjobBackend.cmd_status` command (or
+        None if the response does not determine the status), and store the
+        status details contained in the response"""
+        status = self.backend.get_status(response, finished=finished)
+        if status is not None:
+            self._set_status_details(
+                self.backend.get_status_details(response, finished=finished))
+        return status
+
+    def _set_status_details(self, details):
+        """Store the `details` obtained from the backend's
+        :meth:`~clusterjob.backends.ClusterjobBackend.get_status_details`
+        method in the corresponding attributes"""
+        for attr in self._status_detail_attributes:
+            if attr in details:
+                setattr(self, attr, details[attr])
+
+    def _update_status(self, status):
+        """Set the job status to the given status code. If this is a change
+        from the previous status, write the cache file, and run the epilogue if
+        the job has finished (or dispatch it to the
+        :data:`~clusterjob.epilogue.epilogue_executor`, if
+        :attr:`epilogue_workers` is set). Return the new status."""
+        if status not in STATUS_CODES:
+            raise ValueError("Invalid status code %s" % status)
+        prev_status = self._status
+        self._status = status
+        self._status_time = time.time()
+        if prev_status != self._status:
+            if self._status == RUNNING and self.started is None:
+                self.started = time.time()
+            if self._status == COMPLETED and self.started is not None:
+                if self.jobname is not None:
+                    runtime_history.record(self.jobname,
+                                           time.time() - self.started)
+            dispatch = False
+            if self._status >= COMPLETED:
+                if (self.epilogue or self._stage_out_pending) \
+                        and self.epilogue_workers > 0:
+                    self.epilogue_state = 'pending'
+                    dispatch = True
+                else:
                     self.run_epilogue()
-                self.dump()
-            return self._status
-
-    def get(self, timeout=None):
-        """Return status"""
+            self.dump()
+            if dispatch:
+                epilogue_executor.submit(self)
+        return self._status
+
+    def _enable_connections(self):
+        """If requested by the `ssh_multiplex` attribute, register the
+        `remote` with the pool of persistent ssh connections. If requested by
+        the `agent` attribute, register the `remote` with the pool of
+        agents."""
+        if self.ssh_multiplex and self.remote is not None:
+            ssh_pool.enable(self.ssh, self.remote, persist=self.ssh_persist)
+        if self.agent:
+            agent_pool.enable(self.ssh, self.remote, python=self.agent_python)
+
+    def _throttle(self, cmd_class):
+        """Wait until the rate limit allows to send a command of the given
+        class (``'status'`` or ``'cancel'``) to the `remote`"""
+        rate_limiter.acquire(self.remote, cmd_class,
+                             getattr(self, cmd_class + '_rate'),
+                             self.rate_burst)
+
+    def get(self, timeout=None, wait_epilogue=True):
+        """Wait until the job has finished (see :meth:`wait`), and return its
+        status. If `wait_epilogue` is True, also wait until an epilogue that
+        runs in the background has finished (see :meth:`wait_epilogue`)."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
         status = self.status
-        if status >= COMPLETED:
-            return status
-        else:
+        if status < COMPLETED:
             self.wait(timeout)
-            return self.status
+            status = self.status
+        if wait_epilogue and status >= COMPLETED:
+            if deadline is None:
+                self.wait_epilogue()
+            else:
+                self.wait_epilogue(max(0, deadline - time.time()))
+        return status
+
+    def wait_epilogue(self, timeout=None):
+        """Wait until an epilogue that runs in the background has finished,
+        or until `timeout` seconds pass. Return True if no epilogue is
+        pending."""
+        if self.epilogue_state != 'pending':
+            return True
+        return self._epilogue_done.wait(timeout) \
+            or self.epilogue_state != 'pending'
+
+    def _resume_epilogue(self):
+        """Dispatch an epilogue that was still pending when the result was
+        cached to the :data:`~clusterjob.epilogue.epilogue_executor`"""
+        if self.epilogue_state == 'pending' and self._status >= COMPLETED:
+            epilogue_executor.submit(self)
 
     def dump(self, cache_file=None):
         """Write dump out to file `cache_file`, defaulting to
-        ``self.cache_file``"""
+        ``self.cache_file``. If neither is given, but :attr:`cache_store` is
+        set, write to the :attr:`cache_store` instead."""
         if cache_file is None:
             cache_file = self.cache_file
         if cache_file is not None:
             self.cache_file = cache_file
             with open(cache_file, 'wb') as pickle_fh:
-                pickle.dump(
-                    (self.remote, self.backend.name, self.max_sleep_interval,
-                     self.job_id, self._status, self.epilogue, self.ssh,
-                     self.scp),
-                    pickle_fh)
+                pickle.dump(self._cache_data(), pickle_fh)
+        elif self.cache_store is not None:
+            self.cache_store.save(self.cache_key, self._cache_data())
+
+    def _cache_data(self):
+        """Return a dict of the data to be written by :meth:`dump`"""
+        data = dict([(attr, getattr(self, attr))
+                     for attr in self._cache_attributes])
+        data['backend'] = self.backend.name
+        data['class'] = self.__class__.__name__
+        return data
 
     @classmethod
     def load(cls, cache_file, backend=None):
@@ -991,39 +2114,86 @@ class AsyncResult(object):
                 determined by the *name* of the dumped job's backend.
         """
         with open(cache_file, 'rb') as pickle_fh:
-            (remote, backend_name, max_sleep_interval, job_id, status,
-             epilogue, ssh, scp) = pickle.load(pickle_fh)
+            data = pickle.load(pickle_fh)
+        ar = cls._from_cache_data(data, backend=backend)
+        ar.cache_file = cache_file
+        ar._resume_epilogue()
+        return ar
+
+    @classmethod
+    def _from_cache_data(cls, data, backend=None, cache_store=None,
+                         cache_key=None):
+        """Instantiate AsyncResult from the `data` obtained from
+        :meth:`_cache_data` (or from an older cache file)"""
+        if isinstance(data, tuple):
+            # cache file written by an older version of clusterjob
+            data = dict(zip(['remote', 'backend', 'max_sleep_interval',
+                             'job_id', '_status', 'epilogue', 'ssh', 'scp'],
+                            data))
         if backend is None:
-            backend = JobScript._backends[backend_name]
+            backend = JobScript._backends[data['backend']]
+        for subclass in cls.__subclasses__():
+            if subclass.__name__ == data.get('class'):
+                cls = subclass
         ar = cls(backend)
-        (ar.remote, ar.max_sleep_interval, ar.job_id, ar._status, ar.epilogue,
-         ar.ssh, ar.scp) \
-            = (remote, max_sleep_interval, job_id, status, epilogue, ssh, scp)
-        ar.cache_file = cache_file
+        for attr in cls._cache_attributes:
+            if attr in data:
+                setattr(ar, attr, data[attr])
+        ar.cache_store = cache_store
+        ar.cache_key = cache_key
+        if cache_store is not None:
+            ar._resume_epilogue()
         return ar
 
+    def status_async(self):
+        """Coroutine that returns the job status, for use with :mod:`asyncio`
+        (Python >= 3.5). See :func:`clusterjob.aio.status`."""
+        from .aio import status
+        return status(self)
+
+    def wait_async(self, timeout=None):
+        """Coroutine version of :meth:`wait`, for use with :mod:`asyncio`
+        (Python >= 3.5). See :func:`clusterjob.aio.wait`."""
+        from .aio import wait
+        return wait(self, timeout=timeout)
+
     def wait(self, timeout=None):
-        """Wait until the result is available or until roughly timeout seconds
-        pass."""
+        """Wait until the result is available or until `timeout` seconds
+        pass.
+
+        The time between polls is determined by the :attr:`polling` strategy.
+        The sleep is cut short when the `timeout` expires, or when
+        :meth:`wake` or :meth:`cancel` is called from another thread.
+        """
         logger = logging.getLogger(__name__)
         if int(self.max_sleep_interval) < int(self._min_sleep_interval):
             self.max_sleep_interval = int(self._min_sleep_interval)
-        t0 = time.time()
-        sleep_seconds = min(5, self.max_sleep_interval)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        interval = None
+        self._wakeup.clear()
         status = self.status
-        prev_status = status
+        changed = False
         while status < COMPLETED:
-            logger.debug("sleep for %d seconds", sleep_seconds)
-            time.sleep(sleep_seconds)
-            if 2*sleep_seconds <= self.max_sleep_interval:
-                sleep_seconds *= 2
-            if timeout is not None:
-                if int(time.time() - t0) > int(timeout):
+            interval = self.polling.interval(self, interval, changed)
+            sleep_seconds = max(interval, self._min_sleep_interval)
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
                     return
+                sleep_seconds = min(sleep_seconds, remaining)
+            logger.debug("sleep for %.2f seconds", sleep_seconds)
+            if self._wakeup.wait(sleep_seconds):
+                self._wakeup.clear()
+            prev_status = status
             status = self.status
-            if status != prev_status:
-                sleep_seconds = min(5, self.max_sleep_interval)
-                prev_status = status
+            changed = (status != prev_status)
+
+    def wake(self):
+        """Interrupt the sleep of a :meth:`wait` in another thread, so that
+        the status is queried immediately"""
+        self._wakeup.set()
 
     def ready(self):
         """Return whether the job has completed."""
@@ -1035,26 +2205,61 @@ class AsyncResult(object):
         if the job has not completed"""
         status = self.status
         assert status >= COMPLETED, "status is %s" % status
-        return (self.status == COMPLETED)
+        return (status == COMPLETED)
 
     def cancel(self):
         """Instruct the cluster to cancel the running job. Has no effect if
         job is not running"""
         if self.status > COMPLETED:
             return
+        self._enable_connections()
         cmd = self.backend.cmd_cancel(self)
-        self._run_cmd(cmd, self.remote, ignore_exit_code=True, ssh=self.ssh)
+        self._throttle('cancel')
+        self._run_cmd(cmd, self.remote, ignore_exit_code=True, ssh=self.ssh,
+                      agent=self.agent)
         self._status = CANCELLED
         self.dump()
+        self.wake()
+
+    def accounting(self):
+        """Return a :class:`~clusterjob.accounting.JobStats` instance with
+        the resources used by the finished job, as reported by the scheduler's
+        accounting (see :mod:`clusterjob.accounting`). The record is fetched
+        only once, and cached in :attr:`job_stats`. Return None if the job
+        has not finished, if the backend does not support accounting, or if
+        the scheduler has no (complete) record of the job yet."""
+        if self.job_stats is not None:
+            return self.job_stats
+        if self.status < COMPLETED:
+            return None
+        cmd = self.backend.cmd_accounting(self)
+        if cmd is None:
+            return None
+        self._enable_connections()
+        self._throttle('status')
+        response = self._run_cmd(cmd, self.remote, ignore_exit_code=True,
+                                 ssh=self.ssh, agent=self.agent)
+        self.job_stats = self.backend.get_accounting(response)
+        if self.job_stats is not None:
+            self.dump()
+        return self.job_stats
+
+    @property
+    def _stage_out_pending(self):
+        """Whether the `stage_out` files must still be downloaded"""
+        return len(self.stage_out) > 0 and self.stage_out_bytes is None
 
     def run_epilogue(self):
-        """Run the epilogue script in the current working directory.
+        """Download the `stage_out` files (if they have not been downloaded
+        yet), and run the epilogue script in the current working directory.
 
         raises:
-            subprocess.CalledProcessError: if the script does not finish with
-                exit code zero.
+            subprocess.CalledProcessError: if the download fails, or if the
+                script does not finish with exit code zero.
         """
         logger = logging.getLogger(__name__)
+        if self._stage_out_pending:
+            stage_out([self, ])
         if self.epilogue is not None:
             with tempfile.NamedTemporaryFile('w', delete=False) as epilogue_fh:
                 epilogue_fh.write(self.epilogue)
@@ -1078,3 +2283,377 @@ class AsyncResult(object):
             finally:
                 os.unlink(tempfilename)
 
+
+class ArrayAsyncResult(AsyncResult):
+    """Result of submitting a jobscript with an `array` resource, i.e., a job
+    array
+
+    In addition to the attributes of :class:`AsyncResult`, the following
+    attributes are available:
+
+    Attributes:
+
+        array (str, int, or list): The specification of the array indices, as
+            in the `array` resource of the submitted
+            :class:`JobScript`
+
+    The :attr:`status` of a job array as a whole is derived from the status
+    of the individual tasks: the array is running (or pending) while any task
+    is running (or pending). Once all tasks have finished, the status is the
+    "worst" status of any task (``FAILED`` > ``CANCELLED`` > ``COMPLETED``).
+    If the backend cannot report on individual tasks (see
+    :meth:`~clusterjob.backends.ClusterjobBackend.cmd_array_status`), the
+    status is obtained as for a regular job.
+    """
+
+    _cache_attributes = AsyncResult._cache_attributes + ['array', ]
+
+    def __init__(self, backend):
+        super(ArrayAsyncResult, self).__init__(backend)
+        self.array = None
+        self._task_status = {}
+
+    @property
+    def task_status(self):
+        """Dictionary mapping array indices to the status code for the
+        corresponding task. All tasks are queried with a single command to the
+        scheduler. If the backend cannot report on individual tasks, the
+        dictionary is empty."""
+        if self._status >= COMPLETED:
+            if len(self._task_status) > 0:
+                return dict(self._task_status)
+        self._task_status = self._query_task_status()
+        return dict(self._task_status)
+
+    def _query_task_status(self):
+        """Query the scheduler for the status of all tasks, and return a
+        dictionary mapping array indices to status codes"""
+        self._enable_connections()
+        task_status = {}
+        for finished in (False, True):
+            cmd = self.backend.cmd_array_status(self, finished=finished)
+            if cmd is None:
+                break
+            self._throttle('status')
+            response = self._run_cmd(cmd, self.remote, ignore_exit_code=True,
+                                     ssh=self.ssh, agent=self.agent)
+            task_status = self.backend.get_array_status(response,
+                                                        finished=finished)
+            if len(task_status) > 0:
+                break
+        return task_status
+
+    @property
+    def status(self):
+        """Return the status of the job array as one of the codes defined in
+        the `clusterjob.status` module"""
+        if self._status >= COMPLETED or self._status_is_current():
+            return self._status
+        task_status = self._query_task_status()
+        if len(task_status) == 0:
+            return self._update_status(self._query_status())
+        self._task_status = task_status
+        return self._update_status(self._array_status(task_status))
+
+    @staticmethod
+    def _array_status(task_status):
+        """Combine the status codes in the `task_status` dict into a status
+        code for the array as a whole"""
+        statuses = set(task_status.values())
+        if RUNNING in statuses:
+            return RUNNING
+        elif PENDING in statuses:
+            return PENDING
+        else:
+            return max(statuses)
+
+
+def _read_markers(results):
+    """Return a list of the dicts of status markers (see
+    :func:`clusterjob.markers.read_markers`) for all the given
+    :class:`AsyncResult` instances (which must have a `marker_dir`). Every
+    local marker folder is read only once, and the marker folders on a remote
+    are read with a single command for every `marker_root`."""
+    folders = {} # (remote, ssh, agent, marker_root) => {marker_dir => markers}
+    for (key, runs) in _marker_groups(results).items():
+        (remote, ssh, agent, marker_root) = key
+        marker_dirs = []
+        for ar in runs:
+            marker_dir = os.path.normpath(ar.marker_dir)
+            if marker_dir not in marker_dirs:
+                marker_dirs.append(marker_dir)
+        if remote is None:
+            folders[key] = dict([
+                (marker_dir,
+                 read_markers(os.path.join(marker_root, marker_dir)))
+                for marker_dir in marker_dirs])
+        else:
+            runs[0]._throttle('status')
+            response = runs[0]._run_cmd(cmd_list_markers(marker_dirs),
+                                        remote, marker_root,
+                                        ignore_exit_code=True, ssh=ssh,
+                                        agent=agent)
+            folders[key] = parse_marker_listing(response)
+    return [folders[(ar.remote, ar.ssh, ar.agent, ar.marker_root)].get(
+                os.path.normpath(ar.marker_dir), {})
+            for ar in results]
+
+
+def _remove_markers(results):
+    """Remove the status markers of all the given :class:`AsyncResult`
+    instances (which must have a `marker_dir`), after their final status has
+    been read. The markers on a remote are removed with a single command for
+    every `marker_root`."""
+    for (key, runs) in _marker_groups(results).items():
+        (remote, ssh, agent, marker_root) = key
+        if remote is None:
+            for ar in runs:
+                remove_markers(os.path.join(marker_root, ar.marker_dir),
+                               [ar.job_id, ])
+        else:
+            runs[0]._throttle('status')
+            runs[0]._run_cmd(
+                cmd_remove_markers([(os.path.normpath(ar.marker_dir),
+                                     ar.job_id) for ar in runs]),
+                remote, marker_root, ignore_exit_code=True, ssh=ssh,
+                agent=agent)
+
+
+def _marker_groups(results):
+    """Group the given :class:`AsyncResult` instances by the remote (and the
+    connection to it) and the `marker_root` of their status markers. Return
+    an ordered dict that maps tuples ``(remote, ssh, agent, marker_root)`` to
+    lists of results."""
+    groups = OrderedDict()
+    for ar in results:
+        groups.setdefault((ar.remote, ar.ssh, ar.agent, ar.marker_root),
+                          []).append(ar)
+    return groups
+
+
+def poll_many(results):
+    """Update the status of all the given :class:`AsyncResult` instances,
+    using as few queries to the scheduler as possible.
+
+    Jobs that are not yet known to have finished are grouped by their remote
+    host and backend. For each group, the scheduler is queried once for all
+    jobs via the backend's
+    :meth:`~clusterjob.backends.ClusterjobBackend.cmd_status_many` method, and
+    once more (with ``finished=True``) for any job that was not found in the
+    first response. The epilogue is run and the cache file is written only for
+    jobs whose status changed. For backends that do not support querying
+    multiple jobs at once, the status of each job is obtained individually
+    through :attr:`AsyncResult.status`.
+
+    Jobs that write status markers (see :mod:`clusterjob.markers`) are
+    resolved from the markers first. All markers in a local folder are read
+    at once, and all marker folders on a remote with a single command. Only
+    jobs that cannot be resolved from their markers are queried from the
+    scheduler. The markers of jobs that are found to have finished are
+    removed afterwards (with one more command for every remote).
+
+    The `stage_out` files (see :mod:`clusterjob.staging`) of all jobs that
+    are found to have finished, and whose epilogue runs synchronously, are
+    downloaded with a single transfer for every remote and `rootdir`, before
+    the epilogues run.
+
+    Returns a list of the status codes of all `results`, in order. The status
+    of a job that the scheduler does not report on is left unchanged.
+    """
+    logger = logging.getLogger(__name__)
+    results = list(results)
+    groups = OrderedDict()
+    unfinished = []
+    marked = []
+    updates = [] # (ar, status)
+    for ar in results:
+        if ar._status >= COMPLETED:
+            continue
+        if isinstance(ar, ArrayAsyncResult):
+            ar.status # array status is always obtained per array
+            continue
+        if ar.marker_dir is not None:
+            marked.append(ar)
+        else:
+            unfinished.append(ar)
+    finished_markers = []
+    for (ar, markers) in zip(marked, _read_markers(marked)):
+        status = marker_status(markers, ar)
+        if status is None:
+            unfinished.append(ar)
+        else:
+            updates.append((ar, status))
+            if status >= COMPLETED:
+                finished_markers.append(ar)
+    for ar in unfinished:
+        key = (ar.remote, ar.ssh, ar.agent, id(ar.backend))
+        groups.setdefault(key, []).append(ar)
+    for runs in groups.values():
+        backend = runs[0].backend
+        remote = runs[0].remote
+        runs[0]._enable_connections()
+        pending = runs
+        for finished in (False, True):
+            cmd = backend.cmd_status_many(pending, finished=finished)
+            if cmd is None:
+                # no support for bulk queries: fall back to individual queries
+                for ar in pending:
+                    ar.status
+                pending = []
+                break
+            runs[0]._throttle('status')
+            response = runs[0]._run_cmd(cmd, remote, ignore_exit_code=True,
+                                        ssh=runs[0].ssh, agent=runs[0].agent)
+            statuses = backend.get_status_many(response, finished=finished)
+            details = backend.get_status_details_many(response,
+                                                      finished=finished)
+            unresolved = []
+            for ar in pending:
+                if str(ar.job_id) in statuses:
+                    ar._set_status_details(details.get(str(ar.job_id), {}))
+                    updates.append((ar, statuses[str(ar.job_id)]))
+                else:
+                    unresolved.append(ar)
+            pending = unresolved
+            if len(pending) == 0:
+                break
+        for ar in pending:
+            logger.warning("Cannot determine status of job %s", ar.job_id)
+    staging = [ar for (ar, status) in updates
+               if status >= COMPLETED and ar._status < COMPLETED
+               and ar._stage_out_pending and ar.epilogue_workers == 0]
+    if len(staging) > 0:
+        try:
+            stage_out(staging)
+        except sp.CalledProcessError as e:
+            # every epilogue will retry the download individually
+            logger.error("Failed to download stage_out files: %s", e)
+    for (ar, status) in updates:
+        ar._update_status(status)
+    _remove_markers(finished_markers)
+    return [ar._status for ar in results]
+
+
+#: Value for the `return_when` argument of :func:`wait`: return as soon as any
+#: job has finished
+FIRST_COMPLETED = 'FIRST_COMPLETED'
+#: Value for the `return_when` argument of :func:`wait`: return when all jobs
+#: have finished
+ALL_COMPLETED = 'ALL_COMPLETED'
+
+#: Return value of :func:`wait`
+DoneAndNotDoneResults = namedtuple('DoneAndNotDoneResults', 'done not_done')
+
+try:
+    TimeoutError = TimeoutError
+except NameError: # Python 2
+    class TimeoutError(Exception):
+        """Raised by :func:`as_completed` if not all jobs finish in time"""
+
+
+def _shared_interval(interval, changed, results):
+    """Return the number of seconds to sleep before polling the given
+    unfinished `results` again, given the previous `interval` (None for the
+    first poll) and whether the status of any job `changed` in the previous
+    poll. The interval starts at 5 seconds and is doubled after every poll, up
+    to the smallest `max_sleep_interval` of any of the `results`."""
+    max_interval = max(min([ar.max_sleep_interval for ar in results]),
+                       AsyncResult._min_sleep_interval)
+    if interval is None or changed:
+        return min(5, max_interval)
+    if 2 * interval <= max_interval:
+        return 2 * interval
+    return interval
+
+
+def _sleep_until(interval, deadline, n_pending):
+    """Sleep for the given `interval`, but not past the `deadline`. Raise a
+    :exc:`TimeoutError` if the `deadline` has passed already"""
+    logger = logging.getLogger(__name__)
+    sleep_seconds = max(interval, AsyncResult._min_sleep_interval)
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError("%d jobs did not finish in time" % n_pending)
+        sleep_seconds = min(sleep_seconds, remaining)
+    logger.debug("sleep for %.2f seconds (%d unfinished jobs)",
+                 sleep_seconds, n_pending)
+    time.sleep(sleep_seconds)
+
+
+def as_completed(results, timeout=None):
+    """Generator that yields the given :class:`AsyncResult` instances as the
+    corresponding jobs finish (analogous to
+    :func:`concurrent.futures.as_completed`).
+
+    Jobs that have already finished are yielded first. The remaining jobs are
+    polled together with :func:`poll_many`, and every finished job is yielded
+    as soon as its status is known. Between polls, the generator sleeps with
+    an exponential backoff shared by all jobs: starting at 5 seconds, the
+    interval is doubled after every poll (up to the smallest
+    :attr:`~AsyncResult.max_sleep_interval` of any unfinished job), and is
+    reset whenever the status of any job changes. Yielded results are not
+    referenced by the generator anymore.
+
+    Raises:
+        TimeoutError: if not all jobs have finished after `timeout` seconds
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    pending = []
+    for ar in results:
+        if ar._status >= COMPLETED:
+            yield ar
+        else:
+            pending.append(ar)
+    statuses = [ar._status for ar in pending]
+    interval = None
+    while len(pending) > 0:
+        prev_statuses = statuses
+        statuses = poll_many(pending)
+        changed = (statuses != prev_statuses)
+        unfinished = []
+        for (ar, status) in zip(pending, statuses):
+            if status >= COMPLETED:
+                yield ar
+            else:
+                unfinished.append(ar)
+        if len(unfinished) < len(pending):
+            pending = unfinished
+            statuses = [ar._status for ar in pending]
+        if len(pending) == 0:
+            break
+        interval = _shared_interval(interval, changed, pending)
+        _sleep_until(interval, deadline, len(pending))
+
+
+def wait(results, timeout=None, return_when=ALL_COMPLETED):
+    """Wait for the jobs of the given :class:`AsyncResult` instances to
+    finish (analogous to :func:`concurrent.futures.wait`).
+
+    Arguments:
+        results (list): The :class:`AsyncResult` instances to wait for
+        timeout (float or None): Maximum number of seconds to wait
+        return_when (str): When to return: :data:`FIRST_COMPLETED` (as soon
+            as any job has finished) or :data:`ALL_COMPLETED`.
+
+    The jobs are polled as in :func:`as_completed`.
+
+    Returns:
+        DoneAndNotDoneResults: A named tuple of two sets, `done` (the results
+        of the finished jobs) and `not_done` (the results of the unfinished
+        jobs).
+    """
+    if return_when not in [FIRST_COMPLETED, ALL_COMPLETED]:
+        raise ValueError("Invalid return_when: %s" % return_when)
+    results = list(results)
+    try:
+        for __ in as_completed(results, timeout=timeout):
+            if return_when == FIRST_COMPLETED:
+                break
+    except TimeoutError:
+        pass
+    done = set([ar for ar in results if ar._status >= COMPLETED])
+    not_done = set([ar for ar in results if ar._status < COMPLETED])
+    return DoneAndNotDoneResults(done, not_done)
@@ -0,0 +1,162 @@
+"""Resources used by finished jobs
+
+Jobs routinely request more `time` and `mem` than they need, which makes it
+harder for the scheduler to fit them into gaps (backfill), and increases the
+time they wait in the queue. After a job has finished,
+:meth:`AsyncResult.accounting <clusterjob.AsyncResult.accounting>` obtains
+the record of the resources that the job actually used from the scheduler's
+accounting, and returns it as a :class:`JobStats` instance. The record is
+cached with the :class:`~clusterjob.AsyncResult`, so that it is fetched only
+once.
+
+Every backend translates its own accounting record, through the optional
+:meth:`~clusterjob.backends.ClusterjobBackend.cmd_accounting` and
+:meth:`~clusterjob.backends.ClusterjobBackend.get_accounting` methods:
+
+* SLURM: ``sacct`` (`Elapsed`, `TotalCPU`, `MaxRSS`, `MaxVMSize`)
+* PBS/TORQUE and PBS Pro: ``qstat -x -f`` (``resources_used``)
+* LSF: ``bhist -l``
+* SGE: ``qacct -j``
+
+The helper functions :func:`duration_to_seconds` and :func:`memory_to_bytes`
+convert the values in these records.
+"""
+from __future__ import absolute_import
+import re
+
+__all__ = ['JobStats', 'duration_to_seconds', 'memory_to_bytes']
+
+_MEMORY_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3,
+                 'T': 1024**4, 'P': 1024**5}
+
+
+class JobStats(object):
+    """Record of the resources used by a finished job
+
+    Attributes:
+        elapsed (float or None): The wallclock time (in seconds) that the job
+            was running
+        cpu_time (float or None): The total CPU time (in seconds) used by all
+            processes of the job
+        max_rss (int or None): The maximum resident memory (in bytes) of the
+            job
+        max_vmem (int or None): The maximum virtual memory (in bytes) of the
+            job
+        exit_code (int or None): The exit code of the job
+        raw (dict): The fields of the accounting record from which the above
+            values were obtained, as strings
+
+    Attributes that the scheduler did not report are None.
+    """
+
+    _fields = ['elapsed', 'cpu_time', 'max_rss', 'max_vmem', 'exit_code']
+
+    def __init__(self, elapsed=None, cpu_time=None, max_rss=None,
+                 max_vmem=None, exit_code=None, raw=None):
+        self.elapsed = elapsed
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+        self.max_vmem = max_vmem
+        self.exit_code = exit_code
+        if raw is None:
+            raw = {}
+        self.raw = raw
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(
+            ["%s=%r" % (attr, getattr(self, attr)) for attr in self._fields]))
+
+    def __eq__(self, other):
+        if not isinstance(other, JobStats):
+            return NotImplemented
+        return all([getattr(self, attr) == getattr(other, attr)
+                    for attr in self._fields + ['raw', ]])
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def cpu_efficiency(self, cores=1):
+        """Return the fraction of the CPU time available on the given number
+        of `cores` during the `elapsed` time that the job used, or None if
+        it cannot be determined
+
+        >>> print(JobStats(elapsed=100, cpu_time=150).cpu_efficiency(cores=2))
+        0.75
+        """
+        if self.elapsed is None or self.cpu_time is None \
+                or self.elapsed * cores <= 0:
+            return None
+        return self.cpu_time / float(self.elapsed * cores)
+
+
+def duration_to_seconds(val):
+    """Convert a duration as reported by a scheduler's accounting into
+    seconds (as a float). The supported formats are a number of seconds
+    (optionally followed by 's'), and ``[days-][hours:]minutes:seconds``
+    (where seconds may have a fractional part).
+
+    Raises:
+        ValueError: if `val` has an invalid format
+
+    Examples:
+        >>> print(duration_to_seconds('1-02:03:04'))
+        93784.0
+        >>> print(duration_to_seconds('01:05.500'))
+        65.5
+        >>> print(duration_to_seconds('12.5s'))
+        12.5
+    """
+    val = str(val).strip()
+    match = re.match(r'^(?:(\d+)-)?(?:(\d+):)?(?:(\d+):)?(\d+(?:\.\d*)?)s?$',
+                     val)
+    if not match:
+        raise ValueError("%r has invalid pattern" % val)
+    (days, first, second, seconds) = match.groups()
+    if second is None:
+        (hours, minutes) = (None, first)
+    else:
+        (hours, minutes) = (first, second)
+    if days is not None and minutes is None:
+        raise ValueError("%r has invalid pattern" % val)
+    total = float(seconds)
+    for (count, factor) in [(minutes, 60), (hours, 3600), (days, 86400)]:
+        if count is not None:
+            total += int(count) * factor
+    return total
+
+
+def memory_to_bytes(val):
+    """Convert an amount of memory as reported by a scheduler's accounting
+    into bytes (as an int). The value may have a unit (``K``, ``M``, ``G``,
+    ``T``, ``P``, optionally followed by ``b`` or ``bytes``, in upper or
+    lower case; all units are powers of 1024). Values without a unit are in
+    bytes.
+
+    Raises:
+        ValueError: if `val` has an invalid format
+
+    Examples:
+        >>> memory_to_bytes('2048K')
+        2097152
+        >>> memory_to_bytes('1.5G')
+        1610612736
+        >>> memory_to_bytes('52 Mbytes')
+        54525952
+    """
+    val = str(val).strip()
+    match = re.match(r'^(\d+(?:\.\d*)?)\s*([KMGTP]?)(?:B|BYTES)?$',
+                     val.upper())
+    if not match:
+        raise ValueError("%r has invalid pattern" % val)
+    return int(float(match.group(1)) * _MEMORY_UNITS[match.group(2)])
+
+
+def _convert(converter, val):
+    """Return ``converter(val)``, or None if `val` cannot be converted"""
+    try:
+        return converter(val)
+    except (ValueError, TypeError):
+        return None
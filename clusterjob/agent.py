@@ -0,0 +1,369 @@
+"""Persistent helper process for running commands on a remote
+
+Without an agent, every command sent to the scheduler by
+:func:`~clusterjob.utils.run_cmd` (and every upload of a job script) starts a
+new ssh session, which in turn starts a new shell on the login node. If the
+`agent` attribute of a :class:`~clusterjob.JobScript` is True, a small
+self-contained Python program (:data:`AGENT_SOURCE`) is instead started once
+on the `remote`, through a single long-lived ssh channel (or as a local
+subprocess if `remote` is None). All further commands, and all files to be
+written, are sent to the agent as requests on its standard input, and the
+agent replies on its standard output. The backends are unaffected: the
+commands returned by their ``cmd_*`` methods are run by the agent, and the
+responses are passed to their ``get_*`` methods, exactly as without the
+agent.
+
+The protocol consists of JSON objects, one per line. After starting, the agent
+writes the line ``{"agent": "clusterjob", "version": 1}``. Every request has
+an integer "id" and an "op", which is one of
+
+* "run": run the "cmd" (a list of arguments, or a string to be interpreted by
+  the shell) in the folder "workdir" (relative to the folder in which the
+  agent was started, i.e., the home directory on a remote; may start with
+  '~')
+* "write": write the "files" (dict of filename to content), creating any
+  missing folders, and set their permissions to "mode"
+* "exit": end the agent
+
+The reply is a JSON object with the "id" of the request, the "exit_code",
+and the "output" (the combined stdout/stderr of a command, or an error
+message).
+
+The agents are managed by the global :obj:`agent_pool`, to which
+:meth:`JobScript.submit <clusterjob.JobScript.submit>` and
+:class:`~clusterjob.AsyncResult` register their remote if requested. If an
+agent cannot be started, the commands are run through regular ssh
+connections. The agents exit when the Python process ends.
+"""
+from __future__ import absolute_import
+import os
+import json
+import base64
+import atexit
+import logging
+import threading
+import subprocess as sp
+
+from .utils import ssh_pool, quote, CMD_RESPONSE_ENCODING
+
+__all__ = ['AGENT_SOURCE', 'AgentError', 'Agent', 'AgentPool', 'agent_pool']
+
+PROTOCOL_VERSION = 1
+
+#: Source code of the agent program. It only uses the Python standard library
+#: and runs under both Python 2 and Python 3.
+AGENT_SOURCE = r'''
+import os, sys, json, subprocess
+
+def run(request):
+    cmd = request['cmd']
+    workdir = os.path.expanduser(request.get('workdir') or '.')
+    devnull = open(os.devnull)
+    try:
+        proc = subprocess.Popen(cmd, shell=not isinstance(cmd, list),
+                                cwd=workdir, stdin=devnull,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+    finally:
+        devnull.close()
+    return (proc.returncode, output.decode('utf-8', 'replace'))
+
+def write(request):
+    for filename in request['files']:
+        path = os.path.expanduser(filename)
+        folder = os.path.dirname(path)
+        if folder != '' and not os.path.isdir(folder):
+            os.makedirs(folder)
+        out_fh = open(path, 'wb')
+        try:
+            out_fh.write(request['files'][filename].encode('utf-8'))
+        finally:
+            out_fh.close()
+        os.chmod(path, request['mode'])
+    return (0, '')
+
+def reply(data):
+    sys.stdout.write(json.dumps(data) + '\n')
+    sys.stdout.flush()
+
+def main():
+    reply({'agent': 'clusterjob', 'version': %(version)d})
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        op = request.get('op')
+        try:
+            if op == 'run':
+                (exit_code, output) = run(request)
+            elif op == 'write':
+                (exit_code, output) = write(request)
+            elif op == 'exit':
+                (exit_code, output) = (0, '')
+            else:
+                (exit_code, output) = (-1, 'Unknown op %%r' %% op)
+        except Exception:
+            (exit_code, output) = (-1, str(sys.exc_info()[1]))
+        reply({'id': request.get('id'), 'exit_code': exit_code,
+               'output': output})
+        if op == 'exit':
+            break
+
+main()
+''' % {'version': PROTOCOL_VERSION}
+
+
+class AgentError(IOError):
+    """Exception raised if the communication with an agent fails"""
+    pass
+
+
+class Agent(object):
+    """Client for an agent process running :data:`AGENT_SOURCE` on `remote`
+    (or locally if `remote` is None). The agent is started on the first
+    request. The instance may be shared between threads; requests are sent
+    one at a time.
+
+    Arguments:
+        remote (str or None): Host on which to run the agent
+        ssh (str): The executable to use for ssh
+        python (str): The Python interpreter to use for running the agent
+            (on the remote)
+
+    Attributes:
+        requests (int): The number of requests that were answered by the
+            agent
+    """
+
+    def __init__(self, remote, ssh='ssh', python='python3'):
+        self.remote = remote
+        self.ssh = ssh
+        self.python = python
+        self.requests = 0
+        self._proc = None
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _cmd(self):
+        """Return the command (list of arguments) that starts the agent"""
+        if self.remote is None:
+            return [self.python, '-u', '-c', AGENT_SOURCE]
+        # the base64 encoding protects the source from the remote shell
+        source = base64.b64encode(AGENT_SOURCE.encode('utf-8'))
+        bootstrap = "import base64; exec(base64.b64decode('%s'))" \
+                    % source.decode('ascii')
+        return ([self.ssh, ] + ssh_pool.ssh_options(self.ssh, self.remote)
+                + [self.remote, '%s -u -c %s' % (self.python,
+                                                 quote(bootstrap))])
+
+    def start(self):
+        """Start the agent, if it is not running already
+
+        Raises:
+            AgentError: if the agent does not start
+        """
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        if self._proc is not None and self._proc.poll() is None:
+            return
+        logger = logging.getLogger(__name__)
+        logger.info("Starting agent on %s", self.remote or 'localhost')
+        with open(os.devnull, 'w') as devnull:
+            self._proc = sp.Popen(self._cmd(), stdin=sp.PIPE,
+                                  stdout=sp.PIPE, stderr=devnull)
+        # skip anything the remote's login shell prints before the agent
+        # starts
+        while True:
+            hello = self._read()
+            if hello.get('agent') == 'clusterjob':
+                break
+        if hello.get('version') != PROTOCOL_VERSION:
+            self._terminate()
+            raise AgentError("Agent on %s speaks protocol version %s"
+                             % (self.remote, hello.get('version')))
+
+    def _read(self):
+        """Read the next JSON object from the agent's stdout. Lines that are
+        not JSON objects are ignored."""
+        while True:
+            line = self._proc.stdout.readline()
+            if not line:
+                self._terminate()
+                raise AgentError("Agent on %s exited unexpectedly"
+                                 % self.remote)
+            try:
+                data = json.loads(line.decode(CMD_RESPONSE_ENCODING))
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                return data
+
+    def _terminate(self):
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.kill()
+            self._proc.wait()
+            for fh in (self._proc.stdin, self._proc.stdout):
+                fh.close()
+            self._proc = None
+
+    def request(self, op, **kwargs):
+        """Send a request with the given `op` and the data in `kwargs` to the
+        agent (starting it if necessary), and return the reply as a dict
+
+        Raises:
+            AgentError: if the agent does not start, or exits before replying
+        """
+        logger = logging.getLogger(__name__)
+        with self._lock:
+            self._start()
+            self._counter += 1
+            kwargs.update({'id': self._counter, 'op': op})
+            logger.debug("AGENT REQUEST (%s): %r", self.remote, kwargs)
+            try:
+                self._proc.stdin.write(
+                    (json.dumps(kwargs) + "\n").encode(CMD_RESPONSE_ENCODING))
+                self._proc.stdin.flush()
+            except (IOError, OSError) as exc_info:
+                self._terminate()
+                raise AgentError("Cannot send request to agent on %s: %s"
+                                 % (self.remote, exc_info))
+            while True:
+                reply = self._read()
+                if reply.get('id') == self._counter:
+                    break
+            self.requests += 1
+        logger.debug("AGENT REPLY (%s): %r", self.remote, reply)
+        return reply
+
+    def run_cmd(self, cmd, workdir='', ignore_exit_code=False):
+        """Run `cmd` through the agent, and return the combined stdout/stderr,
+        cf. :func:`~clusterjob.utils.run_cmd`. Like a command run through ssh,
+        a command on a remote is always interpreted by the shell. If the
+        communication with the agent fails, this is treated like a failing
+        ssh connection, with an exit code of 255.
+
+        Raises:
+            subprocess.CalledProcessError: if the command has a non-zero exit
+                code and `ignore_exit_code` is False
+        """
+        if type(cmd) in [list, tuple]:
+            if self.remote is None:
+                cmd = list(cmd)
+            else:
+                cmd = " ".join(cmd)
+        else:
+            cmd = str(cmd)
+        try:
+            reply = self.request('run', cmd=cmd, workdir=workdir)
+        except AgentError as exc_info:
+            reply = {'exit_code': 255, 'output': str(exc_info)}
+        if reply['exit_code'] != 0 and not ignore_exit_code:
+            raise sp.CalledProcessError(reply['exit_code'], cmd,
+                                        output=reply['output'])
+        return reply['output']
+
+    def write_files(self, files, mode=0o755):
+        """Write `files` (dict of filename to content) through the agent,
+        cf. :func:`~clusterjob.utils.upload_files`
+
+        Raises:
+            subprocess.CalledProcessError: if the files cannot be written, or
+                if the communication with the agent fails
+        """
+        try:
+            reply = self.request('write', files=dict(files), mode=mode)
+        except AgentError as exc_info:
+            reply = {'exit_code': 255, 'output': str(exc_info)}
+        if reply['exit_code'] != 0:
+            raise sp.CalledProcessError(reply['exit_code'],
+                                        ['write', ] + sorted(files),
+                                        output=reply['output'])
+
+    def close(self):
+        """Ask the agent to exit"""
+        with self._lock:
+            if self._proc is None:
+                return
+            try:
+                self._proc.stdin.write(b'{"id": 0, "op": "exit"}\n')
+                self._proc.stdin.flush()
+                self._proc.stdout.readline()
+            except (IOError, OSError):
+                pass
+            self._terminate()
+
+
+class AgentPool(object):
+    """Registry of the agents for every combination of ssh executable and
+    remote (where `remote` may be None for running commands locally).
+
+    There is a single global instance of this class, :obj:`agent_pool`, which
+    :func:`~clusterjob.utils.run_cmd` and the upload functions in
+    :mod:`clusterjob.utils` consult when they are called with
+    ``agent=True``. Calls without this flag (e.g. from jobs that do not set
+    their `agent` attribute) bypass the agent, even if one is enabled for
+    the same remote.
+    """
+
+    def __init__(self):
+        self._python = {} # (ssh, remote) => python executable
+        self._agents = {} # (ssh, remote) => Agent
+
+    def enable(self, ssh, remote, python='python3'):
+        """Run all commands for `remote` (through the `ssh` executable) that
+        request an agent through an agent, using the given `python`
+        interpreter"""
+        key = (ssh, remote)
+        if key not in self._python:
+            logger = logging.getLogger(__name__)
+            logger.debug("Enabling agent for %s (via %s)", remote, ssh)
+        self._python[key] = python
+
+    def is_enabled(self, ssh, remote):
+        """Return True if an agent is enabled for the given ssh executable
+        and remote"""
+        return (ssh, remote) in self._python
+
+    def agent(self, ssh, remote):
+        """Return the running :class:`Agent` for the given ssh executable
+        and remote, starting it if necessary. Return None if no agent is
+        enabled, or if the agent cannot be started (in which case the agent
+        is disabled)."""
+        key = (ssh, remote)
+        if key not in self._python:
+            return None
+        agent = self._agents.get(key)
+        if agent is None:
+            agent = Agent(remote, ssh=ssh, python=self._python[key])
+            self._agents[key] = agent
+        try:
+            agent.start()
+        except (AgentError, OSError) as exc_info:
+            logger = logging.getLogger(__name__)
+            logger.warning("Cannot start agent on %s (%s); using regular "
+                           "connections", remote, exc_info)
+            self.close(ssh, remote)
+            return None
+        return agent
+
+    def close(self, ssh, remote):
+        """Stop the agent for the given ssh executable and remote, and
+        disable it"""
+        self._python.pop((ssh, remote), None)
+        agent = self._agents.pop((ssh, remote), None)
+        if agent is not None:
+            agent.close()
+
+    def close_all(self):
+        """Stop all agents"""
+        for (ssh, remote) in list(self._python.keys()):
+            self.close(ssh, remote)
+
+
+agent_pool = AgentPool()
+atexit.register(agent_pool.close_all)
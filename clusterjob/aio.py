@@ -0,0 +1,338 @@
+"""Coroutine-based API for submitting and waiting on jobs with :mod:`asyncio`
+
+This module requires Python >= 3.5. It provides coroutine versions of
+:meth:`JobScript.submit <clusterjob.JobScript.submit>`,
+:attr:`AsyncResult.status <clusterjob.AsyncResult.status>`, and
+:meth:`AsyncResult.wait <clusterjob.AsyncResult.wait>`, which are also
+available as the methods :meth:`~clusterjob.JobScript.submit_async`,
+:meth:`~clusterjob.AsyncResult.status_async`, and
+:meth:`~clusterjob.AsyncResult.wait_async`.
+
+Commands for the scheduler are run as subprocesses through
+:func:`asyncio.create_subprocess_exec` (or by the agent, see
+:mod:`clusterjob.agent`), so that a single event loop can handle
+a large number of submissions and waits at the same time. The number of
+commands that are in flight simultaneously for any remote is bounded (see
+:func:`set_max_concurrency`). Writing and uploading the job scripts, as well as
+running the prologue and epilogue scripts is done in the loop's default
+executor.
+
+Example:
+
+    >>> import asyncio
+    >>> from clusterjob import JobScript
+    >>> async def run_all(jobs):
+    ...     runs = await asyncio.gather(*[job.submit_async() for job in jobs])
+    ...     await asyncio.gather(*[run.wait_async() for run in runs])
+    ...     return [run.status for run in runs]
+"""
+import os
+import time
+import asyncio
+import logging
+import subprocess as sp
+import weakref
+
+from .status import COMPLETED, STATUS_CODES
+from .backends import ResourcesNotSupportedError
+from .utils import ssh_pool, quote, CMD_RESPONSE_ENCODING, InProcessCommand
+from .utils import run_cmd as utils_run_cmd
+from .ratelimit import rate_limiter
+from .agent import agent_pool
+from .markers import (marker_status, read_markers, cmd_list_markers,
+                      parse_marker_listing, remove_markers,
+                      cmd_remove_markers)
+
+__all__ = ['run_cmd', 'submit', 'status', 'wait', 'set_max_concurrency']
+
+_max_concurrency = 16
+
+# event loop => {remote => asyncio.Semaphore}
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def set_max_concurrency(max_concurrency):
+    """Set the maximum number of commands that :func:`run_cmd` runs
+    simultaneously for each remote (where all local commands count as one
+    "remote"). The default is 16."""
+    global _max_concurrency
+    max_concurrency = int(max_concurrency)
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    _max_concurrency = max_concurrency
+    _semaphores.clear()
+
+
+def _semaphore(remote):
+    """Return the semaphore that limits the number of concurrent commands for
+    the given `remote` in the running event loop"""
+    loop = asyncio.get_event_loop()
+    semaphores = _semaphores.setdefault(loop, {})
+    if remote not in semaphores:
+        semaphores[remote] = asyncio.Semaphore(_max_concurrency)
+    return semaphores[remote]
+
+
+async def run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
+                  ssh='ssh', agent=False):
+    """Coroutine version of :func:`clusterjob.utils.run_cmd`, with the same
+    parameters. Wait until the number of commands running for the given
+    `remote` is below the limit set by :func:`set_max_concurrency`, then run
+    the command in a subprocess, and return the combined stdout/stderr.
+
+    Raises:
+        subprocess.CalledProcessError: if the command has a non-zero exit code
+            and `ignore_exit_code` is False.
+    """
+    async with _semaphore(remote):
+        return await _run_cmd(cmd, remote, rootdir, workdir,
+                              ignore_exit_code, ssh, agent)
+
+
+async def _run_cmd(cmd, remote, rootdir, workdir, ignore_exit_code, ssh,
+                   agent=False):
+    """Run the given cmd in a subprocess, see :func:`run_cmd`"""
+    logger = logging.getLogger(__name__)
+    workdir = os.path.join(rootdir, workdir)
+    if isinstance(cmd, InProcessCommand):
+        # in-process commands only look up the state of a backend
+        return utils_run_cmd(cmd, remote, '', workdir, ignore_exit_code, ssh)
+    if agent and agent_pool.is_enabled(ssh, remote):
+        # the agent handles one request at a time, in a blocking call
+        return await _in_executor(utils_run_cmd, cmd, remote, '', workdir,
+                                  ignore_exit_code, ssh, agent)
+    if type(cmd) in [list, tuple]:
+        use_shell = False
+    else:
+        cmd = str(cmd)
+        use_shell = True
+    kwargs = {'stdout': sp.PIPE, 'stderr': sp.STDOUT}
+    if remote is None: # run locally
+        workdir = os.path.expanduser(workdir)
+        if workdir != '':
+            kwargs['cwd'] = workdir
+    else: # run remotely
+        if not use_shell:
+            cmd = " ".join(cmd)
+        loop = asyncio.get_event_loop()
+        ssh_options = await loop.run_in_executor(
+                None, ssh_pool.ssh_options, ssh, remote)
+        if workdir == '':
+            cmd = [ssh, ] + ssh_options + [remote, cmd]
+        else:
+            cmd = [ssh, ] + ssh_options \
+                  + [remote, 'cd %s && %s' % (workdir, cmd)]
+        use_shell = False
+    if use_shell:
+        logger.debug("COMMAND: %s", cmd)
+    else:
+        logger.debug("COMMAND: %s", " ".join([quote(part) for part in cmd]))
+    t0 = time.time()
+    if use_shell:
+        proc = await asyncio.create_subprocess_shell(cmd, **kwargs)
+    else:
+        proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+    (response, __) = await proc.communicate()
+    logger.debug("Command finished after %.3f s", time.time() - t0)
+    response = response.decode(CMD_RESPONSE_ENCODING)
+    if proc.returncode != 0 and not ignore_exit_code:
+        raise sp.CalledProcessError(proc.returncode, cmd, output=response)
+    logger.debug("RESPONSE: %r", response)
+    return response
+
+
+async def _throttle(obj, cmd_class, remote):
+    """Sleep until the rate limit of the given :class:`~clusterjob.JobScript`
+    or :class:`~clusterjob.AsyncResult` `obj` allows to send a command of
+    `cmd_class` to `remote` (see :mod:`clusterjob.ratelimit`)"""
+    wait = rate_limiter.reserve(remote, cmd_class,
+                                getattr(obj, cmd_class + '_rate'),
+                                obj.rate_burst)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def _in_executor(func, *args):
+    """Run the blocking `func` in the default executor of the event loop"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+async def _submit_uncached(job, cache_key):
+    """Coroutine version of :meth:`JobScript._submit_uncached
+    <clusterjob.JobScript._submit_uncached>`"""
+    stream = job._streams_submission()
+    if not stream:
+        await _in_executor(job._write_aux_scripts)
+    response = None
+    staged = None
+    error = None
+    try:
+        staged = await _in_executor(job._write_and_stage_in, stream)
+        await _in_executor(job._run_prologue)
+        if stream:
+            response = await _in_executor(job._stream_submit)
+        else:
+            cmd = job._backends[job.backend].cmd_submit(job)
+            await _throttle(job, 'submit', job.remote)
+            response = await run_cmd(cmd, job.remote, job.rootdir,
+                                     job.workdir, ignore_exit_code=True,
+                                     ssh=job.ssh, agent=job.agent)
+    except (sp.CalledProcessError, ResourcesNotSupportedError) as e:
+        error = e
+    return job._submission_result(cache_key, response, staged, error)
+
+
+async def submit(job, block=False, cache_id=None, force=False, retry=True,
+                 after=None, condition='afterok'):
+    """Coroutine version of :meth:`JobScript.submit
+    <clusterjob.JobScript.submit>`, with the same parameters.
+
+    The job script and auxiliary scripts are written, and the prologue is
+    run, in the event loop's default executor. The submission command is run
+    through :func:`run_cmd` (or, if the `stream_submit` attribute of the job
+    is set, together with the writing of the scripts, in the executor). If
+    `block` is True, wait for the job to finish (using :func:`wait`) and
+    return the exit status code. Otherwise, return an
+    :class:`~clusterjob.AsyncResult` object.
+    """
+    dependency = job.resources.get('dependency')
+    try:
+        (cache_key, ar) = job._submit_prepare(cache_id, force, retry, after,
+                                              condition)
+        if ar is None:
+            ar = await _submit_uncached(job, cache_key)
+    finally:
+        job._restore_dependency(dependency)
+
+    ar.dump()
+
+    if block:
+        await wait(ar)
+        return ar._status
+    else:
+        return ar
+
+
+async def _read_markers(run):
+    """Coroutine that returns the status markers of the given
+    :class:`~clusterjob.AsyncResult` (see :mod:`clusterjob.markers`)"""
+    if run.remote is None:
+        return await _in_executor(
+            read_markers, os.path.join(run.marker_root, run.marker_dir))
+    marker_dir = os.path.normpath(run.marker_dir)
+    await _throttle(run, 'status', run.remote)
+    response = await run_cmd(cmd_list_markers([marker_dir, ]), run.remote,
+                             run.marker_root, ignore_exit_code=True,
+                             ssh=run.ssh, agent=run.agent)
+    return parse_marker_listing(response).get(marker_dir, {})
+
+
+async def _remove_markers(run):
+    """Coroutine that removes the status markers of the given
+    :class:`~clusterjob.AsyncResult`, after its final status has been read"""
+    if run.remote is None:
+        return await _in_executor(
+            remove_markers, os.path.join(run.marker_root, run.marker_dir),
+            [run.job_id, ])
+    await _throttle(run, 'status', run.remote)
+    await run_cmd(cmd_remove_markers([(os.path.normpath(run.marker_dir),
+                                       run.job_id), ]),
+                  run.remote, run.marker_root, ignore_exit_code=True,
+                  ssh=run.ssh, agent=run.agent)
+
+
+async def _query_status(run):
+    """Coroutine version of :meth:`AsyncResult._query_status
+    <clusterjob.AsyncResult._query_status>`"""
+    if run.marker_dir is not None:
+        status = marker_status(await _read_markers(run), run)
+        if status is not None:
+            if status >= COMPLETED:
+                await _remove_markers(run)
+            return status
+    status = None
+    for finished in (False, True):
+        cmd = run.backend.cmd_status(run, finished=finished)
+        await _throttle(run, 'status', run.remote)
+        response = await run_cmd(cmd, run.remote, ignore_exit_code=True,
+                                 ssh=run.ssh, agent=run.agent)
+        status = run._status_from_response(response, finished)
+        if status is not None:
+            break
+    return status
+
+
+async def _query_task_status(run):
+    """Coroutine version of :meth:`ArrayAsyncResult._query_task_status
+    <clusterjob.ArrayAsyncResult._query_task_status>`"""
+    task_status = {}
+    for finished in (False, True):
+        cmd = run.backend.cmd_array_status(run, finished=finished)
+        if cmd is None:
+            break
+        await _throttle(run, 'status', run.remote)
+        response = await run_cmd(cmd, run.remote, ignore_exit_code=True,
+                                 ssh=run.ssh, agent=run.agent)
+        task_status = run.backend.get_array_status(response,
+                                                   finished=finished)
+        if len(task_status) > 0:
+            break
+    return task_status
+
+
+async def status(run):
+    """Coroutine that returns the status of the given
+    :class:`~clusterjob.AsyncResult` (cf. its :attr:`status
+    <clusterjob.AsyncResult.status>` property). If the status changes to
+    "finished", the epilogue is run in the event loop's default executor."""
+    from . import ArrayAsyncResult
+    if run._status >= COMPLETED or run._status_is_current():
+        return run._status
+    run._enable_connections()
+    new_status = None
+    if isinstance(run, ArrayAsyncResult):
+        task_status = await _query_task_status(run)
+        if len(task_status) > 0:
+            run._task_status = task_status
+            new_status = run._array_status(task_status)
+    if new_status is None:
+        new_status = await _query_status(run)
+    if new_status not in STATUS_CODES:
+        raise ValueError("Invalid status code %s" % new_status)
+    if new_status == run._status:
+        run._status_time = time.time()
+        return run._status
+    return await _in_executor(run._update_status, new_status)
+
+
+async def wait(run, timeout=None):
+    """Coroutine version of :meth:`AsyncResult.wait
+    <clusterjob.AsyncResult.wait>`: wait until the result is available or
+    until `timeout` seconds pass, sleeping between polls (as determined by
+    the :attr:`~clusterjob.AsyncResult.polling` strategy) without blocking
+    the event loop. Unlike :meth:`AsyncResult.wait
+    <clusterjob.AsyncResult.wait>`, the sleep cannot be interrupted by
+    :meth:`~clusterjob.AsyncResult.wake`; cancel the task instead."""
+    logger = logging.getLogger(__name__)
+    if int(run.max_sleep_interval) < int(run._min_sleep_interval):
+        run.max_sleep_interval = int(run._min_sleep_interval)
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    interval = None
+    current_status = await status(run)
+    changed = False
+    while current_status < COMPLETED:
+        interval = run.polling.interval(run, interval, changed)
+        sleep_seconds = max(interval, run._min_sleep_interval)
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            sleep_seconds = min(sleep_seconds, remaining)
+        logger.debug("sleep for %.2f seconds", sleep_seconds)
+        await asyncio.sleep(sleep_seconds)
+        prev_status = current_status
+        current_status = await status(run)
+        changed = (current_status != prev_status)
@@ -3,8 +3,24 @@ Package for default backends
 """
 from __future__ import absolute_import
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+import re
 import six
 
+
+def _freeze(val):
+    """Return a hashable representation of the resource value `val`, that
+    distinguishes values of different types (e.g. ``1`` and ``True``)"""
+    if isinstance(val, (list, tuple)):
+        return (type(val), tuple([_freeze(v) for v in val]))
+    elif isinstance(val, dict):
+        return (type(val), tuple(sorted([(k, _freeze(v))
+                                         for (k, v) in val.items()])))
+    else:
+        hash(val) # raise TypeError for unhashable values
+        return (type(val), val)
+
+
 @six.add_metaclass(ABCMeta)
 class ClusterjobBackend(object):
     """Abstract base class for all clusterjob backends. All backends must
@@ -13,9 +29,54 @@ class ClusterjobBackend(object):
     Attributes:
         name (str): (default) name of the backend
         extension (str): extension to be used for job scripts
+        job_vars (dict): mapping of placeholders for environment variables
+            (e.g., ``$CLUSTERJOB_ID`` and ``${CLUSTERJOB_ID}``, see
+            :meth:`replace_body_vars`) to their backend-specific realization
+
+    The following attributes describe how :meth:`_default_resource_headers`
+    translates resources into header lines:
+
+    Attributes:
+        prefix (str): The prefix for every line in the resource header
+        resource_replacements (dict): mapping of resource keys to the
+            corresponding command line option of the submission command
+        resource_converters (dict): mapping of resource keys to a function
+            that converts the value of the resource for use in the header
+        resource_handlers (dict): mapping of resource keys to the name of a
+            method that receives the value of the resource and the full
+            resources dict, and returns a list of header lines for the
+            resource (e.g. for the `array` resource)
+        packed_resources (tuple): Resource keys (usually `nodes`, `ppn`,
+            `threads`) that are jointly translated by the
+            :meth:`_packed_headers` method, instead of individually
+        ignored_resources (tuple): Resource keys that do not result in any
+            header lines
+        fixed_headers (list): Options that are added to the header for every
+            job
+        resource_option_style (str): How resource keys are turned into
+            command line options, see :meth:`_resource_option`. One of
+            'plain', 'getopt', 'pbs'.
+        long_option_separator (str): Separator between an option starting
+            with ``--`` and its value (``' '`` or ``'='``)
     """
     common_keys = ['name', 'queue', 'time', 'nodes', 'ppn', 'threads', 'mem',
-                   'stdout', 'stderr']
+                   'stdout', 'stderr', 'array']
+
+    job_vars = {}
+
+    prefix = '#'
+    resource_replacements = {}
+    resource_converters = {}
+    resource_handlers = {}
+    packed_resources = ()
+    ignored_resources = ()
+    fixed_headers = []
+    resource_option_style = 'plain'
+    long_option_separator = ' '
+
+    # maximum number of distinct sets of resources for which the header lines
+    # are cached
+    header_cache_size = 256
 
     @abstractmethod
     def cmd_submit(self, jobscript):
@@ -47,6 +108,101 @@ class ClusterjobBackend(object):
         None if  the status cannot be determined."""
         raise NotImplementedError()
 
+    def cmd_status_many(self, runs, finished=False):
+        """Given a list of :class:`~clusterjob.AsyncResult` instances, return a
+        single command (cf. :meth:`cmd_submit`) that queries the scheduler for
+        the status of all of the jobs at once. If ``finished=True``, the
+        command should be appropriate for runs that have already finished.
+
+        Implementing this method is optional. The default implementation
+        returns None, indicating that the backend does not support querying
+        multiple jobs in one command. In this case,
+        :func:`clusterjob.poll_many` falls back to querying every job
+        individually, via :meth:`cmd_status`.
+        """
+        return None
+
+    def get_status_many(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_status_many`, return a dictionary that maps job IDs (as
+        str) to one of the status codes defined in :mod:`clusterjob.status`.
+        Jobs for which the status cannot be determined should be omitted.
+
+        Must be implemented if :meth:`cmd_status_many` is implemented.
+        """
+        raise NotImplementedError()
+
+    def get_status_details(self, response, finished=False):
+        """Given the stdout from the command returned by :meth:`cmd_status`,
+        return a dictionary of additional information about the job that the
+        scheduler reported along with the status. The recognized keys are
+        'exit_code' (int), 'elapsed' (seconds), 'start_time', and 'end_time'
+        (str, as reported by the scheduler). They are stored as attributes of
+        the :class:`~clusterjob.AsyncResult`.
+
+        Implementing this method is optional. The default implementation
+        returns an empty dictionary.
+        """
+        return {}
+
+    def get_status_details_many(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_status_many`, return a dictionary that maps job IDs (as
+        str) to a dictionary of additional information, cf.
+        :meth:`get_status_details`.
+
+        Implementing this method is optional. The default implementation
+        returns an empty dictionary.
+        """
+        return {}
+
+    def cmd_array_status(self, run, finished=False):
+        """Given a :class:`~clusterjob.ArrayAsyncResult` instance, return a
+        command (cf. :meth:`cmd_submit`) that queries the scheduler for the
+        status of all the tasks in the job array. If ``finished=True``, the
+        command should be appropriate for an array that has already finished.
+
+        Implementing this method is optional. The default implementation
+        returns None, indicating that the backend cannot report the status of
+        individual array tasks. In this case, the status of the array as a
+        whole is obtained via :meth:`cmd_status`.
+        """
+        return None
+
+    def get_array_status(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_array_status`, return a dictionary that maps array indices
+        (as int) to one of the status codes defined in
+        :mod:`clusterjob.status`. Tasks for which the status cannot be
+        determined should be omitted.
+
+        Must be implemented if :meth:`cmd_array_status` is implemented.
+        """
+        raise NotImplementedError()
+
+    def cmd_accounting(self, run):
+        """Given a :class:`~clusterjob.AsyncResult` instance for a finished
+        job, return a command (cf. :meth:`cmd_submit`) that obtains the
+        record of the resources used by the job from the scheduler's
+        accounting.
+
+        Implementing this method is optional. The default implementation
+        returns None, indicating that the backend does not support
+        accounting. In this case, :meth:`AsyncResult.accounting
+        <clusterjob.AsyncResult.accounting>` returns None.
+        """
+        return None
+
+    def get_accounting(self, response):
+        """Given the stdout from the command returned by
+        :meth:`cmd_accounting`, return a
+        :class:`~clusterjob.accounting.JobStats` instance, or None if the
+        response does not contain a (complete) accounting record.
+
+        Must be implemented if :meth:`cmd_accounting` is implemented.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def cmd_cancel(self, run):
         """Given a :class:`~clusterjob.AsyncResult` instance, return a command
@@ -60,15 +216,139 @@ class ClusterjobBackend(object):
         be added at the top of the rendered job script, between the shbang and
         the script body. At the very least, keys in the `jobscript` resources
         dict that are in the list of :attr:`common_keys` must be handled, or a
-        :exc:`ResourcesNotSupportedError` must be raised.
+        :exc:`ResourcesNotSupportedError` must be raised. The `array` resource
+        should be parsed with :func:`clusterjob.utils.parse_array_spec`.
+
+        Backends that describe their resource header with the class
+        attributes above may simply return the result of
+        :meth:`_default_resource_headers`.
         """
         raise NotImplementedError()
 
+    def _default_resource_headers(self, jobscript):
+        """Table-driven implementation of :meth:`resource_headers`, based on
+        the class attributes described above: the resources of `jobscript`
+        are processed in order; every resource is mapped to an option via
+        :attr:`resource_replacements` (or :meth:`_resource_option` for keys
+        not in :attr:`resource_replacements`), and its value is converted
+        with the function in :attr:`resource_converters`, if any. Boolean
+        values result in a flag (if True), and None values are skipped.
+
+        Since many jobs (e.g. in a parameter sweep) share identical
+        resources, the resulting header lines are cached for the most
+        recently used :attr:`header_cache_size` sets of resources. The cache
+        is discarded whenever any of the attributes above changes (see
+        :meth:`_header_config`).
+        """
+        resources = jobscript.resources
+        config = self._header_config()
+        try:
+            key = tuple([(k, _freeze(v)) for (k, v) in resources.items()])
+        except TypeError: # unhashable resource value
+            return self._compile_headers(resources)
+        cached = self.__dict__.get('_header_cache')
+        if cached is None or cached[0] != config:
+            cached = (config, OrderedDict())
+            self.__dict__['_header_cache'] = cached
+        cache = cached[1]
+        lines = cache.pop(key, None)
+        if lines is None:
+            lines = tuple(self._compile_headers(resources))
+            if len(cache) >= self.header_cache_size:
+                cache.popitem(last=False)
+        cache[key] = lines
+        return list(lines)
+
+    def _header_config(self):
+        """Return a hashable snapshot of all the attributes that determine
+        the header lines of :meth:`_default_resource_headers`. Changing any
+        of them (also in place) invalidates the cached header lines, and the
+        cached renderings of job scripts. Replacing the methods named in
+        :attr:`resource_handlers` is not detected."""
+        return (self.prefix,
+                tuple(sorted(self.resource_replacements.items())),
+                tuple([(k, self.resource_converters[k])
+                       for k in sorted(self.resource_converters)]),
+                tuple(sorted(self.resource_handlers.items())),
+                tuple(self.packed_resources), tuple(self.ignored_resources),
+                tuple(self.fixed_headers), self.resource_option_style,
+                self.long_option_separator)
+
+    def _compile_headers(self, resources):
+        """Return the list of header lines for the given `resources` dict,
+        see :meth:`resource_headers`"""
+        lines = []
+        if len(set(self.packed_resources).intersection(resources)) > 0:
+            lines.extend(self._packed_headers(resources))
+        for (key, val) in resources.items():
+            if key in self.packed_resources or key in self.ignored_resources:
+                continue
+            if key in self.resource_handlers:
+                handler = getattr(self, self.resource_handlers[key])
+                lines.extend(handler(val, resources))
+                continue
+            if val is None:
+                continue
+            if key in self.resource_replacements:
+                option = self.resource_replacements[key]
+                if key in self.resource_converters:
+                    val = self.resource_converters[key](val)
+            else:
+                option = key
+            option = self._resource_option(option, val)
+            if type(val) is bool:
+                if val:
+                    lines.append("%s %s" % (self.prefix, option))
+            elif option.endswith('='):
+                lines.append("%s %s%s" % (self.prefix, option, str(val)))
+            elif option.startswith('--'):
+                lines.append("%s %s%s%s" % (self.prefix, option,
+                                            self.long_option_separator,
+                                            str(val)))
+            else:
+                lines.append("%s %s %s" % (self.prefix, option, str(val)))
+        for option in self.fixed_headers:
+            lines.append("%s %s" % (self.prefix, option))
+        return lines
+
+    def _resource_option(self, option, val):
+        """Return the command line option for the given `option` (either from
+        :attr:`resource_replacements` or the name of a resource key without a
+        replacement), according to the :attr:`resource_option_style`:
+
+        * 'plain': `option` is used unchanged
+        * 'getopt': if `option` does not start with a dash, it is prefixed
+          with ``-`` if it is a single letter, and with ``--`` otherwise
+        * 'pbs': if `option` does not start with a dash, it is prefixed with
+          ``-`` for boolean values. For other values, it is used as a resource
+          list entry, ``-l option=``
+        """
+        if option.startswith('-'):
+            return option
+        if self.resource_option_style == 'getopt':
+            if len(option) == 1:
+                return '-%s' % option
+            else:
+                return '--%s' % option
+        elif self.resource_option_style == 'pbs':
+            if type(val) is bool:
+                return '-%s' % option
+            else:
+                return '-l %s=' % option
+        return option
+
+    def _packed_headers(self, resources):
+        """Return a list of header lines that encode all the
+        :attr:`packed_resources` in the given `resources` dict"""
+        raise NotImplementedError()
+
     @abstractmethod
     def replace_body_vars(self, body):
         """Given a multiline string that is the body of the job script, replace
         the placeholders for environment variables with backend-specific
-        realizations, and return the modified body
+        realizations, and return the modified body. Backends that describe
+        the mapping with the :attr:`job_vars` dict may simply return the
+        result of :meth:`_default_replace_body_vars`.
 
         At a minimum the following environment variables should be handled:
 
@@ -94,6 +374,79 @@ class ClusterjobBackend(object):
         """
         raise NotImplementedError()
 
+    def _default_replace_body_vars(self, body):
+        """Implementation of :meth:`replace_body_vars` that replaces all the
+        keys in the :attr:`job_vars` dict with the corresponding values, in a
+        single pass over the `body`. Where keys overlap, the longest key takes
+        precedence, and the result of a replacement is never replaced again.
+        Additional variables may be added with :meth:`set_job_var`."""
+        (regex, job_vars) = self._compiled_job_vars()
+        if regex is None:
+            return body
+        # splitting on a capturing group puts the matched keys at the odd
+        # indices, which is faster than `regex.sub` with a callback
+        parts = regex.split(body)
+        parts[1::2] = [job_vars[key] for key in parts[1::2]]
+        return "".join(parts)
+
+    def set_job_var(self, name, value, braced_value=None):
+        """Add a mapping for the environment variable `name` (without the
+        leading ``$``) to the :attr:`job_vars` of the backend instance, for
+        both the ``$name`` and the ``${name}`` form.
+
+        Arguments:
+            name (str): name of the placeholder variable, e.g.
+                ``'CLUSTERJOB_PARTITION'``
+            value (str): replacement for ``$name``, e.g.
+                ``'$SLURM_JOB_PARTITION'``
+            braced_value (str or None): replacement for ``${name}``. If not
+                given, and `value` is of the form ``$VAR``, use ``${VAR}``.
+                Otherwise, use `value`.
+
+        Example:
+
+            >>> from clusterjob.backends.slurm import SlurmBackend
+            >>> backend = SlurmBackend()
+            >>> backend.set_job_var('CLUSTERJOB_PARTITION',
+            ...                     '$SLURM_JOB_PARTITION')
+            >>> print(backend.replace_body_vars(
+            ...       'echo $CLUSTERJOB_PARTITION ${CLUSTERJOB_PARTITION}_x'))
+            echo $SLURM_JOB_PARTITION ${SLURM_JOB_PARTITION}_x
+        """
+        if braced_value is None:
+            match = re.match(r'^\$(\w+)$', value)
+            if match:
+                braced_value = '${%s}' % match.group(1)
+            else:
+                braced_value = value
+        if 'job_vars' not in self.__dict__:
+            # do not modify the (shared) class attribute
+            self.job_vars = dict(self.job_vars)
+        self.job_vars['$%s' % name] = value
+        self.job_vars['${%s}' % name] = braced_value
+
+    def _compiled_job_vars(self):
+        """Return a tuple of a compiled regex that matches any key in
+        :attr:`job_vars` (or None if there are no keys), and a copy of
+        :attr:`job_vars`. The result is cached for as long as :attr:`job_vars`
+        does not change."""
+        snapshot = tuple(sorted(self.job_vars.items()))
+        cached = self.__dict__.get('_job_vars_cache')
+        if cached is not None and cached[0] == snapshot:
+            return cached[1]
+        job_vars = dict(snapshot)
+        if len(job_vars) == 0:
+            compiled = (None, job_vars)
+        else:
+            # longest keys first, so that e.g. $CLUSTERJOB_ID does not
+            # shadow a (hypothetical) $CLUSTERJOB_IDX
+            keys = sorted(job_vars, key=len, reverse=True)
+            regex = re.compile(
+                "(%s)" % "|".join([re.escape(key) for key in keys]))
+            compiled = (regex, job_vars)
+        self.__dict__['_job_vars_cache'] = (snapshot, compiled)
+        return compiled
+
 #   def submission_scripts(self, jobscript):
 #       """Given a :class:`~clusterjob.JobScript` instance, return a dictionary
 #       of submission scripts. This is for situations where the backend
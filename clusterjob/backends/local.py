@@ -0,0 +1,484 @@
+"""
+Local backend, running job scripts on the local machine
+"""
+from __future__ import absolute_import
+
+import atexit
+import itertools
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import subprocess as sp
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from ..status import PENDING, RUNNING, COMPLETED, CANCELLED, FAILED
+from ..utils import (InProcessCommand, time_to_seconds,
+                     parse_dependency_spec, interpreter_cmd)
+from .. import ClusterjobBackend, ResourcesNotSupportedError
+
+
+def _total_memory():
+    """Return the total physical memory of the machine in MB, or None if it
+    cannot be determined"""
+    try:
+        return (os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+                // 2**20)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class _LocalJob(object):
+    """Book-keeping for a job in a :class:`LocalScheduler`"""
+
+    def __init__(self, job_id, scriptfile, workdir, name, cores, mem,
+                 time_limit, stdout, stderr, env, dependencies):
+        self.job_id = job_id
+        self.scriptfile = scriptfile
+        self.workdir = workdir
+        self.name = name
+        self.cores = cores
+        self.mem = mem
+        self.time_limit = time_limit
+        self.stdout = stdout
+        self.stderr = stderr
+        self.env = env
+        self.dependencies = dependencies
+        self.state = 'PENDING'
+        self.proc = None
+        self.files = [] # open file handles for stdout/stderr
+        self.start_time = None
+        self.exit_code = None
+
+
+class LocalScheduler(object):
+    """Pool that runs job scripts as subprocesses on the local machine
+
+    Jobs are started in the order in which they were submitted, as soon as
+    enough cores and memory are available (jobs that do not fit are skipped
+    in favor of smaller jobs further down the queue), and all of their
+    dependencies are satisfied. A job whose dependencies can no longer be
+    satisfied is cancelled. A background thread that is started with the
+    first submission starts and reaps the subprocesses.
+
+    Arguments:
+        cores (int or None): Number of cores available to jobs. Defaults to
+            the number of cores of the machine
+        mem (int or None): Memory available to jobs, in MB. Defaults to the
+            physical memory of the machine
+        poll_interval (float): Number of seconds between checks for finished
+            jobs
+    """
+
+    def __init__(self, cores=None, mem=None, poll_interval=0.05):
+        if cores is None:
+            cores = multiprocessing.cpu_count()
+        if mem is None:
+            mem = _total_memory()
+        self.cores = cores
+        self.mem = mem
+        self.poll_interval = poll_interval
+        self._jobs = OrderedDict() # job_id => _LocalJob
+        self._counter = itertools.count(1)
+        self._condition = threading.Condition()
+        self._thread = None
+        atexit.register(self.shutdown)
+
+    def submit(self, scriptfile, workdir, name, cores=1, mem=None,
+               time_limit=None, stdout=None, stderr=None, env=None,
+               dependencies=None):
+        """Queue the executable `scriptfile` to be run in `workdir`, and
+        return the job ID. The `dependencies` are a list of tuples
+        ``(condition, job_ids)``, as returned by
+        :func:`~clusterjob.utils.parse_dependency_spec`."""
+        if cores > self.cores:
+            raise ResourcesNotSupportedError(
+                "Job %s requires %d cores, but only %d are available"
+                % (name, cores, self.cores))
+        if mem is not None and self.mem is not None and mem > self.mem:
+            raise ResourcesNotSupportedError(
+                "Job %s requires %d MB of memory, but only %d MB are "
+                "available" % (name, mem, self.mem))
+        job_id = "%d.%d" % (os.getpid(), next(self._counter))
+        env = dict(env or {})
+        env['CLUSTERJOB_ID'] = job_id
+        job = _LocalJob(job_id, scriptfile, workdir, name, cores, mem,
+                        time_limit, stdout, stderr, env,
+                        list(dependencies or []))
+        with self._condition:
+            self._jobs[job_id] = job
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return job_id
+
+    def state(self, job_id):
+        """Return the state of the job with the given `job_id`: one of
+        'PENDING', 'RUNNING', 'COMPLETED', 'FAILED', 'CANCELLED'. Jobs that
+        are not known to the scheduler (submitted from another process, which
+        cancels all of its jobs when it ends) are reported as 'CANCELLED'"""
+        with self._condition:
+            self._reap()
+            if job_id in self._jobs:
+                return self._jobs[job_id].state
+        return 'CANCELLED'
+
+    def cancel(self, job_id):
+        """Cancel the job with the given `job_id`, killing it if it is
+        running"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is not None and job.state in ('PENDING', 'RUNNING'):
+                if job.proc is not None:
+                    self._kill(job)
+                    job.proc = None
+                    self._close(job)
+                job.state = 'CANCELLED'
+                self._condition.notify()
+
+    def shutdown(self):
+        """Cancel all pending and running jobs"""
+        with self._condition:
+            job_ids = list(self._jobs.keys())
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def _available(self):
+        """Return the number of free cores and the free memory"""
+        cores = self.cores
+        mem = self.mem
+        for job in self._jobs.values():
+            if job.state == 'RUNNING':
+                cores -= job.cores
+                if mem is not None and job.mem is not None:
+                    mem -= job.mem
+        return cores, mem
+
+    def _kill(self, job):
+        """Kill the process group of the given running `job`"""
+        try:
+            os.killpg(job.proc.pid, signal.SIGKILL)
+        except OSError: # process has already ended
+            pass
+        job.proc.wait()
+
+    def _close(self, job):
+        for fh in job.files:
+            fh.close()
+        job.files = []
+
+    def _start(self, job):
+        """Start the subprocess for the given `job`, which the background
+        thread has marked as 'RUNNING'. This is called without holding the
+        lock, so that status queries and cancellations are not blocked while
+        the process is forked."""
+        files = []
+        try:
+            stdout = open(os.path.join(job.workdir, job.stdout), 'w')
+            files.append(stdout)
+            if job.stderr is None or job.stderr == job.stdout:
+                stderr = sp.STDOUT
+            else:
+                stderr = open(os.path.join(job.workdir, job.stderr), 'w')
+                files.append(stderr)
+            env = dict(os.environ)
+            env.update(job.env)
+            # each job runs in its own process group, so that it can be
+            # killed together with all of its child processes
+            if sys.version_info >= (3, 2):
+                session = {'start_new_session': True}
+            else:
+                session = {'preexec_fn': os.setsid}
+            proc = sp.Popen(interpreter_cmd(job.scriptfile), cwd=job.workdir,
+                            env=env, stdout=stdout, stderr=stderr, **session)
+        except (OSError, IOError) as exc_info:
+            if len(files) > 0:
+                files[0].write("Cannot run %s: %s\n"
+                               % (job.scriptfile, exc_info))
+            proc = None
+        with self._condition:
+            job.files = files
+            job.proc = proc
+            if job.state == 'CANCELLED': # cancelled while starting
+                if proc is not None:
+                    self._kill(job)
+                    job.proc = None
+                self._close(job)
+            elif proc is None:
+                job.state = 'FAILED'
+                self._close(job)
+
+    def _reap(self):
+        """Update the state of all running jobs, and kill jobs that exceed
+        their time limit"""
+        for job in self._jobs.values():
+            if job.state != 'RUNNING' or job.proc is None: # or starting
+                continue
+            if job.proc.poll() is None:
+                if job.time_limit is not None \
+                        and time.time() - job.start_time > job.time_limit:
+                    self._kill(job)
+                else:
+                    continue
+            job.exit_code = job.proc.returncode
+            job.state = 'COMPLETED' if job.exit_code == 0 else 'FAILED'
+            job.proc = None
+            self._close(job)
+
+    def _dependencies_ready(self, job):
+        """Return True if all dependencies of the given `job` are satisfied,
+        False if they can never be satisfied, and None if the job must wait
+        for other jobs to finish"""
+        waiting = False
+        for (condition, job_ids) in job.dependencies:
+            for job_id in job_ids:
+                dependency = self._jobs.get(job_id)
+                if dependency is None:
+                    state = 'CANCELLED'
+                else:
+                    state = dependency.state
+                if state in ('PENDING', 'RUNNING'):
+                    waiting = True
+                elif condition == 'afterok' and state != 'COMPLETED':
+                    return False
+                elif condition == 'afternotok' and state == 'COMPLETED':
+                    return False
+        if waiting:
+            return None
+        return True
+
+    def _schedule(self):
+        """Mark all pending jobs for which resources are available and whose
+        dependencies are satisfied as 'RUNNING'. Return a tuple ``(active,
+        starting)``, where `active` is True if there are any pending or
+        running jobs, and `starting` is the list of jobs whose processes must
+        be started (cf. :meth:`_start`)"""
+        (cores, mem) = self._available()
+        active = False
+        starting = []
+        for job in self._jobs.values():
+            if job.state == 'PENDING' and len(job.dependencies) > 0:
+                ready = self._dependencies_ready(job)
+                if ready is None:
+                    active = True
+                    continue
+                elif not ready:
+                    job.state = 'CANCELLED'
+            if job.state == 'PENDING':
+                fits_mem = (mem is None or job.mem is None or job.mem <= mem)
+                if job.cores <= cores and fits_mem:
+                    job.start_time = time.time()
+                    job.state = 'RUNNING'
+                    starting.append(job)
+                    cores -= job.cores
+                    if mem is not None and job.mem is not None:
+                        mem -= job.mem
+            if job.state in ('PENDING', 'RUNNING'):
+                active = True
+        return active, starting
+
+    def _run(self):
+        """Main loop of the background thread"""
+        while True:
+            with self._condition:
+                self._reap()
+                (active, starting) = self._schedule()
+                if len(starting) == 0:
+                    if active:
+                        self._condition.wait(self.poll_interval)
+                    else:
+                        self._condition.wait()
+            for job in starting:
+                self._start(job)
+
+
+class LocalBackend(ClusterjobBackend):
+    """Backend that runs job scripts on the local machine, without a
+    scheduling system
+
+    The rendered job scripts are run as subprocesses by a
+    :class:`LocalScheduler`, which is kept for the lifetime of the backend
+    instance. The cores required by a job (``nodes*ppn*threads``) and its
+    memory (`mem`, in MB) are used to decide when the job may start. The
+    `time` resource is enforced as a time limit, and the `stdout`/`stderr`
+    resources name the files (relative to the job's working directory) to
+    which the output of the job is written. The *core environment variables*
+    (``$CLUSTERJOB_ID``, etc.) are set in the environment of the job. In
+    addition, ``$OMP_NUM_THREADS`` is set to the value of the `threads`
+    resource. Dependencies between jobs (the `dependency` resource, see
+    :func:`~clusterjob.utils.parse_dependency_spec`) are resolved by the
+    :attr:`scheduler`.
+
+    The status of jobs, and cancellations, are handled in-process (see
+    :class:`~clusterjob.utils.InProcessCommand`), so that jobs must be
+    submitted with ``remote=None``. All running jobs are killed when the
+    Python process ends.
+
+    Attributes:
+        name (str): Name of the backend
+        extension (str): Extension for job scripts
+        prefix (str): The prefix for every line in the resource header
+        status_mapping (dict): mapping of job states in the
+            :attr:`scheduler` to clusterjob integer status codes
+        scheduler (LocalScheduler): The pool that runs the jobs
+
+    Arguments:
+        cores (int or None): Number of cores available to jobs, see
+            :class:`LocalScheduler`
+        mem (int or None): Memory (MB) available to jobs
+    """
+    name = 'local'
+    extension = 'sh'
+    prefix = '#LOCAL'
+    resource_option_style = 'getopt'
+    long_option_separator = '='
+    resource_handlers = {'array': '_array_headers'}
+
+    def __init__(self, cores=None, mem=None):
+        self.status_mapping = {
+            'PENDING'  : PENDING,
+            'RUNNING'  : RUNNING,
+            'COMPLETED': COMPLETED,
+            'FAILED'   : FAILED,
+            'CANCELLED': CANCELLED,
+        }
+        self.resource_replacements = {
+            'jobname': '--job-name',
+            'queue'  : '--queue',
+            'time'   : '--time',
+            'nodes'  : '--nodes',
+            'ppn'    : '--tasks-per-node',
+            'threads': '--cpus-per-task',
+            'mem'    : '--mem',
+            'stdout' : '--output',
+            'stderr' : '--error',
+        }
+        self.job_vars = {}
+        self.scheduler = LocalScheduler(cores=cores, mem=mem)
+        self._hostname = socket.gethostname()
+
+    def _array_headers(self, array, resources):
+        raise ResourcesNotSupportedError("The local backend does not support "
+                                         "job arrays")
+
+    def resource_headers(self, jobscript):
+        """Given a :class:`~clusterjob.JobScript` instance, return a list of
+        lines that encode the resource requirements, to be added at the top of
+        the rendered job script
+        """
+        return self._default_resource_headers(jobscript)
+
+    def replace_body_vars(self, body):
+        """Given a multiline string that is the body of the job script, replace
+        the placeholders for environment variables with backend-specific
+        realizations, and return the modified body
+        """
+        return self._default_replace_body_vars(body)
+
+    def cmd_submit(self, jobscript):
+        """Given a :class:`~clusterjob.JobScript` instance, return an
+        in-process command that queues the job script in the
+        :attr:`scheduler`"""
+        if jobscript.remote is not None:
+            raise ResourcesNotSupportedError("The local backend can only "
+                                             "run jobs with remote=None")
+        resources = jobscript.resources
+        name = str(resources['jobname'])
+        cores = 1
+        for key in ('nodes', 'ppn', 'threads'):
+            if key in resources:
+                cores *= int(resources[key])
+        mem = resources.get('mem')
+        if mem is not None:
+            mem = int(mem)
+        time_limit = resources.get('time')
+        if time_limit is not None:
+            time_limit = time_to_seconds(time_limit)
+        stdout = resources.get('stdout')
+        if stdout is None:
+            stdout = "%s.out" % name
+        stderr = resources.get('stderr')
+        dependencies = None
+        if resources.get('dependency') is not None:
+            dependencies = parse_dependency_spec(resources['dependency'])
+        filename = jobscript.filename
+
+        def submit(workdir):
+            workdir = os.path.abspath(workdir)
+            env = {
+                'CLUSTERJOB_WORKDIR': workdir,
+                'CLUSTERJOB_SUBMIT_HOST': self._hostname,
+                'CLUSTERJOB_NAME': name,
+                'CLUSTERJOB_NODELIST': self._hostname,
+            }
+            if 'threads' in resources:
+                env['OMP_NUM_THREADS'] = str(resources['threads'])
+            job_id = self.scheduler.submit(
+                os.path.join(workdir, filename), workdir, name, cores=cores,
+                mem=mem, time_limit=time_limit, stdout=stdout, stderr=stderr,
+                env=env, dependencies=dependencies)
+            return (0, "Submitted local job %s\n" % job_id)
+
+        return InProcessCommand(['local-submit', filename], submit)
+
+    def get_job_id(self, response):
+        """Given the response from the command returned by
+        :meth:`cmd_submit`, return a job ID"""
+        match = re.search(r'Submitted local job (\S+)', response)
+        if match:
+            return match.group(1)
+        else:
+            return None
+
+    def cmd_status(self, run, finished=False):
+        """Given a :class:`~clusterjob.AsyncResult` instance, return an
+        in-process command that returns the state of the job in the
+        :attr:`scheduler`. The same command is used for running and finished
+        jobs."""
+        job_id = str(run.job_id)
+        return InProcessCommand(
+            ['local-status', job_id],
+            lambda workdir: (0, self.scheduler.state(job_id) + "\n"))
+
+    def get_status(self, response, finished=False):
+        """Given the response from the command returned by :meth:`cmd_status`,
+        return one of the status code defined in :mod:`clusterjob.status`"""
+        return self.status_mapping.get(response.strip())
+
+    def cmd_status_many(self, runs, finished=False):
+        """Given a list of :class:`~clusterjob.AsyncResult` instances, return
+        an in-process command that returns the state of all the jobs"""
+        job_ids = [str(run.job_id) for run in runs]
+        return InProcessCommand(
+            ['local-status', ] + job_ids,
+            lambda workdir: (0, "".join(
+                ["%s %s\n" % (job_id, self.scheduler.state(job_id))
+                 for job_id in job_ids])))
+
+    def get_status_many(self, response, finished=False):
+        """Given the response from the command returned by
+        :meth:`cmd_status_many`, return a dictionary mapping job IDs to status
+        codes defined in :mod:`clusterjob.status`"""
+        result = {}
+        for line in response.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[1] in self.status_mapping:
+                result[fields[0]] = self.status_mapping[fields[1]]
+        return result
+
+    def cmd_cancel(self, run):
+        """Given a :class:`~clusterjob.AsyncResult` instance, return an
+        in-process command that cancels the job"""
+        job_id = str(run.job_id)
+
+        def cancel(workdir):
+            self.scheduler.cancel(job_id)
+            return (0, "")
+
+        return InProcessCommand(['local-cancel', job_id], cancel)
@@ -23,8 +23,17 @@ class LPbsBackend(PbsBackend):
         ``lqstat`` command that queries the scheduler for the job status."""
         return ['lqstat', str(run.job_id)]
 
+    def cmd_status_many(self, runs, finished=False):
+        """Return None, as ``lqstat`` does not support querying multiple jobs
+        at once"""
+        return None
+
     def cmd_cancel(self, run):
         """Given a :class:`~clusterjob.AsyncResult` instance, return a
         ``lqdel`` command that cancels the run, as a list of command arguments.
         """
         return ['lqdel', str(run.job_id)]
+
+    def cmd_array_status(self, run, finished=False):
+        """Return None, as LPBS does not support job arrays"""
+        return None
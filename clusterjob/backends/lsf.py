@@ -5,7 +5,9 @@ from __future__ import absolute_import
 
 import re
 from ..status import PENDING, RUNNING, COMPLETED, CANCELLED, FAILED
-from ..utils import time_to_seconds
+from ..utils import (time_to_seconds, parse_array_spec,
+                     format_array_ranges, parse_dependency_spec)
+from ..accounting import JobStats, memory_to_bytes, _convert
 from .. import ClusterjobBackend
 
 def time_to_minutes(val):
@@ -28,6 +30,11 @@ class LsfBackend(ClusterjobBackend):
     name = 'lsf'
     extension = 'lsf'
     prefix = '#BSUB'
+    resource_converters = {'time': time_to_minutes}
+    resource_handlers = {'jobname': '_jobname_headers',
+                         'array': '_array_headers',
+                         'dependency': '_dependency_headers'}
+    packed_resources = ('nodes', 'ppn', 'threads')
 
     def __init__(self):
         self.status_mapping = {
@@ -64,6 +71,20 @@ class LsfBackend(ClusterjobBackend):
             '${CLUSTERJOB_ARRAY_INDEX}': '${LSB_JOBINDEX}',
             '${CLUSTERJOB_NODELIST}'   : '${LSB_HOSTS}',
         }
+    def resource_headers(self, jobscript):
+        """Given a :class:`~clusterjob.JobScript` instance, return a list of
+        lines that encode the resource requirements, to be added at the top of
+        the rendered job script
+        """
+        return self._default_resource_headers(jobscript)
+
+    def replace_body_vars(self, body):
+        """Given a multiline string that is the body of the job script, replace
+        the placeholders for environment variables with backend-specific
+        realizations, and return the modified body
+        """
+        return self._default_replace_body_vars(body)
+
     def cmd_submit(self, jobscript):
         """Given a :class:`~clusterjob.JobScript` instance, return a ``bsub``
         command that submits the job to the scheduler, as a string.
@@ -105,6 +126,101 @@ class LsfBackend(ClusterjobBackend):
                     return self.status_mapping[status]
         return None
 
+    def cmd_status_many(self, runs, finished=False):
+        """Given a list of :class:`~clusterjob.AsyncResult` instances, return
+        a single ``bjobs`` command that queries the scheduler for the status of
+        all the jobs, as a list of command arguments.
+        """
+        return ['bjobs', '-a'] + [str(run.job_id) for run in runs]
+
+    def get_status_many(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_status_many`, return a dictionary mapping job IDs to status
+        codes defined in :mod:`clusterjob.status`"""
+        result = {}
+        status_pos = None
+        for line in response.split("\n"):
+            if line.startswith('JOBID'):
+                status_pos = line.find('STAT')
+            elif status_pos is not None and status_pos >= 0:
+                fields = line.split()
+                status = line[status_pos:].split()
+                if len(fields) == 0 or len(status) == 0:
+                    continue
+                if status[0] in self.status_mapping:
+                    result[fields[0]] = self.status_mapping[status[0]]
+        return result
+
+    def cmd_array_status(self, run, finished=False):
+        """Given a :class:`~clusterjob.ArrayAsyncResult` instance, return a
+        ``bjobs`` command that queries the status of all tasks in the array,
+        as a list of command arguments.
+        """
+        return ['bjobs', '-a', str(run.job_id)]
+
+    def get_array_status(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_array_status`, return a dictionary mapping array indices
+        to status codes defined in :mod:`clusterjob.status`. The array index
+        is obtained from the job name of each array element, e.g.
+        ``test_clj[5]``"""
+        result = {}
+        status_pos = name_pos = None
+        for line in response.split("\n"):
+            if line.startswith('JOBID'):
+                status_pos = line.find('STAT')
+                name_pos = line.find('JOB_NAME')
+            elif status_pos is not None and min(status_pos, name_pos) >= 0:
+                status = line[status_pos:].split()
+                match = re.search(r'\[(\d+)\]', line[name_pos:])
+                if match and len(status) > 0:
+                    if status[0] in self.status_mapping:
+                        result[int(match.group(1))] \
+                            = self.status_mapping[status[0]]
+        return result
+
+    def cmd_accounting(self, run):
+        """Given a :class:`~clusterjob.AsyncResult` instance, return a
+        ``bhist`` command that obtains the history of the job, including its
+        resource usage, as a list of command arguments. Unlike ``bjobs``,
+        ``bhist`` also reports jobs that finished a long time ago.
+        """
+        return ['bhist', '-l', str(run.job_id)]
+
+    def get_accounting(self, response):
+        """Given the stdout from the command returned by
+        :meth:`cmd_accounting`, return a
+        :class:`~clusterjob.accounting.JobStats` instance. The elapsed time
+        is the time spent in the RUN state. The `raw` fields are the CPU
+        time, the memory usage, and the times spent in the various states.
+        Return None if the history does not show the job as finished."""
+        # bhist wraps long lines, indenting the continuation
+        response = re.sub(r'\n {21}', '', response)
+        raw = {}
+        match = re.search(r'Exited with exit code (\d+)', response)
+        if match:
+            raw['exit code'] = match.group(1)
+        elif 'Done successfully' in response:
+            raw['exit code'] = '0'
+        else:
+            return None
+        match = re.search(r'CPU time used is ([\d.]+) seconds', response)
+        if match:
+            raw['CPU time'] = match.group(1)
+        for key in ('MAX MEM', 'AVG MEM', 'MAX SWAP'):
+            match = re.search(r'%s: ([\d.]+ *\w*)' % key, response)
+            if match:
+                raw[key] = match.group(1)
+        lines = response.split("\n")
+        for (i, line) in enumerate(lines[:-1]):
+            if line.split()[:2] == ['PEND', 'PSUSP']:
+                raw.update(zip(line.split(), lines[i+1].split()))
+        return JobStats(
+            elapsed=_convert(float, raw.get('RUN')),
+            cpu_time=_convert(float, raw.get('CPU time')),
+            max_rss=_convert(memory_to_bytes, raw.get('MAX MEM')),
+            exit_code=int(raw['exit code']), raw=raw)
+
     def cmd_cancel(self, run):
         """Given a :class:`~clusterjob.AsyncResult` instance, return an
         ``bkill`` command that cancels the run, as a list of command
@@ -112,13 +228,9 @@ class LsfBackend(ClusterjobBackend):
         """
         return ['bkill', str(run.job_id)]
 
-    def resource_headers(self, jobscript):
-        """Given a :class:`~clusterjob.JobScript` instance, return a list of
-        lines that encode the resource requirements, to be added at the top of
-        the rendered job script
-        """
-        resources = jobscript.resources
-        lines = []
+    def _packed_headers(self, resources):
+        """Return a list of header lines for the `nodes`, `ppn`, and
+        `threads` resources"""
         cores_per_node = 1
         nodes = 1
         if 'ppn' in resources:
@@ -127,34 +239,45 @@ class LsfBackend(ClusterjobBackend):
             cores_per_node *= resources['threads']
         if 'nodes' in resources:
             nodes = resources['nodes']
-        if len(set(['ppn', 'threads', 'nodes']).intersection(resources)) > 0:
-            line = '%s -n %d' % (self.prefix, nodes*cores_per_node)
-            if cores_per_node > 1:
-                line += ' -R "span[ptiles=%d]"' % cores_per_node
-            lines.append(line)
-        for (key, val) in resources.items():
-            if key in ['nodes', 'ppn', 'threads']:
-                continue
-            if key in self.resource_replacements:
-                lsf_key = self.resource_replacements[key]
-                if key == 'time':
-                    val = time_to_minutes(val)
-            else:
-                lsf_key = key
-            if val is None:
-                continue
-            if type(val) is bool:
-                if val:
-                    lines.append("%s %s" % (self.prefix, lsf_key))
-            else:
-                lines.append("%s %s %s" % (self.prefix, lsf_key, str(val)))
-        return lines
+        line = '%s -n %d' % (self.prefix, nodes*cores_per_node)
+        if cores_per_node > 1:
+            line += ' -R "span[ptiles=%d]"' % cores_per_node
+        return [line, ]
 
-    def replace_body_vars(self, body):
-        """Given a multiline string that is the body of the job script, replace
-        the placeholders for environment variables with backend-specific
-        realizations, and return the modified body
-        """
-        for key, val in self.job_vars.items():
-            body = body.replace(key, val)
-        return body
+    def _jobname_headers(self, jobname, resources):
+        """Return a list of header lines for the `jobname` resource. For a
+        job array, the array indices are part of the job name"""
+        if 'array' in resources:
+            jobname = '"%s%s"' % (jobname,
+                                  self._array_spec(resources['array']))
+        return ['%s %s %s' % (self.prefix,
+                              self.resource_replacements['jobname'], jobname)]
+
+    def _array_headers(self, array, resources):
+        """Return a list of header lines for the `array` resource, if it is
+        not already encoded in the job name"""
+        if 'jobname' in resources:
+            return []
+        return ['%s -J "%s"' % (self.prefix, self._array_spec(array))]
+
+    def _dependency_headers(self, dependency, resources=None):
+        """Return a list of header lines for the given `dependency` resource
+        (see :func:`~clusterjob.utils.parse_dependency_spec`), as a ``-w``
+        dependency expression"""
+        functions = {'afterok': 'done', 'afterany': 'ended',
+                     'afternotok': 'exit'}
+        expr = " && ".join(["%s(%s)" % (functions[condition], job_id)
+                            for (condition, job_ids)
+                            in parse_dependency_spec(dependency)
+                            for job_id in job_ids])
+        return ['%s -w "%s"' % (self.prefix, expr)]
+
+    @staticmethod
+    def _array_spec(array):
+        """Convert the `array` resource into the LSF format for job array
+        indices, e.g. ``[1-10:2,20]%5``"""
+        (ranges, max_running) = parse_array_spec(array)
+        spec = "[%s]" % format_array_ranges(ranges)
+        if max_running is not None:
+            spec += "%%%d" % max_running
+        return spec
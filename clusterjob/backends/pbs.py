@@ -5,7 +5,15 @@ from __future__ import absolute_import
 import re
 
 from ..status import PENDING, RUNNING, COMPLETED
-from .. import ClusterjobBackend
+from ..utils import (parse_array_spec, format_array_ranges,
+                     parse_dependency_spec, format_dependency_spec)
+from ..accounting import (JobStats, duration_to_seconds, memory_to_bytes,
+                          _convert)
+from .. import ClusterjobBackend, ResourcesNotSupportedError
+
+def _megabytes(val):
+    return str(val) + "m"
+
 
 class PbsBackend(ClusterjobBackend):
     """PBS/TORQUE Backend
@@ -24,6 +32,11 @@ class PbsBackend(ClusterjobBackend):
     name = 'pbs'
     extension = 'pbs'
     prefix = '#PBS'
+    resource_converters = {'mem': _megabytes}
+    resource_handlers = {'array': '_array_headers',
+                         'dependency': '_dependency_headers'}
+    packed_resources = ('nodes', 'ppn', 'threads')
+    resource_option_style = 'pbs'
 
     def __init__(self):
         self.status_mapping = {
@@ -65,6 +78,20 @@ class PbsBackend(ClusterjobBackend):
             '${CLUSTERJOB_NODELIST}'   : '`cat $PBS_NODEFILE`',
         }
 
+    def resource_headers(self, jobscript):
+        """Given a :class:`~clusterjob.JobScript` instance, return a list of
+        lines that encode the resource requirements, to be added at the top of
+        the rendered job script
+        """
+        return self._default_resource_headers(jobscript)
+
+    def replace_body_vars(self, body):
+        """Given a multiline string that is the body of the job script, replace
+        the placeholders for environment variables with backend-specific
+        realizations, and return the modified body
+        """
+        return self._default_replace_body_vars(body)
+
     def cmd_submit(self, jobscript):
         """Given a :class:`~clusterjob.JobScript` instance, return a ``qsub``
         command that submits the job to the scheduler, as a list of program
@@ -74,11 +101,11 @@ class PbsBackend(ClusterjobBackend):
 
     def get_job_id(self, response):
         """Given the stdout from the command returned by :meth:`cmd_submit`,
-        return a job ID"""
+        return a job ID. For job arrays, the job ID has the form ``1234[]``"""
         lines = [line.strip() for line in response.split("\n")
                 if line.strip() != '']
         last_line = lines[-1]
-        match = re.match('(\d+)\.[\w.-]+$', last_line)
+        match = re.match(r'(\d+(\[\])?)\.[\w.-]+$', last_line)
         if match:
             return match.group(1)
         else:
@@ -108,19 +135,109 @@ class PbsBackend(ClusterjobBackend):
             except (IndexError, KeyError):
                 return None
 
+    def cmd_status_many(self, runs, finished=False):
+        """Given a list of :class:`~clusterjob.AsyncResult` instances, return
+        a single ``qstat`` command that queries the scheduler for the status of
+        all the jobs, as a list of command arguments. As in
+        :meth:`cmd_status`, the same command is used for running and finished
+        jobs.
+        """
+        return ['qstat', '-x'] + [str(run.job_id) for run in runs]
+
+    def get_status_many(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_status_many`, return a dictionary mapping job IDs to status
+        codes defined in :mod:`clusterjob.status`. Jobs reported as unknown by
+        ``qstat`` are taken to be completed."""
+        result = {}
+        for line in response.split("\n"):
+            line = line.strip()
+            match = re.search(r'Unknown Job Id:?\s+(\d+)', line)
+            if match:
+                result[match.group(1)] = COMPLETED
+                continue
+            match = re.match(r'(\d+)\.\S*\s', line)
+            if match:
+                try:
+                    status = line.split()[4]
+                    result[match.group(1)] = self.status_mapping[status]
+                except (IndexError, KeyError):
+                    continue
+        return result
+
+    def cmd_array_status(self, run, finished=False):
+        """Given a :class:`~clusterjob.ArrayAsyncResult` instance, return a
+        ``qstat`` command that queries the status of all tasks in the array,
+        as a list of command arguments.
+        """
+        return ['qstat', '-t', '-x', str(run.job_id)]
+
+    def get_array_status(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_array_status`, return a dictionary mapping array indices
+        to status codes defined in :mod:`clusterjob.status`"""
+        result = {}
+        for line in response.split("\n"):
+            line = line.strip()
+            match = re.match(r'\d+\[(\d+)\]\S*\s', line)
+            if match:
+                try:
+                    status = line.split()[4]
+                    result[int(match.group(1))] = self.status_mapping[status]
+                except (IndexError, KeyError):
+                    continue
+        return result
+
+    def cmd_accounting(self, run):
+        """Given a :class:`~clusterjob.AsyncResult` instance, return a
+        ``qstat`` command that obtains the full record of the (finished) job,
+        including the ``resources_used``, as a list of command arguments.
+        """
+        return ['qstat', '-x', '-f', str(run.job_id)]
+
+    def get_accounting(self, response):
+        """Given the stdout from the command returned by
+        :meth:`cmd_accounting`, return a
+        :class:`~clusterjob.accounting.JobStats` instance, from the
+        ``resources_used`` and the exit status of the job. The `raw` fields
+        are all the attributes reported by ``qstat``. Return None if the job
+        is unknown, or has not finished."""
+        raw = {}
+        key = None
+        for line in response.split("\n"):
+            if line.startswith("\t") and key is not None:
+                # continuation of a long value
+                raw[key] += line.strip()
+                continue
+            (key, sep, val) = line.strip().partition(' = ')
+            if sep == '':
+                key = None
+                continue
+            raw[key] = val.strip()
+        if 'job_state' not in raw:
+            return None
+        if self.status_mapping.get(raw['job_state'], COMPLETED) < COMPLETED:
+            return None
+        exit_code = raw.get('exit_status', raw.get('Exit_status'))
+        return JobStats(
+            elapsed=_convert(duration_to_seconds,
+                             raw.get('resources_used.walltime')),
+            cpu_time=_convert(duration_to_seconds,
+                              raw.get('resources_used.cput')),
+            max_rss=_convert(memory_to_bytes, raw.get('resources_used.mem')),
+            max_vmem=_convert(memory_to_bytes,
+                              raw.get('resources_used.vmem')),
+            exit_code=_convert(int, exit_code), raw=raw)
+
     def cmd_cancel(self, run):
         """Given a :class:`~clusterjob.AsyncResult` instance, return a ``qdel``
         command that cancels the run, as a list of command arguments.
         """
         return ['qdel', str(run.job_id)]
 
-    def resource_headers(self, jobscript):
-        """Given a :class:`~clusterjob.JobScript` instance, return a list of
-        lines that encode the resource requirements, to be added at the top of
-        the rendered job script
-        """
-        resources = jobscript.resources
-        lines = []
+    def _packed_headers(self, resources):
+        """Return a list of header lines for the `nodes`, `ppn`, and
+        `threads` resources"""
         cores_per_node = 1
         nodes = 1
         if 'ppn' in resources:
@@ -129,41 +246,22 @@ class PbsBackend(ClusterjobBackend):
             cores_per_node *= resources['threads']
         if 'nodes' in resources:
             nodes = resources['nodes']
-        if len(set(['ppn', 'threads', 'nodes']).intersection(resources)) > 0:
-            lines.append('%s -l nodes=%d:ppn=%d'
-                        % (self.prefix, nodes, cores_per_node))
-        for (key, val) in resources.items():
-            if key in ['nodes', 'threads', 'ppn']:
-                continue
-            if key in self.resource_replacements:
-                pbs_key = self.resource_replacements[key]
-                if key == 'mem':
-                    val = str(val) + "m"
-            else:
-                pbs_key = key
-            if val is None:
-                continue
-            if type(val) is bool:
-                if val:
-                    if not pbs_key.startswith('-'):
-                        pbs_key = '-' + pbs_key
-                    lines.append("%s %s" % (self.prefix, pbs_key))
-            else:
-                if not pbs_key.startswith('-'):
-                    pbs_key = '-l %s=' % pbs_key
-                if pbs_key.endswith('='):
-                    lines.append('%s %s%s' % (self.prefix, pbs_key, str(val)))
-                else:
-                    lines.append('%s %s %s' % (self.prefix, pbs_key, str(val)))
-        return lines
+        return ['%s -l nodes=%d:ppn=%d' % (self.prefix, nodes, cores_per_node)]
 
-    def replace_body_vars(self, body):
-        """Given a multiline string that is the body of the job script, replace
-        the placeholders for environment variables with backend-specific
-        realizations, and return the modified body. See the `job_vars`
-        attribute for the mappings that are performed.
-        """
-        for key, val in self.job_vars.items():
-            body = body.replace(key, val)
-        return body
+    def _array_headers(self, array, resources=None):
+        """Return a list of header lines for the given `array` resource"""
+        (ranges, max_running) = parse_array_spec(array)
+        for (start, end, step) in ranges:
+            if step != 1:
+                raise ResourcesNotSupportedError("PBS/TORQUE does not "
+                        "support job arrays with a step size")
+        spec = format_array_ranges(ranges)
+        if max_running is not None:
+            spec += "%%%d" % max_running
+        return ['%s -t %s' % (self.prefix, spec)]
 
+    def _dependency_headers(self, dependency, resources=None):
+        """Return a list of header lines for the given `dependency` resource
+        (see :func:`~clusterjob.utils.parse_dependency_spec`)"""
+        spec = format_dependency_spec(parse_dependency_spec(dependency))
+        return ['%s -W depend=%s' % (self.prefix, spec)]
@@ -4,9 +4,18 @@ SGE (Sun Grid Engine) backend
 from __future__ import absolute_import
 
 import re
+import logging
 from ..status import RUNNING, COMPLETED
+from ..utils import (parse_array_spec, format_array_ranges,
+                     parse_dependency_spec)
+from ..accounting import (JobStats, duration_to_seconds, memory_to_bytes,
+                          _convert)
 from .. import ClusterjobBackend, ResourcesNotSupportedError
 
+def _megabytes(val):
+    return str(val) + "m"
+
+
 class SgeBackend(ClusterjobBackend):
     """SGE Backend
 
@@ -46,6 +55,13 @@ class SgeBackend(ClusterjobBackend):
     name = 'sge'
     extension = 'sge'
     prefix = '#$'
+    resource_converters = {'mem': _megabytes}
+    resource_handlers = {'array': '_array_headers',
+                         'dependency': '_dependency_headers'}
+    packed_resources = ('nodes', 'threads', 'ppn')
+    ignored_resources = ('-cwd', 'cwd')
+    fixed_headers = ['-cwd', ]
+    resource_option_style = 'pbs'
 
     def __init__(self):
         self.resource_replacements = {
@@ -55,7 +71,7 @@ class SgeBackend(ClusterjobBackend):
             'mem'    : '-l h_vmem==',
             'stdout' : '-o',
             'stderr' : '-e',
-            # nodes and threads are handled separately, in resource_headers
+            # nodes and threads are handled separately, in _packed_headers
         }
         self.job_vars = {
             '$CLUSTERJOB_ID'         : '$JOB_ID',
@@ -72,11 +88,39 @@ class SgeBackend(ClusterjobBackend):
             '${CLUSTERJOB_NODELIST}'   : '${HOSTNAME}',
         }
 
+    def resource_headers(self, jobscript):
+        """Given a :class:`~clusterjob.JobScript` instance, return a list of
+        lines that encode the resource requirements, to be added at the top of
+        the rendered job script
+        """
+        return self._default_resource_headers(jobscript)
+
+    def replace_body_vars(self, body):
+        """Given a multiline string that is the body of the job script, replace
+        the placeholders for environment variables with backend-specific
+        realizations, and return the modified body
+        """
+        return self._default_replace_body_vars(body)
+
     def cmd_submit(self, jobscript):
         """Given a :class:`~clusterjob.JobScript` instance, return a ``qsub``
         command that submits the job to the scheduler, as a list of program
         arguments.
+
+        If the job depends on other jobs with the 'afterok' condition, which
+        SGE treats as 'afterany', a warning is logged for every submission.
         """
+        dependency = jobscript.resources.get('dependency')
+        if dependency is not None:
+            ids = [job_id for (condition, job_ids)
+                   in parse_dependency_spec(dependency)
+                   if condition == 'afterok' for job_id in job_ids]
+            if len(ids) > 0:
+                logger = logging.getLogger(__name__)
+                logger.warning("SGE does not support the dependency "
+                               "condition 'afterok'; the job will start "
+                               "after jobs %s have finished, even if they "
+                               "failed", ",".join(ids))
         return ['qsub', jobscript.filename]
 
     def get_job_id(self, response):
@@ -85,7 +129,9 @@ class SgeBackend(ClusterjobBackend):
         lines = [line.strip() for line in response.split("\n")
                 if line.strip() != '']
         last_line = lines[-1]
-        match = re.match(r'Your job (\d+) .* has been submitted$', last_line)
+        match = re.match(
+                r'Your job(?:-array)? (\d+)[ .].* has been submitted$',
+                last_line)
         if match:
             return match.group(1)
         else:
@@ -110,56 +156,80 @@ class SgeBackend(ClusterjobBackend):
         else:
             return RUNNING
 
+    def cmd_accounting(self, run):
+        """Given a :class:`~clusterjob.AsyncResult` instance, return a
+        ``qacct`` command that obtains the accounting record of the finished
+        job, as a list of command arguments.
+        """
+        return ['qacct', '-j', str(run.job_id)]
+
+    def get_accounting(self, response):
+        """Given the stdout from the command returned by
+        :meth:`cmd_accounting`, return a
+        :class:`~clusterjob.accounting.JobStats` instance. The `raw` fields
+        are all the fields of the record. For a job array, ``qacct`` reports
+        a record for every task, and only the first record is used. Return
+        None if there is no record for the job (yet)."""
+        raw = {}
+        for line in response.split("\n"):
+            if line.startswith('====='):
+                if len(raw) > 0:
+                    break # end of first record
+                continue
+            fields = line.split(None, 1)
+            if len(fields) == 2:
+                raw[fields[0]] = fields[1].strip()
+        if 'jobnumber' not in raw:
+            return None
+        max_rss = raw.get('ru_maxrss', '')
+        if max_rss[-1:].isdigit():
+            max_rss += 'K' # ru_maxrss is in kilobytes, unless given a unit
+        return JobStats(
+            elapsed=_convert(duration_to_seconds, raw.get('ru_wallclock')),
+            cpu_time=_convert(duration_to_seconds, raw.get('cpu')),
+            max_rss=_convert(memory_to_bytes, max_rss),
+            max_vmem=_convert(memory_to_bytes, raw.get('maxvmem')),
+            exit_code=_convert(lambda val: int(val.split()[0]),
+                               raw.get('exit_status')),
+            raw=raw)
+
     def cmd_cancel(self, run):
         """Given a :class:`~clusterjob.AsyncResult` instance, return a ``qdel``
         command that cancels the run, as a list of command arguments.
         """
         return ['qdel', str(run.job_id)]
 
-    def resource_headers(self, jobscript):
-        """Given a :class:`~clusterjob.JobScript` instance, return a list of
-        lines that encode the resource requirements, to be added at the top of
-        the rendered job script
-        """
-        lines = []
-        for (key, val) in jobscript.resources.items():
-            if key in self.resource_replacements:
-                pbs_key = self.resource_replacements[key]
-                if key == 'mem':
-                    val = str(val) + "m"
-            else:
-                pbs_key = key
-            if key in ['nodes', 'threads', 'ppn']:
-                raise ResourcesNotSupportedError("The SGE scheduling system "
-                        "uses 'parallel environments' to request resources "
-                        "for parallelization. SgeBackend should be subclassed "
-                        "for a specific cluster configuration in order to "
-                        "encode 'nodes', 'threads', and 'ppn'.")
-            if key in ['-cwd', 'cwd']:
-                continue
-            if val is None:
-                continue
-            if type(val) is bool:
-                if val:
-                    if not pbs_key.startswith('-'):
-                        pbs_key = '-' + pbs_key
-                    lines.append("%s %s" % (self.prefix, pbs_key))
-            else:
-                if not pbs_key.startswith('-'):
-                    pbs_key = '-l %s=' % pbs_key
-                if pbs_key.endswith('='):
-                    lines.append('%s %s%s' % (self.prefix, pbs_key, str(val)))
-                else:
-                    lines.append('%s %s %s' % (self.prefix, pbs_key, str(val)))
-        lines.append("%s -cwd" % self.prefix)
+    def _packed_headers(self, resources):
+        """Raise a :exc:`~clusterjob.backends.ResourcesNotSupportedError`, as
+        `nodes`, `threads`, and `ppn` must be encoded through a
+        cluster-specific parallel environment"""
+        raise ResourcesNotSupportedError("The SGE scheduling system "
+                "uses 'parallel environments' to request resources "
+                "for parallelization. SgeBackend should be subclassed "
+                "for a specific cluster configuration in order to "
+                "encode 'nodes', 'threads', and 'ppn'.")
+
+    def _array_headers(self, array, resources=None):
+        """Return a list of header lines for the given `array` resource"""
+        (ranges, max_running) = parse_array_spec(array)
+        if len(ranges) > 1:
+            raise ResourcesNotSupportedError("SGE only supports job arrays "
+                    "with a single range of indices")
+        lines = ['%s -t %s' % (self.prefix, format_array_ranges(ranges))]
+        if max_running is not None:
+            lines.append('%s -tc %d' % (self.prefix, max_running))
         return lines
 
-    def replace_body_vars(self, body):
-        """Given a multiline string that is the body of the job script, replace
-        the placeholders for environment variables with backend-specific
-        realizations, and return the modified body. See the `job_vars`
-        attribute for the mappings that are performed.
-        """
-        for key, val in self.job_vars.items():
-            body = body.replace(key, val)
-        return body
+    def _dependency_headers(self, dependency, resources=None):
+        """Return a list of header lines for the given `dependency` resource
+        (see :func:`~clusterjob.utils.parse_dependency_spec`). SGE only
+        supports waiting for jobs to finish (``-hold_jid``), irrespective of
+        their exit status, so that 'afterok' is treated as 'afterany' (with a
+        warning on submission, see :meth:`cmd_submit`)."""
+        job_ids = []
+        for (condition, ids) in parse_dependency_spec(dependency):
+            if condition == 'afternotok':
+                raise ResourcesNotSupportedError("SGE does not support "
+                        "the dependency condition 'afternotok'")
+            job_ids.extend(ids)
+        return ['%s -hold_jid %s' % (self.prefix, ",".join(job_ids))]
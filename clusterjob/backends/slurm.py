@@ -2,9 +2,55 @@ from __future__ import absolute_import
 import re
 
 from ..status import PENDING, RUNNING, COMPLETED, CANCELLED, FAILED
+from ..utils import (parse_array_spec, format_array_ranges, array_indices,
+                     time_to_seconds)
+from ..accounting import (JobStats, duration_to_seconds, memory_to_bytes,
+                          _convert)
 from .. import ClusterjobBackend
 
 
+def _array_spec(array):
+    (ranges, max_running) = parse_array_spec(array)
+    spec = format_array_ranges(ranges)
+    if max_running is not None:
+        spec += "%%%d" % max_running
+    return spec
+
+
+def _strip(val):
+    return str(val).strip()
+
+
+def _sacct_time(val):
+    """Return the `Start` or `End` field of ``sacct``, or None if the time
+    is not known (yet)"""
+    if val in ('', 'Unknown', 'None'):
+        return None
+    return val
+
+
+# fields of the single ``sacct`` query in the 'sacct' status mode
+SACCT_FIELDS = ('JobID', 'State', 'ExitCode', 'Elapsed', 'Start', 'End')
+
+# fields of the ``sacct`` query for the accounting record of a job
+SACCT_ACCOUNTING_FIELDS = ('JobID', 'State', 'ExitCode', 'Elapsed',
+                           'TotalCPU', 'MaxRSS', 'MaxVMSize')
+
+
+def _values(records, key, converter):
+    """Return the list of values for `key` in the given list of `records`
+    (dicts), converted with `converter`. Values that cannot be converted are
+    skipped."""
+    values = [_convert(converter, record[key]) for record in records]
+    return [val for val in values if val is not None]
+
+
+def _exit_code(val):
+    """Convert the `ExitCode` field of ``sacct`` (``<exit code>:<signal>``)
+    into an int"""
+    return int(val.split(':')[0])
+
+
 class SlurmBackend(ClusterjobBackend):
     """SLURM Backend
 
@@ -18,25 +64,48 @@ class SlurmBackend(ClusterjobBackend):
             keys to command line options of the `qsub` command.
         job_vars(dict): mapping of *core environment variables* to
             Slurm-specific environment variables.
+        status_mode (str): How the status of a job is queried. In the default
+            'squeue' mode, the status is obtained from ``squeue``, and only
+            if the job is no longer in the queue, from ``sacct``. In the
+            'sacct' mode, a single ``sacct`` query with parsable output (see
+            :data:`SACCT_FIELDS`) is used for pending, running and finished
+            jobs, and the exit code, the elapsed time, and the start and end
+            time of the job are stored in the :class:`~clusterjob.AsyncResult`
+            (``squeue`` is only used as a fallback, for jobs that ``sacct``
+            does not know yet). The 'sacct' mode requires SLURM's accounting
+            to be enabled.
+
+    To use the 'sacct' status mode, register a backend instance with
+    ``status_mode='sacct'``, e.g.::
 
+        JobScript.register_backend(SlurmBackend(status_mode='sacct'))
     """
     name = 'slurm'
     extension = 'slr'
     prefix = '#SBATCH'
+    resource_option_style = 'getopt'
+    long_option_separator = '='
 
-    def __init__(self):
+    def __init__(self, status_mode='squeue'):
+        if status_mode not in ('squeue', 'sacct'):
+            raise ValueError("Invalid status_mode %r" % status_mode)
+        self.status_mode = status_mode
         self.status_mapping = {
-            'RUNNING'    : RUNNING,
-            'CANCELLED'  : CANCELLED,
-            'COMPLETED'  : COMPLETED,
-            'CONFIGURING': PENDING,
-            'COMPLETING' : RUNNING,
-            'FAILED'     : FAILED,
-            'NODE_FAIL'  : FAILED,
-            'PENDING'    : PENDING,
-            'PREEMPTED'  : FAILED,
-            'SUSPENDED'  : PENDING,
-            'TIMEOUT'    : FAILED,
+            'RUNNING'      : RUNNING,
+            'CANCELLED'    : CANCELLED,
+            'COMPLETED'    : COMPLETED,
+            'CONFIGURING'  : PENDING,
+            'COMPLETING'   : RUNNING,
+            'FAILED'       : FAILED,
+            'NODE_FAIL'    : FAILED,
+            'BOOT_FAIL'    : FAILED,
+            'OUT_OF_MEMORY': FAILED,
+            'DEADLINE'     : FAILED,
+            'PENDING'      : PENDING,
+            'REQUEUED'     : PENDING,
+            'PREEMPTED'    : FAILED,
+            'SUSPENDED'    : PENDING,
+            'TIMEOUT'      : FAILED,
         }
         self.resource_replacements = {
             'jobname': '--job-name',
@@ -48,7 +117,11 @@ class SlurmBackend(ClusterjobBackend):
             'mem'    : '--mem',
             'stdout' : '--output',
             'stderr' : '--error',
+            'array'  : '--array',
         }
+        self.resource_converters = dict(
+                [(key, _strip) for key in self.resource_replacements])
+        self.resource_converters['array'] = _array_spec
         self.job_vars = {
             '$CLUSTERJOB_ID'         : '$SLURM_JOBID',
             '$CLUSTERJOB_WORKDIR'    : '$SLURM_SUBMIT_DIR',
@@ -63,6 +136,20 @@ class SlurmBackend(ClusterjobBackend):
             '${CLUSTERJOB_ARRAY_INDEX}': '${SLURM_ARRAY_TASK_ID}',
             '${CLUSTERJOB_NODELIST}'   : '${SLURM_JOB_NODELIST}',
         }
+    def resource_headers(self, jobscript):
+        """Given a :class:`~clusterjob.JobScript` instance, return a list of
+        lines that encode the resource requirements, to be added at the top of
+        the rendered job script
+        """
+        return self._default_resource_headers(jobscript)
+
+    def replace_body_vars(self, body):
+        """Given a multiline string that is the body of the job script, replace
+        the placeholders for environment variables with backend-specific
+        realizations, and return the modified body
+        """
+        return self._default_replace_body_vars(body)
+
     def cmd_submit(self, jobscript):
         """Given a :class:`~clusterjob.JobScript` instance, return a ``sbatch``
         command that submits the job to the scheduler, as a list of program
@@ -79,13 +166,66 @@ class SlurmBackend(ClusterjobBackend):
         else:
             return None
 
+    def _cmd_sacct(self, job_ids):
+        """Return the ``sacct`` command of the 'sacct' status mode for the
+        given comma-separated `job_ids`"""
+        return ['sacct', '--parsable2', '--noheader', '-X',
+                '--format=%s' % ",".join(SACCT_FIELDS), '-j', job_ids]
+
+    def _parse_sacct(self, response):
+        """Parse the response to the command returned by :meth:`_cmd_sacct`
+        into a dictionary mapping job IDs to tuples of the status code and a
+        dictionary of details (cf. :meth:`get_status_details`). Lines that
+        cannot be parsed are skipped."""
+        result = {}
+        for line in response.splitlines():
+            fields = line.strip().split("|")
+            if len(fields) < len(SACCT_FIELDS):
+                continue
+            (job_id, state, exit_code, elapsed, start, end) \
+                = fields[:len(SACCT_FIELDS)]
+            # e.g. 'CANCELLED by 1234'
+            state = (state.split() or [''])[0].rstrip('+')
+            if job_id.strip() == '' or state not in self.status_mapping:
+                continue
+            details = {'start_time': _sacct_time(start),
+                       'end_time': _sacct_time(end)}
+            for (key, converter, val) in [
+                    ('exit_code', _exit_code, exit_code),
+                    ('elapsed', time_to_seconds, elapsed)]:
+                val = _convert(converter, val)
+                if val is not None:
+                    details[key] = val
+            result[job_id.strip()] = (self.status_mapping[state], details)
+        return result
+
+    def _sacct_record(self, response):
+        """Return the tuple of status code and details for the job in the
+        response to :meth:`_cmd_sacct` for a single job, or None"""
+        records = self._parse_sacct(response)
+        for job_id in sorted(records):
+            if job_id.isdigit():
+                return records[job_id]
+        if len(records) > 0:
+            return records[sorted(records)[0]]
+        return None
+
+    def _uses_sacct(self, finished):
+        """Whether the status query for the given value of `finished` is the
+        single ``sacct`` query of the 'sacct' status mode"""
+        return self.status_mode == 'sacct' and not finished
+
     def cmd_status(self, run, finished=False):
         """Given a :class:`~clusterjob.AsyncResult` instance, return a command
         that queries the scheduler for the job status, as a list of command
         arguments.  If ``finished=True``, the scheduler is queried via
-        ``sacct``. Otherwise, ``squeue`` is used.
+        ``sacct``. Otherwise, ``squeue`` is used. In the 'sacct'
+        :attr:`status_mode`, it is the other way around: ``sacct`` reports
+        the status of all jobs, and ``squeue`` is only a fallback.
         """
-        if finished:
+        if self._uses_sacct(finished):
+            return self._cmd_sacct(str(run.job_id))
+        if finished and self.status_mode == 'squeue':
             return ['sacct', '--format=state', '-n', '-j',  str(run.job_id)]
         else:
             return ['squeue', '-h', '-o', '%T', '-j', str(run.job_id)]
@@ -93,55 +233,164 @@ class SlurmBackend(ClusterjobBackend):
     def get_status(self, response, finished=False):
         """Given the stdout from the command returned by :meth:`cmd_status`,
         return one of the status code defined in :mod:`clusterjob.status`"""
+        if self._uses_sacct(finished):
+            record = self._sacct_record(response)
+            if record is None:
+                return None
+            return record[0]
         for line in response.split("\n"):
-            if line.strip() in self.status_mapping:
-                return self.status_mapping[line.strip()]
+            # sacct may report e.g. 'CANCELLED by 1234'
+            state = (line.split() or [''])[0]
+            if state in self.status_mapping:
+                return self.status_mapping[state]
         return None
 
-    def cmd_cancel(self, run):
-        """Given a :class:`~clusterjob.AsyncResult` instance, return an
-        ``scancel`` command that cancels the run, as a list of command
-        arguments.
-        """
-        return ['scancel', str(run.job_id)]
+    def get_status_details(self, response, finished=False):
+        """Given the stdout from the command returned by :meth:`cmd_status`,
+        return a dictionary with the exit code, the elapsed time and the
+        start and end time of the job. Only in the 'sacct'
+        :attr:`status_mode`; otherwise, return an empty dictionary."""
+        if self._uses_sacct(finished):
+            record = self._sacct_record(response)
+            if record is not None:
+                return record[1]
+        return {}
 
-    def resource_headers(self, jobscript):
-        """Given a :class:`~clusterjob.JobScript` instance, return a list of
-        lines that encode the resource requirements, to be added at the top of
-        the rendered job script
+    def cmd_status_many(self, runs, finished=False):
+        """Given a list of :class:`~clusterjob.AsyncResult` instances, return
+        a single command that queries the scheduler for the status of all the
+        jobs, as a list of command arguments. If ``finished=True``, the
+        scheduler is queried via ``sacct``. Otherwise, ``squeue`` is used.
         """
-        lines = []
-        for (key, val) in jobscript.resources.items():
-            if key in self.resource_replacements:
-                slurm_key = self.resource_replacements[key]
-                val = str(val).strip()
+        job_ids = ",".join([str(run.job_id) for run in runs])
+        if self._uses_sacct(finished):
+            return self._cmd_sacct(job_ids)
+        if finished and self.status_mode == 'squeue':
+            return ['sacct', '--format=jobid,state', '-n', '-X', '-P',
+                    '-j', job_ids]
+        else:
+            return ['squeue', '-h', '-o', '%i %T', '-j', job_ids]
+
+    def get_status_many(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_status_many`, return a dictionary mapping job IDs to status
+        codes defined in :mod:`clusterjob.status`"""
+        if self._uses_sacct(finished):
+            return dict([(job_id, status) for (job_id, (status, __))
+                         in self._parse_sacct(response).items()])
+        result = {}
+        for line in response.split("\n"):
+            if finished and self.status_mode == 'squeue':
+                fields = line.strip().split("|")
             else:
-                slurm_key = key
-            if not slurm_key.startswith('-'):
-                if len(slurm_key) == 1:
-                    slurm_key = '-%s' % slurm_key
-                else:
-                    slurm_key = '--%s' % slurm_key
-            if val is None:
+                fields = line.split()
+            if len(fields) < 2 or fields[1].strip() == '':
                 continue
-            if type(val) is bool:
-                if val:
-                    lines.append("%s %s" % (self.prefix, slurm_key))
-            else:
-                if slurm_key.startswith('--'):
-                    lines.append('%s %s=%s'
-                                  % (self.prefix, slurm_key, str(val)))
-                else:
-                    lines.append('%s %s %s'
-                                 % (self.prefix, slurm_key, str(val)))
-        return lines
+            # sacct may report e.g. 'CANCELLED by 1234'
+            state = fields[1].split()[0]
+            if state in self.status_mapping:
+                result[fields[0].strip()] = self.status_mapping[state]
+        return result
 
-    def replace_body_vars(self, body):
-        """Given a multiline string that is the body of the job script, replace
-        the placeholders for environment variables with backend-specific
-        realizations, and return the modified body
+    def get_status_details_many(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_status_many`, return a dictionary that maps job IDs to
+        dictionaries of details, cf. :meth:`get_status_details`"""
+        if self._uses_sacct(finished):
+            return dict([(job_id, details) for (job_id, (__, details))
+                         in self._parse_sacct(response).items()])
+        return {}
+
+    def cmd_array_status(self, run, finished=False):
+        """Given a :class:`~clusterjob.ArrayAsyncResult` instance, return a
+        ``sacct`` command that queries the status of all tasks in the array,
+        as a list of command arguments. The same command is used for running
+        and finished arrays.
         """
-        for key, val in self.job_vars.items():
-            body = body.replace(key, val)
-        return body
+        return ['sacct', '--format=jobid,state', '-n', '-X', '-P', '-j',
+                str(run.job_id)]
+
+    def get_array_status(self, response, finished=False):
+        """Given the stdout from the command returned by
+        :meth:`cmd_array_status`, return a dictionary mapping array indices
+        to status codes defined in :mod:`clusterjob.status`. Pending tasks
+        that ``sacct`` reports as a range (e.g. ``1234_[5-100]``) are
+        expanded."""
+        result = {}
+        for line in response.split("\n"):
+            match = re.match(r'\d+_(\S+)\|(\S+)', line.strip())
+            if match and match.group(2) in self.status_mapping:
+                status = self.status_mapping[match.group(2)]
+                try:
+                    for index in array_indices(match.group(1).strip('[]')):
+                        result[index] = status
+                except ValueError:
+                    continue
+        return result
 
+    def cmd_accounting(self, run):
+        """Given a :class:`~clusterjob.AsyncResult` instance, return a
+        ``sacct`` command that obtains the accounting record of the job and
+        all of its steps (see :data:`SACCT_ACCOUNTING_FIELDS`), as a list of
+        command arguments.
+        """
+        return ['sacct', '--parsable2', '--noheader',
+                '--format=%s' % ",".join(SACCT_ACCOUNTING_FIELDS),
+                '-j', str(run.job_id)]
+
+    def get_accounting(self, response):
+        """Given the stdout from the command returned by
+        :meth:`cmd_accounting`, return a
+        :class:`~clusterjob.accounting.JobStats` instance. ``sacct`` reports
+        the allocation of the job (or of every task, for a job array) and
+        each of its steps (e.g. ``1234.batch``) on separate lines. The
+        elapsed time and the exit code are the maxima over the allocations,
+        the CPU time is their sum, and the memory usage is the maximum over
+        all steps. The `raw` fields are those of the first allocation.
+        Return None if ``sacct`` does not report the job, or reports it as
+        pending or running."""
+        allocations = []
+        steps = []
+        for line in response.splitlines():
+            fields = line.strip().split("|")
+            if len(fields) < len(SACCT_ACCOUNTING_FIELDS) \
+                    or fields[0].strip() == '':
+                continue
+            record = dict(zip(SACCT_ACCOUNTING_FIELDS,
+                              [field.strip() for field in fields]))
+            if '.' in record['JobID']:
+                steps.append(record)
+            else:
+                allocations.append(record)
+        if len(allocations) == 0:
+            return None
+        for record in allocations:
+            # e.g. 'CANCELLED by 1234'
+            state = (record['State'].split() or [''])[0].rstrip('+')
+            if self.status_mapping.get(state, COMPLETED) < COMPLETED:
+                return None
+        stats = JobStats(raw=allocations[0])
+        elapsed = _values(allocations, 'Elapsed', duration_to_seconds)
+        if len(elapsed) > 0:
+            stats.elapsed = max(elapsed)
+        cpu_time = _values(allocations, 'TotalCPU', duration_to_seconds)
+        if len(cpu_time) > 0:
+            stats.cpu_time = sum(cpu_time)
+        exit_code = _values(allocations, 'ExitCode', _exit_code)
+        if len(exit_code) > 0:
+            stats.exit_code = max(exit_code)
+        max_rss = _values(allocations + steps, 'MaxRSS', memory_to_bytes)
+        if len(max_rss) > 0:
+            stats.max_rss = max(max_rss)
+        max_vmem = _values(allocations + steps, 'MaxVMSize',
+                           memory_to_bytes)
+        if len(max_vmem) > 0:
+            stats.max_vmem = max(max_vmem)
+        return stats
+
+    def cmd_cancel(self, run):
+        """Given a :class:`~clusterjob.AsyncResult` instance, return an
+        ``scancel`` command that cancels the run, as a list of command
+        arguments.
+        """
+        return ['scancel', str(run.job_id)]
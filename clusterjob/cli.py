@@ -253,3 +253,68 @@ def test_backend(inifile, body, backend, jobname):
     click.pause("\nPress Enter to finish")
 
     click.echo("\n\nFINISHED WORKFLOW TEST -- RECORDING MODE\n")
+
+
+@click.group()
+@click.help_option('-h', '--help')
+@click.version_option(version=__version__)
+def emulator():
+    """Emulate a cluster scheduling system on the local machine, for testing
+    workflows and load-testing clusterjob without access to a cluster. See
+    the documentation of the clusterjob.emulator module for details."""
+    pass
+
+
+@emulator.command()
+@click.help_option('-h', '--help')
+@click.option('--state', metavar='STATEDIR', default='~/.clusterjob_emulator',
+        show_default=True, help="Folder in which to keep the state of the "
+        "emulated scheduler.")
+@click.option('--flavor', type=click.Choice(sorted(['slurm', 'pbs', 'pbspro',
+        'lpbs', 'sge', 'lsf'])), default='slurm', show_default=True,
+        help="Scheduling system to emulate.")
+@click.option('--queue-delay', type=float, default=0.0, show_default=True,
+        help="Minimum number of seconds that jobs are pending.")
+@click.option('--run-time', type=float, default=None, help="If given, "
+        "simulate jobs that run for the given number of seconds, instead of "
+        "executing the job scripts.")
+@click.option('--failure-rate', type=float, default=0.0, show_default=True,
+        help="Probability for a job to fail.")
+@click.option('--submit-failure-rate', type=float, default=0.0,
+        show_default=True, help="Probability for a submission to be "
+        "rejected.")
+@click.option('--seed', type=int, default=None, help="Seed for random "
+        "failures.")
+@click.argument('bindir', type=click.Path())
+def install(bindir, state, flavor, queue_delay, run_time, failure_rate,
+        submit_failure_rate, seed):
+    """Write executables for the commands of the emulated scheduler (e.g.
+    sbatch, squeue, sacct, scancel) to BINDIR. Put BINDIR at the front of
+    your $PATH to use the emulated scheduler."""
+    from .emulator import install as install_emulator
+    emulator = install_emulator(
+        bindir, state, flavor=flavor, queue_delay=queue_delay,
+        run_time=run_time, failure_rate=failure_rate,
+        submit_failure_rate=submit_failure_rate, seed=seed)
+    emulator.close()
+    click.echo("Installed emulated %s scheduler in %s (state in %s)"
+               % (flavor, os.path.abspath(bindir), emulator.statedir))
+    if run_time is None:
+        click.echo("Run 'clusterjob-emulator serve --state %s' to execute "
+                   "submitted jobs" % state)
+
+
+@emulator.command()
+@click.help_option('-h', '--help')
+@click.option('--state', metavar='STATEDIR', default='~/.clusterjob_emulator',
+        show_default=True, help="Folder in which the state of the emulated "
+        "scheduler is kept.")
+@click.option('--workers', type=int, default=None, help="Number of jobs to "
+        "run in parallel. Defaults to the number of cores.")
+def serve(state, workers):
+    """Execute the jobs submitted to the emulated scheduler, until
+    interrupted with CTRL+C."""
+    from .emulator import Emulator
+    emulator = Emulator(state)
+    click.echo("Executing jobs submitted to %s" % emulator.statedir)
+    emulator.serve(workers=workers)
@@ -0,0 +1,765 @@
+r"""Emulation of cluster scheduling systems on the local machine
+
+The :class:`Emulator` implements the submission, status, and cancellation
+commands of the scheduling systems supported by the built-in backends
+(``sbatch``/``squeue``/``sacct``/``scancel`` for SLURM,
+``qsub``/``qstat``/``qdel`` for PBS, PBS Pro, and SGE,
+``lqsub``/``lqstat``/``lqdel`` for LPBS, and ``bsub``/``bjobs``/``bkill`` for
+LSF), producing output in the format that the backends parse. All jobs are
+kept in a SQLite database inside a local state directory, so that any number
+of processes may talk to the same emulated scheduler.
+
+The emulator runs in one of two modes:
+
+* If a `run_time` is configured, jobs are *simulated*: every job is pending
+  for `queue_delay` seconds after submission, then running for `run_time`
+  seconds, and then finishes (failing with a probability of `failure_rate`).
+  The job scripts are never executed, which allows to emulate tens of
+  thousands of jobs.
+* Otherwise, job scripts are *executed* by a pool of workers (see
+  :meth:`Emulator.serve`, or ``clusterjob-emulator serve``), which must be
+  running alongside the emulated scheduler. A job is started no earlier than
+  `queue_delay` seconds after its submission.
+
+There are two ways to direct a :class:`~clusterjob.JobScript` to the
+emulator. Wrapper executables for all commands can be written to a folder
+(:func:`install`, or ``clusterjob-emulator install``) that is then put at the
+front of the ``$PATH``; jobs are submitted with ``remote=None``.
+Alternatively, :meth:`Emulator.run_cmd` is a drop-in replacement for
+:func:`clusterjob.utils.run_cmd` that handles all scheduler commands
+in-process::
+
+    >>> import tempfile, shutil, os
+    >>> statedir = tempfile.mkdtemp()
+    >>> with open(os.path.join(statedir, 'hello.slr'), 'w') as out_fh:
+    ...     _ = out_fh.write("#!/bin/bash\n#SBATCH --job-name=hello\n")
+    >>> emulator = Emulator(statedir, flavor='slurm', queue_delay=0,
+    ...                     run_time=0)
+    >>> emulator.run_cmd(['sbatch', 'hello.slr'], remote=None,
+    ...                  workdir=statedir)
+    'Submitted batch job 1\n'
+    >>> emulator.run_cmd(['squeue', '-h', '-o', '%T', '-j', '1'], remote=None)
+    ''
+    >>> emulator.run_cmd(['sacct', '--format=jobid,state', '-n', '-X', '-P',
+    ...                   '-j', '1'], remote=None)
+    '1|COMPLETED\n'
+    >>> emulator.close()
+    >>> shutil.rmtree(statedir)
+
+For load tests, the in-process :meth:`~Emulator.run_cmd` can be installed as
+``JobScript._run_cmd`` and ``AsyncResult._run_cmd``.
+"""
+from __future__ import absolute_import, print_function
+import getpass
+import json
+import os
+import random
+import re
+import shlex
+import socket
+import sqlite3
+import stat
+import subprocess as sp
+import sys
+import threading
+import time
+
+from .utils import run_cmd, interpreter_cmd, CMD_RESPONSE_ENCODING
+
+__all__ = ['Emulator', 'install', 'main', 'FLAVORS']
+
+#: Supported scheduling systems, mapped to the names of their commands
+FLAVORS = {
+    'slurm': ['sbatch', 'squeue', 'sacct', 'scancel'],
+    'pbs': ['qsub', 'qstat', 'qdel'],
+    'pbspro': ['qsub', 'qstat', 'qdel'],
+    'lpbs': ['lqsub', 'lqstat', 'lqdel'],
+    'sge': ['qsub', 'qstat', 'qdel'],
+    'lsf': ['bsub', 'bjobs', 'bkill'],
+}
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+REJECTED = 'REJECTED' # failed submission, not visible to any command
+
+_ACTIVE = (PENDING, RUNNING)
+_PBS_STATES = {PENDING: 'Q', RUNNING: 'R', COMPLETED: 'C', FAILED: 'C',
+               CANCELLED: 'C'}
+_LSF_STATES = {PENDING: 'PEND', RUNNING: 'RUN', COMPLETED: 'DONE',
+               FAILED: 'EXIT', CANCELLED: 'EXIT'}
+
+# header options for the job name, stdout and stderr, for each flavor
+_HEADER_OPTIONS = {
+    'slurm': ('#SBATCH', {'name': ['--job-name', '-J'],
+                          'stdout': ['--output', '-o'],
+                          'stderr': ['--error', '-e']}),
+    'pbs': ('#PBS', {'name': ['-N'], 'stdout': ['-o'], 'stderr': ['-e']}),
+    'sge': ('#$', {'name': ['-N'], 'stdout': ['-o'], 'stderr': ['-e']}),
+    'lsf': ('#BSUB', {'name': ['-J'], 'stdout': ['-o'], 'stderr': ['-e']}),
+}
+_HEADER_OPTIONS['pbspro'] = _HEADER_OPTIONS['pbs']
+_HEADER_OPTIONS['lpbs'] = _HEADER_OPTIONS['pbs']
+
+# environment variables set for executed jobs, for each flavor
+_JOB_ENV = {
+    'slurm': {'SLURM_JOBID': '{job_id}', 'SLURM_JOB_ID': '{job_id}',
+              'SLURM_SUBMIT_DIR': '{workdir}', 'SLURM_SUBMIT_HOST': '{host}',
+              'SLURM_JOB_NAME': '{name}', 'SLURM_JOB_NODELIST': '{host}'},
+    'pbs': {'PBS_JOBID': '{job_id}.emulator', 'PBS_O_WORKDIR': '{workdir}',
+            'PBS_O_HOST': '{host}', 'PBS_JOBNAME': '{name}',
+            'PBS_NODEFILE': '{nodefile}'},
+    'sge': {'JOB_ID': '{job_id}', 'SGE_O_WORKDIR': '{workdir}',
+            'SGE_O_HOST': '{host}', 'JOB_NAME': '{name}',
+            'HOSTNAME': '{host}'},
+    'lsf': {'LSB_JOBID': '{job_id}', 'LS_SUBCWD': '{workdir}',
+            'LSB_JOBNAME': '{name}', 'LSB_HOSTS': '{host}'},
+}
+_JOB_ENV['pbspro'] = _JOB_ENV['pbs']
+_JOB_ENV['lpbs'] = _JOB_ENV['pbs']
+
+_CONFIG_DEFAULTS = {
+    'flavor': 'slurm',
+    'queue_delay': 0.0,
+    'run_time': None,
+    'failure_rate': 0.0,
+    'submit_failure_rate': 0.0,
+    'seed': None,
+}
+
+
+def _parse_args(args, flags=(), options=()):
+    """Parse the list of command line arguments `args` into a dict of options
+    and a list of positional arguments. Options in `flags` do not take a
+    value, options in `options` do (given either as the next argument, or
+    after ``=`` for long options). Unknown options are ignored."""
+    opts = {}
+    positional = []
+    args = list(args)
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg.startswith('--') and '=' in arg:
+            (name, val) = arg.split('=', 1)
+            opts[name] = val
+        elif arg in flags:
+            opts[arg] = True
+        elif arg in options:
+            opts[arg] = args.pop(0) if len(args) > 0 else ''
+        elif arg.startswith('-') and len(arg) > 1:
+            continue
+        else:
+            positional.append(arg)
+    return opts, positional
+
+
+def _job_ids(args):
+    """Convert a list of job IDs (possibly comma-separated, or with a host
+    suffix such as ``1234.emulator``) into a list of integers"""
+    result = []
+    for arg in args:
+        for job_id in arg.split(','):
+            match = re.match(r'\s*(\d+)', job_id)
+            if match:
+                result.append(int(match.group(1)))
+    return result
+
+
+class Emulator(object):
+    """A scheduler emulated in the local state directory `statedir`
+
+    Arguments:
+        statedir (str): Folder in which to keep the state of the scheduler. It
+            is created if it does not exist
+        flavor (str): The scheduling system to emulate, one of the keys in
+            :obj:`FLAVORS`
+        queue_delay (float): Minimum number of seconds that jobs are pending
+        run_time (float or None): Number of seconds that simulated jobs are
+            running. If None, job scripts are executed by the workers started
+            by :meth:`serve`
+        failure_rate (float): Probability for a job to fail
+        submit_failure_rate (float): Probability for a submission to be
+            rejected by the scheduler
+        seed (int or None): Seed for the random decisions on failures
+
+    Any configuration option that is given is written to the file
+    ``config.json`` in the `statedir`; options that are not given are read
+    from that file (so that all processes using the same `statedir` share the
+    same configuration).
+    """
+
+    def __init__(self, statedir, **config):
+        for key in config:
+            if key not in _CONFIG_DEFAULTS:
+                raise TypeError("Invalid configuration option '%s'" % key)
+        self.statedir = os.path.abspath(os.path.expanduser(statedir))
+        if not os.path.isdir(self.statedir):
+            os.makedirs(self.statedir)
+        self.config = dict(_CONFIG_DEFAULTS)
+        config_file = os.path.join(self.statedir, 'config.json')
+        if os.path.isfile(config_file):
+            with open(config_file) as in_fh:
+                self.config.update(json.load(in_fh))
+        if len(config) > 0:
+            self.config.update(config)
+            with open(config_file, 'w') as out_fh:
+                json.dump(self.config, out_fh, indent=2, sort_keys=True)
+        if self.config['flavor'] not in FLAVORS:
+            raise ValueError("Invalid flavor '%s', must be one of %s"
+                             % (self.config['flavor'], sorted(FLAVORS)))
+        self.flavor = self.config['flavor']
+        self.user = getpass.getuser()
+        self.host = socket.gethostname()
+        self._time = time.time
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.statedir, 'scheduler.sqlite'), timeout=60,
+            check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'name TEXT, script TEXT, workdir TEXT, '
+                'stdout TEXT, stderr TEXT, state TEXT, fail INTEGER, '
+                'submit_time REAL, start_time REAL, end_time REAL, '
+                'exit_code INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS jobs_state '
+                             'ON jobs (state)')
+
+    def close(self):
+        """Close the connection to the state database"""
+        with self._lock:
+            self._db.close()
+
+    def _random(self, job_id, salt):
+        """Return a random number in [0, 1) for the given job, reproducible
+        for a configured `seed`"""
+        if self.config['seed'] is None:
+            return random.random()
+        return random.Random(
+            "%s:%s:%d" % (self.config['seed'], salt, job_id)).random()
+
+    def _parse_headers(self, script):
+        """Return a dict with the job name, stdout, and stderr files defined
+        in the resource headers of the given `script`"""
+        prefix, options = _HEADER_OPTIONS[self.flavor]
+        result = {}
+        for line in script.splitlines():
+            if not line.startswith(prefix):
+                continue
+            try:
+                tokens = shlex.split(line[len(prefix):])
+            except ValueError:
+                continue
+            if len(tokens) == 0:
+                continue
+            if '=' in tokens[0] and tokens[0].startswith('--'):
+                tokens = tokens[0].split('=', 1) + tokens[1:]
+            for (key, names) in options.items():
+                if tokens[0] in names and len(tokens) > 1:
+                    result[key] = tokens[1]
+        return result
+
+    def submit(self, script, workdir):
+        """Submit the job `script` (the contents of a job script), to be run
+        in `workdir`, and return the job ID, or None if the submission was
+        rejected"""
+        headers = self._parse_headers(script)
+        now = self._time()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO jobs (name, script, workdir, stdout, stderr, '
+                'state, fail, submit_time) VALUES (?, ?, ?, ?, ?, ?, 0, ?)',
+                (headers.get('name', 'job'), script, workdir,
+                 headers.get('stdout'), headers.get('stderr'), PENDING, now))
+            job_id = cursor.lastrowid
+            if self._random(job_id, 'submit') \
+                    < self.config['submit_failure_rate']:
+                self._db.execute('UPDATE jobs SET state = ? WHERE job_id = ?',
+                                 (REJECTED, job_id))
+                return None
+            fail = self._random(job_id, 'fail') < self.config['failure_rate']
+            start_time = end_time = None
+            if self.config['run_time'] is not None:
+                # simulated jobs: the timeline is fixed at submission
+                start_time = now + self.config['queue_delay']
+                end_time = start_time + self.config['run_time']
+            self._db.execute(
+                'UPDATE jobs SET fail = ?, start_time = ?, end_time = ? '
+                'WHERE job_id = ?', (int(fail), start_time, end_time, job_id))
+        return job_id
+
+    def _state(self, state, fail, start_time, end_time, now):
+        """Return the current state of a job, based on the given values of the
+        columns in the database"""
+        if state in _ACTIVE and self.config['run_time'] is not None:
+            if now < start_time:
+                return PENDING
+            elif now < end_time:
+                return RUNNING
+            elif fail:
+                return FAILED
+            else:
+                return COMPLETED
+        return state
+
+    def jobs(self, job_ids=None):
+        """Return a list of dicts describing the jobs with the given
+        `job_ids` (all jobs if None), with keys 'job_id', 'name', and
+        'state'"""
+        now = self._time()
+        sql = ('SELECT job_id, name, state, fail, start_time, end_time '
+               'FROM jobs WHERE state != ?')
+        params = [REJECTED, ]
+        if job_ids is not None:
+            job_ids = [int(job_id) for job_id in job_ids]
+            if len(job_ids) == 0:
+                return []
+            if len(job_ids) <= 500:
+                sql += ' AND job_id IN (%s)' % ','.join('?' * len(job_ids))
+                params += job_ids
+        sql += ' ORDER BY job_id'
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        result = []
+        wanted = None if job_ids is None else set(job_ids)
+        for (job_id, name, state, fail, start_time, end_time) in rows:
+            if wanted is not None and job_id not in wanted:
+                continue
+            result.append({
+                'job_id': job_id, 'name': name,
+                'state': self._state(state, fail, start_time, end_time, now)})
+        return result
+
+    def cancel(self, job_ids):
+        """Cancel all pending or running jobs in `job_ids`, and return the
+        list of job IDs that were cancelled"""
+        cancelled = []
+        for job in self.jobs(job_ids):
+            if job['state'] in _ACTIVE:
+                cancelled.append(job['job_id'])
+        if len(cancelled) > 0:
+            with self._lock:
+                self._db.executemany(
+                    'UPDATE jobs SET state = ?, end_time = ? WHERE job_id = ?',
+                    [(CANCELLED, self._time(), job_id)
+                     for job_id in cancelled])
+        return cancelled
+
+    def _claim(self):
+        """Mark the oldest pending job that is past its queue delay as
+        running, and return its database row (or None if there is no such
+        job)"""
+        now = self._time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT job_id, name, script, workdir, stdout, stderr, '
+                    'fail FROM jobs WHERE state = ? AND submit_time <= ? '
+                    'ORDER BY job_id LIMIT 1',
+                    (PENDING, now - self.config['queue_delay'])).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        'UPDATE jobs SET state = ?, start_time = ? '
+                        'WHERE job_id = ?', (RUNNING, now, row[0]))
+            finally:
+                self._db.execute('COMMIT')
+        return row
+
+    def _finish(self, job_id, exit_code):
+        """Record that the job with the given `job_id` has finished with
+        `exit_code`, unless it was cancelled"""
+        state = COMPLETED if exit_code == 0 else FAILED
+        with self._lock:
+            self._db.execute(
+                'UPDATE jobs SET state = ?, end_time = ?, exit_code = ? '
+                'WHERE job_id = ? AND state = ?',
+                (state, self._time(), exit_code, job_id, RUNNING))
+
+    def _is_cancelled(self, job_id):
+        with self._lock:
+            row = self._db.execute('SELECT state FROM jobs WHERE job_id = ?',
+                                   (job_id, )).fetchone()
+        return row is not None and row[0] == CANCELLED
+
+    def _execute(self, row, poll_interval=0.1):
+        """Run the job described by the database `row` (as returned by
+        :meth:`_claim`) and return its exit code"""
+        (job_id, name, script, workdir, stdout, stderr, fail) = row
+        if fail:
+            return 1
+        jobdir = os.path.join(self.statedir, 'jobs')
+        if not os.path.isdir(jobdir):
+            os.makedirs(jobdir)
+        scriptfile = os.path.join(jobdir, '%d.sh' % job_id)
+        nodefile = os.path.join(jobdir, '%d.nodes' % job_id)
+        with open(scriptfile, 'w') as out_fh:
+            out_fh.write(script)
+        with open(nodefile, 'w') as out_fh:
+            out_fh.write(self.host + "\n")
+        os.chmod(scriptfile, os.stat(scriptfile).st_mode | stat.S_IXUSR)
+        env = dict(os.environ)
+        for (key, val) in _JOB_ENV[self.flavor].items():
+            env[key] = val.format(job_id=job_id, workdir=workdir,
+                                  host=self.host, name=name,
+                                  nodefile=nodefile)
+        if stdout is None:
+            stdout = '%s.o%d' % (name, job_id)
+        stdout_fh = open(os.path.join(workdir, stdout), 'w')
+        if stderr is None or stderr == stdout:
+            stderr_fh = None
+        else:
+            stderr_fh = open(os.path.join(workdir, stderr), 'w')
+        try:
+            # another worker may fork while the script file is still open
+            cmd = interpreter_cmd(scriptfile, script)
+            proc = sp.Popen(cmd, cwd=workdir, env=env, stdout=stdout_fh,
+                            stderr=sp.STDOUT if stderr_fh is None
+                            else stderr_fh)
+            while proc.poll() is None:
+                time.sleep(poll_interval)
+                if self._is_cancelled(job_id):
+                    proc.kill()
+                    proc.wait()
+                    break
+            return proc.returncode
+        finally:
+            stdout_fh.close()
+            if stderr_fh is not None:
+                stderr_fh.close()
+            os.unlink(scriptfile)
+            os.unlink(nodefile)
+
+    def serve(self, workers=None, poll_interval=0.1, stop=None):
+        """Execute pending jobs through a pool of `workers` threads (default:
+        number of cores), until the :class:`threading.Event` `stop` is set
+        (forever, if `stop` is None). Every worker runs one job script at a
+        time, as a subprocess"""
+        if self.config['run_time'] is not None:
+            raise ValueError("Jobs are simulated (run_time is set), so there "
+                             "is nothing to execute")
+        if workers is None:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        if stop is None:
+            stop = threading.Event()
+
+        def worker():
+            while not stop.is_set():
+                row = self._claim()
+                if row is None:
+                    stop.wait(poll_interval)
+                    continue
+                try:
+                    exit_code = self._execute(row, poll_interval)
+                except (OSError, IOError):
+                    exit_code = 127
+                self._finish(row[0], exit_code)
+
+        threads = [threading.Thread(target=worker) for i in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while any([thread.is_alive() for thread in threads]):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def command(self, args, stdin='', workdir='.'):
+        """Run the scheduler command with the given `args` (the list of
+        command line arguments, starting with the name of the command), and
+        return a tuple of the exit code and the output of the command.
+        `stdin` is the input of the command, and `workdir` the directory from
+        which it is run."""
+        name = os.path.basename(args[0])
+        if name not in FLAVORS[self.flavor]:
+            return (127, "%s: command not found\n" % name)
+        if name.startswith('l'): # LPBS
+            name = name[1:]
+        handler = getattr(self, '_cmd_%s' % name)
+        return handler(args[1:], stdin, os.path.abspath(workdir))
+
+    def run_cmd(self, cmd, remote, rootdir='', workdir='',
+                ignore_exit_code=False, ssh='ssh', agent=False):
+        """Drop-in replacement for :func:`clusterjob.utils.run_cmd` that runs
+        all scheduler commands in-process (requires ``remote=None``). Any
+        other command is passed to :func:`~clusterjob.utils.run_cmd`."""
+        if remote is not None:
+            raise ValueError("The emulated scheduler must be used with "
+                             "remote=None")
+        workdir = os.path.expanduser(os.path.join(rootdir, workdir))
+        if workdir == '':
+            workdir = '.'
+        if isinstance(cmd, (list, tuple)):
+            args = list(cmd)
+            stdin = ''
+        else:
+            args = shlex.split(cmd)
+            stdin = ''
+            if '<' in args: # e.g. bsub < "job.lsf"
+                i = args.index('<')
+                with open(os.path.join(workdir, args[i+1])) as in_fh:
+                    stdin = in_fh.read()
+                args = args[:i] + args[i+2:]
+        if len(args) == 0 \
+                or os.path.basename(args[0]) not in FLAVORS[self.flavor]:
+            return run_cmd(cmd, remote, '', workdir, ignore_exit_code, ssh,
+                           agent)
+        (exit_code, response) = self.command(args, stdin, workdir)
+        if exit_code != 0 and not ignore_exit_code:
+            raise sp.CalledProcessError(exit_code, cmd, output=response)
+        return response
+
+    def _read_script(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(args)
+        if len(positional) > 0:
+            with open(os.path.join(workdir, positional[-1])) as in_fh:
+                return in_fh.read()
+        return stdin
+
+    # SLURM
+
+    def _cmd_sbatch(self, args, stdin, workdir):
+        job_id = self.submit(self._read_script(args, stdin, workdir), workdir)
+        if job_id is None:
+            return (1, "sbatch: error: Batch job submission failed: "
+                       "Resource temporarily unavailable\n")
+        return (0, "Submitted batch job %d\n" % job_id)
+
+    def _cmd_squeue(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(
+            args, flags=['-h', '--noheader'],
+            options=['-o', '--format', '-j', '--jobs', '-u', '--user'])
+        fmt = opts.get('-o', opts.get('--format', '%i %j %u %T'))
+        job_ids = opts.get('-j', opts.get('--jobs'))
+        if job_ids is not None:
+            job_ids = _job_ids([job_ids, ])
+        lines = []
+        if '-h' not in opts and '--noheader' not in opts:
+            lines.append(self._slurm_format(fmt, None))
+        for job in self.jobs(job_ids):
+            if job['state'] in _ACTIVE:
+                lines.append(self._slurm_format(fmt, job))
+        return (0, "".join([line + "\n" for line in lines]))
+
+    def _slurm_format(self, fmt, job):
+        """Render the squeue format string `fmt` for the given `job` (or the
+        header, if `job` is None)"""
+        fields = {'i': 'JOBID', 'j': 'NAME', 'u': 'USER', 'T': 'STATE'}
+        if job is not None:
+            fields = {'i': str(job['job_id']), 'j': job['name'],
+                      'u': self.user, 'T': job['state']}
+        return re.sub(r'%\.?\d*([a-zA-Z])',
+                      lambda m: fields.get(m.group(1), ''), fmt)
+
+    def _cmd_sacct(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(
+            args, flags=['-n', '--noheader', '-X', '--allocations', '-P',
+                         '--parsable2'],
+            options=['--format', '-o', '-j', '--jobs'])
+        fields = opts.get('--format', opts.get('-o', 'jobid,jobname,state'))
+        fields = [field.lower() for field in fields.split(',')]
+        job_ids = opts.get('-j', opts.get('--jobs'))
+        if job_ids is not None:
+            job_ids = _job_ids([job_ids, ])
+        parsable = ('-P' in opts or '--parsable2' in opts)
+        rows = []
+        if '-n' not in opts and '--noheader' not in opts:
+            rows.append([field.capitalize() for field in fields])
+        for job in self.jobs(job_ids):
+            values = {'jobid': str(job['job_id']), 'jobname': job['name'],
+                      'state': job['state'], 'user': self.user}
+            rows.append([values.get(field, '') for field in fields])
+        if parsable:
+            lines = ["|".join(row) for row in rows]
+        else:
+            lines = [" ".join(["%10s" % val for val in row]) + " "
+                     for row in rows]
+        return (0, "".join([line + "\n" for line in lines]))
+
+    def _cmd_scancel(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(args)
+        self.cancel(_job_ids(positional))
+        return (0, "")
+
+    # PBS/PBSPro/LPBS/SGE
+
+    def _cmd_qsub(self, args, stdin, workdir):
+        script = self._read_script(args, stdin, workdir)
+        job_id = self.submit(script, workdir)
+        if self.flavor == 'sge':
+            if job_id is None:
+                return (1, "Unable to run job: job rejected\n")
+            name = self._parse_headers(script).get('name', 'job')
+            return (0, 'Your job %d ("%s") has been submitted\n'
+                       % (job_id, name))
+        if job_id is None:
+            return (1, "qsub: Job rejected by all possible destinations\n")
+        return (0, "%d.emulator\n" % job_id)
+
+    def _cmd_qstat(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(args, flags=['-x', '-t', '-f'],
+                                         options=['-j', '-u'])
+        if self.flavor == 'sge':
+            return self._sge_qstat(opts, positional)
+        job_ids = _job_ids(positional)
+        finished = ('-x' in opts)
+        jobs = dict([(job['job_id'], job) for job in self.jobs(job_ids)])
+        lines = []
+        unknown = []
+        for job_id in job_ids:
+            job = jobs.get(job_id)
+            if job is None or (job['state'] not in _ACTIVE and not finished):
+                unknown.append("qstat: Unknown Job Id %d.emulator" % job_id)
+                continue
+            if len(lines) == 0:
+                lines = [
+                    "Job id                    Name             User"
+                    "            Time Use S Queue",
+                    "------------------------- ---------------- ------------"
+                    "--- -------- - -----"]
+            lines.append("%-25s %-16s %-15s %8s %s %s" % (
+                "%d.emulator" % job_id,
+                re.sub(r'\s', '_', job['name'])[:16], self.user[:15],
+                "00:00:00", _PBS_STATES[job['state']], 'batch'))
+        return (0 if len(unknown) == 0 else 153,
+                "".join([line + "\n" for line in unknown + lines]))
+
+    def _sge_qstat(self, opts, positional):
+        if '-j' not in opts:
+            return (0, "")
+        job_ids = _job_ids([opts['-j'], ])
+        active = [job for job in self.jobs(job_ids)
+                  if job['state'] in _ACTIVE]
+        if len(active) == 0:
+            return (1, "Following jobs do not exist: \n%s\n"
+                       % ", ".join([str(job_id) for job_id in job_ids]))
+        lines = []
+        for job in active:
+            lines += ["=" * 62,
+                      "job_number:                 %d" % job['job_id'],
+                      "owner:                      %s" % self.user,
+                      "job_name:                   %s" % job['name']]
+        return (0, "".join([line + "\n" for line in lines]))
+
+    def _cmd_qdel(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(args)
+        job_ids = _job_ids(positional)
+        cancelled = self.cancel(job_ids)
+        if self.flavor == 'sge':
+            return (0, "".join(["%s has registered the job %d for deletion\n"
+                                % (self.user, job_id)
+                                for job_id in cancelled]))
+        return (0, "")
+
+    # LSF
+
+    def _cmd_bsub(self, args, stdin, workdir):
+        job_id = self.submit(self._read_script(args, stdin, workdir), workdir)
+        if job_id is None:
+            return (255, "Request aborted by esub. Job not submitted.\n")
+        return (0, "Job <%d> is submitted to default queue <normal>.\n"
+                   % job_id)
+
+    def _cmd_bjobs(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(args, flags=['-a', '-w'])
+        job_ids = _job_ids(positional)
+        if len(job_ids) == 0:
+            jobs = [job for job in self.jobs()
+                    if job['state'] in _ACTIVE or '-a' in opts]
+        else:
+            jobs = self.jobs(job_ids)
+        lines = []
+        found = set()
+        for job in jobs:
+            if len(lines) == 0:
+                lines.append("%-7s %-7s %-5s %-10s %-11s %-11s %s"
+                             % ('JOBID', 'USER', 'STAT', 'QUEUE',
+                                'FROM_HOST', 'EXEC_HOST', 'JOB_NAME'))
+            found.add(job['job_id'])
+            exec_host = '' if job['state'] == PENDING else self.host[:11]
+            lines.append("%-7d %-7s %-5s %-10s %-11s %-11s %s"
+                         % (job['job_id'], self.user[:7],
+                            _LSF_STATES[job['state']], 'normal',
+                            self.host[:11], exec_host, job['name']))
+        lines += ["Job <%d> is not found" % job_id for job_id in job_ids
+                  if job_id not in found]
+        return (0, "".join([line + "\n" for line in lines]))
+
+    def _cmd_bkill(self, args, stdin, workdir):
+        (opts, positional) = _parse_args(args)
+        job_ids = _job_ids(positional)
+        cancelled = self.cancel(job_ids)
+        lines = []
+        for job_id in job_ids:
+            if job_id in cancelled:
+                lines.append("Job <%d> is being terminated" % job_id)
+            else:
+                lines.append("Job <%d>: Job has already finished" % job_id)
+        return (0, "".join([line + "\n" for line in lines]))
+
+
+def install(bindir, statedir, **config):
+    """Write wrapper executables for the commands of the emulated scheduler
+    to the folder `bindir`, for the scheduler in `statedir`. All other
+    keyword arguments are configuration options for :class:`Emulator`.
+    Return the :class:`Emulator` instance.
+
+    Putting `bindir` at the front of the ``$PATH`` directs all submissions
+    with ``remote=None`` to the emulated scheduler.
+    """
+    emulator = Emulator(statedir, **config)
+    bindir = os.path.abspath(os.path.expanduser(bindir))
+    if not os.path.isdir(bindir):
+        os.makedirs(bindir)
+    pythonpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in FLAVORS[emulator.flavor]:
+        filename = os.path.join(bindir, name)
+        with open(filename, 'w') as out_fh:
+            out_fh.write("#!/bin/sh\n")
+            out_fh.write('PYTHONPATH="%s:$PYTHONPATH" exec "%s" -m '
+                         'clusterjob.emulator "%s" %s "$@"\n'
+                         % (pythonpath, sys.executable, emulator.statedir,
+                            name))
+        os.chmod(filename, os.stat(filename).st_mode
+                 | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return emulator
+
+
+def main(argv=None):
+    """Run a command of the emulated scheduler. The arguments `argv` are the
+    state directory, followed by the command line of the scheduler command,
+    e.g.::
+
+        python -m clusterjob.emulator ~/.emulator squeue -h -j 1234
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) < 2:
+        print("Usage: python -m clusterjob.emulator STATEDIR COMMAND "
+              "[ARGS...]", file=sys.stderr)
+        return 2
+    stdin = ''
+    if os.path.basename(argv[1]) in ('bsub', ) and not sys.stdin.isatty():
+        stdin = sys.stdin.read()
+    emulator = Emulator(argv[0])
+    try:
+        (exit_code, response) = emulator.command(argv[1:], stdin=stdin,
+                                                 workdir=os.getcwd())
+    finally:
+        emulator.close()
+    if sys.version_info < (3, 0):
+        response = response.encode(CMD_RESPONSE_ENCODING)
+    sys.stdout.write(response)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Background execution of epilogue scripts
+
+The epilogue of a job (typically an ``rsync`` that copies the results from
+the cluster) is run the first time the job is known to have finished. By
+default, it runs synchronously, inside :attr:`AsyncResult.status
+<clusterjob.AsyncResult.status>` or :func:`~clusterjob.poll_many`. Thus,
+polling a batch of finished jobs would stall while all the transfers run one
+after another.
+
+If the `epilogue_workers` attribute of a :class:`~clusterjob.JobScript` is
+larger than zero, the epilogue is instead handed to the module-level
+:data:`epilogue_executor`, which runs it in a background thread, with at most
+`epilogue_workers` epilogues running at the same time for any remote. A
+failing epilogue is retried up to `epilogue_retries` times, waiting
+`epilogue_backoff` seconds before the first retry, and twice as long before
+every further retry.
+
+The state of the epilogue is recorded in the :attr:`epilogue_state
+<clusterjob.AsyncResult.epilogue_state>` attribute of the
+:class:`~clusterjob.AsyncResult`, and written to the cache: 'pending' while
+the epilogue is waiting or running, and 'done' or 'failed' afterwards. An
+epilogue that was still pending when the Python process ended is dispatched
+again when the result is loaded from the cache. :meth:`AsyncResult.get
+<clusterjob.AsyncResult.get>` waits for a pending epilogue to finish, unless
+called with ``wait_epilogue=False``.
+"""
+from __future__ import absolute_import
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+__all__ = ['EpilogueExecutor', 'epilogue_executor']
+
+
+class EpilogueExecutor(object):
+    """Pool of background threads that run the epilogues of
+    :class:`~clusterjob.AsyncResult` instances, with a separate limit for the
+    number of concurrent epilogues for every remote. Threads are only started
+    while there are epilogues to run. The instance may be shared between
+    threads.
+    """
+
+    _sleep = staticmethod(time.sleep) # for easy mocking
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queues = OrderedDict() # remote => deque of AsyncResults
+        self._max_workers = {} # remote => int
+        self._n_workers = {} # remote => int
+        self._keys = set() # keys of queued or running results
+        # key => other instances of the same result, which are updated when
+        # the epilogue for the key has finished
+        self._followers = {}
+
+    @staticmethod
+    def _key(run):
+        """Return a key that identifies `run`, also if the same result was
+        loaded from the cache more than once"""
+        if run.cache_file is not None:
+            return ('file', run.cache_file)
+        elif run.cache_key is not None:
+            return ('store', run.cache_key)
+        return ('id', id(run))
+
+    def submit(self, run):
+        """Queue the epilogue of the given :class:`~clusterjob.AsyncResult`
+        `run`, using up to `run.epilogue_workers` threads for its remote.
+        Return False if the epilogue of `run` (or of another instance loaded
+        from the same cache) is already queued or running, True otherwise."""
+        key = self._key(run)
+        with self._condition:
+            if key in self._keys:
+                self._followers.setdefault(key, []).append(run)
+                return False
+            self._keys.add(key)
+            remote = run.remote
+            queue = self._queues.setdefault(remote, deque())
+            queue.append((key, run))
+            self._max_workers[remote] = max(1, int(run.epilogue_workers))
+            n_workers = self._n_workers.get(remote, 0)
+            if n_workers < min(self._max_workers[remote], len(queue)):
+                self._n_workers[remote] = n_workers + 1
+                thread = threading.Thread(target=self._work, args=(remote, ))
+                thread.daemon = True
+                thread.start()
+        return True
+
+    def _work(self, remote):
+        """Main loop of a worker thread for the given `remote`"""
+        while True:
+            with self._condition:
+                queue = self._queues[remote]
+                if len(queue) == 0 \
+                        or self._n_workers[remote] > self._max_workers[remote]:
+                    self._n_workers[remote] -= 1
+                    self._condition.notify_all()
+                    return
+                (key, run) = queue.popleft()
+            try:
+                self._run(run)
+            finally:
+                with self._condition:
+                    self._keys.discard(key)
+                    for follower in self._followers.pop(key, []):
+                        follower.epilogue_state = run.epilogue_state
+                        follower._epilogue_done.set()
+                    self._condition.notify_all()
+
+    def _run(self, run):
+        """Run the epilogue of `run`, with retries, and record the result"""
+        logger = logging.getLogger(__name__)
+        retries = int(run.epilogue_retries)
+        delay = float(run.epilogue_backoff)
+        for attempt in range(retries + 1):
+            try:
+                run.run_epilogue()
+                run.epilogue_state = 'done'
+                break
+            except Exception as exc_info:
+                if attempt < retries:
+                    logger.warning("Epilogue of job %s failed (%s), retrying "
+                                   "in %s seconds", run.job_id, exc_info,
+                                   delay)
+                    self._sleep(delay)
+                    delay *= 2
+                else:
+                    logger.error("Epilogue of job %s failed: %s",
+                                 run.job_id, exc_info)
+                    run.epilogue_state = 'failed'
+        try:
+            run.dump()
+        finally:
+            run._epilogue_done.set()
+
+    @property
+    def pending(self):
+        """Number of epilogues that are queued or running"""
+        with self._condition:
+            return len(self._keys)
+
+    def join(self, timeout=None):
+        """Wait until all queued epilogues have finished, or until `timeout`
+        seconds pass. Return True if no epilogue is pending."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._condition:
+            while len(self._keys) > 0:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            return True
+
+
+#: The executor that runs all background epilogues
+epilogue_executor = EpilogueExecutor()
@@ -0,0 +1,232 @@
+"""Marker files through which jobs report their own status
+
+If the `status_markers` attribute of a :class:`~clusterjob.JobScript` is True,
+the rendered job script writes a small marker file when the job starts and
+when it exits (including when it is terminated by a signal). The markers are
+written to the folder ``.clusterjob`` inside the job's work directory, with the
+job ID as the file name. Each marker consists of a single line containing the
+job state (``RUNNING``, ``COMPLETED``, or ``FAILED``), the exit code of the job
+script (``-`` while running), and a Unix timestamp. For example::
+
+    COMPLETED 0 1467372014
+
+:attr:`AsyncResult.status <clusterjob.AsyncResult.status>` and
+:func:`~clusterjob.poll_many` then obtain the status of the job from the
+markers, without any query to the scheduler: locally, by scanning the marker
+folder, and for a remote, through a single ``ssh`` command that prints all the
+markers in the marker folders of the polled jobs. The scheduler is only
+queried for jobs that have no marker after a grace period (the `marker_grace`
+attribute), e.g. because they are still waiting in the queue, or because the
+job was killed without a chance to write its final marker. Once the final
+status of a job has been read from its marker, the marker is removed, so that
+the marker folders do not grow with the number of finished jobs.
+
+The marker code requires a Bourne-compatible `shell`, and the job script must
+not set its own ``EXIT`` trap. Markers are not used for job arrays.
+"""
+from __future__ import absolute_import
+import os
+import time
+
+from .status import RUNNING, COMPLETED, FAILED
+from .utils import quote
+
+__all__ = ['MARKER_FOLDER', 'marker_script', 'parse_marker',
+           'read_markers', 'cmd_list_markers', 'parse_marker_listing',
+           'remove_markers', 'cmd_remove_markers', 'marker_status']
+
+#: Name of the folder (inside the job's work directory) that contains the
+#: marker files
+MARKER_FOLDER = '.clusterjob'
+
+_STATES = {'RUNNING': RUNNING, 'COMPLETED': COMPLETED, 'FAILED': FAILED}
+
+_MARKER_SCRIPT = r'''# clusterjob status marker
+_clusterjob_marker="$CLUSTERJOB_WORKDIR/%(folder)s/$CLUSTERJOB_ID"
+_clusterjob_mark() {
+    mkdir -p "$CLUSTERJOB_WORKDIR/%(folder)s"
+    echo "$1 $2 `date +%%s`" > "$_clusterjob_marker.tmp"
+    mv -f "$_clusterjob_marker.tmp" "$_clusterjob_marker"
+}
+_clusterjob_exit() {
+    _clusterjob_exit_code=$?
+    if [ "$_clusterjob_exit_code" -eq 0 ]; then
+        _clusterjob_mark COMPLETED 0
+    else
+        _clusterjob_mark FAILED "$_clusterjob_exit_code"
+    fi
+}
+trap _clusterjob_exit EXIT
+trap 'exit 129' HUP
+trap 'exit 130' INT
+trap 'exit 143' TERM
+_clusterjob_mark RUNNING -''' % {'folder': MARKER_FOLDER}
+
+
+def marker_script(backend):
+    """Return the lines of shell code that make a job script write its status
+    markers, with the core environment variables replaced for the given
+    `backend`"""
+    return backend.replace_body_vars(_MARKER_SCRIPT).split("\n")
+
+
+def parse_marker(text):
+    """Parse the content of a marker file into a tuple ``(status, exit_code,
+    timestamp)``, where `status` is one of the codes in
+    :mod:`clusterjob.status` and `exit_code` is None while the job is running.
+    Return None if `text` is not a valid (complete) marker.
+
+    >>> parse_marker("COMPLETED 0 1467372014\\n") == (0, 0, 1467372014)
+    True
+    >>> parse_marker("RUNNING - 1467372014") == (-1, None, 1467372014)
+    True
+    >>> print(parse_marker("RUNNING"))
+    None
+    """
+    fields = text.split()
+    if len(fields) != 3 or fields[0] not in _STATES:
+        return None
+    try:
+        exit_code = None if fields[1] == '-' else int(fields[1])
+        return (_STATES[fields[0]], exit_code, int(fields[2]))
+    except ValueError:
+        return None
+
+
+def _scandir(folder):
+    """Return a list of (name, path) tuples for the files in `folder`"""
+    try:
+        return [(entry.name, entry.path) for entry in os.scandir(folder)
+                if entry.is_file()]
+    except AttributeError:  # Python < 3.5
+        return [(name, os.path.join(folder, name))
+                for name in os.listdir(folder)]
+
+
+def _add_short_names(markers):
+    """Make every marker whose name has the form ``<job_id>.<server>`` (e.g.
+    ``$PBS_JOBID``) also available under ``<job_id>``, as the ID reported on
+    submission may lack the server name"""
+    for name in list(markers):
+        if '.' in name:
+            markers.setdefault(name.split('.')[0], markers[name])
+    return markers
+
+
+def read_markers(folder):
+    """Return a dict mapping job IDs to parsed markers (see
+    :func:`parse_marker`) for all valid marker files in the local `folder`"""
+    markers = {}
+    try:
+        files = _scandir(os.path.expanduser(folder))
+    except OSError:  # folder does not exist (yet)
+        return markers
+    for (name, path) in files:
+        if name.endswith('.tmp'):
+            continue
+        try:
+            with open(path) as in_fh:
+                marker = parse_marker(in_fh.read())
+        except (OSError, IOError):
+            continue
+        if marker is not None:
+            markers[name] = marker
+    return _add_short_names(markers)
+
+
+def cmd_list_markers(folders):
+    """Return a shell command that prints the contents of all marker files in
+    the given marker `folders` (relative to the working directory in which
+    the command is run), every line prefixed with the path of the file (see
+    :func:`parse_marker_listing`)
+
+    >>> print(cmd_list_markers(['a/.clusterjob', 'my run/.clusterjob']))
+    grep -s -H '' a/.clusterjob/* 'my run/.clusterjob'/*
+    """
+    return "grep -s -H '' %s" % " ".join(
+        [quote(folder) + '/*' for folder in folders])
+
+
+def parse_marker_listing(response):
+    """Given the output of the command returned by :func:`cmd_list_markers`,
+    return a dict mapping the path of every marker folder (relative to the
+    folder in which the command was run) to a dict of markers, as returned by
+    :func:`read_markers`
+
+    >>> listing = parse_marker_listing(
+    ...     "run1/.clusterjob/1.server:COMPLETED 0 1467372014\\n")
+    >>> listing['run1/.clusterjob']['1'] == (0, 0, 1467372014)
+    True
+    """
+    result = {}
+    for line in response.split("\n"):
+        (path, __, text) = line.rpartition(":")
+        marker = parse_marker(text)
+        if marker is None or path.endswith('.tmp'):
+            continue
+        (folder, name) = os.path.split(path)
+        result.setdefault(os.path.normpath(folder), {})[name] = marker
+    for markers in result.values():
+        _add_short_names(markers)
+    return result
+
+
+def _is_marker_of(name, job_id):
+    """Return True if `name` is the name of a marker file (or a temporary
+    marker file) for the job with the given `job_id`"""
+    return name == job_id or name.startswith(job_id + '.')
+
+
+def remove_markers(folder, job_ids):
+    """Remove the marker files of all jobs with the given `job_ids` from the
+    local `folder`"""
+    job_ids = [str(job_id) for job_id in job_ids]
+    try:
+        files = _scandir(os.path.expanduser(folder))
+    except OSError:
+        return
+    for (name, path) in files:
+        if any([_is_marker_of(name, job_id) for job_id in job_ids]):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def cmd_remove_markers(markers):
+    """Return a shell command that removes the marker files for the given list
+    of tuples ``(folder, job_id)``, where `folder` is a marker folder relative
+    to the working directory in which the command is run
+
+    >>> print(cmd_remove_markers([('a/.clusterjob', 1)]))
+    rm -f a/.clusterjob/1 a/.clusterjob/1.*
+    """
+    paths = [quote(os.path.join(folder, str(job_id)))
+             for (folder, job_id) in markers]
+    return "rm -f %s" % " ".join(
+        ["%s %s.*" % (path, path) for path in paths])
+
+
+def marker_status(markers, run, now=None):
+    """Return the status of the :class:`~clusterjob.AsyncResult` `run`
+    according to the dict of `markers` for its marker folder, or None if the
+    scheduler must be queried instead.
+
+    The marker for the job is looked up by its job ID. A job without a marker
+    is assumed to be still pending until the grace period since the
+    submission has passed. A running job is trusted to be running until its
+    walltime plus the grace period has passed.
+    """
+    if now is None:
+        now = time.time()
+    marker = markers.get(str(run.job_id))
+    if marker is None:
+        if run.submitted is not None \
+                and now - run.submitted < run.marker_grace:
+            return run._status
+        return None
+    (status, __, timestamp) = marker
+    if status == RUNNING and run.walltime is not None:
+        if now - timestamp > run.walltime + run.marker_grace:
+            return None
+    return status
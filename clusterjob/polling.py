@@ -0,0 +1,189 @@
+"""Strategies for polling the scheduler while waiting for a job to finish
+
+:meth:`AsyncResult.wait <clusterjob.AsyncResult.wait>` queries the scheduler
+repeatedly until the job has finished. How long to sleep between two queries
+is decided by the :attr:`~clusterjob.AsyncResult.polling` attribute of the
+:class:`~clusterjob.AsyncResult`, an instance of a subclass of
+:class:`PollingStrategy`:
+
+* :class:`BackoffPolling` (the default) starts polling every 5 seconds, and
+  doubles the interval after every query, up to the
+  :attr:`~clusterjob.AsyncResult.max_sleep_interval` of the job. Whenever the
+  status of the job changes, the interval is reset.
+* :class:`AdaptivePolling` predicts when a running job will finish, based on
+  the runtimes of earlier jobs with the same name (see
+  :class:`RuntimeHistory`) or on the requested walltime. It sleeps for a
+  fraction of the predicted remaining runtime, so that the scheduler is
+  queried rarely at the beginning of a long job, and densely close to its
+  expected end.
+
+Example:
+
+    >>> from clusterjob import AsyncResult
+    >>> from clusterjob.polling import AdaptivePolling, BackoffPolling
+    >>> AsyncResult.polling = AdaptivePolling()   # for all jobs
+    >>> AsyncResult.polling = BackoffPolling()    # restore the default
+"""
+from __future__ import absolute_import, division
+import time
+import threading
+from collections import deque
+
+from .status import RUNNING
+
+__all__ = ['PollingStrategy', 'BackoffPolling', 'AdaptivePolling',
+           'RuntimeHistory', 'runtime_history']
+
+
+class RuntimeHistory(object):
+    """Record of the runtimes of completed jobs, by job name
+
+    Arguments:
+        maxlen (int): Number of runtimes to keep for every job name. Older
+            runtimes are discarded.
+
+    The instance may be shared between threads.
+    """
+
+    def __init__(self, maxlen=20):
+        self.maxlen = maxlen
+        self._runtimes = {}
+        self._lock = threading.Lock()
+
+    def record(self, jobname, runtime):
+        """Add the `runtime` (in seconds) of a job with the given `jobname`"""
+        with self._lock:
+            if jobname not in self._runtimes:
+                self._runtimes[jobname] = deque(maxlen=self.maxlen)
+            self._runtimes[jobname].append(float(runtime))
+
+    def predict(self, jobname):
+        """Return the median of the recorded runtimes for `jobname`, or None
+        if no runtimes have been recorded"""
+        with self._lock:
+            runtimes = sorted(self._runtimes.get(jobname, []))
+        if len(runtimes) == 0:
+            return None
+        mid = len(runtimes) // 2
+        if len(runtimes) % 2 == 1:
+            return runtimes[mid]
+        return (runtimes[mid-1] + runtimes[mid]) / 2
+
+    def clear(self):
+        """Forget all recorded runtimes"""
+        with self._lock:
+            self._runtimes.clear()
+
+
+#: The :class:`RuntimeHistory` to which the runtimes of all jobs that
+#: complete successfully are added
+runtime_history = RuntimeHistory()
+
+
+class PollingStrategy(object):
+    """Abstract polling strategy"""
+
+    def interval(self, run, previous, changed):
+        """Return the number of seconds to sleep before querying the status of
+        the given :class:`~clusterjob.AsyncResult` again.
+
+        Arguments:
+            run (clusterjob.AsyncResult): The job that is being waited for.
+                Its status is the one obtained by the most recent query.
+            previous (float or None): The interval returned by the previous
+                call, or None for the first call in a :meth:`wait
+                <clusterjob.AsyncResult.wait>`
+            changed (bool): Whether the status of the job changed with the
+                most recent query
+        """
+        raise NotImplementedError()
+
+
+class BackoffPolling(PollingStrategy):
+    """Exponential backoff
+
+    Arguments:
+        initial (float): The initial interval, in seconds. The interval is
+            doubled after every query (without exceeding the
+            :attr:`~clusterjob.AsyncResult.max_sleep_interval` of the job), and
+            is reset to `initial` whenever the status of the job changes.
+    """
+
+    def __init__(self, initial=5):
+        self.initial = initial
+
+    def interval(self, run, previous, changed):
+        """Return the next interval, see :meth:`PollingStrategy.interval`"""
+        if previous is None or changed:
+            return min(self.initial, run.max_sleep_interval)
+        if 2 * previous <= run.max_sleep_interval:
+            return 2 * previous
+        return previous
+
+
+class AdaptivePolling(PollingStrategy):
+    """Polling based on the predicted end of a running job
+
+    The runtime of a job is predicted as the median runtime of earlier jobs
+    with the same name in `history`, or otherwise, as the walltime requested
+    through the `time` resource. For a running job, the strategy sleeps for
+    the given `fraction` of the predicted remaining runtime (but at least
+    `min_interval`, and no more than the
+    :attr:`~clusterjob.AsyncResult.max_sleep_interval` of the job). Thus, the
+    end of the job is detected with a latency of about `min_interval`, while
+    only a small number of queries (logarithmic in the runtime) is made. Once
+    the predicted end has passed, the interval grows again exponentially,
+    starting from `min_interval`.
+
+    Pending jobs, and jobs for which no prediction can be made, are polled as
+    in `fallback` (by default a :class:`BackoffPolling` instance).
+
+    Arguments:
+        min_interval (float): Shortest interval between two queries
+        fraction (float): Fraction of the predicted remaining runtime to sleep
+        history (RuntimeHistory or None): History of runtimes. If None, use the
+            module-level :data:`runtime_history`.
+        fallback (PollingStrategy or None): Strategy for jobs that are not
+            running or whose runtime cannot be predicted.
+    """
+
+    def __init__(self, min_interval=1, fraction=0.5, history=None,
+                 fallback=None):
+        if not 0 < fraction <= 1:
+            raise ValueError("fraction must be in (0, 1]")
+        self.min_interval = min_interval
+        self.fraction = fraction
+        self.history = history
+        if fallback is None:
+            fallback = BackoffPolling()
+        self.fallback = fallback
+
+    def predicted_runtime(self, run):
+        """Return the predicted runtime of the given
+        :class:`~clusterjob.AsyncResult` in seconds, or None"""
+        history = self.history
+        if history is None:
+            history = runtime_history
+        runtime = None
+        if run.jobname is not None:
+            runtime = history.predict(run.jobname)
+        if runtime is None:
+            runtime = run.walltime
+        return runtime
+
+    def interval(self, run, previous, changed):
+        """Return the next interval, see :meth:`PollingStrategy.interval`"""
+        runtime = None
+        if run._status == RUNNING and run.started is not None:
+            runtime = self.predicted_runtime(run)
+        if runtime is None:
+            return self.fallback.interval(run, previous, changed)
+        remaining = runtime - (time.time() - run.started)
+        if remaining > 0:
+            interval = self.fraction * remaining
+        elif previous is None or changed:
+            interval = self.min_interval
+        else:
+            interval = 2 * previous
+        interval = max(interval, self.min_interval)
+        return min(interval, run.max_sleep_interval)
@@ -0,0 +1,184 @@
+"""Rate limits for the commands sent to the cluster scheduler
+
+Polling a large number of jobs, or submitting many jobs in quick succession,
+can cause a login node to throttle or reject ssh connections, or overload the
+scheduler daemon. To prevent this, the rate of commands for every remote can
+be limited, separately for the following classes of commands:
+
+* ``'submit'``: submission of jobs
+* ``'status'``: queries of the job status
+* ``'cancel'``: cancellation of jobs
+* ``'upload'``: uploading job scripts to the remote (including the creation
+  of the folders for the scripts)
+
+The limits are set through the `submit_rate`, `status_rate`, `cancel_rate`,
+`upload_rate`, and `rate_burst` attributes of :class:`~clusterjob.JobScript`
+(e.g., in the INI file read by :meth:`JobScript.read_defaults
+<clusterjob.JobScript.read_defaults>`). The rates are in commands per second;
+a rate of zero (the default) disables the limit. Every remote/command class
+pair has its own token bucket that holds up to `rate_burst` commands. A command
+for which no token is available waits until the bucket is refilled, instead of
+being sent immediately.
+
+All limits apply within a single process. If several processes share a
+remote, the limit for each process should be the appropriate fraction of the
+total rate that the remote can sustain.
+
+The number of commands that are currently waiting, and the time a new command
+would have to wait, can be obtained from :meth:`RateLimiter.stats` of the
+module-level :data:`rate_limiter`:
+
+    >>> rate_limiter.acquire('cluster', 'status', rate=2)
+    0.0
+    >>> stats = rate_limiter.stats()[('cluster', 'status')]
+    >>> stats['queued'], stats['count']
+    (0, 1)
+    >>> rate_limiter.clear()
+"""
+from __future__ import absolute_import, division
+import time
+import math
+import logging
+import threading
+
+__all__ = ['TokenBucket', 'RateLimiter', 'rate_limiter', 'COMMAND_CLASSES']
+
+#: Classes of commands that are rate-limited separately
+COMMAND_CLASSES = ['submit', 'status', 'cancel', 'upload']
+
+
+class TokenBucket(object):
+    """Token bucket, refilled at a constant rate
+
+    Arguments:
+        rate (float): Number of tokens added per second
+        burst (int): Maximum number of tokens in the bucket
+
+    Tokens are handed out by :meth:`reserve` in the order of the calls. If the
+    bucket is empty, the token is borrowed from the future, and the caller is
+    told how long to wait before using it. The instance may be shared between
+    threads.
+    """
+
+    _clock = staticmethod(time.time) # for easy mocking
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        if burst < 1:
+            raise ValueError("burst must be >= 1")
+        self.rate = float(rate)
+        self.burst = int(burst)
+        self._tokens = float(self.burst)
+        self._updated = self._clock()
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_wait = 0.0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token from the bucket, and return the number of seconds the
+        caller must wait before it may send its command"""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            self.count += 1
+            self.total_wait += wait
+        return wait
+
+    @property
+    def queued(self):
+        """Number of reserved tokens that cannot be used yet"""
+        with self._lock:
+            self._refill()
+            return max(0, int(math.ceil(-self._tokens)))
+
+    @property
+    def wait_time(self):
+        """Number of seconds that a new command would have to wait"""
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self._tokens) / self.rate)
+
+
+class RateLimiter(object):
+    """Collection of :class:`TokenBucket` instances, one for every pair of
+    remote and command class (see :data:`COMMAND_CLASSES`)"""
+
+    _sleep = staticmethod(time.sleep) # for easy mocking
+
+    def __init__(self):
+        self._buckets = {} # (remote, cmd_class) => TokenBucket
+        self._lock = threading.Lock()
+
+    def _bucket(self, remote, cmd_class, rate, burst):
+        """Return the bucket for `remote` and `cmd_class`, adjusted to the
+        given `rate` and `burst`"""
+        if cmd_class not in COMMAND_CLASSES:
+            raise ValueError("Unknown command class %s" % cmd_class)
+        key = (remote, cmd_class)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+                self._buckets[key] = bucket
+            else:
+                bucket.rate = float(rate)
+                bucket.burst = int(burst)
+            return bucket
+
+    def reserve(self, remote, cmd_class, rate, burst=1):
+        """Reserve the right to send a command of class `cmd_class` to
+        `remote`, and return the number of seconds the caller must wait before
+        sending it. If `rate` is zero or None, the command is not limited."""
+        if not rate:
+            return 0.0
+        return self._bucket(remote, cmd_class, rate, burst).reserve()
+
+    def acquire(self, remote, cmd_class, rate, burst=1):
+        """Block until a command of class `cmd_class` may be sent to `remote`,
+        see :meth:`reserve`. Return the number of seconds that were spent
+        waiting."""
+        wait = self.reserve(remote, cmd_class, rate, burst)
+        if wait > 0:
+            logger = logging.getLogger(__name__)
+            logger.debug("Rate limit for %s commands on %s: wait %.2f s",
+                         cmd_class, remote, wait)
+            self._sleep(wait)
+        return wait
+
+    def stats(self):
+        """Return a dict mapping every ``(remote, cmd_class)`` tuple for which
+        commands were limited to a dict with the following keys:
+
+        * ``'rate'``, ``'burst'``: the current limits
+        * ``'queued'``: the number of commands that are currently waiting
+        * ``'wait'``: the number of seconds a new command would have to wait
+        * ``'count'``: the total number of commands
+        * ``'total_wait'``: the total number of seconds spent waiting
+        """
+        with self._lock:
+            buckets = list(self._buckets.items())
+        result = {}
+        for (key, bucket) in buckets:
+            result[key] = {
+                'rate': bucket.rate, 'burst': bucket.burst,
+                'queued': bucket.queued, 'wait': bucket.wait_time,
+                'count': bucket.count, 'total_wait': bucket.total_wait}
+        return result
+
+    def clear(self):
+        """Remove all buckets"""
+        with self._lock:
+            self._buckets.clear()
+
+
+#: The :class:`RateLimiter` used for all commands sent by
+#: :class:`~clusterjob.JobScript` and :class:`~clusterjob.AsyncResult`
+rate_limiter = RateLimiter()
@@ -0,0 +1,227 @@
+"""Batched transfer of input and output files of jobs
+
+Instead of putting ``rsync`` commands into the `prologue` and `epilogue` of
+every job, the files that a job needs and produces can be declared in the
+`stage_in` and `stage_out` attributes of the :class:`~clusterjob.JobScript`,
+as a list of paths relative to the job's `workdir`. The local file
+``workdir/<path>`` corresponds to ``rootdir/workdir/<path>`` on the `remote`.
+Directories are transferred recursively.
+
+The `stage_in` files are uploaded before the job is submitted, and the
+`stage_out` files are downloaded when the job is first seen to have finished
+(before the epilogue runs). Both use ``rsync``, which skips files that are
+unchanged and only transfers the differences of changed files. The transfers
+for all jobs that share a remote and a `rootdir` are coalesced into a single
+``rsync`` command with a ``--files-from`` list: when submitting with
+:meth:`JobScript.submit_many <clusterjob.JobScript.submit_many>`, and when
+polling with :func:`~clusterjob.poll_many` (for jobs whose epilogue runs
+synchronously). If the `stage_compress` attribute is True, data is compressed
+during the transfer (``rsync -z``).
+
+The number of bytes transferred for every job, and the duration of the
+(possibly coalesced) transfer, are recorded in the `stage_in_bytes`,
+`stage_in_time`, `stage_out_bytes`, and `stage_out_time` attributes of the
+:class:`~clusterjob.AsyncResult`.
+"""
+from __future__ import absolute_import
+import os
+import time
+import logging
+import tempfile
+import subprocess as sp
+from collections import OrderedDict
+
+from .utils import CMD_RESPONSE_ENCODING
+
+__all__ = ['stage_paths', 'cmd_rsync', 'parse_rsync_output', 'transfer',
+           'stage_in', 'stage_out']
+
+# exit codes of rsync for a partial transfer (e.g. output files that a failed
+# job did not produce), which are not treated as an error for `stage_out`
+_PARTIAL_TRANSFER = (23, 24)
+
+
+def stage_paths(workdir, files):
+    """Return the paths of the given `files` (relative to `workdir`), relative
+    to the root of the transfer
+
+    >>> stage_paths('run1', ['input.dat', 'data/'])
+    ['run1/input.dat', 'run1/data']
+
+    Raises:
+        ValueError: if any file is not inside `workdir`
+    """
+    paths = []
+    for filename in files:
+        path = os.path.normpath(os.path.join(workdir, filename))
+        if os.path.isabs(filename) or path == '..' \
+                or path.startswith('..' + os.path.sep):
+            raise ValueError("Staged file %s is not inside the workdir %s"
+                             % (filename, workdir))
+        paths.append(path)
+    return paths
+
+
+def _remote_path(remote, rootdir):
+    """Return the rsync location of `rootdir` on `remote`"""
+    if remote is None:
+        return rootdir + '/'
+    return "%s:%s/" % (remote, rootdir)
+
+
+def cmd_rsync(files_from, remote, rootdir, upload=True, compress=False,
+              rsync='rsync', ssh='ssh'):
+    """Return an ``rsync`` command (as a list of arguments) that transfers
+    the paths listed in the file `files_from` from the current working
+    directory to `rootdir` on `remote` (if `upload` is True), or the other way
+    around. For every transferred file, the command prints the number of bytes
+    that were transferred and the path of the file (see
+    :func:`parse_rsync_output`).
+
+    >>> print(" ".join(cmd_rsync('files', 'cluster', 'jobs', upload=False)))
+    rsync -a -r --files-from=files --out-format=%b|%n -e ssh cluster:jobs/ .
+    """
+    cmd = [rsync, '-a', '-r', '--files-from=%s' % files_from,
+           '--out-format=%b|%n']
+    if compress:
+        cmd.append('-z')
+    if remote is not None:
+        cmd.extend(['-e', ssh])
+    if upload:
+        cmd.extend(['.', _remote_path(remote, rootdir)])
+    else:
+        cmd.extend([_remote_path(remote, rootdir), '.'])
+    return cmd
+
+
+def parse_rsync_output(response):
+    """Given the output of the command returned by :func:`cmd_rsync`, return
+    a dict mapping every transferred path to the number of bytes that were
+    transferred for it
+
+    >>> parse_rsync_output("1024|run1/input.dat\\n0|run1/\\n") == {
+    ...     'run1/input.dat': 1024, 'run1': 0}
+    True
+    """
+    result = {}
+    for line in response.splitlines():
+        (transferred, __, path) = line.partition('|')
+        try:
+            result[os.path.normpath(path)] = int(transferred)
+        except ValueError:
+            continue # not an --out-format line
+    return result
+
+
+def _run_rsync(cmd, ignore_codes=()):
+    """Run the local `cmd` and return its output. Raise a
+    :exc:`subprocess.CalledProcessError` if the exit code is neither zero nor
+    in `ignore_codes`"""
+    logger = logging.getLogger(__name__)
+    logger.debug("Running %s", " ".join(cmd))
+    proc = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.STDOUT)
+    output = proc.communicate()[0].decode(CMD_RESPONSE_ENCODING)
+    if proc.returncode in ignore_codes:
+        logger.warning("rsync could not transfer all files:\n%s", output)
+    elif proc.returncode != 0:
+        raise sp.CalledProcessError(proc.returncode, cmd, output)
+    return output
+
+
+def _bytes(paths, transferred):
+    """Return the number of bytes in `transferred` (see
+    :func:`parse_rsync_output`) that belong to any of the given `paths`,
+    including files inside directories"""
+    total = 0
+    for (path, n_bytes) in transferred.items():
+        for prefix in paths:
+            if path == prefix or path.startswith(prefix + '/'):
+                total += n_bytes
+                break
+    return total
+
+
+def transfer(requests, upload=True):
+    """Perform the transfers described by `requests`, coalescing all requests
+    for the same remote and root directory into a single ``rsync`` command.
+
+    Arguments:
+        requests (list): list of tuples ``(remote, rootdir, paths, options)``
+            where `paths` are paths relative to the current working directory
+            (locally) and to `rootdir` (on the `remote`), and `options` is a
+            dict with the keys 'compress', 'rsync', and 'ssh'
+        upload (bool): If True, transfer the files to the remotes, otherwise
+            transfer them from the remotes
+
+    Returns a list of tuples ``(n_bytes, seconds)`` for every request: the
+    number of bytes transferred for the paths in the request, and the
+    duration of the coalesced transfer. Requests without any paths, and
+    transfers of a local folder onto itself, result in ``(0, 0.0)``.
+
+    Raises:
+        subprocess.CalledProcessError: if ``rsync`` fails. For downloads,
+            missing files are not an error.
+    """
+    stats = [(0, 0.0) for request in requests]
+    groups = OrderedDict()
+    for (i, (remote, rootdir, paths, options)) in enumerate(requests):
+        if len(paths) == 0:
+            continue
+        if remote is None \
+                and os.path.abspath(os.path.expanduser(rootdir)) \
+                == os.getcwd():
+            continue
+        key = (remote, rootdir, options['compress'], options['rsync'],
+               options['ssh'])
+        groups.setdefault(key, []).append(i)
+    for ((remote, rootdir, compress, rsync, ssh), indices) in groups.items():
+        paths = OrderedDict()
+        for i in indices:
+            for path in requests[i][2]:
+                paths[path] = True
+        with tempfile.NamedTemporaryFile('w', delete=False) as files_fh:
+            files_fh.write("".join([path + "\n" for path in paths]))
+            files_from = files_fh.name
+        try:
+            if remote is None:
+                rootdir = os.path.expanduser(rootdir)
+            cmd = cmd_rsync(files_from, remote, rootdir, upload=upload,
+                            compress=compress, rsync=rsync, ssh=ssh)
+            start = time.time()
+            if upload:
+                response = _run_rsync(cmd)
+            else:
+                response = _run_rsync(cmd, ignore_codes=_PARTIAL_TRANSFER)
+            seconds = time.time() - start
+        finally:
+            os.unlink(files_from)
+        transferred = parse_rsync_output(response)
+        for i in indices:
+            stats[i] = (_bytes(requests[i][2], transferred), seconds)
+    return stats
+
+
+def stage_in(jobs):
+    """Upload the `stage_in` files of all the given
+    :class:`~clusterjob.JobScript` instances, and return a list of tuples
+    ``(n_bytes, seconds)``, see :func:`transfer`"""
+    return transfer([(job.remote, job.rootdir,
+                      stage_paths(job.workdir, job.stage_in),
+                      {'compress': job.stage_compress, 'rsync': job.rsync,
+                       'ssh': job.ssh})
+                     for job in jobs], upload=True)
+
+
+def stage_out(results):
+    """Download the `stage_out` files of all the given
+    :class:`~clusterjob.AsyncResult` instances, and record the number of
+    transferred bytes and the transfer time in their `stage_out_bytes` and
+    `stage_out_time` attributes"""
+    stats = transfer([(ar.remote, ar.stage_root, ar.stage_out,
+                       {'compress': ar.stage_compress, 'rsync': ar.rsync,
+                        'ssh': ar.ssh})
+                      for ar in results], upload=False)
+    for (ar, (n_bytes, seconds)) in zip(results, stats):
+        ar.stage_out_bytes = n_bytes
+        ar.stage_out_time = seconds
+    return stats
@@ -0,0 +1,168 @@
+"""SQLite-based storage for cached :class:`~clusterjob.AsyncResult` instances
+
+By default, every :class:`~clusterjob.AsyncResult` is cached in its own pickle
+file inside :attr:`JobScript.cache_folder <clusterjob.JobScript>`. If the
+`cache_backend` class attribute of :class:`~clusterjob.JobScript` is set to
+``'sqlite'``, all results are instead stored in a single SQLite database
+``clusterjob.sqlite`` inside the `cache_folder`, through a
+:class:`SqliteJobStore`. This avoids creating (and scanning) a large number of
+small files, and allows to efficiently look up jobs by their cache key, job
+ID, remote, or status.
+"""
+from __future__ import absolute_import
+import os
+import sqlite3
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+__all__ = ['SqliteJobStore', 'get_job_store']
+
+#: Allowed values for :attr:`JobScript.cache_backend <clusterjob.JobScript>`
+CACHE_BACKENDS = ['files', 'sqlite']
+
+_stores = {} # absolute filename => SqliteJobStore
+_stores_lock = threading.Lock()
+
+
+def get_job_store(filename):
+    """Return the :class:`SqliteJobStore` for the database in `filename`.
+    Only one instance is created for every database file."""
+    filename = os.path.abspath(os.path.expanduser(filename))
+    with _stores_lock:
+        if filename not in _stores:
+            _stores[filename] = SqliteJobStore(filename)
+        return _stores[filename]
+
+
+class SqliteJobStore(object):
+    """Store for the data of cached :class:`~clusterjob.AsyncResult`
+    instances, in an SQLite database.
+
+    Every entry is identified by a unique cache key
+    (``<cache_prefix>.<cache_id>``, see :meth:`JobScript.submit
+    <clusterjob.JobScript.submit>`). The data describing the
+    :class:`~clusterjob.AsyncResult` is stored as a pickled dict, as in the
+    cache files written by :meth:`AsyncResult.dump
+    <clusterjob.AsyncResult.dump>`. In addition, the job ID, remote, backend,
+    and status are stored in indexed columns.
+
+    Arguments:
+        filename (str): Name of the database file. It is created if it does not
+            exist.
+
+    Every write happens in its own transaction. The instance may be shared
+    between threads.
+    """
+
+    _schema = [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+               cache_key TEXT PRIMARY KEY,
+               job_id TEXT,
+               remote TEXT,
+               backend TEXT,
+               status INTEGER,
+               data BLOB)''',
+        'CREATE INDEX IF NOT EXISTS jobs_job_id ON jobs (job_id)',
+        'CREATE INDEX IF NOT EXISTS jobs_remote ON jobs (remote)',
+        'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)',
+    ]
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, timeout=60,
+                                           check_same_thread=False)
+        with self._lock, self._connection:
+            for statement in self._schema:
+                self._connection.execute(statement)
+
+    def save(self, cache_key, data):
+        """Store the `data` dict (as obtained from
+        :meth:`AsyncResult._cache_data <clusterjob.AsyncResult._cache_data>`)
+        under the given `cache_key`, replacing any existing entry"""
+        blob = sqlite3.Binary(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO jobs '
+                '(cache_key, job_id, remote, backend, status, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (cache_key, data.get('job_id'), data.get('remote'),
+                 data.get('backend'), data.get('_status'), blob))
+
+    def load(self, cache_key):
+        """Return the data dict stored for `cache_key`, or None if there is no
+        such entry"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT data FROM jobs WHERE cache_key = ?',
+                (cache_key, )).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(bytes(row[0]))
+
+    def __contains__(self, cache_key):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM jobs WHERE cache_key = ?',
+                (cache_key, )).fetchone()
+        return row is not None
+
+    def delete(self, cache_key):
+        """Remove the entry for `cache_key` (if it exists)"""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM jobs WHERE cache_key = ?',
+                                     (cache_key, ))
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM jobs')
+
+    def load_all(self, status=None, remote=None, job_id=None):
+        """Return a list of tuples ``(cache_key, data)`` for all entries,
+        ordered by the cache key.
+
+        Arguments:
+            status (int, list of int, or None): If given, only return entries
+                with the given status code (or one of the given status codes)
+            remote (str or None): If given, only return entries for the
+                given remote.
+            job_id (str or None): If given, only return entries with the
+                given job ID.
+        """
+        conditions = []
+        values = []
+        if status is not None:
+            if isinstance(status, int):
+                status = [status, ]
+            status = list(status)
+            conditions.append('status IN (%s)'
+                              % ", ".join(['?' for val in status]))
+            values.extend(status)
+        if remote is not None:
+            conditions.append('remote = ?')
+            values.append(remote)
+        if job_id is not None:
+            conditions.append('job_id = ?')
+            values.append(str(job_id))
+        query = 'SELECT cache_key, data FROM jobs'
+        if len(conditions) > 0:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY cache_key'
+        with self._lock:
+            rows = self._connection.execute(query, values).fetchall()
+        return [(cache_key, pickle.loads(bytes(data)))
+                for (cache_key, data) in rows]
+
+    def close(self):
+        """Close the connection to the database. Afterwards, a new instance
+        for the same database file must be obtained from
+        :func:`get_job_store`"""
+        with _stores_lock:
+            if _stores.get(os.path.abspath(self.filename)) is self:
+                del _stores[os.path.abspath(self.filename)]
+        with self._lock:
+            self._connection.close()
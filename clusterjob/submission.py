@@ -0,0 +1,192 @@
+"""Client-side queue for submitting a large number of jobs
+
+Many clusters limit the number of jobs that a user may have in the queue at
+any time (e.g. ``MaxSubmitJobs`` in SLURM). Submitting a larger number of jobs
+in a loop over :meth:`JobScript.submit <clusterjob.JobScript.submit>` fails as
+soon as the limit is reached. A :class:`SubmissionQueue` instead holds back
+jobs on the client, and keeps at most a given number of jobs pending or
+running on every remote, submitting more jobs as earlier ones finish.
+
+Example:
+
+    >>> from clusterjob import JobScript
+    >>> queue = SubmissionQueue(max_in_flight=500, longest_first=True)
+    >>> for i in range(10000):
+    ...     job = JobScript('./sweep %d' % i, jobname='sweep_%d' % i,
+    ...                     time='%d:00:00' % (1 + i % 4))
+    ...     __ = queue.put(job, cache_id='sweep_%d' % i)
+    >>> queue.queued
+    10000
+    >>> results = queue.run() # doctest: +SKIP
+"""
+from __future__ import absolute_import
+import time
+import heapq
+from collections import OrderedDict, deque
+
+from . import JobScript, poll_many, _shared_interval, _sleep_until
+from .status import COMPLETED
+from .utils import time_to_seconds
+
+__all__ = ['SubmissionQueue']
+
+
+class SubmissionQueue(object):
+    """Queue of :class:`~clusterjob.JobScript` instances, of which at most
+    `max_in_flight` are submitted to the scheduler of every remote at any
+    time
+
+    Arguments:
+        max_in_flight (int): Maximum number of unfinished (pending or running)
+            jobs for every remote
+        longest_first (bool): If True, submit the jobs with the longest `time`
+            resource first (jobs without a `time` resource last). This tends
+            to minimize the total time until all jobs have finished. If False,
+            jobs are submitted in the order in which they were added.
+
+    Jobs are submitted with :meth:`JobScript.submit_many
+    <clusterjob.JobScript.submit_many>`, using the `cache_id` given to
+    :meth:`put`. Thus, jobs whose result is cached are not submitted again: a
+    job that has finished (successfully) takes up no slot, and a job that is
+    still pending or running takes up its slot without being resubmitted. A
+    job should not be modified after it has been added to the queue.
+
+    Attributes:
+        results (list): For every job added through :meth:`put`, the
+            :class:`~clusterjob.AsyncResult` of its submission, or None if the
+            job has not been submitted yet.
+    """
+
+    def __init__(self, max_in_flight=100, longest_first=False):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.max_in_flight = int(max_in_flight)
+        self.longest_first = longest_first
+        self.results = []
+        # remote => heap of (priority, index, job, cache_id)
+        self._queued = OrderedDict()
+        # remote => list of unfinished AsyncResults
+        self._in_flight = OrderedDict()
+        # finished results that have not been yielded by `as_completed`
+        self._finished = deque()
+
+    def put(self, job, cache_id=None):
+        """Add a :class:`~clusterjob.JobScript` to the queue, to be submitted
+        with the given `cache_id`. Return the index of the job in
+        :attr:`results`."""
+        index = len(self.results)
+        self.results.append(None)
+        priority = 0
+        if self.longest_first and 'time' in job.resources:
+            priority = -time_to_seconds(job.resources['time'])
+        heapq.heappush(self._queued.setdefault(job.remote, []),
+                       (priority, index, job, cache_id))
+        return index
+
+    def extend(self, jobs, cache_ids=None):
+        """Add all the given `jobs` to the queue, with the corresponding
+        `cache_ids` (cf. :meth:`put`)"""
+        jobs = list(jobs)
+        if cache_ids is None:
+            cache_ids = [None for job in jobs]
+        if len(cache_ids) != len(jobs):
+            raise ValueError("cache_ids must have the same length as jobs")
+        for (job, cache_id) in zip(jobs, cache_ids):
+            self.put(job, cache_id)
+
+    @property
+    def queued(self):
+        """Number of jobs that have not been submitted yet"""
+        return sum([len(heap) for heap in self._queued.values()])
+
+    @property
+    def in_flight(self):
+        """Number of submitted jobs that have not finished yet"""
+        return sum([len(runs) for runs in self._in_flight.values()])
+
+    def submit(self):
+        """Submit as many queued jobs as there are free slots for every
+        remote, and return a list of the resulting
+        :class:`~clusterjob.AsyncResult` instances"""
+        submitted = []
+        for (remote, heap) in self._queued.items():
+            in_flight = self._in_flight.setdefault(remote, [])
+            n_free = min(self.max_in_flight - len(in_flight), len(heap))
+            if n_free <= 0:
+                continue
+            batch = [heapq.heappop(heap) for i in range(n_free)]
+            results = JobScript.submit_many(
+                [job for (__, __, job, __) in batch],
+                cache_ids=[cache_id for (__, __, __, cache_id) in batch])
+            for ((__, index, __, __), ar) in zip(batch, results):
+                self.results[index] = ar
+                if ar._status >= COMPLETED:
+                    self._finished.append(ar)
+                else:
+                    in_flight.append(ar)
+            submitted.extend(results)
+        return submitted
+
+    def poll(self):
+        """Update the status of all unfinished jobs (with
+        :func:`~clusterjob.poll_many`), freeing the slots of the finished
+        jobs. Return whether the status of any job changed."""
+        runs = []
+        for in_flight in self._in_flight.values():
+            runs.extend(in_flight)
+        prev_statuses = [ar._status for ar in runs]
+        statuses = poll_many(runs)
+        for (remote, in_flight) in self._in_flight.items():
+            unfinished = []
+            for ar in in_flight:
+                if ar._status >= COMPLETED:
+                    self._finished.append(ar)
+                else:
+                    unfinished.append(ar)
+            self._in_flight[remote] = unfinished
+        return statuses != prev_statuses
+
+    def as_completed(self, timeout=None):
+        """Generator that submits all queued jobs (keeping at most
+        `max_in_flight` jobs per remote unfinished), and yields the
+        :class:`~clusterjob.AsyncResult` of every job as soon as it has
+        finished. Between polls, it sleeps as :func:`clusterjob.as_completed`.
+
+        Raises:
+            TimeoutError: if not all jobs have finished after `timeout`
+                seconds
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        interval = None
+        changed = True
+        while True:
+            if len(self.submit()) > 0:
+                changed = True
+            while len(self._finished) > 0:
+                yield self._finished.popleft()
+            if self.in_flight == 0:
+                if self.queued == 0:
+                    break
+                continue
+            runs = []
+            for in_flight in self._in_flight.values():
+                runs.extend(in_flight)
+            interval = _shared_interval(interval, changed, runs)
+            _sleep_until(interval, deadline, len(runs) + self.queued)
+            changed = self.poll()
+            while len(self._finished) > 0:
+                yield self._finished.popleft()
+
+    def run(self, timeout=None):
+        """Submit all queued jobs and wait until they have finished (see
+        :meth:`as_completed`). Return :attr:`results`.
+
+        Raises:
+            TimeoutError: if not all jobs have finished after `timeout`
+                seconds
+        """
+        for __ in self.as_completed(timeout=timeout):
+            pass
+        return self.results
@@ -8,6 +8,14 @@ import subprocess as sp
 import pprint
 import re
 import json
+import time
+import atexit
+import tempfile
+import shutil
+import io
+import tarfile
+import hashlib
+import threading
 try:
     from shlex import quote
 except ImportError:
@@ -16,6 +24,132 @@ except ImportError:
 CMD_RESPONSE_ENCODING = 'utf-8'
 
 
+class SshConnectionPool(object):
+    """Pool of persistent, multiplexed ssh connections.
+
+    For every combination of ssh executable and remote host that is registered
+    through :meth:`enable`, a single master connection is opened (using the
+    ``ControlMaster`` feature of OpenSSH) the first time a command is run on
+    the remote. All further calls to :func:`run_cmd` and :func:`upload_file`
+    for the same remote are routed through the master connection's control
+    socket, avoiding the overhead of establishing a new TCP connection and
+    re-authenticating. The master connections are closed when the Python
+    process exits (or when :meth:`close_all` is called).
+
+    There is a single global instance of this class, :obj:`ssh_pool`. It may
+    be used from multiple threads.
+
+    Attributes:
+        commands (dict): Map of ``(ssh, remote)`` to the number of commands
+            that have been routed through the master connection. This may be
+            used to monitor the number of saved connection handshakes.
+    """
+
+    def __init__(self):
+        self._persist = {}    # (ssh, remote) => persist time
+        self._sockets = {}    # (ssh, remote) => control path of open master
+        self._socket_dir = None
+        self._lock = threading.RLock()
+        self.commands = {}
+
+    def enable(self, ssh, remote, persist=600):
+        """Use a multiplexed connection for all commands run on `remote`
+        through the `ssh` executable. After `persist` seconds of inactivity,
+        the master connection closes automatically (it will be re-opened when
+        required)."""
+        key = (ssh, remote)
+        with self._lock:
+            if key not in self._persist:
+                logger = logging.getLogger(__name__)
+                logger.debug("Enabling ssh multiplexing for %s (via %s)",
+                             remote, ssh)
+                self.commands[key] = 0
+            self._persist[key] = int(persist)
+
+    def is_enabled(self, ssh, remote):
+        """Return True if multiplexing is enabled for the given ssh executable
+        and remote"""
+        return (ssh, remote) in self._persist
+
+    def _control_path(self, key):
+        if self._socket_dir is None:
+            # socket paths must be short, so we don't use the cache folder
+            self._socket_dir = tempfile.mkdtemp(prefix='clj')
+        # the socket name must be unique for every (ssh, remote), also after
+        # other master connections have been closed
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self._socket_dir, digest[:12])
+
+    def ssh_options(self, ssh, remote):
+        """Return a list of command line options for `ssh` (or `scp`) that
+        route a connection to `remote` through the control socket of the
+        master connection, opening the master connection if necessary. If
+        multiplexing is not enabled for `ssh` and `remote`, return an empty
+        list."""
+        logger = logging.getLogger(__name__)
+        key = (ssh, remote)
+        with self._lock:
+            if key not in self._persist:
+                return []
+            control_path = self._sockets.get(key)
+            if control_path is None or not os.path.exists(control_path):
+                if control_path is None:
+                    control_path = self._control_path(key)
+                logger.info("Opening multiplexed ssh connection to %s",
+                            remote)
+                t0 = time.time()
+                with open(os.devnull, 'w') as devnull:
+                    exit_code = sp.call(
+                        [ssh, '-o', 'ControlMaster=yes',
+                         '-o', 'ControlPath=%s' % control_path,
+                         '-o', 'ControlPersist=%d' % self._persist[key],
+                         '-N', '-f', remote],
+                        stdout=devnull, stderr=devnull)
+                if exit_code != 0:
+                    logger.warning("Cannot open multiplexed ssh connection "
+                                   "to %s; using regular connections",
+                                   remote)
+                    return []
+                logger.info("Opened multiplexed ssh connection to %s in "
+                            "%.2f s", remote, time.time() - t0)
+                self._sockets[key] = control_path
+            else:
+                logger.debug("Re-using multiplexed ssh connection to %s",
+                             remote)
+            self.commands[key] += 1
+            return ['-o', 'ControlMaster=no',
+                    '-o', 'ControlPath=%s' % control_path]
+
+    def close(self, ssh, remote):
+        """Close the master connection for the given ssh executable and
+        remote, and disable multiplexing for it"""
+        logger = logging.getLogger(__name__)
+        key = (ssh, remote)
+        with self._lock:
+            control_path = self._sockets.pop(key, None)
+            self._persist.pop(key, None)
+            if control_path is not None and os.path.exists(control_path):
+                logger.info("Closing multiplexed ssh connection to %s (%d "
+                            "commands)", remote, self.commands.get(key, 0))
+                with open(os.devnull, 'w') as devnull:
+                    sp.call([ssh, '-o', 'ControlPath=%s' % control_path,
+                             '-O', 'exit', remote],
+                            stdout=devnull, stderr=devnull)
+
+    def close_all(self):
+        """Close all master connections"""
+        with self._lock:
+            for (ssh, remote) in list(self._persist.keys()):
+                self.close(ssh, remote)
+            if self._socket_dir is not None:
+                shutil.rmtree(self._socket_dir, ignore_errors=True)
+                self._socket_dir = None
+
+
+ssh_pool = SshConnectionPool()
+atexit.register(ssh_pool.close_all)
+
+
 def set_executable(filename):
     """Set the exectuable bit on the given filename"""
     st = os.stat(filename)
@@ -28,6 +162,50 @@ def write_file(filename, data):
         out_fh.write(data)
 
 
+def interpreter_cmd(scriptfile, script=None):
+    """Return the command (list of arguments) that runs the given
+    `scriptfile` through the interpreter named in its shebang line
+    (``/bin/sh`` if there is none). The content of the script may be passed
+    as `script`, if known; otherwise, the first line of `scriptfile` is read.
+
+    A freshly written script should be run this way instead of being
+    executed directly: exec fails with ETXTBSY if another thread has forked
+    while the file was still open for writing.
+
+    >>> interpreter_cmd('job.sh', script="#!/usr/bin/env python\\nprint(1)")
+    ['/usr/bin/env', 'python', 'job.sh']
+    >>> interpreter_cmd('job.sh', script="echo 1")
+    ['/bin/sh', 'job.sh']
+    """
+    if script is None:
+        with open(scriptfile) as in_fh:
+            first_line = in_fh.readline()
+    else:
+        first_line = (script.splitlines() or [''])[0]
+    if first_line.startswith('#!'):
+        cmd = first_line[2:].strip().split(None, 1)
+    else:
+        cmd = ['/bin/sh', ]
+    cmd.append(scriptfile)
+    return cmd
+
+
+def quote_path(path):
+    """Quote `path` for use in a shell command, such that a leading ``~`` is
+    still expanded to the home directory
+
+    >>> print(quote_path('~/my jobs'))
+    ~/'my jobs'
+    >>> print(quote_path('./jobs'))
+    ./jobs
+    """
+    if path == '~':
+        return path
+    if path.startswith('~/'):
+        return '~/' + quote(path[2:])
+    return quote(path)
+
+
 def split_seq(seq, n_chunks):
     """Split the given sequence into `n_chunks`. Suitable for distributing an
     array of jobs over a fixed number of workers.
@@ -59,7 +237,8 @@ def read_file(filename):
         return in_fh.read()
 
 
-def upload_file(localfile, remote, remotefile, scp='scp'):
+def upload_file(localfile, remote, remotefile, scp='scp', ssh='ssh',
+                agent=False):
     """Run ``{scp} {localfile} {remote}:{remotefile}``
 
     Parameters:
@@ -69,17 +248,189 @@ def upload_file(localfile, remote, remotefile, scp='scp'):
             to indicate the home directory.
         scp (str): the scp executables. If not a full path, the executable must
             be in ``$PATH``.
+        ssh (str): the ssh executable. This is only used to identify the
+            multiplexed connection in :obj:`ssh_pool` or the agent in
+            :obj:`~clusterjob.agent.agent_pool` through which the file should
+            be uploaded, if any.
+        agent (bool): If True, and an agent is enabled for `ssh` and `remote`
+            in :obj:`~clusterjob.agent.agent_pool`, the file is written by the
+            agent.
 
     Raises:
         subprocess.CalledProcessError: if call to `scp` fails.
     """
+    agent = _agent(ssh, remote, agent)
+    if agent is not None:
+        mode = os.stat(localfile).st_mode & 0o777
+        agent.write_files({remotefile: read_file(localfile)}, mode=mode)
+        return
     sp.check_output(
-        [scp, localfile, remote+':'+remotefile],
+        [scp, ] + ssh_pool.ssh_options(ssh, remote)
+        + [localfile, remote+':'+remotefile],
         stderr=sp.STDOUT)
 
 
+def upload_files(files, remote, ssh='ssh', mode=0o755, agent=False):
+    """Upload multiple files to `remote` through a single ssh connection
+
+    The files are packed into a tar archive in memory, which is streamed to
+    ``tar`` running on the remote. Any missing folders on the remote are
+    created automatically.
+
+    Parameters:
+        files (dict): mapping of remote filenames to file contents (str).
+            Relative filenames, or filenames starting with ``~/``, are taken
+            relative to the home directory on the remote.
+        remote (str): Host on which to put the files
+        ssh (str): the ssh executable. If not a full path, the executable must
+            be in ``$PATH``.
+        mode (int): Permissions for the uploaded files. The default makes the
+            files executable.
+        agent (bool): If True, and an agent is enabled for `ssh` and `remote`
+            in :obj:`~clusterjob.agent.agent_pool`, the files are written by
+            the agent.
+
+    Raises:
+        subprocess.CalledProcessError: if the remote ``tar`` fails.
+    """
+    agent = _agent(ssh, remote, agent)
+    if agent is not None:
+        agent.write_files(files, mode=mode)
+        return
+    archive = _tar_archive(files, mode)
+    # -P preserves absolute paths; relative paths are taken relative to the
+    # working directory of the ssh session, i.e., the home directory
+    cmd = [ssh, ] + ssh_pool.ssh_options(ssh, remote) + [remote, 'tar -xPf -']
+    (exit_code, output) = _stream_to_ssh(cmd, archive, len(files))
+    if exit_code != 0:
+        raise sp.CalledProcessError(exit_code, cmd, output=output)
+
+
+def upload_and_run(files, cmd, remote, workdir='', ssh='ssh', mode=0o755,
+                   agent=False):
+    """Upload multiple files to `remote` and run `cmd` on the remote, all
+    through a single ssh connection
+
+    This combines :func:`upload_files` and :func:`run_cmd` into one round
+    trip: the tar archive of the files is streamed to the standard input of a
+    remote shell that unpacks it (creating any missing folders and setting
+    the permissions given by `mode`), changes to `workdir`, and runs `cmd`.
+
+    Parameters:
+        files (dict): mapping of remote filenames to file contents (str), see
+            :func:`upload_files`
+        cmd (list of str or str): Command to execute after the files have
+            been written, cf. :func:`run_cmd`. It is not run if unpacking the
+            files fails.
+        remote (str): Host on which to put the files and run the command
+        workdir (str, optional): Remote directory from which to run the
+            command. May start with `~` to indicate the home directory.
+        ssh (str): the ssh executable. If not a full path, the executable must
+            be in ``$PATH``.
+        mode (int): Permissions for the uploaded files
+        agent (bool): If True, and an agent is enabled for `ssh` and `remote`
+            in :obj:`~clusterjob.agent.agent_pool`, the files are written and
+            the command is run by the agent.
+
+    Returns the combined stdout/stderr of the remote shell, irrespective of
+    the exit code (cf. the `ignore_exit_code` argument of :func:`run_cmd`).
+    """
+    agent = _agent(ssh, remote, agent)
+    if agent is not None:
+        try:
+            agent.write_files(files, mode=mode)
+        except sp.CalledProcessError as exc_info:
+            return exc_info.output
+        return agent.run_cmd(cmd, workdir, ignore_exit_code=True)
+    logger = logging.getLogger(__name__)
+    archive = _tar_archive(files, mode)
+    if type(cmd) in [list, tuple]:
+        cmd = " ".join(cmd)
+    if workdir != '':
+        cmd = 'cd %s && %s' % (workdir, cmd)
+    ssh_cmd = [ssh, ] + ssh_pool.ssh_options(ssh, remote) \
+              + [remote, 'tar -xPf - && %s' % cmd]
+    (exit_code, response) = _stream_to_ssh(ssh_cmd, archive, len(files))
+    if sys.version_info >= (3, 0):
+        response = response.decode(CMD_RESPONSE_ENCODING)
+    logger.debug("RESPONSE (exit code %d): %r", exit_code, response)
+    return response
+
+
+def _tar_archive(files, mode):
+    """Return the content of a tar archive (bytes) containing the given
+    `files` (mapping of filenames to str), with the permissions `mode`. A
+    leading ``~/`` is removed from the filenames."""
+    archive = io.BytesIO()
+    tar = tarfile.open(fileobj=archive, mode='w')
+    mtime = time.time()
+    for filename in files:
+        data = files[filename].encode(CMD_RESPONSE_ENCODING)
+        if filename.startswith('~/'):
+            filename = filename[2:]
+        info = tarfile.TarInfo(name=filename)
+        info.size = len(data)
+        info.mode = mode
+        info.mtime = mtime
+        tar.addfile(info, io.BytesIO(data))
+    tar.close()
+    return archive.getvalue()
+
+
+def _stream_to_ssh(cmd, data, n_files):
+    """Run the local `cmd` with `data` (the tar archive containing `n_files`
+    files) on its standard input, and return a tuple of the exit code and the
+    combined stdout/stderr (bytes)"""
+    logger = logging.getLogger(__name__)
+    logger.debug("COMMAND: %s (uploading %d files, %d bytes)",
+                 " ".join([quote(part) for part in cmd]), n_files,
+                 len(data))
+    proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.STDOUT)
+    output = proc.communicate(data)[0]
+    return (proc.returncode, output)
+
+
+def _agent(ssh, remote, agent=True):
+    """Return the :class:`~clusterjob.agent.Agent` through which to
+    communicate with `remote`, or None if `agent` is False or no agent is
+    enabled for `ssh` and `remote`"""
+    if not agent:
+        return None
+    from .agent import agent_pool
+    return agent_pool.agent(ssh, remote)
+
+
+class InProcessCommand(list):
+    """Command that is not run as a subprocess by :func:`run_cmd`, but by
+    calling a function in the current process. This allows backends that
+    manage jobs themselves (e.g.
+    :class:`~clusterjob.backends.local.LocalBackend`) to answer queries from
+    their own state.
+
+    Arguments:
+        args (list of str): The command line arguments that describe the
+            command (used for logging and for recording the command)
+        func (callable): Function that receives the working directory of the
+            command and returns a tuple of the exit code and the response
+    """
+
+    def __init__(self, args, func):
+        super(InProcessCommand, self).__init__(args)
+        self.func = func
+
+    def run(self, workdir='', ignore_exit_code=False):
+        """Call `func` and return the response. Raise
+        `subprocess.CalledProcessError` for a non-zero exit code, unless
+        `ignore_exit_code` is True."""
+        (exit_code, response) = self.func(workdir)
+        if exit_code != 0 and not ignore_exit_code:
+            raise sp.CalledProcessError(exit_code, list(self),
+                                        output=response)
+        return response
+
+
 def run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
-        ssh='ssh'):
+        ssh='ssh', agent=False):
     r'''Run the given cmd in the given workdir, either locally or remotely, and
     return the combined stdout/stderr
 
@@ -88,7 +439,8 @@ def run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
             command, and options.  Alternatively, the command can be given a
             single string, which will then be executed as a shell command. Only
             use shell commands when necessary, e.g. when the command involves a
-            pipe.
+            pipe. An :class:`InProcessCommand` is run without starting a
+            subprocess (only for ``remote=None``).
         remote (None or str): If None, run command locally. Otherwise, run on
             the given host (via SSH)
         rootdir (str, optional): Local or remote root directory. The `workdir`
@@ -105,7 +457,12 @@ def run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
             exit code other than 0. This exception can be supressed by passing
             `ignore_exit_code=False`
         ssh (str, optional): The executable to be used for ssh. If not a full
-            path, the executable must be in ``$PATH``
+            path, the executable must be in ``$PATH``. If multiplexing is
+            enabled for `ssh` and `remote` in :obj:`ssh_pool`, the command is
+            run through the persistent master connection.
+        agent (bool, optional): If True, and an agent is enabled for `ssh`
+            and `remote` in :obj:`~clusterjob.agent.agent_pool`, the command
+            is run by the agent. Otherwise, the agent is bypassed.
 
     Example:
 
@@ -127,11 +484,22 @@ def run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
     '''
     logger = logging.getLogger(__name__)
     workdir = os.path.join(rootdir, workdir)
+    if isinstance(cmd, InProcessCommand):
+        if remote is not None:
+            raise ValueError("The command %s can only be run locally" % cmd)
+        logger.debug("COMMAND (in-process): %s", " ".join(cmd))
+        response = cmd.run(os.path.expanduser(workdir), ignore_exit_code)
+        logger.debug("RESPONSE: %r", response)
+        return response
+    agent = _agent(ssh, remote, agent)
+    if agent is not None:
+        return agent.run_cmd(cmd, workdir, ignore_exit_code)
     if type(cmd) in [list, tuple]:
         use_shell = False
     else:
         cmd = str(cmd)
         use_shell = True
+    t0 = time.time()
     try:
         if remote is None: # run locally
             workdir = os.path.expanduser(workdir)
@@ -149,10 +517,12 @@ def run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
         else: # run remotely
             if not use_shell:
                 cmd = " ".join(cmd)
+            ssh_options = ssh_pool.ssh_options(ssh, remote)
             if workdir == '':
-                cmd = [ssh, remote, cmd]
+                cmd = [ssh, ] + ssh_options + [remote, cmd]
             else:
-                cmd = [ssh, remote, 'cd %s && %s' % (workdir, cmd)]
+                cmd = [ssh, ] + ssh_options \
+                      + [remote, 'cd %s && %s' % (workdir, cmd)]
             logger.debug("COMMAND: %s",
                          " ".join([quote(part) for part in cmd]))
             response = sp.check_output(cmd, stderr=sp.STDOUT)
@@ -161,6 +531,7 @@ def run_cmd(cmd, remote, rootdir='', workdir='', ignore_exit_code=False,
             response = e.output
         else:
             raise
+    logger.debug("Command finished after %.3f s", time.time() - t0)
     if sys.version_info >= (3, 0):
         # For Python 3, we should return a unicode string, so that the backends
         # can safely assume that string operations such as regex matching are
@@ -288,6 +659,164 @@ def time_to_seconds(time_str):
     raise ValueError("'%s' has invalid pattern" % time_str)
 
 
+def parse_array_spec(spec):
+    """Parse the specification of the indices of a job array (the `array`
+    resource of a :class:`~clusterjob.JobScript`) into a tuple ``(ranges,
+    max_running)``, where `ranges` is a list of tuples ``(start, end, step)``
+    (with inclusive `end`), and `max_running` is the maximum number of array
+    tasks that may run at the same time, or None. The `spec` may be given as
+
+    * an integer `N`, for the indices 1 to `N`
+    * a list (or other iterable) of integers
+    * a string of comma-separated ranges ``start-end`` or ``start-end:step``
+      or single indices, optionally followed by ``%max_running``, as in the
+      array specification of the schedulers. Note that in a string, a bare
+      number `N` is the single index `N`, not the number of tasks (so that
+      ``array = 1-10`` must be used in an INI file for the indices 1 to 10)
+
+    Raises:
+        ValueError: if `spec` has an invalid format.
+
+    Examples:
+        >>> parse_array_spec(10)
+        ([(1, 10, 1)], None)
+        >>> parse_array_spec('10')
+        ([(10, 10, 1)], None)
+        >>> parse_array_spec('1-100:2,200%10')
+        ([(1, 99, 2), (200, 200, 1)], 10)
+        >>> parse_array_spec([1, 2, 3, 5, 8, 9])
+        ([(1, 3, 1), (5, 5, 1), (8, 9, 1)], None)
+        >>> parse_array_spec('1-a')
+        Traceback (most recent call last):
+        ...
+        ValueError: '1-a' is not a valid job array specification
+    """
+    ranges = []
+    max_running = None
+    if isinstance(spec, int):
+        if spec < 1:
+            raise ValueError("Job array must have at least one task")
+        return [(1, spec, 1)], None
+    elif isinstance(spec, str) or not hasattr(spec, '__iter__'):
+        spec = str(spec).strip()
+        pattern = re.compile(r'^(\d+)(-(\d+)(:(\d+))?)?$')
+        if '%' in spec:
+            spec, max_running = spec.split('%', 1)
+            try:
+                max_running = int(max_running)
+            except ValueError:
+                raise ValueError("'%s%%%s' is not a valid job array "
+                                 "specification" % (spec, max_running))
+        for part in spec.split(","):
+            match = pattern.match(part.strip())
+            if not match:
+                raise ValueError("'%s' is not a valid job array "
+                                 "specification" % spec)
+            start = int(match.group(1))
+            end = start
+            step = 1
+            if match.group(3) is not None:
+                end = int(match.group(3))
+            if match.group(5) is not None:
+                step = int(match.group(5))
+            if end < start or step < 1:
+                raise ValueError("'%s' is not a valid job array "
+                                 "specification" % spec)
+            end -= (end - start) % step
+            ranges.append((start, end, step))
+    else:
+        for index in sorted(set([int(i) for i in spec])):
+            if len(ranges) > 0 and ranges[-1][1] == index - 1:
+                ranges[-1] = (ranges[-1][0], index, 1)
+            else:
+                ranges.append((index, index, 1))
+        if len(ranges) == 0:
+            raise ValueError("Job array must have at least one task")
+    return ranges, max_running
+
+
+def format_array_ranges(ranges):
+    """Format the `ranges` obtained from :func:`parse_array_spec` as a
+    string
+
+    >>> format_array_ranges([(1, 99, 2), (200, 200, 1), (5, 8, 1)])
+    '1-99:2,200,5-8'
+    """
+    parts = []
+    for (start, end, step) in ranges:
+        if start == end:
+            parts.append(str(start))
+        elif step == 1:
+            parts.append("%d-%d" % (start, end))
+        else:
+            parts.append("%d-%d:%d" % (start, end, step))
+    return ",".join(parts)
+
+
+def array_indices(spec):
+    """Return a list of all the indices in the given job array
+    specification (see :func:`parse_array_spec`)
+
+    >>> array_indices('1-5:2,10-11%2')
+    [1, 3, 5, 10, 11]
+    """
+    indices = []
+    for (start, end, step) in parse_array_spec(spec)[0]:
+        indices.extend(range(start, end+1, step))
+    return indices
+
+
+#: Conditions that may be used in a job dependency, see
+#: :func:`parse_dependency_spec`
+DEPENDENCY_CONDITIONS = ('afterok', 'afterany', 'afternotok')
+
+
+def parse_dependency_spec(spec):
+    """Parse the specification of job dependencies (the `dependency` resource
+    of a :class:`~clusterjob.JobScript`) into a list of tuples ``(condition,
+    job_ids)``, where `condition` is one of :data:`DEPENDENCY_CONDITIONS` and
+    `job_ids` is a list of job IDs (as str). The `spec` is a string of
+    comma-separated entries ``condition:job_id[:job_id...]``, as for the
+    ``--dependency`` option of SLURM's ``sbatch``. The job must only start
+    once all of the entries are satisfied:
+
+    * ``afterok``: all the listed jobs have completed successfully
+    * ``afterany``: all the listed jobs have finished, in any way
+    * ``afternotok``: all the listed jobs have failed or were cancelled
+
+    Raises:
+        ValueError: if `spec` has an invalid format.
+
+    Examples:
+        >>> parse_dependency_spec('afterok:12:13.server,afterany:14')
+        [('afterok', ['12', '13.server']), ('afterany', ['14'])]
+        >>> parse_dependency_spec('singleton')
+        Traceback (most recent call last):
+        ...
+        ValueError: 'singleton' is not a valid job dependency specification
+    """
+    result = []
+    for entry in str(spec).split(','):
+        fields = entry.strip().split(':')
+        job_ids = [job_id for job_id in fields[1:] if job_id != '']
+        if fields[0] not in DEPENDENCY_CONDITIONS or len(job_ids) == 0:
+            raise ValueError("%r is not a valid job dependency specification"
+                             % spec)
+        result.append((fields[0], job_ids))
+    return result
+
+
+def format_dependency_spec(dependencies):
+    """Format a list of tuples ``(condition, job_ids)`` as a string, the
+    inverse of :func:`parse_dependency_spec`
+
+    >>> format_dependency_spec([('afterok', ['12', '13']), ('afterany', [14])])
+    'afterok:12:13,afterany:14'
+    """
+    return ",".join([":".join([condition, ] + [str(i) for i in job_ids])
+                     for (condition, job_ids) in dependencies])
+
+
 def mkdir(name, mode=0o750):
     """Implementation of ``mkdir -p``: Creates folder with the given `name` and
     the given permissions (`mode`)
@@ -0,0 +1,181 @@
+"""Submission of a directed acyclic graph (DAG) of dependent jobs
+
+A :class:`Workflow` holds a number of :class:`~clusterjob.JobScript`
+instances, together with the dependencies between them. When the workflow is
+submitted, every job is passed to the scheduler with a native dependency on
+the jobs it depends on (see the `after` argument of
+:meth:`JobScript.submit <clusterjob.JobScript.submit>`). Thus, all jobs are
+submitted at once, and a downstream job waits in the scheduler's queue and
+starts as soon as its dependencies have finished, without any further
+interaction with the client.
+
+Example:
+
+    >>> from clusterjob import JobScript
+    >>> wf = Workflow()
+    >>> prepare = wf.add(JobScript('./prepare', jobname='prepare'))
+    >>> runs = [wf.add(JobScript('./run %d' % i, jobname='run_%d' % i),
+    ...                after=[prepare]) for i in range(3)]
+    >>> analyze = wf.add(JobScript('./analyze', jobname='analyze'),
+    ...                  after=runs, condition='afterany')
+    >>> [[job.resources['jobname'] for job in level] for level in wf.levels()]
+    [['prepare'], ['run_0', 'run_1', 'run_2'], ['analyze']]
+    >>> results = wf.submit() # doctest: +SKIP
+"""
+from __future__ import absolute_import
+
+from . import JobScript, AsyncResult
+from .status import COMPLETED
+
+__all__ = ['Workflow']
+
+
+class Workflow(object):
+    """Directed acyclic graph of :class:`~clusterjob.JobScript` instances
+
+    Jobs are added with :meth:`add`, which also defines the dependencies of
+    the job. Since a job may only depend on jobs that were added before it,
+    the graph cannot contain any cycles. All jobs must be submitted to the
+    same `remote` as the jobs they depend on.
+
+    Note that with the SGE backend, the default condition 'afterok' is
+    treated as 'afterany': a job also starts if a job it depends on failed.
+
+    Attributes:
+        jobs (list): The :class:`~clusterjob.JobScript` instances, in the
+            order in which they were added
+        results (list): For every job in :attr:`jobs`, the
+            :class:`~clusterjob.AsyncResult` of its submission, or None if the
+            workflow has not been submitted yet
+    """
+
+    def __init__(self):
+        self.jobs = []
+        self.results = []
+        self._index = {} # id(job) => index in self.jobs
+        self._after = [] # for every job, list of indices or AsyncResults
+        self._conditions = []
+        self._cache_ids = []
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, job, after=None, condition='afterok', cache_id=None):
+        """Add a :class:`~clusterjob.JobScript` to the workflow, and return
+        it.
+
+        Arguments:
+            job (JobScript): The job to add
+            after (list or None): Jobs that must finish before `job` may
+                start. Every element is either a :class:`~clusterjob.JobScript`
+                that was added to the workflow before, or the
+                :class:`~clusterjob.AsyncResult` of a job that was submitted
+                independently of the workflow.
+            condition (str): The condition under which `job` may start, see
+                the `condition` argument of :meth:`JobScript.submit
+                <clusterjob.JobScript.submit>`
+            cache_id (str or None): The `cache_id` with which to submit the
+                job
+
+        Raises:
+            ValueError: if `job` is already part of the workflow, or if
+                `after` contains a job that is not.
+        """
+        if id(job) in self._index:
+            raise ValueError("Job %s was already added to the workflow"
+                             % job.resources['jobname'])
+        dependencies = []
+        for dependency in (after or []):
+            if isinstance(dependency, AsyncResult):
+                dependencies.append(dependency)
+            elif id(dependency) in self._index:
+                dependencies.append(self._index[id(dependency)])
+            else:
+                raise ValueError("Job %s must be added to the workflow "
+                                 "before the jobs that depend on it"
+                                 % dependency.resources['jobname'])
+        self._index[id(job)] = len(self.jobs)
+        self.jobs.append(job)
+        self.results.append(None)
+        self._after.append(dependencies)
+        self._conditions.append(condition)
+        self._cache_ids.append(cache_id)
+        return job
+
+    def _levels(self):
+        """Return a list of lists of job indices, grouped by the length of
+        the longest path of dependencies leading to the job"""
+        depths = []
+        levels = []
+        for dependencies in self._after:
+            depth = 0
+            for dependency in dependencies:
+                if not isinstance(dependency, AsyncResult):
+                    depth = max(depth, depths[dependency] + 1)
+            depths.append(depth)
+            if depth == len(levels):
+                levels.append([])
+            levels[depth].append(len(depths) - 1)
+        return levels
+
+    def levels(self):
+        """Return a list of lists of jobs, such that every job only depends
+        on jobs in earlier lists"""
+        return [[self.jobs[i] for i in level] for level in self._levels()]
+
+    def submit(self, block=False, force=False, retry=True):
+        """Submit all jobs in the workflow, and return :attr:`results`.
+
+        The jobs are submitted level by level (see :meth:`levels`), each
+        level with a single call to :meth:`JobScript.submit_many
+        <clusterjob.JobScript.submit_many>`, so that the number of round trips
+        to a remote is the depth of the graph, not the number of jobs. A job
+        whose dependencies can never be satisfied (e.g. because a job it
+        depends on with the 'afterok' condition failed to submit) is not
+        submitted, but results in an :class:`~clusterjob.AsyncResult` with
+        the status ``CANCELLED``.
+
+        Arguments:
+            block (bool): If True, wait until all jobs have finished, and
+                return a list of exit status codes.
+            force (bool): If True, discard any cached results, cf.
+                :meth:`JobScript.submit <clusterjob.JobScript.submit>`
+            retry (bool): If True, resubmit jobs whose cached result
+                indicates that they finished with an error
+        """
+        for level in self._levels():
+            batch = []
+            dependencies = {} # i => previous `dependency` resource
+            try:
+                for i in level:
+                    after = [dependency if isinstance(dependency, AsyncResult)
+                             else self.results[dependency]
+                             for dependency in self._after[i]]
+                    job = self.jobs[i]
+                    dependencies[i] = job.resources.get('dependency')
+                    if job._set_dependency(after, self._conditions[i]):
+                        batch.append(i)
+                    else:
+                        self.results[i] = job.submit(
+                            cache_id=self._cache_ids[i], force=force,
+                            retry=retry, after=after,
+                            condition=self._conditions[i])
+                results = JobScript.submit_many(
+                    [self.jobs[i] for i in batch],
+                    cache_ids=[self._cache_ids[i] for i in batch],
+                    force=force, retry=retry)
+            finally:
+                for (i, dependency) in dependencies.items():
+                    self.jobs[i]._restore_dependency(dependency)
+            for (i, ar) in zip(batch, results):
+                self.results[i] = ar
+        if block:
+            return [ar.get() for ar in self.results]
+        return self.results
+
+    def cancel(self):
+        """Cancel all submitted jobs of the workflow that have not finished
+        yet"""
+        for ar in self.results:
+            if ar is not None and ar._status < COMPLETED:
+                ar.cancel()
@@ -0,0 +1,30 @@
+import sys
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.backends.local import LocalBackend
+from clusterjob.utils import run_cmd
+# builtin fixtures: tmpdir, monkeypatch
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # the asyncio API uses async/await syntax
+    collect_ignore += ['clusterjob/aio.py', 'tests/test_aio.py']
+
+
+@pytest.fixture
+def local(tmpdir, monkeypatch):
+    """A LocalBackend with 4 cores and 1000 MB of memory, registered as
+    'local'. Commands are run with :func:`~clusterjob.utils.run_cmd`, even
+    if another test (e.g. of the backend tester in the cli) has replaced
+    it."""
+    backend = LocalBackend(cores=4, mem=1000)
+    backend.scheduler.poll_interval = 0.01
+    monkeypatch.setitem(JobScript._backends, 'local', backend)
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    monkeypatch.setattr(AsyncResult, '_min_sleep_interval', 0)
+    monkeypatch.setattr(JobScript, '_run_cmd', staticmethod(run_cmd))
+    monkeypatch.setattr(AsyncResult, '_run_cmd', staticmethod(run_cmd))
+    yield backend
+    backend.scheduler.shutdown()
@@ -33,6 +33,7 @@ setup(name='clusterjob',
       entry_points='''
           [console_scripts]
           clusterjob-test-backend=clusterjob.cli:test_backend
+          clusterjob-emulator=clusterjob.cli:emulator
       ''',
       classifiers=[
           'Development Status :: 4 - Beta',
@@ -0,0 +1,144 @@
+import time
+from textwrap import dedent
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.accounting import (JobStats, duration_to_seconds,
+                                   memory_to_bytes)
+from clusterjob.status import RUNNING, COMPLETED, FAILED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+SACCT = dedent(r'''
+1234|FAILED|2:0|01:00:05|00:10:30|||
+1234.batch|FAILED|2:0|01:00:05|00:10:30|2048K|1.5G
+1234.0|COMPLETED|0:0|00:30:00|00:05:00|1G|1G
+''')
+
+QSTAT = dedent('''
+Job Id: 1234.pbs01
+    Job_Name = test
+    job_state = F
+    resources_used.cput = 00:10:30
+    resources_used.mem = 2048kb
+    resources_used.vmem = 1572864kb
+    resources_used.walltime = 01:00:05
+    Variable_List = PBS_O_HOME=/home/user,PBS_O_LANG=en_US.UTF-8,PBS_O_LO
+\tGNAME=user
+    Exit_status = 2
+''')
+
+BHIST = dedent('''
+Job <1234>, User <user>, Project <default>, Command <#!/bin/bash>
+Mon Oct  1 10:00:00: Submitted from host <login1>, to Queue <normal>, CWD <$H
+                     OME>;
+Mon Oct  1 10:00:02: Dispatched 1 Task(s) on Host(s) <node1>;
+Mon Oct  1 11:00:07: Exited with exit code 2. The CPU time used is 630.0 seco
+                     nds;
+
+MEMORY USAGE:
+MAX MEM: 2 Mbytes;  AVG MEM: 1 Mbytes
+
+Summary of time in seconds spent in various states by  Mon Oct  1 11:00:07
+  PEND     PSUSP    RUN      USUSP    SSUSP    UNKWN    TOTAL
+  2        0        3605     0        0        0        3607
+''')
+
+QACCT = dedent('''
+==============================================================
+qname        all.q
+hostname     node1
+jobnumber    1234
+exit_status  2
+ru_wallclock 3605s
+ru_maxrss    2048
+cpu          630.000s
+maxvmem      1.500G
+''')
+
+
+@pytest.mark.parametrize('backend, response', [
+    ('slurm', SACCT), ('pbs', QSTAT), ('pbspro', QSTAT), ('lsf', BHIST),
+    ('sge', QACCT)])
+def test_get_accounting(backend, response):
+    """Test that the accounting record of every backend is translated into a
+    JobStats instance"""
+    stats = JobScript._backends[backend].get_accounting(response)
+    assert stats.elapsed == 3605
+    assert stats.cpu_time == 630
+    assert stats.exit_code == 2
+    if backend == 'slurm':
+        assert stats.max_rss == 1024**3 # maximum over the steps
+        assert stats.raw['ExitCode'] == '2:0'
+    else:
+        assert stats.max_rss == 2 * 1024**2
+    if backend != 'lsf':
+        assert stats.max_vmem == 1.5 * 1024**3
+    assert JobScript._backends[backend].get_accounting("") is None
+
+
+def test_unfinished_accounting():
+    assert JobScript._backends['slurm'].get_accounting(
+        "1234|RUNNING|0:0|00:10:00|00:09:00||\n") is None
+    assert JobScript._backends['pbs'].get_accounting(
+        "Job Id: 1234.pbs01\n    job_state = R\n") is None
+    assert JobScript._backends['lsf'].get_accounting(
+        "Mon Oct  1 10:00:02: Starting (Pid 12345);\n") is None
+    assert JobScript._backends['local'].cmd_accounting(None) is None
+
+
+def test_conversions():
+    assert duration_to_seconds('2-00:00:01') == 172801
+    assert duration_to_seconds('10') == 10
+    assert memory_to_bytes('0') == 0
+    assert memory_to_bytes('12345kb') == 12345 * 1024
+    with pytest.raises(ValueError):
+        duration_to_seconds('1-10')
+    with pytest.raises(ValueError):
+        memory_to_bytes('12 parsecs')
+    stats = JobStats(elapsed=100, cpu_time=50)
+    assert stats.cpu_efficiency() == 0.5
+    assert JobStats().cpu_efficiency() is None
+    assert stats == JobStats(elapsed=100, cpu_time=50)
+    assert stats != JobStats(elapsed=100)
+
+
+def test_accounting_cached(tmpdir, monkeypatch):
+    """Test that the accounting record is fetched once, after the job has
+    finished, and is cached with the job"""
+    run_cmd = Mock(return_value=SACCT)
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    ar = AsyncResult(backend=JobScript._backends['slurm'])
+    ar.job_id = '1234'
+    ar._status = RUNNING
+    ar.cache_file = str(tmpdir.join('1234.cache'))
+    ar.status_ttl = 1e6 # do not query the status
+    ar._status_time = time.time()
+    assert ar.accounting() is None
+    assert run_cmd.call_count == 0
+    ar._status = FAILED
+    stats = ar.accounting()
+    assert stats.exit_code == 2
+    assert run_cmd.call_count == 1
+    assert run_cmd.call_args[0][0] == [
+        'sacct', '--parsable2', '--noheader',
+        '--format=JobID,State,ExitCode,Elapsed,TotalCPU,MaxRSS,MaxVMSize',
+        '-j', '1234']
+    assert ar.accounting() is stats
+    assert run_cmd.call_count == 1
+    loaded = AsyncResult.load(ar.cache_file)
+    assert loaded.accounting() == stats
+    assert run_cmd.call_count == 1
+    # an incomplete record is not cached
+    run_cmd = Mock(return_value="")
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    ar = AsyncResult(backend=JobScript._backends['slurm'])
+    ar._status = COMPLETED
+    assert ar.accounting() is None
+    assert ar.accounting() is None
+    assert run_cmd.call_count == 2
@@ -0,0 +1,124 @@
+import os
+import sys
+import subprocess as sp
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.agent import Agent, agent_pool
+from clusterjob.emulator import install
+from clusterjob.status import COMPLETED, CANCELLED
+from clusterjob.utils import (run_cmd, upload_files, upload_file,
+                              set_executable)
+# builtin fixtures: tmpdir, monkeypatch
+
+
+@pytest.fixture
+def local_agent():
+    """Route all local commands through an agent running as a child
+    process"""
+    agent_pool.enable('ssh', None, python=sys.executable)
+    yield agent_pool
+    agent_pool.close_all()
+
+
+def test_agent_protocol(tmpdir):
+    """Test the requests that are understood by the agent"""
+    agent = Agent(None, python=sys.executable)
+    try:
+        assert agent.run_cmd(['echo', 'Hello'], workdir=str(tmpdir)) \
+            == 'Hello\n'
+        assert agent.run_cmd('pwd; echo "$0" >&2', workdir=str(tmpdir)) \
+            == str(tmpdir) + '\n/bin/sh\n'
+        with pytest.raises(sp.CalledProcessError) as exc_info:
+            agent.run_cmd('echo failed; exit 3')
+        assert exc_info.value.returncode == 3
+        assert exc_info.value.output == 'failed\n'
+        filename = str(tmpdir.join('sub', 'run.sh'))
+        agent.write_files({filename: '#!/bin/sh\necho run\n'})
+        assert agent.run_cmd(['./run.sh'], str(tmpdir.join('sub'))) \
+            == 'run\n'
+        assert agent.request('unknown')['exit_code'] == -1
+        assert agent.requests == 6
+        # the agent is restarted if it dies
+        agent._proc.kill()
+        agent._proc.wait()
+        assert agent.run_cmd(['echo', 'again']) == 'again\n'
+    finally:
+        agent.close()
+    assert agent._proc is None
+
+
+def test_agent_remote(tmpdir):
+    """Test starting an agent through ssh, using a fake ssh that runs the
+    remote command in a local 'home' folder, after printing a banner"""
+    home = tmpdir.join('home')
+    home.ensure(dir=True)
+    ssh = tmpdir.join('ssh')
+    ssh.write('#!/bin/bash\necho "Welcome"\ncd %s && eval "$2"\n' % home)
+    set_executable(str(ssh))
+    agent = Agent('host', ssh=str(ssh), python=sys.executable)
+    try:
+        agent.write_files({'jobs/run.sh': 'echo run'})
+        assert agent.run_cmd(['cat', 'run.sh'], workdir='jobs') == 'echo run'
+    finally:
+        agent.close()
+    assert home.join('jobs', 'run.sh').check()
+
+
+def test_agent_routing(tmpdir, local_agent):
+    """Test that run_cmd and the upload functions use an enabled agent if
+    requested, and bypass it otherwise"""
+    agent = local_agent.agent('ssh', None)
+    assert run_cmd(['pwd'], None, str(tmpdir), agent=True) \
+        == str(tmpdir) + '\n'
+    upload_files({str(tmpdir.join('a.sh')): 'echo a'}, None, agent=True)
+    local_file = tmpdir.join('b.sh')
+    local_file.write('echo b')
+    upload_file(str(local_file), None, str(tmpdir.join('sub', 'b.sh')),
+                agent=True)
+    assert tmpdir.join('sub', 'b.sh').read() == 'echo b'
+    assert os.access(str(tmpdir.join('a.sh')), os.X_OK)
+    assert agent.requests == 3
+    assert run_cmd(['pwd'], None, str(tmpdir)) == str(tmpdir) + '\n'
+    assert run_cmd(['pwd'], None, str(tmpdir), agent=False) \
+        == str(tmpdir) + '\n'
+    assert agent.requests == 3
+
+
+def test_agent_unavailable(tmpdir):
+    """Test that commands are run regularly if the agent cannot start"""
+    agent_pool.enable('ssh', None, python=str(tmpdir.join('missing')))
+    assert run_cmd(['echo', 'Hello'], None, agent=True) == 'Hello\n'
+    assert not agent_pool.is_enabled('ssh', None)
+
+
+def test_agent_jobs(tmpdir, monkeypatch):
+    """Test the life cycle of jobs through an agent, with the scheduler
+    commands of the emulator"""
+    bindir = tmpdir.join('bin')
+    install(str(bindir), str(tmpdir.join('state')), flavor='slurm',
+            run_time=100).close()
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    try:
+        runs = [JobScript('echo', jobname='test%d' % i, rootdir=str(tmpdir),
+                          agent=True, agent_python=sys.executable).submit()
+                for i in range(2)]
+        agent = agent_pool.agent('ssh', None)
+        assert agent is not None
+        assert [ar.job_id for ar in runs] == ['1', '2']
+        runs[0].cancel()
+        assert runs[0].status == CANCELLED
+        assert runs[1].status < COMPLETED
+        # mkdir and submission for every job, cancellation, status queries
+        assert agent.requests == 2 * 2 + 1 + 2
+        assert AsyncResult.load(runs[1].cache_file).agent is True
+        # jobs without the agent attribute do not use the enabled agent
+        run = JobScript('echo', jobname='test', rootdir=str(tmpdir)).submit()
+        assert run.job_id == '3'
+        run.cancel()
+        assert run.status == CANCELLED
+        assert agent.requests == 2 * 2 + 1 + 2
+    finally:
+        agent_pool.close_all()
@@ -0,0 +1,118 @@
+import asyncio
+import subprocess as sp
+import pytest
+import clusterjob.aio
+from clusterjob import JobScript, AsyncResult
+from clusterjob.status import PENDING, RUNNING, COMPLETED, FAILED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def fake_run_cmd(responses):
+    """Return a coroutine function that returns the given responses, and
+    records the commands it was called with in its `calls` attribute"""
+    responses = list(responses)
+    async def run_cmd(cmd, remote, *args, **kwargs):
+        run_cmd.calls.append(cmd)
+        return responses.pop(0)
+    run_cmd.calls = []
+    return run_cmd
+
+
+def test_run_cmd(tmpdir):
+    """Test running local commands through the async run_cmd"""
+    tmpdir.join('hello.txt').write('Hello World\n')
+    aio = clusterjob.aio
+    assert run(aio.run_cmd(['cat', 'hello.txt'], None,
+                           workdir=str(tmpdir))) == 'Hello World\n'
+    assert run(aio.run_cmd("cat hello.txt | tr 'W' 'w'", None,
+                           workdir=str(tmpdir))) == 'Hello world\n'
+    with pytest.raises(sp.CalledProcessError):
+        run(aio.run_cmd(['cat', 'missing.txt'], None, workdir=str(tmpdir)))
+    assert 'missing.txt' in run(aio.run_cmd(
+        ['cat', 'missing.txt'], None, workdir=str(tmpdir),
+        ignore_exit_code=True))
+
+
+def test_max_concurrency(monkeypatch):
+    """Test that the number of commands in flight for a remote is bounded"""
+    running = {'now': 0, 'max': 0}
+    async def _run_cmd(cmd, remote, *args):
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        await asyncio.sleep(0.01)
+        running['now'] -= 1
+        return cmd
+    monkeypatch.setattr(clusterjob.aio, '_run_cmd', _run_cmd)
+    clusterjob.aio.set_max_concurrency(3)
+    try:
+        async def run_many():
+            return await asyncio.gather(*[
+                clusterjob.aio.run_cmd(str(i), 'cluster')
+                for i in range(20)])
+        assert run(run_many()) == [str(i) for i in range(20)]
+        assert running['max'] == 3
+    finally:
+        clusterjob.aio.set_max_concurrency(16)
+
+
+def test_submit_async(tmpdir, monkeypatch):
+    """Test submitting and waiting on a job with the asyncio API"""
+    run_cmd = fake_run_cmd(["Submitted batch job 123\n", "RUNNING\n",
+                            "RUNNING\n", "\n", "COMPLETED\n"])
+    monkeypatch.setattr(clusterjob.aio, 'run_cmd', run_cmd)
+    sleep = Mock()
+    async def fake_sleep(seconds):
+        sleep(seconds)
+    monkeypatch.setattr(clusterjob.aio.asyncio, 'sleep', fake_sleep)
+    job = JobScript('echo Hello', jobname='async', rootdir=str(tmpdir),
+                    workdir='jobs')
+    ar = run(job.submit_async())
+    assert isinstance(ar, AsyncResult)
+    assert ar.job_id == '123'
+    assert ar._status == PENDING
+    assert tmpdir.join('jobs', 'async.slr').check()
+    assert run(ar.status_async()) == RUNNING
+    run(ar.wait_async())
+    assert ar.status == COMPLETED
+    assert run_cmd.calls[0] == ['sbatch', 'async.slr']
+    assert run_cmd.calls[-1][0] == 'sacct'
+    sleep.assert_called_once_with(5)
+
+
+def test_submit_async_failed(tmpdir, monkeypatch):
+    run_cmd = fake_run_cmd(["sbatch: error: invalid partition\n"])
+    monkeypatch.setattr(clusterjob.aio, 'run_cmd', run_cmd)
+    job = JobScript('echo Hello', jobname='async', rootdir=str(tmpdir))
+    assert run(job.submit_async(block=True)) == FAILED
+
+
+def test_status_async_markers(monkeypatch):
+    """Test that the status is read from the marker folder of a remote job,
+    and that the marker is removed once the job has finished"""
+    run_cmd = fake_run_cmd(["a/.clusterjob/1:RUNNING - 1467372014\n",
+                            "a/.clusterjob/1:COMPLETED 0 1467372014\n", ""])
+    monkeypatch.setattr(clusterjob.aio, 'run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    ar = AsyncResult(backend=JobScript._backends['slurm'])
+    ar.remote = 'cluster'
+    ar.job_id = '1'
+    ar._status = PENDING
+    ar.marker_root = '~/jobs'
+    ar.marker_dir = 'a/.clusterjob'
+    assert run(clusterjob.aio.status(ar)) == RUNNING
+    ar._status_time = None
+    assert run(clusterjob.aio.status(ar)) == COMPLETED
+    assert run_cmd.calls == ["grep -s -H '' a/.clusterjob/*"] * 2 \
+        + ["rm -f a/.clusterjob/1 a/.clusterjob/1.*"]
@@ -0,0 +1,132 @@
+from textwrap import dedent
+from clusterjob import JobScript, AsyncResult, ArrayAsyncResult
+from clusterjob.backends import ResourcesNotSupportedError
+from clusterjob.utils import parse_array_spec, format_array_ranges
+from clusterjob.status import PENDING, RUNNING, COMPLETED, CANCELLED, FAILED
+import pytest
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+def render_headers(backend, **resources):
+    job = JobScript('echo $CLUSTERJOB_ARRAY_INDEX', jobname='sweep',
+                    backend=backend, **resources)
+    return str(job)
+
+
+def test_array_headers():
+    assert render_headers('slurm', array='1-100%10') == dedent(r'''
+    #!/bin/bash
+    #SBATCH --job-name=sweep
+    #SBATCH --array=1-100%10
+    echo $SLURM_ARRAY_TASK_ID''').strip()
+    assert render_headers('pbs', array=[1, 2, 3, 7]) == dedent(r'''
+    #!/bin/bash
+    #PBS -N sweep
+    #PBS -t 1-3,7
+    echo $PBS_ARRAYID''').strip()
+    assert render_headers('pbspro', array='1-99:2%5') == dedent(r'''
+    #!/bin/bash
+    #PBS -N sweep
+    #PBS -J 1-99:2
+    #PBS -W max_run_subjobs=5
+    echo $PBS_ARRAYID''').strip()
+    assert render_headers('sge', array=10) == dedent(r'''
+    #!/bin/bash
+    #$ -N sweep
+    #$ -t 1-10
+    #$ -cwd
+    echo $SGE_TASK_ID''').strip()
+    assert render_headers('lsf', array='1-10%2') == dedent(r'''
+    #!/bin/bash
+    #BSUB -J "sweep[1-10]%2"
+    echo $LSB_JOBINDEX''').strip()
+    with pytest.raises(ResourcesNotSupportedError):
+        render_headers('sge', array='1-10,20')
+    with pytest.raises(ResourcesNotSupportedError):
+        render_headers('pbs', array='1-10:2')
+    with pytest.raises(ValueError):
+        render_headers('slurm', array='1-a')
+
+
+def test_array_ini(tmpdir):
+    """Test that array indices read from an INI file (as a string) are
+    interpreted as by the scheduler"""
+    p = tmpdir.join("job.ini")
+    p.write(dedent(r'''
+    [Resources]
+    array = 1-10
+    '''))
+    job = JobScript('echo $CLUSTERJOB_ARRAY_INDEX', jobname='sweep',
+                    backend='slurm')
+    job.read_settings(str(p))
+    assert job.resources['array'] == '1-10'
+    assert str(job) == render_headers('slurm', array=10)
+    p.write(dedent(r'''
+    [Resources]
+    array = 10
+    '''))
+    job.read_settings(str(p))
+    assert job.resources['array'] == '10'
+    assert '#SBATCH --array=10\n' in str(job)
+
+
+def test_array_format_roundtrip():
+    """Test that formatted array ranges parse back to the same ranges"""
+    for spec in ['5', '1-10', '1-99:2,200', [3], [1, 2, 3, 7]]:
+        (ranges, __) = parse_array_spec(spec)
+        assert parse_array_spec(format_array_ranges(ranges)) \
+            == (ranges, None)
+
+
+def test_array_job_id():
+    backends = JobScript._backends
+    assert backends['slurm'].get_job_id("Submitted batch job 123\n") == '123'
+    assert backends['pbs'].get_job_id("123[].copper\n") == '123[]'
+    assert backends['pbspro'].get_job_id("123[].pbs01\n") == '123[]'
+    assert backends['sge'].get_job_id(
+        'Your job-array 123.1-10:1 ("sweep") has been submitted\n') == '123'
+    assert backends['lsf'].get_job_id(
+        "Job <123> is submitted to default queue <normal>.\n") == '123'
+
+
+def test_array_status(tmpdir, monkeypatch):
+    """Test that the status of all tasks is obtained with a single query"""
+    run_cmd = Mock(side_effect=[
+        "123_1|COMPLETED\n123_2|RUNNING\n123_[3-5%2]|PENDING\n",
+        "123_1|COMPLETED\n123_2|FAILED\n123_3|COMPLETED\n123_4|COMPLETED\n"
+        "123_5|CANCELLED by 1000\n",
+    ])
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir))
+    job = JobScript('echo $CLUSTERJOB_ARRAY_INDEX', jobname='sweep',
+                    array='1-5%2')
+    ar = job._async_result('123', PENDING, 'array')
+    assert isinstance(ar, ArrayAsyncResult)
+    assert ar.status == RUNNING
+    assert ar.status == FAILED
+    # once the array has finished, the task status is known without a query
+    assert ar.task_status == {1: COMPLETED, 2: FAILED, 3: COMPLETED,
+                              4: COMPLETED, 5: CANCELLED}
+    assert run_cmd.call_count == 2
+    assert run_cmd.call_args[0][0][-1] == '123'
+    ar2 = AsyncResult.load(str(tmpdir.join('array.cache')))
+    assert isinstance(ar2, ArrayAsyncResult)
+    assert ar2.array == '1-5%2'
+    assert ar2.status == FAILED
+
+
+def test_array_status_fallback(monkeypatch):
+    """Test that for backends without support for the status of individual
+    tasks, the status of the array is obtained as for a regular job"""
+    run_cmd = Mock(return_value="Following jobs do not exist: 123")
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    job = JobScript('sleep 1', jobname='sweep', backend='sge', array=5)
+    ar = job._async_result('123', PENDING, None)
+    assert ar.task_status == {}
+    assert ar.status == COMPLETED
+    assert run_cmd.call_args[0][0] == ['qstat', '-j', '123']
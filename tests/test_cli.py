@@ -1,6 +1,7 @@
 from __future__ import print_function
 import os
 import clusterjob.cli
+from clusterjob import JobScript, AsyncResult
 from clusterjob.cli import test_backend as cli_backend_tester
 import click
 from click.testing import CliRunner
@@ -22,6 +23,12 @@ def test_cli_backend_tester(monkeypatch, request):
     assert clusterjob.cli.DEFAULT_TEST_BODY in result.output
 
     monkeypatch.setattr(clusterjob.cli, '_run_testing_workflow', Mock())
+    # the backend tester replaces _run_cmd with a recorder; restore it
+    # afterwards, so that it does not record the commands of later tests
+    monkeypatch.setattr(JobScript, '_run_cmd',
+                        staticmethod(JobScript._run_cmd))
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        staticmethod(AsyncResult._run_cmd))
     monkeypatch.setattr(clusterjob.cli, '_abort_pause', click.echo)
     monkeypatch.setattr(clusterjob.cli, 'write_file', Mock())
     monkeypatch.setattr(click, 'clear', Mock())
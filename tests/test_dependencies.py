@@ -0,0 +1,177 @@
+import re
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.backends import ResourcesNotSupportedError
+from clusterjob.workflow import Workflow
+from clusterjob.status import PENDING, COMPLETED, CANCELLED, FAILED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+# fixtures from conftest.py: local
+
+
+def headers(backend, dependency):
+    job = JobScript('echo "Hello"', jobname='test', backend=backend,
+                    dependency=dependency)
+    return [line for line in str(job).splitlines()
+            if 'depend' in line or 'hold_jid' in line or '-w' in line]
+
+
+def test_dependency_headers():
+    spec = 'afterok:12:13,afterany:14'
+    assert headers('slurm', spec) == ['#SBATCH --dependency=%s' % spec]
+    assert headers('pbs', spec) == ['#PBS -W depend=%s' % spec]
+    assert headers('pbspro', spec) == ['#PBS -W depend=%s' % spec]
+    assert headers('sge', spec) == ['#$ -hold_jid 12,13,14']
+    assert headers('lsf', spec) \
+        == ['#BSUB -w "done(12) && done(13) && ended(14)"']
+    assert headers('lsf', 'afternotok:12') == ['#BSUB -w "exit(12)"']
+    with pytest.raises(ResourcesNotSupportedError):
+        headers('sge', 'afternotok:12')
+    with pytest.raises(ValueError):
+        headers('pbs', 'afterok')
+
+
+def test_sge_afterok_warning(caplog):
+    """Test that the 'afterok' condition, which SGE treats as 'afterany',
+    issues a warning on every submission"""
+    assert headers('sge', 'afterok:16') == ['#$ -hold_jid 16']
+    backend = JobScript._backends['sge']
+    job = JobScript('echo "Hello"', jobname='test', backend='sge',
+                    dependency='afterany:15')
+    str(job)
+    backend.cmd_submit(job)
+    assert 'afterok' not in caplog.text
+    job.resources['dependency'] = 'afterok:16,afterany:15'
+    for i in range(3):
+        str(job)
+        assert backend.cmd_submit(job)[0] == 'qsub'
+    assert caplog.text.count("SGE does not support the dependency "
+                             "condition 'afterok'; the job will start "
+                             "after jobs 16 have finished") == 3
+
+
+def make_result(job_id, status, remote=None):
+    ar = AsyncResult(backend=JobScript._backends['slurm'])
+    ar.remote = remote
+    ar.job_id = job_id
+    ar._status = status
+    return ar
+
+
+def test_submit_after(tmpdir, monkeypatch):
+    """Test that `submit` translates the `after` argument into a dependency,
+    and does not submit jobs whose dependencies cannot be satisfied"""
+    run_cmd = Mock(return_value="Submitted batch job 3\n")
+    monkeypatch.setattr(JobScript, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    job = JobScript('echo "Hello"', jobname='test', rootdir=str(tmpdir))
+    after = [make_result('1', PENDING), make_result('2', COMPLETED)]
+    ar = job.submit(after=after)
+    assert ar.job_id == '3' and ar._status == PENDING
+    assert 'dependency' not in job.resources
+    assert '#SBATCH --dependency=afterok:1' in tmpdir.join('test.slr').read()
+    n_calls = run_cmd.call_count
+    ar = job.submit(after=[make_result('2', COMPLETED)], condition='afterany')
+    assert 'dependency' not in job.resources
+    assert 'dependency' not in tmpdir.join('test.slr').read()
+    ar = job.submit(after=[make_result('2', COMPLETED)],
+                    condition='afternotok')
+    assert ar._status == CANCELLED and ar.job_id is None
+    ar = job.submit(after=after + [make_result(None, FAILED)])
+    assert ar._status == CANCELLED
+    assert run_cmd.call_count == 2 * n_calls
+    with pytest.raises(ValueError):
+        job.submit(after=after, condition='singleton')
+    with pytest.raises(ValueError):
+        job.submit(after=[make_result('4', PENDING, remote='cluster')])
+
+
+def test_dependency_single_submission(tmpdir, monkeypatch):
+    """Test that the dependency from `after` only applies to one submission,
+    and that a dependency set by the user is kept"""
+    run_cmd = Mock(return_value="Submitted batch job 3\n")
+    monkeypatch.setattr(JobScript, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    job = JobScript('echo "Hello"', jobname='test', rootdir=str(tmpdir))
+    job.submit(after=[make_result('1', PENDING)])
+    assert '--dependency=afterok:1' in tmpdir.join('test.slr').read()
+    job.submit()
+    assert 'dependency' not in tmpdir.join('test.slr').read()
+    job.resources['dependency'] = 'afterany:2'
+    job.submit(after=[make_result('1', COMPLETED)])
+    assert job.resources['dependency'] == 'afterany:2'
+    assert '--dependency=afterany:2' in tmpdir.join('test.slr').read()
+    job.submit(after=[make_result('1', PENDING)])
+    assert job.resources['dependency'] == 'afterany:2'
+    assert '--dependency=afterok:1' in tmpdir.join('test.slr').read()
+    run_cmd.side_effect = ResourcesNotSupportedError
+    job.submit(after=[make_result('4', PENDING)])
+    assert job.resources['dependency'] == 'afterany:2'
+
+
+def test_workflow_round_trips(monkeypatch):
+    """Test that a workflow is submitted with one command per level of the
+    graph, with the dependencies on the job IDs of the previous levels"""
+    job_ids = iter(range(1, 100))
+
+    def submit(cmd, remote, **kwargs):
+        markers = re.findall(r"echo '(--- clusterjob submission \d+ ---)'",
+                             cmd)
+        return "".join(["Submitted batch job %d\n%s\n" % (next(job_ids), m)
+                        for m in markers])
+
+    run_cmd = Mock(side_effect=submit)
+    monkeypatch.setattr(JobScript, '_run_cmd', run_cmd)
+    upload = Mock()
+    monkeypatch.setattr(JobScript, '_upload_files', upload)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    wf = Workflow()
+    jobs = [wf.add(JobScript('./prepare', jobname='prepare',
+                             remote='cluster'))]
+    jobs += [wf.add(JobScript('./run %d' % i, jobname='run_%d' % i,
+                              remote='cluster'), after=jobs[:1])
+             for i in range(3)]
+    jobs.append(wf.add(JobScript('./analyze', jobname='analyze',
+                                 remote='cluster'),
+                       after=jobs[1:], condition='afterany'))
+    with pytest.raises(ValueError):
+        wf.add(jobs[0])
+    with pytest.raises(ValueError):
+        wf.add(JobScript('./other', jobname='other'),
+               after=[JobScript('./missing', jobname='missing')])
+    results = wf.submit()
+    assert run_cmd.call_count == 3
+    assert upload.call_count == 3
+    assert [ar.job_id for ar in results] == ['1', '2', '3', '4', '5']
+    assert [job.resources.get('dependency') for job in jobs] == [None] * 5
+    files = upload.call_args_list[1][0][0]
+    assert '#SBATCH --dependency=afterok:1' in files['././run_0.slr']
+    files = upload.call_args_list[2][0][0]
+    assert '#SBATCH --dependency=afterany:2:3:4' in files['././analyze.slr']
+
+
+def test_local_workflow(local, tmpdir):
+    """Test that the local backend resolves the dependencies in a
+    workflow"""
+    def make_job(name, body):
+        return JobScript(body, jobname=name, backend='local',
+                         rootdir=str(tmpdir))
+
+    wf = Workflow()
+    first = wf.add(make_job('first', 'sleep 0.2; echo first >> log'))
+    second = wf.add(make_job('second', 'echo second >> log'), after=[first])
+    fail = wf.add(make_job('fail', 'exit 1'))
+    skipped = wf.add(make_job('skipped', 'echo skipped >> log'),
+                     after=[fail, second])
+    recover = wf.add(make_job('recover', 'echo recover >> log'),
+                     after=[fail], condition='afternotok')
+    statuses = wf.submit(block=True)
+    assert statuses == [COMPLETED, COMPLETED, FAILED, CANCELLED, COMPLETED]
+    log = tmpdir.join('log').read().split()
+    assert sorted(log) == ['first', 'recover', 'second']
+    assert log.index('first') < log.index('second')
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import pytest
+from clusterjob import JobScript, AsyncResult, poll_many
+from clusterjob.emulator import Emulator, install
+from clusterjob.status import PENDING, RUNNING, COMPLETED, FAILED, CANCELLED
+from clusterjob.utils import run_cmd
+# builtin fixtures: tmpdir, monkeypatch
+
+
+def use_emulator(emulator, monkeypatch):
+    monkeypatch.setattr(JobScript, '_run_cmd',
+                        staticmethod(emulator.run_cmd))
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        staticmethod(emulator.run_cmd))
+
+
+@pytest.mark.parametrize('flavor', ['slurm', 'pbs', 'pbspro', 'lpbs', 'sge',
+                                    'lsf'])
+def test_simulated_jobs(flavor, tmpdir, monkeypatch):
+    """Test the life cycle of simulated jobs through each backend"""
+    emulator = Emulator(str(tmpdir.join('state')), flavor=flavor,
+                        queue_delay=10, run_time=100, failure_rate=0.5,
+                        seed=1)
+    clock = [1000.0]
+    emulator._time = lambda: clock[0]
+    use_emulator(emulator, monkeypatch)
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    jobs = [JobScript('echo %d' % i, jobname='job%d' % i, backend=flavor,
+                      rootdir=str(tmpdir), filename='job%d.sh' % i)
+            for i in range(20)]
+    runs = [job.submit() for job in jobs]
+    assert [ar.job_id for ar in runs] == [str(i+1) for i in range(20)]
+    assert tmpdir.join('job0.sh').check()
+    # SGE does not distinguish between pending and running jobs
+    expected = RUNNING if flavor == 'sge' else PENDING
+    assert [ar.status for ar in runs] == [expected, ] * 20
+    clock[0] += 50
+    assert poll_many(runs) == [RUNNING, ] * 20
+    runs[0].cancel()
+    assert runs[0].status == CANCELLED
+    clock[0] += 100
+    statuses = poll_many(runs[1:])
+    if flavor in ['slurm', 'lsf']:
+        assert set(statuses) == set([COMPLETED, FAILED])
+        # the failures are reproducible for a given seed
+        assert statuses == [ar.status for ar in runs[1:]]
+    else: # PBS and SGE do not report failures
+        assert set(statuses) == set([COMPLETED, ])
+    emulator.close()
+
+
+def test_submit_failure(tmpdir, monkeypatch):
+    emulator = Emulator(str(tmpdir), flavor='slurm', run_time=1,
+                        submit_failure_rate=1.0)
+    use_emulator(emulator, monkeypatch)
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    ar = JobScript('echo', jobname='test', rootdir=str(tmpdir)).submit()
+    assert ar.status == FAILED
+    assert emulator.jobs() == []
+    # configuration is shared through the state directory
+    assert Emulator(str(tmpdir)).config['submit_failure_rate'] == 1.0
+    with pytest.raises(TypeError):
+        Emulator(str(tmpdir), run_time=1, failure=1.0)
+    emulator.close()
+
+
+def test_executed_jobs(tmpdir, monkeypatch):
+    """Test that job scripts are executed by the workers of the emulator"""
+    emulator = Emulator(str(tmpdir.join('state')), flavor='slurm')
+    use_emulator(emulator, monkeypatch)
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    monkeypatch.setattr(AsyncResult, '_min_sleep_interval', 0)
+    job = JobScript('echo "$CLUSTERJOB_NAME $CLUSTERJOB_ID"; exit {code}',
+                    jobname='test', rootdir=str(tmpdir))
+    job.code = 0
+    job.resources['stdout'] = 'ok.out'
+    ar_ok = job.submit(cache_id='ok')
+    job.code = 1
+    job.resources['stdout'] = 'fail.out'
+    ar_fail = job.submit(cache_id='fail')
+    ar_long = JobScript('sleep 60', jobname='long', rootdir=str(tmpdir)
+                        ).submit()
+    assert poll_many([ar_ok, ar_fail, ar_long]) == [PENDING, ] * 3
+    stop = threading.Event()
+    server = threading.Thread(target=emulator.serve,
+                              kwargs=dict(workers=2, poll_interval=0.01,
+                                          stop=stop))
+    server.start()
+    try:
+        ar_ok.max_sleep_interval = ar_fail.max_sleep_interval = 0.01
+        assert ar_ok.get(timeout=10) == COMPLETED
+        assert ar_fail.get(timeout=10) == FAILED
+        assert tmpdir.join('ok.out').read() == "test 1\n"
+        assert tmpdir.join('fail.out').read() == "test 2\n"
+        while ar_long.status != RUNNING:
+            time.sleep(0.01)
+        ar_long.cancel()
+        assert ar_long.status == CANCELLED
+    finally:
+        ar_long.cancel()
+        stop.set()
+        server.join()
+    emulator.close()
+
+
+def test_install(tmpdir, monkeypatch):
+    """Test the emulated scheduler through wrapper executables"""
+    bindir = tmpdir.join('bin')
+    for flavor in ['slurm', 'lsf']:
+        statedir = str(tmpdir.join(flavor))
+        install(str(bindir), statedir, flavor=flavor, run_time=0).close()
+        assert bindir.join(JobScript._backends[flavor].cmd_status(
+            AsyncResult(JobScript._backends[flavor]))[0]).check()
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    for flavor in ['slurm', 'lsf']:
+        ar = JobScript('echo', jobname='test', backend=flavor,
+                       rootdir=str(tmpdir)).submit()
+        assert ar.job_id == '1'
+        assert ar.status == COMPLETED
+    assert run_cmd(['bjobs', '2'], remote=None) == "Job <2> is not found\n"
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult, poll_many
+from clusterjob.epilogue import epilogue_executor
+from clusterjob.status import RUNNING, COMPLETED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+def make_result(job_id, tmpdir, epilogue, workers=2):
+    ar = AsyncResult(backend=JobScript._backends['slurm'])
+    ar.job_id = job_id
+    ar._status = RUNNING
+    ar.cache_file = str(tmpdir.join('%s.cache' % job_id))
+    ar.epilogue = "#!/bin/bash\ncd %s\n%s\n" % (tmpdir, epilogue)
+    ar.epilogue_workers = workers
+    ar.epilogue_backoff = 1
+    return ar
+
+
+@pytest.fixture
+def sleep(monkeypatch):
+    sleep = Mock()
+    monkeypatch.setattr(epilogue_executor, '_sleep', sleep)
+    return sleep
+
+
+def test_background_epilogue(tmpdir, monkeypatch, sleep):
+    """Test that epilogues of finished jobs do not block polling, and that
+    at most `epilogue_workers` epilogues run at the same time"""
+    monkeypatch.setattr(AsyncResult, '_run_cmd', Mock(
+        return_value="1 COMPLETED\n2 COMPLETED\n3 COMPLETED\n"))
+    results = [make_result(str(i), tmpdir, 'echo start >> log; sleep 0.2; '
+                           'echo end >> log', workers=1)
+               for i in (1, 2, 3)]
+    t0 = time.time()
+    assert poll_many(results) == [COMPLETED, ] * 3
+    assert time.time() - t0 < 0.2
+    assert [ar.epilogue_state for ar in results] == ['pending', ] * 3
+    assert AsyncResult.load(results[2].cache_file).epilogue_state \
+        == 'pending'
+    assert results[0].get(wait_epilogue=False) == COMPLETED
+    assert [ar.get() for ar in results] == [COMPLETED, ] * 3
+    assert [ar.epilogue_state for ar in results] == ['done', ] * 3
+    assert epilogue_executor.join(timeout=5)
+    assert AsyncResult.load(results[2].cache_file).epilogue_state == 'done'
+    assert tmpdir.join('log').read().split() == ['start', 'end'] * 3
+    assert sleep.call_count == 0
+
+
+def test_epilogue_retries(tmpdir, sleep):
+    """Test that failing epilogues are retried with exponential backoff"""
+    flaky = make_result('1', tmpdir, 'if [ -f flag ]; then exit 0; fi\n'
+                        'touch flag; exit 1')
+    broken = make_result('2', tmpdir, 'exit 1')
+    for ar in (flaky, broken):
+        ar._update_status(COMPLETED)
+    assert epilogue_executor.join(timeout=10)
+    assert flaky.epilogue_state == 'done'
+    assert broken.epilogue_state == 'failed'
+    assert sorted([call[0][0] for call in sleep.call_args_list]) \
+        == [1, 1, 2]
+
+
+def test_resume_epilogue(tmpdir, sleep):
+    """Test that an epilogue that was pending when the result was cached is
+    run when the result is loaded"""
+    ar = make_result('1', tmpdir, 'touch done')
+    ar._status = COMPLETED
+    ar.epilogue_state = 'pending'
+    ar.dump()
+    first = AsyncResult.load(ar.cache_file)
+    second = AsyncResult.load(ar.cache_file)
+    assert first.wait_epilogue(timeout=5)
+    assert second.wait_epilogue(timeout=5)
+    assert first.epilogue_state == second.epilogue_state == 'done'
+    assert tmpdir.join('done').check()
+    assert AsyncResult.load(ar.cache_file).epilogue_state == 'done'
@@ -206,10 +206,15 @@ def test_read_defaults(caplog, tmpdir):
     caplog.setLevel(logging.DEBUG, logger='clusterjob')
     jobscript = JobScript(body="echo 'Hello'", jobname="test")
     assert get_attributes(jobscript) == ['aux_scripts', 'body', 'resources']
-    assert get_attributes(jobscript.__class__) == ['backend', 'backends',
-            'cache_folder', 'cache_prefix', 'epilogue', 'filename',
-            'max_sleep_interval', 'prologue', 'remote', 'resources', 'rootdir',
-            'scp', 'shell', 'ssh', 'workdir']
+    assert get_attributes(jobscript.__class__) == ['agent', 'agent_python',
+            'backend', 'backends', 'cache_backend', 'cache_folder',
+            'cache_prefix', 'cancel_rate', 'epilogue', 'epilogue_backoff',
+            'epilogue_retries', 'epilogue_workers', 'filename', 'marker_grace',
+            'max_sleep_interval', 'prologue', 'rate_burst', 'remote',
+            'resources', 'rootdir', 'rsync', 'scp', 'shell', 'ssh',
+            'ssh_multiplex', 'ssh_persist', 'stage_compress', 'stage_in',
+            'stage_out', 'status_markers', 'status_rate', 'stream_submit',
+            'submit_rate', 'upload_rate', 'workdir']
     for attr in get_attributes(jobscript.__class__):
         if attr not in ['resources', 'backends']:
             assert getattr(jobscript, attr) == default_class_attr_val(attr)
@@ -1,7 +1,9 @@
 from textwrap import dedent
 from clusterjob import JobScript
+from clusterjob.backends import ClusterjobBackend
 import logging
 import os
+import pytest
 try:
     from unittest.mock import Mock
 except ImportError:
@@ -15,8 +17,8 @@ def test_init():
                           queue='test', time='00:05:00', nodes=1, threads=1,
                           mem=100, stdout='printenv.out',
                           stderr='printenv.err')
-    assert jobscript.backends == ['lpbs', 'lsf', 'pbs', 'pbspro', 'sge',
-            'slurm']
+    assert jobscript.backends == ['local', 'lpbs', 'lsf', 'pbs', 'pbspro',
+            'sge', 'slurm']
     for key in ['jobname', 'queue', 'time', 'nodes', 'threads', 'mem',
             'stdout', 'stderr']:
         assert key in jobscript.resources
@@ -71,3 +73,146 @@ def test_write(tmpdir, monkeypatch):
     monkeypatch.setattr(JobScript, '_upload_file', Mock())
     job.write()
     assert job._upload_file.call_count == 1
+
+
+def test_render_cache(monkeypatch):
+    """Check that rendered scripts are cached, and that the cache is
+    invalidated by any change to attributes or resources"""
+    body = dedent(r'''
+    echo {greeting} {jobname}
+    echo "$CLUSTERJOB_NAME"
+    echo {text:>{width}}''').strip()
+    jobscript = JobScript(body, jobname='test', greeting='Hello')
+    jobscript.width = 4
+    monkeypatch.setattr(JobScript, 'text', 'X', raising=False)
+    assert str(jobscript) == dedent(r'''
+    #!/bin/bash
+    #SBATCH --job-name=test
+    #SBATCH --greeting=Hello
+    echo Hello test
+    echo "$SLURM_JOB_NAME"
+    echo    X''').strip()
+    backend = jobscript._backends['slurm']
+    replace_body_vars = Mock(side_effect=lambda body: body)
+    monkeypatch.setattr(backend, 'replace_body_vars', replace_body_vars)
+    resource_headers = Mock(return_value=[])
+    monkeypatch.setattr(backend, 'resource_headers', resource_headers)
+    rendered = str(jobscript)
+    assert str(jobscript) is rendered
+    assert resource_headers.call_count == 0
+    assert replace_body_vars.call_count == 0 # compiled earlier
+    jobscript.resources['greeting'] = 'Hi'
+    assert 'echo Hi test' in str(jobscript)
+    del jobscript.resources['greeting']
+    jobscript.greeting = 'Hey'
+    assert 'echo Hey test' in str(jobscript)
+    monkeypatch.setattr(JobScript, 'text', 'Y')
+    assert str(jobscript).endswith('echo    Y')
+    del jobscript.width
+    monkeypatch.setattr(JobScript, 'width', 2, raising=False)
+    assert str(jobscript).endswith('echo  Y')
+    assert resource_headers.call_count == 4
+    jobscript.resources.pop('jobname')
+    try:
+        str(jobscript)
+        assert False, "Expected KeyError"
+    except KeyError as exc:
+        assert "placeholder '{jobname}'" in str(exc)
+
+
+def test_render_cache_backend_config(monkeypatch):
+    """Check that in-place changes to the header configuration of the backend
+    invalidate the rendered script"""
+    jobscript = JobScript('echo', jobname='test', backend='pbs', mem=100)
+    assert '#PBS -l mem=100m' in str(jobscript)
+    backend = jobscript._backends['pbs']
+    monkeypatch.setitem(backend.resource_replacements, 'mem', '-l pmem=')
+    assert '#PBS -l pmem=100m' in str(jobscript)
+
+
+def test_replace_body_vars():
+    """Check the single-pass replacement of environment variables, and that
+    changes to the backend's job_vars take effect in rendered scripts"""
+    for backend in JobScript._backends.values():
+        body = "\n".join(["echo %s" % key for key in backend.job_vars])
+        expected = "\n".join(["echo %s" % val
+                              for val in backend.job_vars.values()])
+        assert backend.replace_body_vars(body) == expected
+    backend = JobScript._backends['pbs']
+    assert backend.replace_body_vars(
+        "$CLUSTERJOB_ID/${CLUSTERJOB_ID}$CLUSTERJOB_NAME") \
+        == "$PBS_JOBID/${PBS_JOBID}$PBS_JOBNAME"
+    jobscript = JobScript("echo $CLUSTERJOB_ACCOUNT", jobname='test',
+                          backend='pbs')
+    assert str(jobscript).endswith("echo $CLUSTERJOB_ACCOUNT")
+    try:
+        backend.set_job_var('CLUSTERJOB_ACCOUNT', '$PBS_ACCOUNT')
+        assert str(jobscript).endswith("echo $PBS_ACCOUNT")
+        # replacements are not replaced again
+        backend.set_job_var('PBS_ACCOUNT', 'none')
+        assert str(jobscript).endswith("echo $PBS_ACCOUNT")
+        assert backend.job_vars['${CLUSTERJOB_ACCOUNT}'] == '${PBS_ACCOUNT}'
+    finally:
+        for key in ['$CLUSTERJOB_ACCOUNT', '${CLUSTERJOB_ACCOUNT}',
+                    '$PBS_ACCOUNT', '${PBS_ACCOUNT}']:
+            del backend.job_vars[key]
+    assert str(jobscript).endswith("echo $CLUSTERJOB_ACCOUNT")
+
+
+def test_resource_headers_cache(monkeypatch):
+    """Check that resource headers are compiled only once for identical
+    resources, and that changes to the backend invalidate the cache"""
+    backend = JobScript._backends['pbs']
+    monkeypatch.setattr(backend, '_header_cache', None, raising=False)
+    compile_headers = Mock(side_effect=backend._compile_headers)
+    monkeypatch.setattr(backend, '_compile_headers', compile_headers)
+    jobs = [JobScript('echo', jobname='test', backend='pbs', nodes=2,
+                      ppn=4, mem=100, array='1-10%2') for i in range(3)]
+    expected = ['#PBS -l nodes=2:ppn=4', '#PBS -N test', '#PBS -l mem=100m',
+                '#PBS -t 1-10%2']
+    for job in jobs:
+        assert sorted(backend.resource_headers(job)) == sorted(expected)
+    assert compile_headers.call_count == 1
+    # the returned list is a copy
+    backend.resource_headers(jobs[0]).append('#PBS -V')
+    assert '#PBS -V' not in backend.resource_headers(jobs[0])
+    jobs[0].resources['mem'] = 200
+    assert '#PBS -l mem=200m' in backend.resource_headers(jobs[0])
+    assert compile_headers.call_count == 2
+    # unhashable values bypass the cache
+    jobs[0].resources['queue'] = set(['a'])
+    backend.resource_headers(jobs[0])
+    backend.resource_headers(jobs[0])
+    assert compile_headers.call_count == 4
+    monkeypatch.setitem(backend.resource_replacements, 'mem', '-l pmem=')
+    assert '#PBS -l pmem=100m' in backend.resource_headers(jobs[1])
+    assert compile_headers.call_count == 5
+    monkeypatch.setitem(backend.resource_converters, 'mem',
+                        lambda val: "%dgb" % val)
+    assert '#PBS -l pmem=100gb' in backend.resource_headers(jobs[1])
+    assert compile_headers.call_count == 6
+    monkeypatch.setattr(backend, 'fixed_headers', ['-V'])
+    assert '#PBS -V' in backend.resource_headers(jobs[1])
+    monkeypatch.setattr(backend, 'prefix', '#XPBS')
+    assert '#XPBS -N test' in backend.resource_headers(jobs[1])
+    monkeypatch.setattr(backend, 'ignored_resources', ('jobname', ))
+    assert '#XPBS -N test' not in backend.resource_headers(jobs[1])
+    assert compile_headers.call_count == 9
+
+
+def test_abstract_header_methods():
+    """Check that a backend must implement resource_headers and
+    replace_body_vars"""
+    class IncompleteBackend(ClusterjobBackend):
+        def cmd_submit(self, jobscript):
+            return 'submit'
+        def get_job_id(self, response):
+            return '1'
+        def cmd_status(self, run, finished=False):
+            return 'status'
+        def get_status(self, response, finished=False):
+            return None
+        def cmd_cancel(self, run):
+            return 'cancel'
+    with pytest.raises(TypeError):
+        IncompleteBackend()
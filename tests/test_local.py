@@ -0,0 +1,95 @@
+import time
+from clusterjob import JobScript, AsyncResult, poll_many
+from clusterjob.status import PENDING, RUNNING, COMPLETED, FAILED, CANCELLED
+# builtin fixtures: tmpdir, monkeypatch
+# fixtures from conftest.py: local
+
+
+def wait_for(ar, status, timeout=10):
+    t0 = time.time()
+    while ar.status != status:
+        assert time.time() - t0 < timeout
+        time.sleep(0.01)
+
+
+def test_local_run(local, tmpdir):
+    job = JobScript(r'''
+    echo "$CLUSTERJOB_NAME $CLUSTERJOB_ID $OMP_NUM_THREADS"
+    echo "error" >&2
+    exit {code}''', jobname='test', backend='local', rootdir=str(tmpdir),
+                    workdir='run', threads=2, stdout='test.out',
+                    stderr='test.err')
+    job.code = 0
+    assert sorted(str(job).splitlines()[1:5]) == [
+        '#LOCAL --cpus-per-task=2', '#LOCAL --error=test.err',
+        '#LOCAL --job-name=test', '#LOCAL --output=test.out']
+    ar = job.submit(cache_id='ok')
+    ar.max_sleep_interval = 0.01
+    assert ar.get(timeout=10) == COMPLETED
+    assert tmpdir.join('run', 'test.out').read() \
+        == "test %s 2\n" % ar.job_id
+    assert tmpdir.join('run', 'test.err').read() == "error\n"
+    job.code = 1
+    ar = job.submit(cache_id='fail')
+    ar.max_sleep_interval = 0.01
+    assert ar.get(timeout=10) == FAILED
+
+
+def test_local_admission(local, tmpdir):
+    """Test that jobs only start when enough cores and memory are free"""
+    def sleeper(**resources):
+        return JobScript('sleep 60', backend='local', rootdir=str(tmpdir),
+                         **resources).submit()
+    ar1 = sleeper(jobname='job1', nodes=1, ppn=1, threads=3)
+    ar2 = sleeper(jobname='job2', threads=2)
+    ar3 = sleeper(jobname='job3', mem=1000)
+    wait_for(ar1, RUNNING)
+    # job3 fits into the remaining core, job2 does not
+    wait_for(ar3, RUNNING)
+    assert ar2.status == PENDING
+    ar1.cancel()
+    wait_for(ar2, RUNNING)
+    assert poll_many([ar1, ar2, ar3]) == [CANCELLED, RUNNING, RUNNING]
+    ar4 = sleeper(jobname='job4', mem=10)
+    time.sleep(0.05)
+    assert ar4.status == PENDING
+    ar3.cancel()
+    wait_for(ar4, RUNNING)
+    # jobs that can never run are rejected
+    assert sleeper(jobname='job5', threads=5).status == FAILED
+    assert sleeper(jobname='job6', mem=2000).status == FAILED
+    assert sleeper(jobname='job7', array=4).status == FAILED
+
+
+def test_local_time_limit(local, tmpdir):
+    ar = JobScript('sleep 60', jobname='test', backend='local',
+                   rootdir=str(tmpdir), time='00:00:01').submit()
+    wait_for(ar, FAILED, timeout=5)
+
+
+def test_local_unknown_job(local):
+    ar = AsyncResult(local)
+    ar.job_id = '1.1'
+    ar._status = RUNNING
+    assert ar.status == CANCELLED
+
+
+def test_local_submit_many(local, tmpdir):
+    jobs = [JobScript('echo %d' % i, jobname='test_%d' % i, backend='local',
+                      rootdir=str(tmpdir)) for i in range(3)]
+    results = JobScript.submit_many(jobs, cache_ids=['a', 'b', 'c'])
+    for (i, ar) in enumerate(results):
+        wait_for(ar, COMPLETED)
+        assert tmpdir.join('test_%d.out' % i).read() == "%d\n" % i
+
+
+def test_local_submit_many_cache_keys(local, tmpdir):
+    """Test that every job takes exactly one cache key"""
+    jobs = [JobScript('echo %d' % i, jobname='test_%d' % i, backend='local',
+                      rootdir=str(tmpdir)) for i in range(3)]
+    counter = JobScript._cache_counter
+    results = JobScript.submit_many(jobs)
+    assert JobScript._cache_counter == counter + 3
+    for (i, ar) in enumerate(results):
+        assert ar.cache_file.endswith('.%d.cache' % (counter + i + 1))
+        wait_for(ar, COMPLETED)
@@ -0,0 +1,107 @@
+import time
+from textwrap import dedent
+
+from clusterjob import JobScript, AsyncResult, poll_many
+from clusterjob.status import PENDING, RUNNING, COMPLETED, FAILED
+from clusterjob.utils import run_cmd
+from clusterjob.markers import read_markers
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+# fixtures from conftest.py: local
+
+
+def test_marker_rendering():
+    job = JobScript(dedent(r'''
+    #SBATCH --exclusive
+
+    echo "Hello"
+    ''').strip(), jobname='test', status_markers=True)
+    lines = str(job).splitlines()
+    assert lines[:4] == ['#!/bin/bash', '#SBATCH --job-name=test',
+                         '#SBATCH --exclusive', '']
+    assert lines[4] == '# clusterjob status marker'
+    assert lines[5] == \
+        '_clusterjob_marker="$SLURM_SUBMIT_DIR/.clusterjob/$SLURM_JOBID"'
+    assert lines[-1] == 'echo "Hello"'
+    job = JobScript('echo "Hello"', jobname='test', array=10,
+                    status_markers=True)
+    assert '_clusterjob_marker' not in str(job)
+
+
+def test_local_markers(local, tmpdir, monkeypatch):
+    """Test that the status of jobs is obtained from markers written by the
+    jobs, without asking the scheduler"""
+    query = Mock(side_effect=run_cmd)
+    monkeypatch.setattr(AsyncResult, '_run_cmd', query)
+    results = {}
+    for (name, body) in [('ok', 'exit 0'), ('fail', 'exit 3'),
+                         ('killed', 'kill -TERM $$; sleep 5')]:
+        job = JobScript(body, jobname=name, backend='local',
+                        rootdir=str(tmpdir), workdir='run',
+                        status_markers=True)
+        results[name] = job.submit()
+        assert results[name].marker_dir == 'run/.clusterjob'
+    marker_folder = str(tmpdir.join('run', '.clusterjob'))
+
+    def final_markers():
+        markers = read_markers(marker_folder)
+        if all([markers.get(ar.job_id, (RUNNING, ))[0] != RUNNING
+                for ar in results.values()]):
+            return markers
+
+    t0 = time.time()
+    while final_markers() is None:
+        assert time.time() - t0 < 10
+        time.sleep(0.01)
+    markers = final_markers()
+    assert markers[results['fail'].job_id][:2] == (FAILED, 3)
+    assert markers[results['killed'].job_id][:2] == (FAILED, 143)
+    t0 = time.time()
+    while PENDING in poll_many(results.values()) \
+            or RUNNING in poll_many(results.values()):
+        assert time.time() - t0 < 10
+        time.sleep(0.01)
+    assert results['ok'].status == COMPLETED
+    assert results['fail'].status == FAILED
+    assert results['killed'].status == FAILED
+    assert query.call_count == 0
+    assert tmpdir.join('run', '.clusterjob').listdir() == []
+
+
+def test_remote_markers(monkeypatch):
+    """Test that all markers on a remote are obtained with one command, that
+    the scheduler is queried only for jobs without a marker after the grace
+    period, and that the markers of finished jobs are removed"""
+    responses = [
+        "a/.clusterjob/1.server:COMPLETED 0 1467372014\n"
+        "b/.clusterjob/2:RUNNING - %d\n" % time.time(),
+        "4 PENDING\n",
+        "",
+    ]
+    query = Mock(side_effect=responses)
+    monkeypatch.setattr(AsyncResult, '_run_cmd', query)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    results = []
+    for (job_id, workdir, submitted) in [
+            ('1', 'a', 0), ('2', 'b', 0), ('3', 'a', time.time()),
+            ('4', 'b', 0)]:
+        ar = AsyncResult(backend=JobScript._backends['slurm'])
+        ar.remote = 'cluster'
+        ar.job_id = job_id
+        ar._status = PENDING
+        ar.submitted = submitted
+        ar.marker_root = '~/jobs'
+        ar.marker_dir = workdir + '/.clusterjob'
+        results.append(ar)
+    assert poll_many(results) == [COMPLETED, RUNNING, PENDING, PENDING]
+    assert query.call_count == 3
+    (args, kwargs) = query.call_args_list[0]
+    assert args[0] == "grep -s -H '' a/.clusterjob/* b/.clusterjob/*"
+    assert args[1:3] == ('cluster', '~/jobs')
+    assert query.call_args_list[1][0][0][-1] == '4'
+    (args, kwargs) = query.call_args_list[2]
+    assert args[0] == "rm -f a/.clusterjob/1 a/.clusterjob/1.*"
+    assert args[1:3] == ('cluster', '~/jobs')
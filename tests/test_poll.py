@@ -0,0 +1,213 @@
+import time
+
+import pytest
+
+import clusterjob
+from clusterjob import (JobScript, AsyncResult, poll_many, as_completed, wait,
+                        FIRST_COMPLETED)
+from clusterjob.status import PENDING, RUNNING, COMPLETED, CANCELLED, FAILED
+from clusterjob.backends.slurm import SlurmBackend
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: monkeypatch
+
+
+SQUEUE_RESPONSES = [
+    "101 RUNNING\n102 PENDING\n103 RUNNING\n",
+    "102 RUNNING\n103 RUNNING\n", "101|COMPLETED\n",
+    "102 RUNNING\n103 RUNNING\n",
+    "", "102|FAILED\n103|COMPLETED\n",
+]
+
+
+def make_results(backend_name, job_ids, status=PENDING, remote='cluster'):
+    results = []
+    for job_id in job_ids:
+        ar = AsyncResult(backend=JobScript._backends[backend_name])
+        ar.remote = remote
+        ar.job_id = job_id
+        ar._status = status
+        results.append(ar)
+    return results
+
+
+def test_poll_many_slurm(monkeypatch):
+    """Test that the status of many SLURM jobs is obtained with one squeue and
+    one sacct call"""
+    responses = [
+        "101 RUNNING\n102 PENDING\n",
+        "103|COMPLETED\n104|CANCELLED by 1234\n",
+    ]
+    run_cmd = Mock(side_effect=responses)
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'run_epilogue', Mock())
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    results = make_results('slurm', ['101', '102', '103', '104'])
+    finished = make_results('slurm', ['105', ], status=COMPLETED)
+    statuses = poll_many(results + finished)
+    assert statuses == [RUNNING, PENDING, COMPLETED, CANCELLED, COMPLETED]
+    assert run_cmd.call_count == 2
+    squeue_cmd = run_cmd.call_args_list[0][0][0]
+    assert squeue_cmd[0] == 'squeue'
+    assert squeue_cmd[-1] == '101,102,103,104'
+    sacct_cmd = run_cmd.call_args_list[1][0][0]
+    assert sacct_cmd[0] == 'sacct'
+    assert sacct_cmd[-1] == '103,104'
+    # 102 did not change its status
+    assert AsyncResult.dump.call_count == 3
+    assert AsyncResult.run_epilogue.call_count == 2
+
+
+SACCT_RESPONSE = """\
+101|RUNNING|0:0|00:10:05|2024-05-01T10:00:00|Unknown
+102|PENDING|0:0|00:00:00|Unknown|Unknown
+103|FAILED|2:0|1-02:00:00|2024-04-30T08:00:00|2024-05-01T10:00:00
+104|CANCELLED by 1234|0:15|00:01:00|2024-05-01T09:00:00|2024-05-01T09:01:00
+105_[1-3]|PENDING|0:0|00:00:00|Unknown|Unknown
+"""
+
+
+@pytest.fixture
+def sacct_slurm(monkeypatch):
+    """A SlurmBackend in the 'sacct' status mode, registered as
+    'slurm_sacct'"""
+    backend = SlurmBackend(status_mode='sacct')
+    monkeypatch.setitem(JobScript._backends, 'slurm_sacct', backend)
+    return backend
+
+
+def test_sacct_status(sacct_slurm, monkeypatch):
+    """Test that in the 'sacct' status mode, a single sacct call determines
+    the status, exit code and timings of a job"""
+    run_cmd = Mock(return_value=SACCT_RESPONSE.splitlines()[2] + "\n")
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'run_epilogue', Mock())
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    ar = make_results('slurm_sacct', ['103'])[0]
+    assert ar.status == FAILED
+    assert run_cmd.call_count == 1
+    assert run_cmd.call_args[0][0] == [
+        'sacct', '--parsable2', '--noheader', '-X',
+        '--format=JobID,State,ExitCode,Elapsed,Start,End', '-j', '103']
+    assert (ar.exit_code, ar.elapsed) == (2, 93600)
+    assert ar.start_time == '2024-04-30T08:00:00'
+    assert ar.end_time == '2024-05-01T10:00:00'
+    # jobs that are not (yet) known to sacct are looked up with squeue
+    run_cmd = Mock(side_effect=["", "PENDING\n"])
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    ar = make_results('slurm_sacct', ['106'])[0]
+    assert ar.status == PENDING
+    assert run_cmd.call_args[0][0][0] == 'squeue'
+    assert ar.exit_code is None
+    with pytest.raises(ValueError):
+        SlurmBackend(status_mode='scontrol')
+
+
+def test_poll_many_sacct(sacct_slurm, monkeypatch):
+    """Test that in the 'sacct' status mode, poll_many needs a single sacct
+    call"""
+    run_cmd = Mock(return_value=SACCT_RESPONSE)
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'run_epilogue', Mock())
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    results = make_results('slurm_sacct', ['101', '102', '103', '104'])
+    assert poll_many(results) == [RUNNING, PENDING, FAILED, CANCELLED]
+    assert run_cmd.call_count == 1
+    assert run_cmd.call_args[0][0][-1] == '101,102,103,104'
+    assert [ar.exit_code for ar in results] == [0, 0, 2, 0]
+    assert [ar.elapsed for ar in results] == [605, 0, 93600, 60]
+    assert results[0].end_time is None
+    assert sacct_slurm.get_status_many(SACCT_RESPONSE)['105_[1-3]'] \
+        == PENDING
+    # in the default mode, a cancellation is recognized in the sacct
+    # response
+    assert JobScript._backends['slurm'].get_status(
+        "CANCELLED by 1234\n", finished=True) == CANCELLED
+
+
+def test_poll_many_groups(monkeypatch):
+    """Test that jobs are grouped by remote and backend, and that backends
+    without support for bulk queries fall back to per-job queries"""
+    run_cmd = Mock(side_effect=[
+        "201 RUNNING\n",  # squeue on cluster1
+        "202 RUNNING\n",  # squeue on cluster2
+        "Following jobs do not exist: 301",  # qstat -j 301
+        "job_number: 302",  # qstat -j 302
+    ])
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    results = (make_results('slurm', ['201'], remote='cluster1')
+               + make_results('slurm', ['202'], remote='cluster2')
+               + make_results('sge', ['301', '302']))
+    assert poll_many(results) == [RUNNING, RUNNING, COMPLETED, RUNNING]
+    assert run_cmd.call_count == 4
+    assert run_cmd.call_args_list[1][0][1] == 'cluster2'
+    assert run_cmd.call_args_list[2][0][0] == ['qstat', '-j', '301']
+
+
+def test_get_status_many():
+    pbs = JobScript._backends['pbs']
+    response = "\n".join([
+        "Job id            Name             User   Time Use S Queue",
+        "----------------  ---------------- ------ -------- - -----",
+        "401.copper        test_clj         goerz  00:00:00 R batch",
+        "402.copper        test_clj         goerz  00:00:00 Q batch",
+        "qstat: Unknown Job Id 403.copper",
+    ])
+    assert pbs.get_status_many(response) == {
+            '401': RUNNING, '402': PENDING, '403': COMPLETED}
+    lsf = JobScript._backends['lsf']
+    response = "\n".join([
+        "JOBID   USER    STAT  QUEUE      FROM_HOST   EXEC_HOST   JOB_NAME",
+        "501     goerz   RUN   normal     login1      node1       test_clj",
+        "502     goerz   EXIT  normal     login1      node2       test_clj",
+        "Job <503> is not found",
+    ])
+    assert lsf.get_status_many(response) == {'501': RUNNING, '502': FAILED}
+
+
+def test_as_completed(monkeypatch):
+    """Test that jobs are yielded as they finish, with a shared backoff"""
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        Mock(side_effect=SQUEUE_RESPONSES))
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    sleep = Mock()
+    monkeypatch.setattr(clusterjob.time, 'sleep', sleep)
+    results = (make_results('slurm', ['101', '102', '103'])
+               + make_results('slurm', ['104'], status=COMPLETED))
+    finished = [ar.job_id for ar in as_completed(iter(results))]
+    assert finished == ['104', '101', '102', '103']
+    assert AsyncResult._run_cmd.call_count == 6
+    assert [call[0][0] for call in sleep.call_args_list] == [5, 5, 10]
+
+
+def test_wait(monkeypatch):
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        Mock(side_effect=SQUEUE_RESPONSES))
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    monkeypatch.setattr(clusterjob.time, 'sleep', Mock())
+    results = make_results('slurm', ['101', '102', '103'])
+    (done, not_done) = wait(results, return_when=FIRST_COMPLETED)
+    assert done == set(results[:1])
+    assert not_done == set(results[1:])
+    (done, not_done) = wait(results)
+    assert done == set(results)
+    assert len(not_done) == 0
+    assert [ar._status for ar in results] == [COMPLETED, FAILED, COMPLETED]
+    with pytest.raises(ValueError):
+        wait(results, return_when='FIRST_EXCEPTION')
+
+
+def test_wait_timeout(monkeypatch):
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        Mock(return_value="101 RUNNING\n102 RUNNING\n"))
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    results = make_results('slurm', ['101', '102'])
+    t0 = time.time()
+    (done, not_done) = wait(results, timeout=0.1)
+    assert 0.1 <= time.time() - t0 < 1.0
+    assert len(done) == 0 and not_done == set(results)
+    with pytest.raises(clusterjob.TimeoutError):
+        list(as_completed(results, timeout=0.1))
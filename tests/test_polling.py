@@ -0,0 +1,149 @@
+import time
+import threading
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.polling import (BackoffPolling, AdaptivePolling,
+                                RuntimeHistory)
+import clusterjob.polling
+from clusterjob.status import PENDING, RUNNING, COMPLETED, CANCELLED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: monkeypatch
+
+
+def make_result(status=RUNNING, jobname='test', walltime=None,
+                max_sleep_interval=900):
+    ar = AsyncResult(backend=JobScript._backends['slurm'])
+    ar.job_id = '123'
+    ar._status = status
+    ar.jobname = jobname
+    ar.walltime = walltime
+    ar.max_sleep_interval = max_sleep_interval
+    return ar
+
+
+def test_runtime_history():
+    history = RuntimeHistory(maxlen=3)
+    assert history.predict('test') is None
+    for runtime in [100, 10, 20]:
+        history.record('test', runtime)
+    assert history.predict('test') == 20
+    history.record('test', 30) # discards 100
+    assert history.predict('test') == 20
+    history.record('test', 40)
+    assert history.predict('test') == 30
+    history.clear()
+    assert history.predict('test') is None
+
+
+def test_backoff_polling():
+    polling = BackoffPolling()
+    ar = make_result(max_sleep_interval=30)
+    intervals = [polling.interval(ar, None, False)]
+    for i in range(3):
+        intervals.append(polling.interval(ar, intervals[-1], False))
+    assert intervals == [5, 10, 20, 20]
+    assert polling.interval(ar, 20, True) == 5
+
+
+def test_adaptive_polling():
+    history = RuntimeHistory()
+    polling = AdaptivePolling(min_interval=1, history=history)
+    # pending jobs use the fallback
+    ar = make_result(status=PENDING, walltime=3600)
+    assert polling.interval(ar, None, False) == 5
+    assert polling.interval(ar, 5, False) == 10
+    # running job without prediction
+    ar = make_result(walltime=None)
+    ar.started = time.time()
+    assert polling.interval(ar, None, False) == 5
+    # prediction from walltime
+    ar = make_result(walltime=3600, max_sleep_interval=3600)
+    ar.started = time.time() - 1600
+    assert 999 <= polling.interval(ar, None, False) <= 1000
+    ar.max_sleep_interval = 360
+    assert polling.interval(ar, None, False) == 360
+    # prediction from history takes precedence
+    history.record('test', 1610)
+    assert 4 <= polling.interval(ar, None, False) <= 5
+    ar.started = time.time() - 1609.5
+    assert polling.interval(ar, None, False) == 1
+    # overdue
+    ar.started = time.time() - 1700
+    assert polling.interval(ar, None, False) == 1
+    assert polling.interval(ar, 1, False) == 2
+    assert polling.interval(ar, 2, True) == 1
+    with pytest.raises(ValueError):
+        AdaptivePolling(fraction=2)
+
+
+def test_runtime_recorded(monkeypatch):
+    """Test that the runtime of completed jobs is added to the history"""
+    history = RuntimeHistory()
+    monkeypatch.setattr(clusterjob, 'runtime_history', history)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    ar = make_result(status=PENDING)
+    ar._update_status(RUNNING)
+    assert ar.started is not None
+    ar.started -= 60
+    ar._update_status(COMPLETED)
+    assert 60 <= history.predict('test') < 70
+
+
+def test_wait_timeout(monkeypatch):
+    """Test that wait does not overshoot its timeout"""
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        Mock(return_value="RUNNING\n"))
+    ar = make_result()
+    t0 = time.time()
+    ar.wait(timeout=0.2)
+    assert 0.2 <= time.time() - t0 < 1.0
+    assert ar._status == RUNNING
+
+
+def test_wait_interrupted(monkeypatch):
+    """Test that a wait in another thread is woken up by cancel"""
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        Mock(return_value="RUNNING\n"))
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    ar = make_result()
+    ar.polling = BackoffPolling(initial=60)
+    waiter = threading.Thread(target=ar.wait)
+    t0 = time.time()
+    waiter.start()
+    time.sleep(0.1)
+    ar.cancel()
+    waiter.join(timeout=10)
+    assert not waiter.is_alive()
+    assert time.time() - t0 < 5
+    assert ar.status == CANCELLED
+
+
+def test_status_ttl(monkeypatch):
+    """Test that the status is memoized for `status_ttl` seconds"""
+    run_cmd = Mock(return_value="RUNNING\n")
+    monkeypatch.setattr(AsyncResult, '_run_cmd', run_cmd)
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    ar = make_result(status=PENDING)
+    assert ar.status == RUNNING
+    assert ar.status == RUNNING
+    assert run_cmd.call_count == 2 and ar.queries_saved == 0
+    monkeypatch.setattr(AsyncResult, 'status_ttl', 60)
+    assert not ar.ready()
+    assert ar.get(timeout=0) == RUNNING
+    assert run_cmd.call_count == 2 and ar.queries_saved == 4
+    run_cmd.return_value = "COMPLETED\n"
+    assert ar.status == RUNNING
+    assert ar.refresh() == COMPLETED
+    assert run_cmd.call_count == 3
+    assert ar.successful()
+    assert run_cmd.call_count == 3
+    other = make_result()
+    other.status_ttl = 0.01
+    other._status_time = time.time() - 1
+    assert other.status == COMPLETED
+    assert run_cmd.call_count == 4 and other.queries_saved == 0
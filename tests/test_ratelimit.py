@@ -0,0 +1,103 @@
+from textwrap import dedent
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.ratelimit import TokenBucket, RateLimiter, rate_limiter
+from clusterjob.status import PENDING, RUNNING
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(TokenBucket, '_clock', staticmethod(clock))
+    bucket = TokenBucket(rate=2, burst=2)
+    assert bucket.wait_time == 0
+    assert [bucket.reserve() for i in range(4)] == [0, 0, 0.5, 1.0]
+    assert bucket.queued == 2
+    assert bucket.wait_time == 1.5
+    clock.now += 1.0
+    assert bucket.queued == 0
+    assert bucket.wait_time == 0.5
+    clock.now += 10.0
+    assert bucket.wait_time == 0 # refilled up to burst
+    assert bucket.count == 4
+    assert bucket.total_wait == 1.5
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_rate_limiter(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(TokenBucket, '_clock', staticmethod(clock))
+    limiter = RateLimiter()
+    limiter._sleep = Mock()
+    assert limiter.acquire('cluster', 'status', rate=0) == 0
+    assert limiter.stats() == {}
+    for i in range(3):
+        limiter.acquire('cluster', 'status', rate=10)
+    limiter.acquire('cluster', 'submit', rate=10)
+    limiter.acquire(None, 'status', rate=10)
+    assert [call[0][0] for call in limiter._sleep.call_args_list] \
+        == [0.1, 0.2]
+    stats = limiter.stats()
+    assert sorted(stats.keys(), key=str) == [
+        ('cluster', 'status'), ('cluster', 'submit'), (None, 'status')]
+    assert stats[('cluster', 'status')]['queued'] == 2
+    assert stats[('cluster', 'status')]['count'] == 3
+    assert abs(stats[('cluster', 'status')]['wait'] - 0.3) < 1e-12
+    with pytest.raises(ValueError):
+        limiter.acquire('cluster', 'scp', rate=1)
+
+
+def test_throttled_jobs(tmpdir, monkeypatch):
+    """Test that submission and status commands are limited according to the
+    attributes read from an INI file"""
+    JobScript.read_defaults() # reset
+    monkeypatch.setattr(rate_limiter, '_sleep', Mock())
+    rate_limiter.clear()
+    ini = tmpdir.join('rates.ini')
+    ini.write(dedent(r'''
+    [Attributes]
+    remote = cluster
+    submit_rate = 0.5
+    status_rate = 2
+    rate_burst = 1
+    '''))
+    monkeypatch.setattr(JobScript, '_run_cmd',
+                        Mock(return_value="Submitted batch job 1\n"))
+    monkeypatch.setattr(JobScript, '_upload_file', Mock())
+    monkeypatch.setattr(AsyncResult, '_run_cmd',
+                        Mock(return_value="RUNNING\n"))
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    runs = []
+    try:
+        for i in range(3):
+            job = JobScript('echo "Hello"', jobname='test_%d' % i)
+            job.read_settings(str(ini))
+            runs.append(job.submit())
+        assert [run._status for run in runs] == [PENDING, ] * 3
+        assert [run.status for run in runs] == [RUNNING, ] * 3
+        waits = [call[0][0] for call in rate_limiter._sleep.call_args_list]
+        assert len(waits) == 4
+        assert 1.9 < waits[0] < 2.0 and 3.9 < waits[1] < 4.0 # submit
+        assert 0.4 < waits[2] < 0.5 and 0.9 < waits[3] < 1.0 # status
+        stats = rate_limiter.stats()
+        assert stats[('cluster', 'submit')]['count'] == 3
+        assert stats[('cluster', 'status')]['count'] == 3
+        assert ('cluster', 'upload') not in stats
+    finally:
+        rate_limiter.clear()
@@ -0,0 +1,130 @@
+import re
+import subprocess as sp
+from textwrap import dedent
+
+import pytest
+
+from clusterjob import JobScript, AsyncResult, poll_many
+from clusterjob import staging
+from clusterjob.staging import stage_paths, _run_rsync
+from clusterjob.status import RUNNING, COMPLETED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+class FakeRsync(object):
+    """Replacement for `staging._run_rsync` that records the commands and
+    the lists of files, and reports every file as transferred with 100
+    bytes"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, cmd, ignore_codes=()):
+        files_from = [arg for arg in cmd if arg.startswith('--files-from=')]
+        with open(files_from[0].split('=', 1)[1]) as in_fh:
+            files = in_fh.read().split()
+        self.calls.append((cmd, files, ignore_codes))
+        return "".join(["100|%s\n" % filename for filename in files])
+
+
+def test_stage_paths():
+    assert stage_paths('.', ['a.dat', 'out/']) == ['a.dat', 'out']
+    assert stage_paths('run', ['../run/a.dat']) == ['run/a.dat']
+    with pytest.raises(ValueError):
+        stage_paths('run', ['../../a.dat'])
+    with pytest.raises(ValueError):
+        stage_paths('run', ['/etc/passwd'])
+
+
+def test_stage_attributes(tmpdir):
+    JobScript.read_defaults() # reset
+    ini = tmpdir.join('staging.ini')
+    ini.write(dedent(r'''
+    [Attributes]
+    stage_in = input.dat
+        params.json
+    stage_compress = true
+    '''))
+    job = JobScript('echo "Hello"', jobname='test', stage_out=['out/'])
+    job.read_settings(str(ini))
+    assert job.stage_in == ('input.dat', 'params.json')
+    assert job.stage_out == ('out/', )
+    assert job.stage_compress is True
+
+
+def test_run_rsync():
+    assert _run_rsync(['sh', '-c', 'echo 10; exit 23'],
+                      ignore_codes=(23, )) == "10\n"
+    with pytest.raises(sp.CalledProcessError):
+        _run_rsync(['sh', '-c', 'exit 23'])
+
+
+def test_stage_in_many(monkeypatch):
+    """Test that the stage_in files of jobs on the same remote and rootdir
+    are uploaded with a single rsync command"""
+    rsync = FakeRsync()
+    monkeypatch.setattr(staging, '_run_rsync', rsync)
+    job_ids = iter(range(1, 100))
+
+    def submit(cmd, remote, **kwargs):
+        markers = re.findall(r"echo '(--- clusterjob submission \d+ ---)'",
+                             cmd)
+        return "".join(["Submitted batch job %d\n%s\n" % (next(job_ids), m)
+                        for m in markers])
+
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock(side_effect=submit))
+    monkeypatch.setattr(JobScript, '_upload_files', Mock())
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    jobs = []
+    for (i, rootdir) in enumerate(['~/jobs', '~/jobs', '~/other']):
+        jobs.append(JobScript('./run', jobname='run_%d' % i,
+                              remote='cluster', rootdir=rootdir,
+                              workdir='run_%d' % i,
+                              stage_in=['input.dat', 'shared/'],
+                              stage_compress=(i == 2)))
+    jobs.append(JobScript('./run', jobname='nothing', remote='cluster'))
+    results = JobScript.submit_many(jobs)
+    assert len(rsync.calls) == 2
+    (cmd, files, __) = rsync.calls[0]
+    assert files == ['run_0/input.dat', 'run_0/shared', 'run_1/input.dat',
+                     'run_1/shared']
+    assert cmd[-2:] == ['.', 'cluster:~/jobs/'] and '-z' not in cmd
+    (cmd, files, __) = rsync.calls[1]
+    assert cmd[-2:] == ['.', 'cluster:~/other/'] and '-z' in cmd
+    assert [ar.stage_in_bytes for ar in results] == [200, 200, 200, 0]
+    assert [ar.job_id for ar in results] == ['1', '2', '3', '4']
+
+
+def test_stage_out_poll(monkeypatch):
+    """Test that the stage_out files of all jobs that finish are downloaded
+    with a single rsync command, before the epilogues run"""
+    rsync = FakeRsync()
+    monkeypatch.setattr(staging, '_run_rsync', rsync)
+    monkeypatch.setattr(AsyncResult, '_run_cmd', Mock(
+        return_value="1 COMPLETED\n2 FAILED\n3 RUNNING\n"))
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    results = []
+    for job_id in ('1', '2', '3'):
+        ar = AsyncResult(backend=JobScript._backends['slurm'])
+        ar.remote = 'cluster'
+        ar.job_id = job_id
+        ar._status = RUNNING
+        ar.stage_root = '~/jobs'
+        ar.stage_out = ('run_%s/out' % job_id, )
+        results.append(ar)
+    n_transfers = [] # number of transfers when an epilogue runs
+    epilogue = Mock(side_effect=lambda: n_transfers.append(len(rsync.calls)))
+    monkeypatch.setattr(AsyncResult, 'run_epilogue', epilogue)
+    statuses = poll_many(results)
+    assert statuses[0] == COMPLETED and statuses[2] == RUNNING
+    assert len(rsync.calls) == 1
+    (cmd, files, ignore_codes) = rsync.calls[0]
+    assert files == ['run_1/out', 'run_2/out']
+    assert cmd[-2:] == ['cluster:~/jobs/', '.']
+    assert ignore_codes == (23, 24)
+    assert [ar.stage_out_bytes for ar in results] == [100, 100, None]
+    assert n_transfers == [1, 1]
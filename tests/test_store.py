@@ -0,0 +1,123 @@
+import pytest
+from clusterjob import JobScript, AsyncResult
+from clusterjob.store import get_job_store
+from clusterjob.status import PENDING, RUNNING, COMPLETED, FAILED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+def fake_run_cmd(cmd, remote, *args, **kwargs):
+    """Simulate the SLURM response to submission and status queries"""
+    if cmd[0] == 'sbatch':
+        if 'fail' in cmd[1]:
+            return "sbatch: error: Batch job submission failed\n"
+        return "Submitted batch job %d\n" % (1000 + int(cmd[1][3:-4]))
+    elif cmd[0] == 'squeue':
+        if cmd[-1] == '1000':
+            return "RUNNING\n"
+        return ""
+    elif cmd[0] == 'sacct':
+        return "COMPLETED\n"
+    return ""
+
+
+@pytest.fixture
+def sqlite_cache(tmpdir, monkeypatch):
+    """Use the 'sqlite' cache backend in a temporary cache folder"""
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    monkeypatch.setattr(JobScript, 'cache_backend', 'sqlite')
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock(side_effect=fake_run_cmd))
+    monkeypatch.setattr(AsyncResult, '_run_cmd', JobScript._run_cmd)
+    monkeypatch.setattr(JobScript, 'rootdir', str(tmpdir))
+    return tmpdir.join('cache')
+
+
+def test_sqlite_store(tmpdir):
+    store = get_job_store(str(tmpdir.join('jobs.sqlite')))
+    assert get_job_store(str(tmpdir.join('jobs.sqlite'))) is store
+    store.save('a.1', {'job_id': '1', 'remote': None, '_status': PENDING})
+    store.save('a.2', {'job_id': '2', 'remote': 'x', '_status': RUNNING})
+    store.save('a.3', {'job_id': '3', 'remote': 'x', '_status': COMPLETED})
+    assert 'a.1' in store
+    assert store.load('a.2')['job_id'] == '2'
+    assert store.load('a.4') is None
+    store.save('a.1', {'job_id': '1', 'remote': None, '_status': FAILED})
+    assert [key for (key, data) in store.load_all()] == ['a.1', 'a.2', 'a.3']
+    assert [key for (key, data)
+            in store.load_all(status=[PENDING, RUNNING])] == ['a.2']
+    assert [key for (key, data) in store.load_all(remote='x')] \
+        == ['a.2', 'a.3']
+    assert [key for (key, data) in store.load_all(job_id=3)] == ['a.3']
+    store.delete('a.1')
+    assert 'a.1' not in store
+    store.close()
+    assert get_job_store(str(tmpdir.join('jobs.sqlite'))) is not store
+
+
+def test_submit_sqlite_cache(sqlite_cache):
+    """Test that submitted jobs are cached in a single database"""
+    jobs = [JobScript('echo %d' % i, jobname='job%d' % i) for i in range(3)]
+    runs = [job.submit(cache_id=str(i)) for (i, job) in enumerate(jobs)]
+    assert [run.job_id for run in runs] == ['1000', '1001', '1002']
+    assert sqlite_cache.listdir() == [sqlite_cache.join('clusterjob.sqlite')]
+    assert runs[0].cache_file is None
+    assert runs[0].cache_key == 'clusterjob.0'
+
+    # resubmitting recovers the cached result, without talking to sbatch
+    JobScript._run_cmd.reset_mock()
+    run = jobs[1].submit(cache_id='1')
+    assert run.job_id == '1001'
+    assert JobScript._run_cmd.call_count == 0
+
+    # status updates are written to the database
+    assert runs[0].status == RUNNING
+    assert runs[1].status == COMPLETED
+    in_flight = JobScript.load_all(status=[PENDING, RUNNING])
+    assert [ar.job_id for ar in in_flight] == ['1000', '1002']
+    assert in_flight[0]._status == RUNNING
+    assert in_flight[0].cache_key == 'clusterjob.0'
+    assert in_flight[1].status == COMPLETED
+    assert JobScript.load_all(status=PENDING) == []
+
+    JobScript.clear_cache_folder()
+    assert JobScript.load_all() == []
+    assert sqlite_cache.listdir() == [sqlite_cache.join('clusterjob.sqlite')]
+
+
+def test_submit_sqlite_retry(sqlite_cache):
+    """Test that failed jobs in the database are resubmitted"""
+    job = JobScript('echo fail', jobname='fail')
+    run = job.submit(cache_id='fail')
+    assert run.status == FAILED
+    job.filename = 'job4.slr'
+    assert job.submit(cache_id='fail', retry=False).status == FAILED
+    run = job.submit(cache_id='fail')
+    assert run.job_id == '1004'
+    assert [ar.job_id for ar in JobScript.load_all()] == ['1004']
+    run = job.submit(cache_id='fail', force=True)
+    assert [ar.job_id for ar in JobScript.load_all()] == ['1004']
+
+
+def test_load_all_files(tmpdir, monkeypatch):
+    """Test load_all for the default 'files' cache backend"""
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir))
+    monkeypatch.setattr(JobScript, 'rootdir', str(tmpdir))
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock(side_effect=fake_run_cmd))
+    for i in range(2):
+        JobScript('echo %d' % i, jobname='job%d' % i).submit(cache_id=i)
+    assert len(tmpdir.listdir(fil=lambda f: f.ext == '.cache')) == 2
+    assert [ar.job_id for ar in JobScript.load_all(status=PENDING)] \
+        == ['1000', '1001']
+    assert JobScript.load_all(remote='cluster') == []
+
+
+def test_invalid_cache_backend(monkeypatch):
+    with pytest.raises(ValueError):
+        JobScript._sanitize_attr('cache_backend', 'mysql')
+    monkeypatch.setattr(JobScript, 'cache_backend', 'mysql')
+    monkeypatch.setattr(JobScript, 'cache_folder', '.')
+    with pytest.raises(ValueError):
+        JobScript._job_store()
@@ -0,0 +1,50 @@
+import pytest
+
+from clusterjob import JobScript, AsyncResult
+from clusterjob.submission import SubmissionQueue
+from clusterjob.status import COMPLETED
+# builtin fixtures: tmpdir, monkeypatch
+# fixtures from conftest.py: local
+
+
+def make_jobs(tmpdir, times):
+    jobs = []
+    for (i, time) in enumerate(times):
+        job = JobScript('sleep 0.1', jobname='job_%d' % i, backend='local',
+                        rootdir=str(tmpdir))
+        if time is not None:
+            job.resources['time'] = time
+        job.max_sleep_interval = 0
+        jobs.append(job)
+    return jobs
+
+
+def test_submission_queue(local, tmpdir):
+    times = [None, '00:00:10', '00:00:30', '00:00:20', None]
+    queue = SubmissionQueue(max_in_flight=2, longest_first=True)
+    queue.extend(make_jobs(tmpdir, times),
+                 cache_ids=['job_%d' % i for i in range(len(times))])
+    assert queue.queued == 5
+    finished = []
+    for ar in queue.as_completed(timeout=20):
+        assert ar.status == COMPLETED
+        assert queue.in_flight <= 2
+        finished.append(ar)
+    assert len(finished) == 5
+    assert queue.queued == queue.in_flight == 0
+    # job IDs of the local backend count the submissions
+    def submission_number(i):
+        return int(queue.results[i].job_id.split('.')[1])
+    submitted = sorted(range(len(times)), key=submission_number)
+    assert submitted == [2, 3, 1, 0, 4]
+
+    # cached results are not submitted again
+    queue2 = SubmissionQueue(max_in_flight=2)
+    queue2.extend(make_jobs(tmpdir, times),
+                  cache_ids=['job_%d' % i for i in range(len(times))])
+    results = queue2.run(timeout=5)
+    assert [ar.job_id for ar in results] \
+        == [ar.job_id for ar in queue.results]
+
+    with pytest.raises(ValueError):
+        SubmissionQueue(max_in_flight=0)
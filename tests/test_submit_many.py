@@ -0,0 +1,147 @@
+import os
+import re
+from clusterjob import JobScript, AsyncResult
+from clusterjob.status import PENDING, FAILED
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+# builtin fixtures: tmpdir, monkeypatch
+
+
+def fake_sbatch(cmd, remote, **kwargs):
+    """Simulate the response to the combined submission command"""
+    response = ''
+    job_id = 1000
+    for line in cmd.splitlines():
+        if 'fail' not in line:
+            response += "Submitted batch job %d\n" % job_id
+        job_id += 1
+        response += re.search(r"echo '(.*)'$", line).group(1) + "\n"
+    return response
+
+
+def make_jobs(n, **kwargs):
+    jobs = []
+    for i in range(n):
+        job = JobScript('echo {i}', jobname='job%d' % i, **kwargs)
+        job.i = i
+        jobs.append(job)
+    return jobs
+
+
+def test_submit_many_remote(monkeypatch):
+    """Test that all jobs for a remote are uploaded and submitted in one call
+    each"""
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock(side_effect=fake_sbatch))
+    monkeypatch.setattr(JobScript, '_upload_files', Mock())
+    jobs = make_jobs(3, remote='cluster', rootdir='~/jobs', workdir='sweep')
+    jobs[1].aux_scripts['aux.sh'] = 'echo aux {i}'
+    jobs[2].filename = 'fail.slr'
+    results = JobScript.submit_many(jobs)
+    assert JobScript._upload_files.call_count == 1
+    files = JobScript._upload_files.call_args[0][0]
+    assert list(files.keys()) == [
+        '~/jobs/sweep/job0.slr', '~/jobs/sweep/aux.sh',
+        '~/jobs/sweep/job1.slr', '~/jobs/sweep/fail.slr']
+    assert files['~/jobs/sweep/aux.sh'] == '#!/bin/bash\necho aux 1'
+    assert JobScript._run_cmd.call_count == 1
+    cmd = JobScript._run_cmd.call_args[0][0]
+    assert cmd.splitlines()[0].startswith(
+            "(cd ~/jobs/sweep && sbatch job0.slr); echo ")
+    assert [ar.job_id for ar in results] == ['1000', '1001', None]
+    assert [ar._status for ar in results] == [PENDING, PENDING, FAILED]
+    assert [ar.remote for ar in results] == ['cluster', ] * 3
+
+
+def test_submit_many_cached(tmpdir, monkeypatch):
+    """Test that submit_many uses the same caching as submit"""
+    monkeypatch.setattr(JobScript, 'cache_folder', str(tmpdir.join('cache')))
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock(side_effect=fake_sbatch))
+    monkeypatch.setattr(JobScript, '_write_script', Mock())
+    monkeypatch.setattr(AsyncResult, '_run_cmd', Mock())
+    jobs = make_jobs(2, rootdir=str(tmpdir))
+    results = JobScript.submit_many(jobs, cache_ids=['a', 'b'])
+    assert JobScript._write_script.call_count == 2
+    assert os.path.isfile(str(tmpdir.join('cache', 'clusterjob.a.cache')))
+    results = JobScript.submit_many(jobs, cache_ids=['a', 'b'])
+    assert JobScript._run_cmd.call_count == 1
+    assert [ar.job_id for ar in results] == ['1000', '1001']
+    results = JobScript.submit_many(jobs, cache_ids=['a', 'b'], force=True)
+    assert JobScript._run_cmd.call_count == 2
+
+
+def test_submit_stream(monkeypatch):
+    """Test that with `stream_submit`, the scripts of a job are written and
+    the job is submitted through a single ssh connection, and that the
+    folder is not created again when writing the job script later"""
+    upload_and_run = Mock(return_value="Submitted batch job 1000\n")
+    monkeypatch.setattr(JobScript, '_upload_and_run', upload_and_run)
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock())
+    monkeypatch.setattr(JobScript, '_upload_file', Mock())
+    monkeypatch.setattr(JobScript, '_created_folders', set())
+    monkeypatch.setattr(AsyncResult, 'dump', Mock())
+    job = make_jobs(1, remote='cluster', rootdir='~/jobs', workdir='sweep',
+                    stream_submit=True)[0]
+    job.aux_scripts['aux.sh'] = 'echo aux {i}'
+    ar = job.submit()
+    assert ar.job_id == '1000'
+    assert upload_and_run.call_count == 1
+    (files, cmd, remote, workdir) = upload_and_run.call_args[0]
+    assert list(files.keys()) == ['~/jobs/sweep/aux.sh',
+                                  '~/jobs/sweep/job0.slr']
+    assert (cmd, remote, workdir) == (['sbatch', 'job0.slr'], 'cluster',
+                                      '~/jobs/sweep')
+    assert JobScript._run_cmd.call_count == 0
+    job.write()
+    assert JobScript._run_cmd.call_count == 0
+    assert JobScript._upload_file.call_count == 1
+
+
+def test_submit_many_stream(monkeypatch):
+    """Test that with `stream_submit`, all jobs for a remote are uploaded and
+    submitted through a single ssh connection"""
+    monkeypatch.setattr(JobScript, '_upload_and_run', Mock(
+        side_effect=lambda files, cmd, remote, **kwargs:
+        fake_sbatch(cmd, remote)))
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock())
+    monkeypatch.setattr(JobScript, '_upload_files', Mock())
+    jobs = make_jobs(2, remote='cluster', stream_submit=True)
+    results = JobScript.submit_many(jobs)
+    assert JobScript._upload_and_run.call_count == 1
+    assert JobScript._run_cmd.call_count == 0
+    assert JobScript._upload_files.call_count == 0
+    files = JobScript._upload_and_run.call_args[0][0]
+    assert list(files.keys()) == ['././job0.slr', '././job1.slr']
+    assert [ar.job_id for ar in results] == ['1000', '1001']
+
+
+def test_submit_many_quoted_folder(monkeypatch):
+    """Test that folders with spaces are quoted in the combined submission
+    command"""
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock(side_effect=fake_sbatch))
+    monkeypatch.setattr(JobScript, '_upload_files', Mock())
+    jobs = make_jobs(2, remote='cluster', rootdir='~/my jobs',
+                     workdir='sweep')
+    results = JobScript.submit_many(jobs)
+    cmd = JobScript._run_cmd.call_args[0][0]
+    assert cmd.splitlines()[0].startswith(
+            "(cd ~/'my jobs/sweep' && sbatch job0.slr); echo ")
+    assert [ar.job_id for ar in results] == ['1000', '1001']
+
+
+def test_submit_many_groups(monkeypatch):
+    """Test that jobs on the same remote with different settings for sending
+    commands are submitted in separate batches"""
+    monkeypatch.setattr(JobScript, '_upload_and_run', Mock(
+        side_effect=lambda files, cmd, remote, **kwargs:
+        fake_sbatch(cmd, remote)))
+    monkeypatch.setattr(JobScript, '_run_cmd', Mock(side_effect=fake_sbatch))
+    monkeypatch.setattr(JobScript, '_upload_files', Mock())
+    jobs = make_jobs(3, remote='cluster')
+    jobs[1].stream_submit = True
+    JobScript.submit_many(jobs)
+    assert JobScript._upload_and_run.call_count == 1
+    assert len(JobScript._upload_and_run.call_args[0][1].splitlines()) == 1
+    assert JobScript._run_cmd.call_count == 1
+    assert len(JobScript._run_cmd.call_args[0][0].splitlines()) == 2
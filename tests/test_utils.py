@@ -1,5 +1,6 @@
 import os
-from clusterjob.utils import run_cmd, _wrap_run_cmd
+from clusterjob.utils import (run_cmd, _wrap_run_cmd, set_executable, ssh_pool,
+        upload_files, upload_and_run)
 
 def test_mkdir(tmpdir):
     """Test that 'mkdir -p folder' actually creates folder"""
@@ -21,3 +22,109 @@ def test_mkdir_wrapped(tmpdir):
     run_cmd(['mkdir', '-p', folder], remote=None, ignore_exit_code=False)
     assert os.path.isdir(folder)
     assert os.path.isfile(jsonfile)
+
+
+FAKE_SSH = r'''#!/bin/bash
+echo "$@" >> {log}
+for arg in "$@"; do
+    case "$arg" in ControlPath=*) path="${{arg#ControlPath=}}";; esac
+done
+if [[ " $* " == *" -N "* ]]; then touch "$path"; fi
+if [[ " $* " == *" -O exit "* ]]; then rm -f "$path"; fi
+'''
+
+
+def test_ssh_multiplex(tmpdir):
+    """Test that with multiplexing enabled, a single master connection is
+    opened and all commands are routed through its control socket"""
+    log = str(tmpdir.join('ssh.log'))
+    ssh = str(tmpdir.join('ssh'))
+    with open(ssh, 'w') as out_fh:
+        out_fh.write(FAKE_SSH.format(log=log))
+    set_executable(ssh)
+    assert ssh_pool.ssh_options(ssh, 'host') == []
+    ssh_pool.enable(ssh, 'host', persist=60)
+    try:
+        for i in range(3):
+            run_cmd(['squeue', '-j', str(i)], remote='host', ssh=ssh)
+        assert ssh_pool.commands[(ssh, 'host')] == 3
+    finally:
+        ssh_pool.close(ssh, 'host')
+    assert not ssh_pool.is_enabled(ssh, 'host')
+    with open(log) as in_fh:
+        calls = in_fh.read().splitlines()
+    assert len(calls) == 5
+    assert 'ControlMaster=yes' in calls[0]
+    assert 'ControlPersist=60' in calls[0]
+    control_path = calls[0].split('ControlPath=')[1].split()[0]
+    for i, call in enumerate(calls[1:4]):
+        assert call.endswith('host squeue -j %d' % i)
+        assert 'ControlPath=%s' % control_path in call
+    assert calls[4].endswith('-O exit host')
+
+
+def test_ssh_multiplex_control_paths(tmpdir):
+    """Test that a new master connection never re-uses the control socket of
+    another open master connection, after a connection has been closed"""
+    log = str(tmpdir.join('ssh.log'))
+    ssh = str(tmpdir.join('ssh'))
+    with open(ssh, 'w') as out_fh:
+        out_fh.write(FAKE_SSH.format(log=log))
+    set_executable(ssh)
+    try:
+        for host in ['hostA', 'hostB']:
+            ssh_pool.enable(ssh, host, persist=60)
+            ssh_pool.ssh_options(ssh, host)
+        ssh_pool.close(ssh, 'hostA')
+        ssh_pool.enable(ssh, 'hostC', persist=60)
+        options_B = ssh_pool.ssh_options(ssh, 'hostB')
+        options_C = ssh_pool.ssh_options(ssh, 'hostC')
+        assert options_B != options_C
+        assert ssh_pool.commands[(ssh, 'hostB')] == 2
+    finally:
+        for host in ['hostA', 'hostB', 'hostC']:
+            ssh_pool.close(ssh, host)
+    with open(log) as in_fh:
+        masters = [call for call in in_fh.read().splitlines()
+                   if 'ControlMaster=yes' in call]
+    assert len(masters) == 3
+    assert masters[2].endswith('hostC')
+
+
+def test_upload_files(tmpdir):
+    """Test uploading multiple files through a single ssh connection, using a
+    fake ssh that runs the remote command in a local 'home' folder"""
+    home = str(tmpdir.join('home'))
+    os.mkdir(home)
+    ssh = str(tmpdir.join('ssh'))
+    with open(ssh, 'w') as out_fh:
+        out_fh.write('#!/bin/bash\ncd %s && eval "$2"\n' % home)
+    set_executable(ssh)
+    abs_file = str(tmpdir.join('abs', 'c.sh'))
+    upload_files({'~/jobs/a.sh': 'echo a', 'jobs/sub/b.sh': 'echo b',
+                  abs_file: 'echo c'}, remote='host', ssh=ssh)
+    with open(os.path.join(home, 'jobs', 'a.sh')) as in_fh:
+        assert in_fh.read() == 'echo a'
+    assert os.access(os.path.join(home, 'jobs', 'sub', 'b.sh'), os.X_OK)
+    assert os.path.isfile(abs_file)
+
+
+def test_upload_and_run(tmpdir):
+    """Test uploading files and running a command through a single ssh
+    connection, using a fake ssh that runs the remote command in a local
+    'home' folder"""
+    home = str(tmpdir.join('home'))
+    os.mkdir(home)
+    ssh = str(tmpdir.join('ssh'))
+    with open(ssh, 'w') as out_fh:
+        out_fh.write('#!/bin/bash\ncd %s && eval "$2"\n' % home)
+    set_executable(ssh)
+    response = upload_and_run({'~/jobs/run.sh': 'echo "ran in $PWD"'},
+                              ['./run.sh'], remote='host', workdir='jobs',
+                              ssh=ssh)
+    assert response == 'ran in %s\n' % os.path.join(home, 'jobs')
+    with open(ssh, 'w') as out_fh:
+        out_fh.write('#!/bin/bash\ncd %s && eval "${2/tar/false}"\n' % home)
+    response = upload_and_run({'jobs/other.sh': 'echo other'},
+                              'echo submitted', remote='host', ssh=ssh)
+    assert 'submitted' not in response
@@ -71,7 +71,7 @@ def test_workflow(workflow_files, monkeypatch):
         filepath = os.path.split(filename)[0]
         if len(filepath) > 0:
             self._run_cmd(['mkdir', '-p', filepath], remote,
-                        ignore_exit_code=False, ssh=self.ssh)
+                        ignore_exit_code=False, ssh=self.ssh, agent=self.agent)
     monkeypatch.setattr(JobScript, '_write_script', dummy_write_script)
     # disable file transfer
     monkeypatch.setattr(JobScript, '_upload_file',